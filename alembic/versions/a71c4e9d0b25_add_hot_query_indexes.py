@@ -0,0 +1,60 @@
+"""add hot query indexes
+
+Revision ID: a71c4e9d0b25
+Revises: f3a9c1d27b64
+Create Date: 2026-10-18 14:02:17.880314
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a71c4e9d0b25'
+down_revision: Union[str, None] = 'f3a9c1d27b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ORDER_TABLES = ('user_orders', 'demo_user_orders')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ORDER_TABLES:
+        # Open/pending orders of a user, optionally of one symbol
+        op.create_index(f'ix_{table}_user_status_symbol', table,
+                        ['order_user_id', 'order_status', 'order_company_name'], unique=False)
+        # Order history pages, newest first
+        op.create_index(f'ix_{table}_user_created_at', table, ['order_user_id', 'created_at'], unique=False)
+        # System-wide scans of open orders, optionally of one symbol (SL/TP sweeps)
+        op.create_index(f'ix_{table}_status_symbol', table, ['order_status', 'order_company_name'], unique=False)
+
+    # Transaction history pages, newest first, and the deposit total (covered)
+    op.create_index('ix_wallets_user_id_created_at', 'wallets', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_wallets_demo_user_id_created_at', 'wallets', ['demo_user_id', 'created_at'], unique=False)
+    op.create_index('ix_wallets_user_id_type_amount', 'wallets',
+                    ['user_id', 'transaction_type', 'transaction_amount'], unique=False)
+
+    # Case-insensitive symbol lookups (previously fix_symbol ILIKE, which cannot use an index)
+    op.add_column('external_symbol_info', sa.Column(
+        'fix_symbol_upper', sa.String(length=255), sa.Computed('upper(fix_symbol)', persisted=True), nullable=True
+    ))
+    op.create_index(op.f('ix_external_symbol_info_fix_symbol_upper'), 'external_symbol_info',
+                    ['fix_symbol_upper'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_external_symbol_info_fix_symbol_upper'), table_name='external_symbol_info')
+    op.drop_column('external_symbol_info', 'fix_symbol_upper')
+
+    op.drop_index('ix_wallets_user_id_type_amount', table_name='wallets')
+    op.drop_index('ix_wallets_demo_user_id_created_at', table_name='wallets')
+    op.drop_index('ix_wallets_user_id_created_at', table_name='wallets')
+
+    for table in ORDER_TABLES:
+        op.drop_index(f'ix_{table}_status_symbol', table_name=table)
+        op.drop_index(f'ix_{table}_user_created_at', table_name=table)
+        op.drop_index(f'ix_{table}_user_status_symbol', table_name=table)
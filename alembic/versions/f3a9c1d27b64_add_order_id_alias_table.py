@@ -0,0 +1,55 @@
+"""add order_id_alias table
+
+Revision ID: f3a9c1d27b64
+Revises: aaf89b3394dd
+Create Date: 2026-10-18 11:20:41.306512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a9c1d27b64'
+down_revision: Union[str, None] = 'aaf89b3394dd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ALIAS_COLUMNS = (
+    'cancel_id', 'close_id', 'modify_id', 'stoploss_id', 'takeprofit_id', 'stoploss_cancel_id', 'takeprofit_cancel_id',
+)
+ORDER_TABLES = (('user_orders', 'live'), ('demo_user_orders', 'demo'))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'order_id_alias',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('alias', sa.String(length=64), nullable=False),
+        sa.Column('order_id', sa.String(length=64), nullable=False),
+        sa.Column('kind', sa.String(length=30), nullable=False),
+        sa.Column('user_type', sa.String(length=10), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_id_alias_id'), 'order_id_alias', ['id'], unique=False)
+    op.create_index('ix_order_id_alias_alias_user_type', 'order_id_alias', ['alias', 'user_type'], unique=False)
+
+    # Backfill the ids of existing orders, one INSERT ... SELECT per id column
+    for table, user_type in ORDER_TABLES:
+        for column in ALIAS_COLUMNS:
+            op.execute(
+                f"INSERT INTO order_id_alias (alias, order_id, kind, user_type, created_at) "
+                f"SELECT {column}, order_id, '{column}', '{user_type}', created_at FROM {table} "
+                f"WHERE {column} IS NOT NULL AND {column} <> ''"
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_order_id_alias_alias_user_type', table_name='order_id_alias')
+    op.drop_index(op.f('ix_order_id_alias_id'), table_name='order_id_alias')
+    op.drop_table('order_id_alias')
@@ -0,0 +1,109 @@
+# app/api/v1/endpoints/admin_metrics.py
+
+from fastapi import APIRouter, Depends, Query
+from app.core.security import get_current_admin_user
+from app.core.tick_latency import tick_tracer
+from app.core.metrics import registry, cache_hit_ratios
+from app.core.loop_monitor import loop_monitor
+from app.core.sql_profiler import sql_profiler
+from app.database.bulkheads import bulkhead_snapshot
+from app.services.margin_risk_index import margin_risk_index
+from app.services.ws_send_queue import send_queue_stats
+from app.database.models import User
+
+router = APIRouter()
+
+@router.get("/admin/metrics")
+async def admin_runtime_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    JSON view of the runtime metrics registry (the same data served at /metrics),
+    with cache hit ratios precomputed.
+    """
+    return {
+        "metrics": registry.snapshot(),
+        "cache_hit_ratios": cache_hit_ratios(),
+    }
+
+@router.get("/admin/metrics/tick-latency")
+async def admin_tick_latency(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    Stage-by-stage latency of market data ticks, measured from the Firebase stamp
+    (percentiles in milliseconds), plus the sampled per-symbol breakdown.
+    """
+    return tick_tracer.snapshot()
+
+@router.post("/admin/metrics/tick-latency/reset")
+async def admin_reset_tick_latency(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    Clears the tick latency histograms, e.g. before a load test.
+    """
+    tick_tracer.reset()
+    return {"status": True, "message": "Tick latency histograms reset"}
+
+@router.get("/admin/metrics/event-loop")
+async def admin_event_loop_lag(
+    limit: int = Query(10, ge=1, le=100),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    Event-loop scheduling lag percentiles and the call sites that blocked the loop
+    the longest (captured from the loop thread's stack while it was stalled).
+    """
+    return loop_monitor.snapshot(limit)
+
+@router.get("/admin/metrics/margin-risk")
+async def admin_margin_risk(
+    limit: int = Query(20, ge=1, le=500),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    Accounts closest to auto-cutoff with their estimated cutoff and margin-call prices.
+    """
+    return {"tracked_accounts": len(margin_risk_index), "accounts": margin_risk_index.snapshot(limit)}
+
+@router.get("/admin/metrics/websockets")
+async def admin_websocket_send_queues(
+    limit: int = Query(50, ge=1, le=1000),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    Per-connection outbound queue lag, depth and conflation counts, most lagging first.
+    """
+    return {"connections": send_queue_stats(limit)}
+
+@router.get("/admin/metrics/db-bulkheads")
+async def admin_db_bulkheads(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    DB session bulkheads per subsystem (api, ws, triggers, batch): size, sessions open,
+    queued requests, queue wait percentiles and fail-fast rejections.
+    """
+    return bulkhead_snapshot()
+
+@router.get("/admin/metrics/sql")
+async def admin_sql_profile(
+    limit: int = Query(20, ge=1, le=200),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    Top SQL queries (normalized fingerprints) by total time and by calls per request,
+    per endpoint and background task, with the most recent slow queries.
+    """
+    return sql_profiler.snapshot(limit)
+
+@router.post("/admin/metrics/sql/reset")
+async def admin_reset_sql_profile(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    Clears the SQL statement statistics, e.g. before a load test.
+    """
+    sql_profiler.reset()
+    return {"status": True, "message": "SQL statement statistics reset"}
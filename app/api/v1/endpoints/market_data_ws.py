@@ -8,17 +8,18 @@ from app.core.logging_config import websocket_logger, orders_logger
 from app.crud.crud_order import get_order_model
 import json
 # import threading # No longer needed for active_connections_lock
-from typing import Dict, Any, List, Optional, Set
+from typing import Dict, Any, List, Mapping, Optional, Set
 import decimal
 from starlette.websockets import WebSocketState
 from decimal import Decimal
 import datetime
-import random
+import time
 
 
 # Import necessary components for DB interaction and authentication
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database.session import get_db, AsyncSessionLocal # Import AsyncSessionLocal for db sessions in tasks
+from app.database.session import get_db, get_ws_sessions, WsSessionLocal # Sessions of the ws bulkhead for db access in tasks
+from app.database.bulkheads import BulkheadSessionFactory, DatabaseBusyError
 from app.crud.user import get_user_by_account_number, get_demo_user_by_account_number
 from app.crud import group as crud_group
 from app.crud import crud_order
@@ -43,8 +44,7 @@ from app.core.cache import (
     DecimalEncoder, decode_decimal,
     # Redis channels
     REDIS_MARKET_DATA_CHANNEL,
-    REDIS_ORDER_UPDATES_CHANNEL,
-    REDIS_USER_DATA_UPDATES_CHANNEL
+    order_updates_channel, user_data_updates_channel, account_update_channels
 )
 
 # Import the dependency to get the Redis client
@@ -62,6 +62,32 @@ from sqlalchemy.future import select
 from app.services.pending_orders import process_order_stoploss_takeprofit
 from app.crud.crud_order import get_all_open_orders_by_user_id, get_order_model
 from app.database.models import UserOrder, DemoUserOrder
+from app.core.tick_latency import (
+    stamp_tick, observe_tick, TICK_METADATA_KEYS, TICK_ORIGIN_KEY,
+    STAGE_QUEUED, STAGE_PUBLISH, STAGE_WS_RECEIVED, STAGE_WS_SENT
+)
+from app.core.metrics import (
+    registry, websocket_connections,
+    pending_order_triggers_total, pending_order_trigger_seconds
+)
+
+from app.services.ws_send_queue import ConnectionSendQueue, SlowConsumerEvicted
+from app.services.ws_subscriptions import SymbolSubscription, parse_control_message, position_symbols
+from app.services.account_stream import AccountSession, account_sessions
+from app.services.ws_codec import (
+    create_frame_codec, negotiate_frame_format, permessage_deflate_offered,
+    price_decimals_from_group_settings, websocket_connections_total
+)
+from app.services.portfolio_writer import dynamic_portfolio_writer
+from app.services.group_state import GroupPriceCursor, GroupState, MarketTickDecoder
+from app.services.group_registry import group_states, group_symbol_registry, update_group_symbol_settings
+from app.services.ws_bootstrap import bootstrap_connection, websocket_time_to_first_frame_seconds
+from app.core.config import get_settings
+from app.core.pubsub import RedisSubscription
+
+_MARKET_DATA_PUBLISHED = registry.counter(
+    "market_data_published_total", "Market data messages published by redis_publisher_task."
+)
 
 # Configure logging for this module
 logger = websocket_logger
@@ -79,86 +105,8 @@ router = APIRouter(
 )
 
 
-async def _calculate_and_cache_adjusted_prices(
-    raw_market_data: Dict[str, Any],
-    group_name: str,
-    relevant_symbols: Set[str],
-    group_settings: Dict[str, Any],
-    redis_client: Redis
-) -> Dict[str, Dict[str, float]]:
-    """
-    Calculates adjusted prices based on group settings and caches them.
-    Returns a dictionary of adjusted prices for symbols in raw_market_data.
-    """
-    adjusted_prices_payload = {}
-    
-    # Get all unique currencies from the group settings
-    all_currencies = set()
-    for symbol in group_settings.keys():
-        if len(symbol) == 6:  # Only process 6-character currency pairs
-            all_currencies.add(symbol[:3])  # First currency
-            all_currencies.add(symbol[3:])  # Second currency
-    
-    # Add USD conversion pairs to relevant symbols
-    for currency in all_currencies:
-        if currency != 'USD':
-            relevant_symbols.add(f"{currency}USD")  # Direct conversion
-            relevant_symbols.add(f"USD{currency}")  # Indirect conversion
-    
-    for symbol, prices in raw_market_data.items():
-        symbol_upper = symbol.upper()
-        if symbol_upper not in relevant_symbols or not isinstance(prices, dict):
-            continue
-
-        # --- Persist last known price for this symbol ---
-        await set_last_known_price(redis_client, symbol_upper, prices)
-
-        # Firebase 'b' is Ask, 'o' is Bid
-        raw_ask_price = prices.get('b')  # Ask from Firebase
-        raw_bid_price = prices.get('o')  # Bid from Firebase
-        symbol_group_settings = group_settings.get(symbol_upper)
-
-        if raw_ask_price is not None and raw_bid_price is not None and symbol_group_settings:
-            try:
-                ask_decimal = Decimal(str(raw_ask_price))
-                bid_decimal = Decimal(str(raw_bid_price))
-                spread_setting = Decimal(str(symbol_group_settings.get('spread', 0)))
-                spread_pip_setting = Decimal(str(symbol_group_settings.get('spread_pip', 0)))
-                
-                configured_spread_amount = spread_setting * spread_pip_setting
-                half_spread = configured_spread_amount / Decimal(2)
-
-                # Adjusted prices for user display and trading
-                adjusted_buy_price = ask_decimal + half_spread  # User buys at adjusted ask
-                adjusted_sell_price = bid_decimal - half_spread  # User sells at adjusted bid
-
-                effective_spread_price_units = adjusted_buy_price - adjusted_sell_price
-                effective_spread_in_pips = Decimal("0.0")
-                if spread_pip_setting > Decimal("0.0"):
-                    effective_spread_in_pips = effective_spread_price_units / spread_pip_setting
-
-                # Add to payload for immediate response
-                adjusted_prices_payload[symbol_upper] = {
-                    'buy': float(adjusted_buy_price),
-                    'sell': float(adjusted_sell_price),
-                    'spread': float(effective_spread_in_pips)
-                }
-
-                logger.debug(f"Adjusted prices for {symbol_upper}: Buy={adjusted_buy_price}, Sell={adjusted_sell_price}, Spread={effective_spread_in_pips}")
-
-            except Exception as e:
-                logger.error(f"Error adjusting price for {symbol_upper} in group {group_name}: {e}", exc_info=True)
-                # Optionally send raw if calculation fails
-                if raw_ask_price is not None and raw_bid_price is not None:
-                    raw_spread = (Decimal(str(raw_ask_price)) - Decimal(str(raw_bid_price)))
-                    raw_spread_pips = raw_spread / spread_pip_setting if spread_pip_setting > Decimal("0.0") else raw_spread
-                    adjusted_prices_payload[symbol_upper] = {
-                        'buy': float(raw_ask_price),
-                        'sell': float(raw_bid_price),
-                        'spread': float(raw_spread_pips)
-                    }
-
-    return adjusted_prices_payload
+# Market data decoded once per process and adjusted once per group (group_states), whatever the number of sockets
+market_ticks = MarketTickDecoder(lambda payload: json.loads(payload, object_hook=decode_decimal), TICK_METADATA_KEYS)
 
 
 async def _get_full_portfolio_details(
@@ -214,10 +162,11 @@ async def _get_full_portfolio_details(
     return account_data_payload
 
 
-async def check_and_trigger_pending_orders(redis_client, db, symbol, adjusted_prices, group_name):
+async def check_and_trigger_pending_orders(redis_client, symbol, adjusted_prices, group_name):
     """
     Check if any pending orders should be triggered based on current market prices.
-    This is called when market data updates are received.
+    This is called when market data updates are received. Each triggered order runs in
+    its own trigger session; the caller must not hold one while this runs.
     """
     try:
         # Get all pending orders for this symbol from Redis
@@ -316,8 +265,10 @@ async def check_and_trigger_pending_orders(redis_client, db, symbol, adjusted_pr
                             # orders_logger.info(f"[PENDING_ORDER_EXECUTION] Trigger condition met for order {order.get('order_id')}. Executing trigger_pending_order.")
                             from app.services.pending_orders import trigger_pending_order
                             # Use a new database session for trigger_pending_order to ensure fresh data
-                            from app.database.session import AsyncSessionLocal
-                            async with AsyncSessionLocal() as trigger_db:
+                            from app.database.session import TriggerSessionLocal
+                            pending_order_triggers_total.labels(order_type).inc()
+                            trigger_started = time.perf_counter()
+                            async with TriggerSessionLocal() as trigger_db:
                                 from app.services.pending_orders import trigger_pending_order
                                 await trigger_pending_order(
                                     db=trigger_db,
@@ -325,6 +276,7 @@ async def check_and_trigger_pending_orders(redis_client, db, symbol, adjusted_pr
                                     order=order,
                                     current_price=adjusted_buy_price_normalized
                                 )
+                            pending_order_trigger_seconds.observe(time.perf_counter() - trigger_started)
                         # else:
                         #     orders_logger.info(f"[PENDING_ORDER_EXECUTION] Order {order.get('order_id')} conditions not met for execution. Skipping.")
             
@@ -384,95 +336,109 @@ async def per_connection_redis_listener(
     user_id: int,
     group_name: str,
     redis_client: Redis,
-    db: AsyncSession,
-    user_type: str
+    user_type: str,
+    send_queue: ConnectionSendQueue,
+    subscription: SymbolSubscription,
+    resumed: bool = False,
+    orders_cached: bool = False
 ):
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(REDIS_MARKET_DATA_CHANNEL)
-    await pubsub.subscribe(REDIS_ORDER_UPDATES_CHANNEL)
-    await pubsub.subscribe(REDIS_USER_DATA_UPDATES_CHANNEL)
+    # Order / user-data events arrive on this account's own channels only
+    order_channel, user_data_channel = account_update_channels(user_type, user_id)
+    # A resumed client already has its account state; only prices of ticking symbols are sent
+    is_initial_connection = not resumed
+
+    async def resync_after_gap():
+        nonlocal is_initial_connection, orders_cached
+        # Order / user-data events may have been published while the subscription was down:
+        # the next tick reloads the orders and sends the full state again
+        logger.warning(f"User {user_id}: Redis subscription resumed after a gap; resending full state")
+        is_initial_connection, orders_cached = True, False
+
+    subscription_channels = RedisSubscription(
+        redis_client, (REDIS_MARKET_DATA_CHANNEL, order_channel, user_data_channel), "websocket",
+        on_gap=resync_after_gap
+    )
+    await subscription_channels.connect()
     logger.info(f"User {user_id}: Subscribed to Redis channels for market data and updates")
+    websocket_connections.inc()
 
-    await update_static_orders_cache(user_id, db, redis_client, user_type)
+    if not orders_cached:
+        try:
+            async with WsSessionLocal() as db:
+                await update_static_orders_cache(user_id, db, redis_client, user_type)
+        except DatabaseBusyError as e:
+            # The first tick reloads the orders of an initial connection
+            logger.warning(f"User {user_id}: Static orders not cached: {e}")
 
-    is_initial_connection = True
-    all_symbols_cache = {}
-    last_sent_prices = {}  # Track last sent prices per symbol
+    # Prices and settings are the group's shared state; the connection only keeps the version it sent
+    price_cursor = GroupPriceCursor(await group_states.get(group_name))
 
     logger.info(f"User {user_id}: WebSocket state: {websocket.client_state}")
 
     try:
-        while websocket.client_state == WebSocketState.CONNECTED:
-            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-            if message is None:
-                if random.random() < 0.01:
-                    logger.info(f"User {user_id}: WebSocket state: {websocket.client_state}")
-                await asyncio.sleep(0.01)
-                continue
+        async for message in subscription_channels:
+            if websocket.client_state != WebSocketState.CONNECTED or send_queue.check():
+                break
 
             try:
-                message_data = json.loads(message['data'], object_hook=decode_decimal)
                 channel = message['channel'].decode('utf-8') if isinstance(message['channel'], bytes) else message['channel']
+                if channel == REDIS_MARKET_DATA_CHANNEL:
+                    tick, first_decode = market_ticks.decode(message['data'])
+                    message_data = tick.data
+                else:
+                    message_data = json.loads(message['data'], object_hook=decode_decimal)
                 logger.info(f"User {user_id}: Received message on channel {channel}: {json.dumps(message_data, cls=DecimalEncoder)[:200]}...")
 
                 if channel == REDIS_MARKET_DATA_CHANNEL:
                     if message_data.get("type") == "market_data_update":
-                        firebase_ts = message_data.get("_timestamp")
-                        if firebase_ts:
-                            import time
-                            delay = time.time() - firebase_ts
-                            logger.info(f"User {user_id}: Market data delay from Firebase to WS listener entry: {delay:.4f} seconds.")
-
-                        price_data_content = {k: v for k, v in message_data.items() if k not in ["type", "_timestamp"]}
-                        group_settings = await get_group_symbol_settings_cache(redis_client, group_name, "ALL")
-                        relevant_symbols = set(group_settings.keys())
-                        adjusted_prices = await _calculate_and_cache_adjusted_prices(
-                            raw_market_data=price_data_content,
-                            group_name=group_name,
-                            relevant_symbols=relevant_symbols,
-                            group_settings=group_settings,
-                            redis_client=redis_client
-                        )
-                        all_symbols_cache.update(adjusted_prices)
+                        observe_tick(message_data, STAGE_WS_RECEIVED)
+                        send_queue.note_tick_origin(message_data.get(TICK_ORIGIN_KEY))
+
+                        if first_decode:
+                            # Last known prices are persisted once per process, not once per socket
+                            for symbol, prices in tick.prices.items():
+                                await set_last_known_price(redis_client, symbol.upper(), prices)
+                        group_state = await group_states.get(group_name)
+                        group_state.apply(tick)
 
                         # --- Only send changed symbols ---
-                        changed_prices = {}
-                        for symbol, price in adjusted_prices.items():
-                            last = last_sent_prices.get(symbol)
-                            if not last or (
-                                price['buy'] != last['buy'] or
-                                price['sell'] != last['sell'] or
-                                price['spread'] != last['spread']
-                            ):
-                                changed_prices[symbol] = price
-                                last_sent_prices[symbol] = price
+                        changed_prices = price_cursor.take(everything=is_initial_connection)
+                        if not is_initial_connection and send_queue.account_pending:
+                            # Client hasn't taken the previous account summary yet: conflate prices
+                            # only and skip the portfolio recalculation for this tick
+                            send_queue.put_market_update(subscription.filter(changed_prices))
+                            observe_tick(message_data, STAGE_WS_SENT)
+                            continue
                         # If initial connection, send all; else, only changed
                         await process_portfolio_update(
                             user_id=user_id,
                             group_name=group_name,
                             redis_client=redis_client,
-                            db=db,
                             user_type=user_type,
-                            adjusted_prices=all_symbols_cache if is_initial_connection else changed_prices,
+                            adjusted_prices=changed_prices,
                             websocket=websocket,
-                            is_initial_connection=is_initial_connection,
-                            all_symbols_cache=all_symbols_cache
+                            is_initial_connection=is_initial_connection and not orders_cached,
+                            all_symbols_cache=group_state.prices,
+                            send_queue=send_queue,
+                            subscription=subscription,
+                            group_settings=group_state.settings
                         )
+                        observe_tick(message_data, STAGE_WS_SENT)
                         if is_initial_connection:
                             is_initial_connection = False
                             logger.info(f"User {user_id}: Initial connection completed, switching to incremental updates")
                 
-                elif channel == REDIS_ORDER_UPDATES_CHANNEL:
+                elif channel == order_channel:
                     # Handle order updates
                     logger.info(f"User {user_id}: ORDER UPDATE CHANNEL - Full message data: {json.dumps(message_data, cls=DecimalEncoder)}")
-                    if message_data.get("type") == "ORDER_UPDATE" and str(message_data.get("user_id")) == str(user_id):
+                    if message_data.get("type") == "ORDER_UPDATE":
                         logger.info(f"User {user_id}: Received order update notification, timestamp: {message_data.get('timestamp')}")
                         
                         # Force refresh of static orders cache from database
                         logger.info(f"User {user_id}: Forcing refresh of static orders cache from database")
                         
                         # IMPORTANT: Create a new database session for this operation to ensure fresh data
-                        async with AsyncSessionLocal() as refresh_db:
+                        async with WsSessionLocal() as refresh_db:
                             try:
                                 static_orders = await update_static_orders_cache(user_id, refresh_db, redis_client, user_type)
                                 
@@ -481,13 +447,15 @@ async def per_connection_redis_listener(
                                 pending_orders_count = len(static_orders.get("pending_orders", []))
                                 logger.info(f"User {user_id}: Refreshed static orders cache: {open_orders_count} open orders, {pending_orders_count} pending orders")
                                 logger.info(f"User {user_id}: Static orders content: {json.dumps(static_orders, cls=DecimalEncoder)}")
+                                # Newly opened / pending positions always stream prices
+                                subscription.follow(position_symbols(static_orders))
                             except Exception as e:
                                 logger.error(f"User {user_id}: Error updating static orders cache: {e}", exc_info=True)
                                 static_orders = {"open_orders": [], "pending_orders": []}
                         
                         # Get fresh user data to ensure we have the latest balance and margin
                         user_data = None
-                        async with AsyncSessionLocal() as refresh_db:
+                        async with WsSessionLocal() as refresh_db:
                             try:
                                 user_data = await get_user_data_cache(redis_client, user_id, refresh_db, user_type)
                                 logger.info(f"User {user_id}: Fresh user data fetched for order update: {json.dumps(user_data, cls=DecimalEncoder) if user_data else None}")
@@ -525,7 +493,7 @@ async def per_connection_redis_listener(
                             response_data = {
                                 "type": "market_update",
                                 "data": {
-                                    "market_prices": all_symbols_cache,  # Send all symbols data for order updates
+                                    "market_prices": dict(subscription.filter(price_cursor.group.prices)),  # Send all subscribed symbols for order updates
                                     "account_summary": {
                                         "balance": balance_value,
                                         "margin": margin_value,
@@ -535,17 +503,17 @@ async def per_connection_redis_listener(
                                 }
                             }
                             logger.info(f"User {user_id}: WebSocket response data: {json.dumps(response_data, cls=DecimalEncoder)[:500]}...")
-                            await websocket.send_text(json.dumps(response_data, cls=DecimalEncoder))
-                            logger.info(f"User {user_id}: Sent orders update using market_update type")
+                            send_queue.put_event(response_data)
+                            logger.info(f"User {user_id}: Queued orders update using market_update type")
                 
-                elif channel == REDIS_USER_DATA_UPDATES_CHANNEL:
+                elif channel == user_data_channel:
                     # Handle user data updates
-                    if message_data.get("type") == "USER_DATA_UPDATE" and str(message_data.get("user_id")) == str(user_id):
+                    if message_data.get("type") == "USER_DATA_UPDATE":
                         logger.info(f"User {user_id}: Received user data update notification")
                         
                         # Refresh user data cache with a fresh database session
                         user_data = None
-                        async with AsyncSessionLocal() as refresh_db:
+                        async with WsSessionLocal() as refresh_db:
                             try:
                                 logger.info(f"User {user_id}: Fetching fresh user data from database")
                                 user_data = await get_user_data_cache(redis_client, user_id, refresh_db, user_type)
@@ -575,7 +543,7 @@ async def per_connection_redis_listener(
                         
                         # Get static orders to include in the response - use fresh database session
                         static_orders = None
-                        async with AsyncSessionLocal() as refresh_db:
+                        async with WsSessionLocal() as refresh_db:
                             try:
                                 logger.info(f"User {user_id}: Fetching fresh static orders from database")
                                 static_orders = await update_static_orders_cache(user_id, refresh_db, redis_client, user_type)
@@ -602,7 +570,7 @@ async def per_connection_redis_listener(
                             response_data = {
                                 "type": "market_update",
                                 "data": {
-                                    "market_prices": all_symbols_cache,  # Send all symbols data for user data updates
+                                    "market_prices": dict(subscription.filter(price_cursor.group.prices)),  # Send all subscribed symbols for user data updates
                                     "account_summary": {
                                         "balance": balance_value,
                                         "margin": margin_value,
@@ -612,9 +580,11 @@ async def per_connection_redis_listener(
                                 }
                             }
                             logger.info(f"User {user_id}: Sending user data update with balance={balance_value}, margin={margin_value}, {len(static_orders.get('open_orders', []))} open orders and {len(static_orders.get('pending_orders', []))} pending orders")
-                            await websocket.send_text(json.dumps(response_data, cls=DecimalEncoder))
-                            logger.info(f"User {user_id}: Sent user data update using market_update type")
+                            send_queue.put_event(response_data)
+                            logger.info(f"User {user_id}: Queued user data update using market_update type")
             
+            except SlowConsumerEvicted:
+                break
             except json.JSONDecodeError as e:
                 logger.error(f"User {user_id}: JSON decode error: {e}", exc_info=True)
             except Exception as e:
@@ -625,10 +595,8 @@ async def per_connection_redis_listener(
     except Exception as e:
         logger.error(f"User {user_id}: Unexpected error: {e}", exc_info=True)
     finally:
-        await pubsub.unsubscribe(REDIS_MARKET_DATA_CHANNEL)
-        await pubsub.unsubscribe(REDIS_ORDER_UPDATES_CHANNEL)
-        await pubsub.unsubscribe(REDIS_USER_DATA_UPDATES_CHANNEL)
-        await pubsub.close()
+        websocket_connections.dec()
+        await subscription_channels.close()
         logger.info(f"User {user_id}: Unsubscribed from Redis and cleaned up.")
 
 async def update_static_orders_cache(user_id: int, db: AsyncSession, redis_client: Redis, user_type: str):
@@ -697,12 +665,15 @@ async def update_dynamic_portfolio_cache(
     open_positions: List[Dict[str, Any]],
     adjusted_market_prices: Dict[str, Dict[str, float]],
     redis_client: Redis,
-    db: AsyncSession,
-    user_type: str
+    db: Optional[AsyncSession],
+    user_type: str,
+    group_symbol_settings: Optional[Mapping[str, Any]] = None
 ):
     """
     Update the dynamic portfolio cache for a user (free margin, positions with PnL, margin level).
-    This is called whenever market data changes.
+    This is called whenever market data changes. Returns the calculated values; the cache
+    write itself goes through dynamic_portfolio_writer and may be deferred. Without a db
+    the user data is only read from the cache.
     """
     try:
         # Get user data for balance, leverage, etc.
@@ -712,7 +683,8 @@ async def update_dynamic_portfolio_cache(
             return
         
         # Get group symbol settings for contract sizes, etc.
-        group_symbol_settings = await get_group_symbol_settings_cache(redis_client, group_name, "ALL")
+        if group_symbol_settings is None:
+            group_symbol_settings = await get_group_symbol_settings_cache(redis_client, group_name, "ALL")
         if not group_symbol_settings:
             logger.warning(f"Group symbol settings not found for group {group_name}. Cannot update dynamic portfolio.")
             return
@@ -736,7 +708,8 @@ async def update_dynamic_portfolio_cache(
             "margin_level": portfolio_metrics.get("margin_level", "0.0"),
             "positions_with_pnl": portfolio_metrics.get("positions", [])  # Positions with PnL calculations
         }
-        await set_user_dynamic_portfolio_cache(redis_client, user_id, dynamic_portfolio_data)
+        # Coalesced per account: sockets of the same account share at most one write per interval
+        await dynamic_portfolio_writer.submit(redis_client, user_type, user_id, dynamic_portfolio_data)
         logger.debug(f"Updated dynamic portfolio cache for user {user_id}")
         
         return dynamic_portfolio_data
@@ -745,25 +718,32 @@ async def update_dynamic_portfolio_cache(
         return None
     finally:
         # Ensure database session is properly handled
-        try:
-            await db.close()
-        except Exception:
-            pass  # Ignore close errors
+        if db is not None:
+            try:
+                await db.close()
+            except Exception:
+                pass  # Ignore close errors
 
 async def process_portfolio_update(
     user_id: int,
     group_name: str,
     redis_client: Redis,
-    db: AsyncSession,
     user_type: str,
     adjusted_prices: Dict[str, Dict[str, float]],
     websocket: WebSocket,
     is_initial_connection: bool,
-    all_symbols_cache: Dict[str, Dict[str, float]]
+    all_symbols_cache: Dict[str, Dict[str, float]],
+    send_queue: Optional[ConnectionSendQueue] = None,
+    subscription: Optional[SymbolSubscription] = None,
+    group_settings: Optional[Mapping[str, Any]] = None
 ):
     """
     Process market data updates, update dynamic portfolio data, and send updates to the client.
     Optimized to use cache instead of database queries on every tick.
+    With a send_queue the update is enqueued (conflated) instead of written to the socket inline.
+    With a subscription only the subscribed symbols' prices are sent; the portfolio is
+    still calculated from all prices. group_settings: the group's shared symbol settings.
+    Reads from the caches; a ws session is opened only when one of them is empty.
     """
     try:
         # Try to get static orders from cache first
@@ -777,7 +757,7 @@ async def process_portfolio_update(
                 logger.info(f"User {user_id}: Initial connection - fetching fresh orders from database.")
             
             # Create a new database session for fresh data
-            async with AsyncSessionLocal() as refresh_db:
+            async with WsSessionLocal() as refresh_db:
                 try:
                     static_orders = await update_static_orders_cache(user_id, refresh_db, redis_client, user_type)
                 except Exception as e:
@@ -787,32 +767,37 @@ async def process_portfolio_update(
         open_positions = static_orders.get("open_orders", []) if static_orders else []
         pending_orders = static_orders.get("pending_orders", []) if static_orders else []
         
+        # Get user data from cache (only query DB if cache is empty), so that the portfolio
+        # below is calculated from the cache
+        user_data = await get_user_data_cache(redis_client, user_id, None, user_type)
+        if not user_data:
+            logger.warning(f"User {user_id}: User data cache empty. Fetching from database.")
+            async with WsSessionLocal() as refresh_db:
+                try:
+                    user_data = await get_user_data_cache(redis_client, user_id, refresh_db, user_type)
+                except Exception as e:
+                    logger.error(f"User {user_id}: Error fetching user data: {e}", exc_info=True)
+        
         # Update dynamic portfolio cache with current market prices
+        dynamic_portfolio = None
         try:
-            await update_dynamic_portfolio_cache(
+            dynamic_portfolio = await update_dynamic_portfolio_cache(
                 user_id=user_id,
                 group_name=group_name,
                 open_positions=open_positions,
-                adjusted_market_prices=adjusted_prices,
+                # Positions in symbols that did not tick are valued at their latest price too
+                adjusted_market_prices=all_symbols_cache,
                 redis_client=redis_client,
-                db=db,
-                user_type=user_type
+                db=None,
+                user_type=user_type,
+                group_symbol_settings=group_settings
             )
         except Exception as e:
             logger.error(f"User {user_id}: Error updating dynamic portfolio cache: {e}", exc_info=True)
         
-        # Get dynamic portfolio from cache
-        dynamic_portfolio = await get_user_dynamic_portfolio_cache(redis_client, user_id)
-        
-        # Get user data from cache (only query DB if cache is empty)
-        user_data = await get_user_data_cache(redis_client, user_id, db, user_type)
-        if not user_data:
-            logger.warning(f"User {user_id}: User data cache empty. Fetching from database.")
-            async with AsyncSessionLocal() as refresh_db:
-                try:
-                    user_data = await get_user_data_cache(redis_client, user_id, refresh_db, user_type)
-                except Exception as e:
-                    logger.error(f"User {user_id}: Error fetching user data: {e}", exc_info=True)
+        # The write may be coalesced: read the cache only if nothing was calculated
+        if dynamic_portfolio is None:
+            dynamic_portfolio = await get_user_dynamic_portfolio_cache(redis_client, user_id)
         
         if not dynamic_portfolio:
             dynamic_portfolio = {
@@ -835,7 +820,7 @@ async def process_portfolio_update(
             logger.debug(f"User {user_id}: Using balance_value={balance_value}, margin_value={margin_value} for WebSocket response")
             
             # Only send changed/updated symbols after initial connection
-            market_prices_to_send = adjusted_prices
+            market_prices_to_send = subscription.filter(adjusted_prices) if subscription is not None else adjusted_prices
             logger.debug(f"User {user_id}: Sending {len(market_prices_to_send)} changed/updated symbols")
             
             response_data = {
@@ -850,16 +835,13 @@ async def process_portfolio_update(
                     }
                 }
             }
-            await websocket.send_text(json.dumps(response_data, cls=DecimalEncoder))
+            if send_queue is not None:
+                send_queue.put_market_update(market_prices_to_send, response_data["data"]["account_summary"])
+            else:
+                await websocket.send_text(json.dumps(response_data, cls=DecimalEncoder))
             logger.debug(f"User {user_id}: Sent positions + market prices update")
     except Exception as e:
         logger.error(f"User {user_id}: Error processing portfolio update: {e}", exc_info=True)
-    finally:
-        # Ensure database session is properly handled
-        try:
-            await db.close()
-        except Exception:
-            pass  # Ignore close errors
 
 
 # app/api/v1/endpoints/market_data_ws.py
@@ -874,14 +856,204 @@ from sqlalchemy.orm import Session
 from app.database.session import get_db
 from app.dependencies.redis_client import get_redis_client
 
+async def send_frame(websocket: WebSocket, codec, frame: Dict[str, Any]):
+    """Writes a frame directly to the socket in the connection's negotiated format."""
+    payload = codec.encode(frame)
+    if codec.binary:
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+
+
+def build_default_subscription(
+    user_id: int,
+    group_name: str,
+    group_state: GroupState,
+    favorite_symbols: List[str],
+    static_orders: Optional[Dict[str, Any]]
+) -> SymbolSubscription:
+    """
+    Default symbol subscription of a connection: the user's favorite symbols plus the
+    symbols of their open and pending orders, restricted to the group's current symbols.
+    """
+    subscription = SymbolSubscription(
+        group_name,
+        set(favorite_symbols) | position_symbols(static_orders),
+        group=group_state
+    )
+    logger.info(f"User {user_id}: Default subscription: "
+                f"{'all symbols' if subscription.subscribes_all else sorted(subscription.symbols)}")
+    return subscription
+
+
+async def handle_subscription_message(
+    message_text: str,
+    subscription: SymbolSubscription,
+    send_queue: ConnectionSendQueue,
+    redis_client: Redis,
+    group_name: str
+):
+    """
+    Applies a client subscription control message, replies with the resulting
+    subscription and sends the current prices of newly subscribed symbols.
+    """
+    try:
+        control = parse_control_message(message_text)
+        if control is None:
+            return
+        reply = subscription.apply(control["action"], control["symbols"])
+        send_queue.put_event(reply)
+
+        snapshot = {}
+        for symbol in reply["data"]["added"]:
+            cached_prices = await get_adjusted_market_price_cache(redis_client, group_name, symbol)
+            if cached_prices:
+                snapshot[symbol] = {
+                    'buy': float(cached_prices.get('buy', 0)),
+                    'sell': float(cached_prices.get('sell', 0)),
+                    'spread': float(cached_prices.get('spread', 0))
+                }
+        if snapshot:
+            send_queue.put_market_update(snapshot)
+    except SlowConsumerEvicted:
+        pass
+    except ValueError as e:
+        send_queue.put_event({"type": "error", "message": str(e)})
+
+
+async def serve_connection(
+    websocket: WebSocket,
+    codec,
+    redis_client: Redis,
+    user_id: int,
+    group_name: str,
+    user_type: str,
+    account_number: str,
+    subscription: SymbolSubscription,
+    account_session: Optional[AccountSession] = None,
+    resumed: bool = False,
+    missed_deltas: Optional[List[Dict[str, Any]]] = None,
+    orders_cached: bool = False
+):
+    """
+    Runs an established connection: send queue, Redis listener and the client message
+    loop. With an account session, account summaries go out as sequenced deltas.
+    orders_cached: the bootstrap already cached fresh static orders for this connection.
+    The connection holds no DB session; the listener opens ws sessions around its DB work.
+    """
+    async def close_evicted(reason: str):
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Slow consumer")
+
+    # Outbound frames go through a bounded, conflating queue so a slow client never blocks the listener
+    settings = get_settings()
+    send_queue = ConnectionSendQueue(
+        websocket.send_bytes if codec.binary else websocket.send_text,
+        label=f"{user_type}:{user_id}",
+        serialize=codec.encode,
+        max_events=settings.WS_SEND_QUEUE_MAX_EVENTS,
+        eviction_deadline=settings.WS_SLOW_CONSUMER_EVICTION_SECONDS,
+        on_evict=close_evicted,
+        account_stream=account_session.stream if account_session is not None else None,
+        stamp_origin=settings.WS_FRAME_ORIGIN_TIMESTAMPS
+    )
+    send_queue.start()
+    if resumed:
+        send_queue.put_event({"type": "account_resumed", "data": {
+            "stream": account_session.token, "seq": account_session.stream.seq, "deltas": missed_deltas or []
+        }})
+
+    # Create and manage the per-connection Redis listener task
+    listener_task = asyncio.create_task(
+        per_connection_redis_listener(websocket, user_id, group_name, redis_client, user_type,
+                                      send_queue, subscription, resumed=resumed,
+                                      orders_cached=orders_cached or resumed)
+    )
+
+    try:
+        while True:
+            # Client -> server messages: subscribe / unsubscribe / set_watchlist
+            message_text = await websocket.receive_text()
+            await handle_subscription_message(message_text, subscription, send_queue, redis_client, group_name)
+
+    except WebSocketDisconnect:
+        logger.info(f"User {account_number}: WebSocket disconnected by client.")
+    except Exception as e:
+        logger.error(f"User {account_number}: Error in main WebSocket loop: {e}", exc_info=True)
+    finally:
+        logger.info(f"User {account_number}: Cleaning up WebSocket connection.")
+        if not listener_task.done():
+            listener_task.cancel()
+            try:
+                await listener_task
+            except asyncio.CancelledError:
+                logger.info(f"User {account_number}: Listener task successfully cancelled.")
+            except Exception as task_e:
+                logger.error(f"User {account_number}: Error during listener task cleanup: {task_e}", exc_info=True)
+        await send_queue.close()
+        if account_session is not None:
+            account_sessions.detach(account_session)
+
+        if websocket.client_state != WebSocketState.DISCONNECTED:
+            try:
+                await websocket.close(code=status.WS_1000_NORMAL_CLOSURE)
+            except Exception as close_e:
+                logger.error(f"User {account_number}: Error explicitly closing WebSocket: {close_e}", exc_info=True)
+        logger.info(f"User {account_number}: WebSocket connection fully closed.")
+
+
+async def resume_account_session(
+    websocket: WebSocket,
+    token: str,
+    redis_client: Redis,
+    sessions: BulkheadSessionFactory
+):
+    """
+    Re-attaches a reconnecting client to its previous account stream session. Skips the
+    bootstrap (user load, group settings, price snapshot); only the open/pending orders
+    are re-read so that changes made while the client was away become deltas.
+    Returns (session, deltas to replay), or (None, None) if the client must bootstrap.
+    """
+    try:
+        payload = decode_token(token)
+        last_seq = int(websocket.query_params.get("seq"))
+    except Exception:
+        return None, None
+    user_type = payload.get("user_type", "live")
+    session, missed, result = account_sessions.resume(
+        websocket.query_params.get("resume"), payload.get("account_number"), user_type, last_seq
+    )
+    if session is None:
+        logger.info(f"Account {payload.get('account_number')}: stream resume refused ({result}), bootstrapping")
+        return None, None
+    try:
+        async with sessions() as db:
+            static_orders = await update_static_orders_cache(session.user_id, db, redis_client, user_type)
+            user_data = await get_user_data_cache(redis_client, session.user_id, db, user_type) or {}
+        missed = missed + session.stream.update({
+            "balance": str(user_data.get("wallet_balance", "0.0")),
+            "margin": str(user_data.get("margin", "0.0")),
+            "open_orders": static_orders.get("open_orders", []),
+            "pending_orders": static_orders.get("pending_orders", [])
+        })
+    except Exception as e:
+        logger.error(f"User {session.user_id}: Error catching up resumed stream: {e}", exc_info=True)
+        account_sessions.detach(session)
+        return None, None
+    logger.info(f"User {session.user_id}: Resumed account stream at seq {last_seq}, replaying {len(missed)} deltas")
+    return session, missed
+
+
 @router.websocket("/ws/market-data")
-async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, sessions: BulkheadSessionFactory = Depends(get_ws_sessions)):
     """
     WebSocket endpoint for market data.
     - Authenticates user as before.
     - Accepts the connection as early as possible, then does heavy DB/Redis work.
     - Sends a loading message immediately after accepting.
+    - Holds a ws bulkhead slot only while it reads the DB, not for the connection's lifetime.
     """
+    connected_at = time.perf_counter()
     logger.info("--- MINIMAL TEST: ENTERED websocket_endpoint ---")
     for handler in logger.handlers:
         handler.flush()
@@ -897,15 +1069,24 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
     # Clean up token - remove any trailing quotes or encoded characters
     token = token.strip('"').strip("'").replace('%22', '').replace('%27', '')
 
+    # Binary msgpack frames when the client asks for them, JSON otherwise
+    frame_format, subprotocol = negotiate_frame_format(
+        websocket.query_params.get("format"), websocket.headers.get("sec-websocket-protocol")
+    )
+    codec = create_frame_codec(frame_format)
+
     # Accept the WebSocket connection as early as possible
     try:
-        await websocket.accept()
-        logger.info(f"WebSocket connection accepted (early) for {websocket.client.host}:{websocket.client.port}")
+        await websocket.accept(subprotocol=subprotocol)
+        compression = "deflate" if permessage_deflate_offered(websocket.headers.get("sec-websocket-extensions")) else "none"
+        websocket_connections_total.labels(frame_format, compression).inc()
+        logger.info(f"WebSocket connection accepted (early) for {websocket.client.host}:{websocket.client.port} "
+                    f"(format={frame_format}, compression={compression})")
         # Send a loading message to the client
-        await websocket.send_text(json.dumps({
+        await send_frame(websocket, codec, {
             "type": "loading",
             "message": "Initializing connection, please wait..."
-        }))
+        })
     except Exception as accept_error:
         logger.error(f"Failed to accept WebSocket connection: {accept_error}")
         return
@@ -913,6 +1094,17 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
     # Initialize Redis client
     redis_client = await get_redis_client()
 
+    # Sequenced account stream (opt in); a reconnecting client may resume its previous session
+    stream_mode = websocket.query_params.get("stream") == "delta" or bool(websocket.query_params.get("resume"))
+    if websocket.query_params.get("resume"):
+        account_session, missed_deltas = await resume_account_session(websocket, token, redis_client, sessions)
+        if account_session is not None:
+            await serve_connection(websocket, codec, redis_client, account_session.user_id,
+                                   account_session.group_name, account_session.user_type,
+                                   account_session.account_number, account_session.subscription,
+                                   account_session, resumed=True, missed_deltas=missed_deltas)
+            return
+
     try:
         from jose import JWTError, ExpiredSignatureError
         try:
@@ -924,16 +1116,11 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
                 await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token: Account number missing")
                 return
 
-            # Strictly fetch from correct table based on user_type and account_number
+            # One joined query for the user, its open/pending orders and favorites; group settings from
+            # the resident registry; user caches written and prices read in one Redis pipeline
             logger.info(f"WebSocket auth: token payload={payload}, account_number={account_number}, user_type={user_type}")
-            if user_type == "demo":
-                logger.info(f"WebSocket auth: About to call get_demo_user_by_account_number with account_number={account_number}, user_type={user_type}")
-                db_user_instance = await get_demo_user_by_account_number(db, account_number, user_type)
-                logger.info(f"WebSocket auth: get_demo_user_by_account_number({account_number}, {user_type}) returned: {db_user_instance}")
-            else:
-                logger.info(f"WebSocket auth: About to call get_user_by_account_number with account_number={account_number}, user_type={user_type}")
-                db_user_instance = await get_user_by_account_number(db, account_number, user_type)
-                logger.info(f"WebSocket auth: get_user_by_account_number({account_number}, {user_type}) returned: {db_user_instance}")
+            bootstrap = await bootstrap_connection(sessions, redis_client, account_number, user_type, group_symbol_registry)
+            db_user_instance = bootstrap["user"] if bootstrap else None
 
             if not db_user_instance:
                 logger.warning(f"Authentication failed for account_number {account_number} (type {user_type}): User not found in correct table.")
@@ -953,64 +1140,25 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
             logger.warning(f"WebSocket auth failed: JWT error for {websocket.client.host}:{websocket.client.port}: {str(jwt_err)}")
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token")
             return
+        except DatabaseBusyError as busy:
+            logger.warning(f"WebSocket bootstrap for {websocket.client.host}:{websocket.client.port} refused: {busy}")
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Server busy")
+            return
 
-        group_name = getattr(db_user_instance, 'group_name', 'default')
+        group_name = bootstrap["group_name"]
         
         # Get user ID from the user instance
-        db_user_id = getattr(db_user_instance, 'id', None)
+        db_user_id = bootstrap["user_id"]
         if not db_user_id:
             logger.warning(f"Authentication failed: User instance missing ID field. Account: {account_number}")
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid user data")
             return
-            
-        # Initial caching of user data, portfolio, and group-symbol settings
-        user_data_to_cache = {
-            "id": getattr(db_user_instance, 'id', None),
-            "email": getattr(db_user_instance, 'email', None),
-            "account_number": account_number,
-            "group_name": group_name,
-            "leverage": Decimal(str(getattr(db_user_instance, 'leverage', 1.0))),
-            "wallet_balance": Decimal(str(getattr(db_user_instance, 'wallet_balance', 0.0))),
-            "margin": Decimal(str(getattr(db_user_instance, 'margin', 0.0))),
-            "user_type": user_type,
-            "first_name": getattr(db_user_instance, 'first_name', None),
-            "last_name": getattr(db_user_instance, 'last_name', None),
-            "country": getattr(db_user_instance, 'country', None),
-            "phone_number": getattr(db_user_instance, 'phone_number', None)
-        }
-        await set_user_data_cache(redis_client, db_user_id, user_data_to_cache, user_type)
 
-        # Always use user_type to select the correct order model
-        order_model_class = get_order_model(user_type)
-        logger.info(f"[WS] Using order model: {order_model_class.__name__} for user_type={user_type}, account_number={account_number}")
-        # Use DB user_id (int) for querying open orders
-        open_positions_orm = await crud_order.get_all_open_orders_by_user_id(db, db_user_id, order_model_class)
-        logger.info(f"[WS] Open positions from DB for user_id={db_user_id}: {open_positions_orm}")
-
-        initial_positions_data = []
-        for pos in open_positions_orm:
-            pos_dict = {attr: str(v) if isinstance(v := getattr(pos, attr, None), Decimal) else v
-                        for attr in ['order_id', 'order_company_name', 'order_type', 'order_quantity', 'order_price', 'margin', 'contract_value', 'stop_loss', 'take_profit', 'order_user_id', 'order_status']}
-            pos_dict['commission'] = str(getattr(pos, 'commission', '0.0'))
-            # Add created_at field instead of updated_at
-            created_at = getattr(pos, 'created_at', None)
-            if created_at:
-                pos_dict['created_at'] = created_at.isoformat() if isinstance(created_at, datetime.datetime) else str(created_at)
-            initial_positions_data.append(pos_dict)
-
-        # Dynamically calculate margin from open positions
-        total_margin = sum(Decimal(pos['margin']) for pos in initial_positions_data if 'margin' in pos)
-        user_portfolio_data = {
-            "balance": str(user_data_to_cache["wallet_balance"]),
-            "equity": "0.0",
-            "margin": str(total_margin),
-            "free_margin": "0.0",
-            "profit_loss": "0.0",
-            "margin_level": "0.0",
-            "positions": initial_positions_data
-        }
-        await set_user_portfolio_cache(redis_client, db_user_id, user_portfolio_data)
-        await update_group_symbol_settings(group_name, db, redis_client)
+        user_data_to_cache = bootstrap["user_data"]
+        static_orders = bootstrap["static_orders"]
+        group_settings = bootstrap["group_settings"]
+        logger.info(f"[WS] Bootstrapped user_id={db_user_id}: {len(static_orders['open_orders'])} open, "
+                    f"{len(static_orders['pending_orders'])} pending orders, {len(group_settings)} group symbols")
 
     except Exception as e:
         logger.error(f"Unexpected WS auth error for {websocket.client.host}:{websocket.client.port}: {e}", exc_info=True)
@@ -1018,85 +1166,31 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
             await websocket.close(code=status.WS_1011_INTERNAL_ERROR, reason="Authentication error")
         return
 
-    # Initialize static orders cache
-    static_orders = await update_static_orders_cache(db_user_id, db, redis_client, user_type)
-    
-    # Initialize dynamic portfolio cache with empty data
-    # This will be updated with the first market data update
-    initial_dynamic_portfolio = {
-        "balance": str(user_data_to_cache["wallet_balance"]),
-        "equity": str(user_data_to_cache["wallet_balance"]),
-        "margin": str(user_data_to_cache["margin"]),
-        "free_margin": str(user_data_to_cache["wallet_balance"]),
-        "profit_loss": "0.0",
-        "margin_level": "0.0",
-        "positions_with_pnl": []
-    }
-    await set_user_dynamic_portfolio_cache(redis_client, db_user_id, initial_dynamic_portfolio)
+    # Symbols this connection streams: favorites + open/pending orders until the client changes them
+    group_state = await group_states.get(group_name)
+    subscription = build_default_subscription(db_user_id, group_name, group_state,
+                                              bootstrap["favorite_symbols"], static_orders)
+    account_session = None
 
-    # Send initial connection data with all available symbols
+    # Send initial connection data with all subscribed symbols
     try:
         # Check if the connection is still alive before proceeding
         if websocket.client_state == WebSocketState.DISCONNECTED:
             logger.warning(f"User {account_number}: Client disconnected before sending initial data")
             return
 
-        # Get all available symbols for the group
-        group_settings = await get_group_symbol_settings_cache(redis_client, group_name, "ALL")
-        initial_symbols_data = {}
-        
-        if group_settings:
-            # Get all symbols for this group
-            group_symbols = list(group_settings.keys())
-            logger.info(f"User {account_number}: Fetching initial market data for {len(group_symbols)} symbols from cache (adjusted or last known price)")
-            for symbol in group_symbols:
-                # 1. Try adjusted price cache
-                cached_prices = await get_adjusted_market_price_cache(redis_client, group_name, symbol)
-                if cached_prices:
-                    initial_symbols_data[symbol] = {
-                        'buy': float(cached_prices.get('buy', 0)),
-                        'sell': float(cached_prices.get('sell', 0)),
-                        'spread': float(cached_prices.get('spread', 0))
-                    }
-                    continue
-                # 2. Fallback to last known price
-                last_price = await get_last_known_price(redis_client, symbol)
-                symbol_group_settings = group_settings.get(symbol)
-                if last_price and last_price.get('b') and last_price.get('o') and symbol_group_settings:
-                    try:
-                        raw_ask_price = last_price.get('b')  # Ask
-                        raw_bid_price = last_price.get('o')  # Bid
-                        ask_decimal = Decimal(str(raw_ask_price))
-                        bid_decimal = Decimal(str(raw_bid_price))
-                        spread_setting = Decimal(str(symbol_group_settings.get('spread', 0)))
-                        spread_pip_setting = Decimal(str(symbol_group_settings.get('spread_pip', 0)))
-                        configured_spread_amount = spread_setting * spread_pip_setting
-                        half_spread = configured_spread_amount / Decimal(2)
-                        adjusted_buy_price = ask_decimal + half_spread
-                        adjusted_sell_price = bid_decimal - half_spread
-                        effective_spread_price_units = adjusted_buy_price - adjusted_sell_price
-                        effective_spread_in_pips = Decimal("0.0")
-                        if spread_pip_setting > Decimal("0.0"):
-                            effective_spread_in_pips = effective_spread_price_units / spread_pip_setting
-                        initial_symbols_data[symbol] = {
-                            'buy': float(adjusted_buy_price),
-                            'sell': float(adjusted_sell_price),
-                            'spread': float(effective_spread_in_pips)
-                        }
-                        logger.debug(f"User {account_number}: Fallback last price for {symbol}: Buy={adjusted_buy_price}, Sell={adjusted_sell_price}")
-                    except Exception as calc_error:
-                        logger.error(f"User {account_number}: Error calculating adjusted prices for {symbol} from last known price: {calc_error}")
-                    continue
-                # 3. If neither, skip or send placeholder (optional)
-                # initial_symbols_data[symbol] = {'buy': 0.0, 'sell': 0.0, 'spread': 0.0}
-        
+        if codec.binary:
+            codec.price_decimals.update(price_decimals_from_group_settings(group_settings))
+        # Adjusted or last known prices of all group symbols, read by the bootstrap pipeline
+        initial_symbols_data = bootstrap["initial_prices"]
+
         # Check connection state again before sending
         if websocket.client_state == WebSocketState.CONNECTED:
             # Send initial connection message with all symbols data
             initial_response = {
                 "type": "market_update",
                 "data": {
-                    "market_prices": initial_symbols_data,
+                    "market_prices": subscription.filter(initial_symbols_data),
                     "account_summary": {
                         "balance": str(user_data_to_cache["wallet_balance"]),
                         "margin": str(user_data_to_cache["margin"]),
@@ -1106,14 +1200,27 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
                 }
             }
             
+            snapshot_frame = None
+            if stream_mode:
+                # The account goes out as a snapshot, later changes as sequenced deltas
+                account_session = account_sessions.create(user_type, db_user_id, account_number, group_name, subscription)
+                snapshot_frame = account_session.stream.snapshot(initial_response["data"].pop("account_summary"))
+
             try:
-                await websocket.send_text(json.dumps(initial_response, cls=DecimalEncoder))
+                await send_frame(websocket, codec, initial_response)
+                if snapshot_frame is not None:
+                    await send_frame(websocket, codec, snapshot_frame)
+                websocket_time_to_first_frame_seconds.observe(time.perf_counter() - connected_at)
                 logger.info(f"User {account_number}: Sent initial connection data with {len(initial_symbols_data)} symbols (fresh from cache)")
             except WebSocketDisconnect:
                 logger.warning(f"User {account_number}: Client disconnected during initial data send")
+                if account_session is not None:
+                    account_sessions.detach(account_session)
                 return
             except Exception as send_error:
                 logger.error(f"User {account_number}: Error sending initial data: {send_error}")
+                if account_session is not None:
+                    account_sessions.detach(account_session)
                 return
         else:
             logger.warning(f"User {account_number}: Client disconnected before sending initial data")
@@ -1122,77 +1229,8 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
     except Exception as e:
         logger.error(f"User {account_number}: Error sending initial connection data: {e}", exc_info=True)
 
-    # Create and manage the per-connection Redis listener task
-    listener_task = asyncio.create_task(
-        per_connection_redis_listener(websocket, db_user_id, group_name, redis_client, db, user_type)
-    )
-
-    try:
-        while True:
-            await websocket.receive_text()
-
-    except WebSocketDisconnect:
-        logger.info(f"User {account_number}: WebSocket disconnected by client.")
-    except Exception as e:
-        logger.error(f"User {account_number}: Error in main WebSocket loop: {e}", exc_info=True)
-    finally:
-        logger.info(f"User {account_number}: Cleaning up WebSocket connection.")
-        if not listener_task.done():
-            listener_task.cancel()
-            try:
-                await listener_task
-            except asyncio.CancelledError:
-                logger.info(f"User {account_number}: Listener task successfully cancelled.")
-            except Exception as task_e:
-                logger.error(f"User {account_number}: Error during listener task cleanup: {task_e}", exc_info=True)
-        
-        if websocket.client_state != WebSocketState.DISCONNECTED:
-            try:
-                await websocket.close(code=status.WS_1000_NORMAL_CLOSURE)
-            except Exception as close_e:
-                logger.error(f"User {account_number}: Error explicitly closing WebSocket: {close_e}", exc_info=True)
-        logger.info(f"User {account_number}: WebSocket connection fully closed.")
-
-
-# --- Helper Function to Update Group Symbol Settings (used by websocket_endpoint) ---
-# This function remains largely the same.
-async def update_group_symbol_settings(group_name: str, db: AsyncSession, redis_client: Redis):
-    if not group_name:
-        logger.warning("Cannot update group-symbol settings: group_name is missing.")
-        return
-    try:
-        group_settings_list = await crud_group.get_groups(db, search=group_name)
-        if not group_settings_list:
-             logger.warning(f"No group settings found in DB for group '{group_name}'.")
-             return
-        for group_setting in group_settings_list:
-            symbol_name = getattr(group_setting, 'symbol', None)
-            if symbol_name:
-                settings = {
-                    # ... (all your settings fields) ...
-                    "commision_type": getattr(group_setting, 'commision_type', None),"commision_value_type": getattr(group_setting, 'commision_value_type', None),"type": getattr(group_setting, 'type', None),"pip_currency": getattr(group_setting, 'pip_currency', "USD"),"show_points": getattr(group_setting, 'show_points', None),"swap_buy": getattr(group_setting, 'swap_buy', decimal.Decimal(0.0)),"swap_sell": getattr(group_setting, 'swap_sell', decimal.Decimal(0.0)),"commision": getattr(group_setting, 'commision', decimal.Decimal(0.0)),"margin": getattr(group_setting, 'margin', decimal.Decimal(0.0)),"spread": getattr(group_setting, 'spread', decimal.Decimal(0.0)),"deviation": getattr(group_setting, 'deviation', decimal.Decimal(0.0)),"min_lot": getattr(group_setting, 'min_lot', decimal.Decimal(0.0)),"max_lot": getattr(group_setting, 'max_lot', decimal.Decimal(0.0)),"pips": getattr(group_setting, 'pips', decimal.Decimal(0.0)),"spread_pip": getattr(group_setting, 'spread_pip', decimal.Decimal(0.0)),"contract_size": getattr(group_setting, 'contract_size', decimal.Decimal("100000")),
-                }
-                # Fetch profit_currency from Symbol model
-                symbol_obj_stmt = select(Symbol).filter_by(name=symbol_name.upper())
-                symbol_obj_result = await db.execute(symbol_obj_stmt)
-                symbol_obj = symbol_obj_result.scalars().first()
-                if symbol_obj and symbol_obj.profit_currency:
-                    settings["profit_currency"] = symbol_obj.profit_currency
-                else: # Fallback
-                    settings["profit_currency"] = getattr(group_setting, 'pip_currency', 'USD')
-                # Fetch contract_size from ExternalSymbolInfo (overrides group if found)
-                external_symbol_obj_stmt = select(ExternalSymbolInfo).filter_by(fix_symbol=symbol_name) # Case-sensitive match?
-                external_symbol_obj_result = await db.execute(external_symbol_obj_stmt)
-                external_symbol_obj = external_symbol_obj_result.scalars().first()
-                if external_symbol_obj and external_symbol_obj.contract_size is not None:
-                    settings["contract_size"] = external_symbol_obj.contract_size
-                
-                await set_group_symbol_settings_cache(redis_client, group_name, symbol_name.upper(), settings)
-            else:
-                 logger.warning(f"Group setting symbol is None for group '{group_name}'.")
-        logger.debug(f"Cached/updated group-symbol settings for group '{group_name}'.")
-    except Exception as e:
-        logger.error(f"Error caching group-symbol settings for '{group_name}': {e}", exc_info=True)
+    await serve_connection(websocket, codec, redis_client, db_user_id, group_name, user_type,
+                           account_number, subscription, account_session, orders_cached=True)
 
 
 # --- Redis Publisher Task (Publishes from Firebase queue to general market data channel) ---
@@ -1215,6 +1253,9 @@ async def redis_publisher_task(redis_client: Redis):
                 # Check if there is meaningful data besides the timestamp
                 if any(k != '_timestamp' for k in message_to_publish_data.keys()):
                      message_to_publish_data["type"] = "market_data_update" # Standardize type for raw updates
+                     # Latency tracing: time spent in redis_publish_queue. The stamp is stored
+                     # under _trace so downstream stages can see whether the tick is sampled.
+                     stamp_tick(message_to_publish_data, STAGE_QUEUED)
                      message_to_publish = json.dumps(message_to_publish_data, cls=DecimalEncoder)
                 else: # Skip if only timestamp was present
                      redis_publish_queue.task_done()
@@ -1225,6 +1266,9 @@ async def redis_publisher_task(redis_client: Redis):
                 continue
             try:
                 await redis_client.publish(REDIS_MARKET_DATA_CHANNEL, message_to_publish)
+                _MARKET_DATA_PUBLISHED.inc()
+                # Stamped once Redis has acknowledged the PUBLISH, so the stage includes the round trip
+                stamp_tick(message_to_publish_data, STAGE_PUBLISH)
             except Exception as e:
                 logger.error(f"Publisher failed to publish to Redis: {e}. Msg: {message_to_publish[:100]}...", exc_info=True)
             redis_publish_queue.task_done()
@@ -1242,6 +1286,7 @@ async def redis_publisher_task(redis_client: Redis):
 @router.post("/debug/publish-order-update/{user_id}")
 async def debug_publish_order_update(
     user_id: int,
+    user_type: str = Query("demo"),
     redis_client: Redis = Depends(get_redis_client)
 ):
     """
@@ -1255,8 +1300,9 @@ async def debug_publish_order_update(
             "timestamp": datetime.datetime.now().isoformat()
         }, cls=DecimalEncoder)
         
-        result = await redis_client.publish(REDIS_ORDER_UPDATES_CHANNEL, message)
-        logger.info(f"DEBUG: Published order update for user {user_id} to {REDIS_ORDER_UPDATES_CHANNEL}, received by {result} subscribers")
+        channel = order_updates_channel(user_type, user_id)
+        result = await redis_client.publish(channel, message)
+        logger.info(f"DEBUG: Published order update for user {user_id} to {channel}, received by {result} subscribers")
         
         return {"status": "success", "message": f"Order update published for user {user_id}", "subscribers": result}
     except Exception as e:
@@ -1277,7 +1323,7 @@ async def debug_refresh_orders(
     """
     try:
         # Create a new database session for this operation
-        async with AsyncSessionLocal() as refresh_db:
+        async with WsSessionLocal() as refresh_db:
             # Force refresh of static orders cache from database
             static_orders = await update_static_orders_cache(user_id, refresh_db, redis_client, user_type)
             
@@ -1292,8 +1338,9 @@ async def debug_refresh_orders(
             "timestamp": datetime.datetime.now().isoformat()
         }, cls=DecimalEncoder)
         
-        result = await redis_client.publish(REDIS_ORDER_UPDATES_CHANNEL, message)
-        logger.info(f"DEBUG: Published order update for user {user_id} to {REDIS_ORDER_UPDATES_CHANNEL}, received by {result} subscribers")
+        channel = order_updates_channel(user_type, user_id)
+        result = await redis_client.publish(channel, message)
+        logger.info(f"DEBUG: Published order update for user {user_id} to {channel}, received by {result} subscribers")
         
         return {
             "status": "success", 
@@ -1325,12 +1372,13 @@ async def debug_publish_user_data_update(
             "timestamp": datetime.datetime.now().isoformat()
         }, cls=DecimalEncoder)
         
-        result = await redis_client.publish(REDIS_USER_DATA_UPDATES_CHANNEL, message)
-        logger.info(f"DEBUG: Published user data update for user {user_id} to {REDIS_USER_DATA_UPDATES_CHANNEL}, received by {result} subscribers")
+        user_type = "demo"  # Default to demo for testing
+        channel = user_data_updates_channel(user_type, user_id)
+        result = await redis_client.publish(channel, message)
+        logger.info(f"DEBUG: Published user data update for user {user_id} to {channel}, received by {result} subscribers")
         
         # Force refresh of user data cache from database
-        async with AsyncSessionLocal() as refresh_db:
-            user_type = "demo"  # Default to demo for testing
+        async with WsSessionLocal() as refresh_db:
             user_data = await get_user_data_cache(redis_client, user_id, refresh_db, user_type)
             logger.info(f"DEBUG: Refreshed user data cache for user {user_id}: {user_data}")
         
@@ -1362,12 +1410,12 @@ async def debug_test_all_updates(
     """
     try:
         # Step 1: Refresh user data cache
-        async with AsyncSessionLocal() as refresh_db:
+        async with WsSessionLocal() as refresh_db:
             user_data = await get_user_data_cache(redis_client, user_id, refresh_db, user_type)
             logger.info(f"DEBUG: Refreshed user data cache for user {user_id}: {json.dumps(user_data, cls=DecimalEncoder) if user_data else None}")
         
         # Step 2: Refresh static orders cache
-        async with AsyncSessionLocal() as refresh_db:
+        async with WsSessionLocal() as refresh_db:
             static_orders = await update_static_orders_cache(user_id, refresh_db, redis_client, user_type)
             open_orders_count = len(static_orders.get("open_orders", []))
             pending_orders_count = len(static_orders.get("pending_orders", []))
@@ -1379,7 +1427,7 @@ async def debug_test_all_updates(
             "user_id": user_id,
             "timestamp": datetime.datetime.now().isoformat()
         }, cls=DecimalEncoder)
-        user_data_result = await redis_client.publish(REDIS_USER_DATA_UPDATES_CHANNEL, user_data_message)
+        user_data_result = await redis_client.publish(user_data_updates_channel(user_type, user_id), user_data_message)
         logger.info(f"DEBUG: Published user data update, received by {user_data_result} subscribers")
         
         # Step 4: Publish order update
@@ -1388,7 +1436,7 @@ async def debug_test_all_updates(
             "user_id": user_id,
             "timestamp": datetime.datetime.now().isoformat()
         }, cls=DecimalEncoder)
-        order_update_result = await redis_client.publish(REDIS_ORDER_UPDATES_CHANNEL, order_update_message)
+        order_update_result = await redis_client.publish(order_updates_channel(user_type, user_id), order_update_message)
         logger.info(f"DEBUG: Published order update, received by {order_update_result} subscribers")
         
         return {
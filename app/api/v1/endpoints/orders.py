@@ -1,6 +1,6 @@
 # app/api/v1/endpoints/orders.py
 
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Request, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Request, BackgroundTasks, Query, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from redis.asyncio import Redis
 import logging
@@ -24,7 +24,9 @@ from app.schemas.order import (
     ServiceProviderUpdateRequest, OrderPlacementRequest, OrderResponse, CloseOrderRequest, 
     UpdateStopLossTakeProfitRequest, PendingOrderPlacementRequest, PendingOrderCancelRequest, 
     AddStopLossRequest, AddTakeProfitRequest, CancelStopLossRequest, CancelTakeProfitRequest, 
-    HalfSpreadRequest, HalfSpreadResponse, OrderStatusResponse
+    HalfSpreadRequest, HalfSpreadResponse, OrderStatusResponse,
+    BulkOrderRequest, BulkOrderResponse, BulkOrderRejection,
+    BatchCloseRequest, CloseAllRequest, BatchCloseResponse, BatchCloseSkipped
 )
 from app.schemas.user import StatusResponse
 from app.schemas.wallet import WalletCreate
@@ -67,6 +69,10 @@ from app.services.order_processing import (
 from app.services.portfolio_calculator import _convert_to_usd, calculate_user_portfolio
 from app.services.margin_calculator import calculate_single_order_margin, get_live_adjusted_buy_price_for_pair, get_live_adjusted_sell_price_for_pair
 from app.services.pending_orders import add_pending_order, remove_pending_order
+from app.services.account_actor import account_actor
+from app.services.idempotency import IdempotencyError, idempotency_guard
+from app.services.bulk_orders import is_verified, place_bulk_orders
+from app.services.batch_close import close_positions
 
 from app.crud import crud_order, group as crud_group
 from app.crud.crud_order import OrderCreateInternal
@@ -82,7 +88,7 @@ from app.database.models import UserOrder, DemoUserOrder, Wallet
 from app.services.order_processing import generate_unique_10_digit_id
 from app.schemas.wallet import WalletCreate
 
-from app.crud.external_symbol_info import get_external_symbol_info_by_symbol
+from app.crud.external_symbol_info import fix_symbol_matches, get_external_symbol_info_by_symbol
 from app.crud.group import get_all_symbols_for_group
 from app.core.firebase import get_latest_market_data
 from app.services.margin_calculator import get_external_symbol_info
@@ -99,8 +105,8 @@ router = APIRouter(
 # --- Global Helper Functions for Cache and Portfolio Updates ---
 async def update_user_cache(user_id, db, redis_client, user_type):
     """Update user cache in background after order changes."""
-    from app.database.session import async_session_factory
-    async with await async_session_factory() as background_db:
+    from app.database.session import ApiSessionLocal
+    async with ApiSessionLocal() as background_db:
         try:
             await update_user_static_orders_cache_after_order_change(user_id, background_db, redis_client, user_type)
         except Exception as e:
@@ -108,8 +114,8 @@ async def update_user_cache(user_id, db, redis_client, user_type):
 
 async def update_portfolio(user_id, db, redis_client, user_type):
     """Update portfolio in background after order changes."""
-    from app.database.session import async_session_factory
-    async with await async_session_factory() as background_db:
+    from app.database.session import ApiSessionLocal
+    async with ApiSessionLocal() as background_db:
         try:
             await calculate_user_portfolio(background_db, redis_client, user_id, user_type)
         except Exception as e:
@@ -339,6 +345,20 @@ class OrderPlacementRequest(BaseModel):
             Decimal: lambda v: str(v),
         }
 
+def _response_body(response: Any) -> Any:
+    return response.model_dump(mode="json") if hasattr(response, "model_dump") else response
+
+
+async def run_idempotent(redis_client: Redis, scope: str, user: User | DemoUser, idempotency_key: Optional[str],
+                         request_model: BaseModel, handler):
+    """Runs an order submission once per Idempotency-Key of the calling user (see services/idempotency)."""
+    try:
+        return await idempotency_guard.run(redis_client, scope, get_user_type(user), user.id, idempotency_key,
+                                           request_model.model_dump(mode="json"), handler, encode=_response_body)
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
 @router.post("/", response_model=OrderResponse)
 async def place_order(
     order_request: OrderPlacementRequest,
@@ -346,7 +366,24 @@ async def place_order(
     current_user: User | DemoUser = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
     redis_client: Redis = Depends(get_redis_client),
-     
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Place a new order. A retry with the same Idempotency-Key gets the first response
+    instead of placing the order again.
+    """
+    return await run_idempotent(
+        redis_client, "place_order", current_user, idempotency_key, order_request,
+        lambda: _place_order(order_request, background_tasks, current_user, db, redis_client)
+    )
+
+
+async def _place_order(
+    order_request: OrderPlacementRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User | DemoUser,
+    db: AsyncSession,
+    redis_client: Redis,
 ):
     """
     Place a new order. ULTRA-OPTIMIZED for sub-500ms performance.
@@ -431,52 +468,55 @@ async def place_order(
             'take_profit': order_request.take_profit
         }
         
-        # Step 4: Process order with optimized function
-        start_processing = time.perf_counter()
-        processed_order_data = await process_new_order(
-            db=db,
-            redis_client=redis_client,
-            user_id=user_id,
-            order_data=order_data,
-            user_type=user_type,
-            is_barclays_live_user=is_barclays_user_result
-        )
-        processing_time = time.perf_counter() - start_processing
-        orders_logger.info(f"[PERF] Order processing: {processing_time:.4f}s")
-        
-        # Step 5: Create order record
-        start_creation = time.perf_counter()
-        order_model = get_order_model(user_type)
-        
-        # Create order with all data
-        order_create_data = OrderCreateInternal(
-            order_id=processed_order_data['order_id'],
-            order_status=processed_order_data['order_status'],
-            order_user_id=user_id,
-            order_company_name=symbol,
-            order_type=order_type,
-            order_price=processed_order_data['order_price'],
-            order_quantity=quantity,
-            contract_value=processed_order_data['contract_value'],
-            margin=processed_order_data['margin'],
-            commission=processed_order_data['commission'],
-            stop_loss=order_request.stop_loss,
-            take_profit=order_request.take_profit,
-            stoploss_id=processed_order_data.get('stoploss_id'),
-            takeprofit_id=processed_order_data.get('takeprofit_id'),
-            status=order_request.order_status
-        )
+        # Steps 4-5 in the account's turn, so the next mutation of the account sees this order
+        async with account_actor.hold(redis_client, user_type, user_id):
+            # Step 4: Process order with optimized function
+            start_processing = time.perf_counter()
+            processed_order_data = await process_new_order(
+                db=db,
+                redis_client=redis_client,
+                user_id=user_id,
+                order_data=order_data,
+                user_type=user_type,
+                is_barclays_live_user=is_barclays_user_result,
+                group_name=getattr(current_user, 'group_name', None)
+            )
+            processing_time = time.perf_counter() - start_processing
+            orders_logger.info(f"[PERF] Order processing: {processing_time:.4f}s")
+        
+            # Step 5: Create order record
+            start_creation = time.perf_counter()
+            order_model = get_order_model(user_type)
+        
+            # Create order with all data
+            order_create_data = OrderCreateInternal(
+                order_id=processed_order_data['order_id'],
+                order_status=processed_order_data['order_status'],
+                order_user_id=user_id,
+                order_company_name=symbol,
+                order_type=order_type,
+                order_price=processed_order_data['order_price'],
+                order_quantity=quantity,
+                contract_value=processed_order_data['contract_value'],
+                margin=processed_order_data['margin'],
+                commission=processed_order_data['commission'],
+                stop_loss=order_request.stop_loss,
+                take_profit=order_request.take_profit,
+                stoploss_id=processed_order_data.get('stoploss_id'),
+                takeprofit_id=processed_order_data.get('takeprofit_id'),
+                status=order_request.order_status
+            )
         
-        new_order = await crud_order.create_user_order(db=db, order_data=order_create_data.dict(), order_model=order_model)
-        creation_time = time.perf_counter() - start_creation
+            new_order = await crud_order.create_user_order(db=db, order_data=order_create_data.dict(), order_model=order_model)
+            creation_time = time.perf_counter() - start_creation
         orders_logger.info(f"[PERF] Order creation: {creation_time:.4f}s")
         
         
         
         async def barclays_push():
             orders_logger.info("[BARCLAYS] barclays_push called in place_order")
-            from app.database.session import async_session_factory
-            async with await async_session_factory() as background_db:
+            from app.database.session import ApiSessionLocal
+            async with ApiSessionLocal() as background_db:
                 try:
                     # Recompute Barclays check inside the task for safety
                     barclays_check = await is_barclays_live_user(current_user, db, redis_client)
@@ -513,9 +553,9 @@ async def place_order(
         
         # Step 7: Publish websocket updates
         orders_logger.info(f"Publishing order update for user {user_id}")
-        await publish_order_update(redis_client, user_id)
+        await publish_order_update(redis_client, user_id, user_type)
         orders_logger.info(f"Publishing user data update for user {user_id}")
-        await publish_user_data_update(redis_client, user_id)
+        await publish_user_data_update(redis_client, user_id, user_type)
         orders_logger.info(f"Publishing market data trigger")
         await publish_market_data_trigger(redis_client)
         
@@ -560,6 +600,58 @@ async def place_order(
         error_logger.error(f"Error in place_order: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to process order: {str(e)}")
 
+@router.post("/bulk", response_model=BulkOrderResponse)
+async def place_bulk_order(
+    bulk_request: BulkOrderRequest,
+    current_user: User | DemoUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    redis_client: Redis = Depends(get_redis_client),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Place one market order on each follower account of the calling fund manager, with
+    the quantity allocated to it. Accounts that cannot take their order are listed in
+    `rejected`; the others are placed in one transaction (see services/bulk_orders).
+    """
+    return await run_idempotent(
+        redis_client, "place_bulk_order", current_user, idempotency_key, bulk_request,
+        lambda: _place_bulk_order(bulk_request, current_user, db, redis_client)
+    )
+
+
+async def _place_bulk_order(
+    bulk_request: BulkOrderRequest,
+    current_user: User | DemoUser,
+    db: AsyncSession,
+    redis_client: Redis,
+):
+    from app.services.group_registry import group_symbol_registry
+    if get_user_type(current_user) != 'live' or not is_verified(current_user):
+        raise HTTPException(status_code=403, detail="Only verified live fund manager accounts can place bulk orders.")
+    orders_logger.info(f"Bulk order request - Manager: {current_user.id}, Symbol: {bulk_request.symbol}, "
+                       f"Type: {bulk_request.order_type}, Accounts: {len(bulk_request.allocations)}")
+    try:
+        placed, rejected = await place_bulk_orders(
+            db, redis_client, current_user,
+            {
+                'symbol': bulk_request.symbol,
+                'order_type': bulk_request.order_type,
+                'stop_loss': bulk_request.stop_loss,
+                'take_profit': bulk_request.take_profit,
+                'status': bulk_request.status,
+            },
+            [(allocation.user_id, allocation.order_quantity) for allocation in bulk_request.allocations],
+            group_symbol_registry,
+        )
+    except Exception as e:
+        orders_logger.error(f"Error in place_bulk_order: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to process bulk order: {str(e)}")
+    return BulkOrderResponse(
+        orders=[OrderResponse(**order) for order in placed],
+        rejected=[BulkOrderRejection(**rejection) for rejection in rejected],
+    )
+
+
 @router.post("/pending-place", response_model=OrderResponse)
 async def place_pending_order(
     order_request: PendingOrderPlacementRequest,
@@ -679,7 +771,7 @@ async def place_pending_order(
         new_order_id = await generate_unique_10_digit_id(db, order_model, 'order_id')
 
         # Fetch contract_size from ExternalSymbolInfo table
-        symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(order_request.symbol))
+        symbol_info_stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(order_request.symbol))
         symbol_info_result = await db.execute(symbol_info_stmt)
         ext_symbol_info = symbol_info_result.scalars().first()
         
@@ -826,13 +918,12 @@ async def place_pending_order(
         
         for attempt in range(max_verification_attempts):
             try:
-                # Create a new connection to the database to verify the order is truly committed
-                from app.database.session import AsyncSessionLocal
-                async with AsyncSessionLocal() as verify_db:
-                    verification_order = await crud_order.get_order_by_id(verify_db, db_order.order_id, order_model)
-                    if verification_order:
-                        orders_logger.info(f"Order {db_order.order_id} verified in database on attempt {attempt + 1} before adding to Redis.")
-                        break
+                # Re-read the committed order with the request's own session: a second api session
+                # opened while this one is held could wait on the bulkhead this request occupies
+                verification_order = await crud_order.get_order_by_id(db, db_order.order_id, order_model)
+                if verification_order:
+                    orders_logger.info(f"Order {db_order.order_id} verified in database on attempt {attempt + 1} before adding to Redis.")
+                    break
             except Exception as e:
                 orders_logger.error(f"Error during verification attempt {attempt + 1}: {str(e)}", exc_info=True)
             
@@ -989,7 +1080,26 @@ async def close_order(
     db: AsyncSession = Depends(get_db),
     redis_client: Redis = Depends(get_redis_client),
     current_user: User | DemoUser = Depends(get_user_from_service_or_user_token),
-    token: str = Depends(oauth2_scheme)
+    token: str = Depends(oauth2_scheme),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Close an existing order. A retry with the same Idempotency-Key gets the first
+    response instead of closing again.
+    """
+    return await run_idempotent(
+        redis_client, "close_order", current_user, idempotency_key, close_request,
+        lambda: _close_order(close_request, background_tasks, db, redis_client, current_user, token)
+    )
+
+
+async def _close_order(
+    close_request: CloseOrderRequest,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession,
+    redis_client: Redis,
+    current_user: User | DemoUser,
+    token: str,
 ):
     """
     Close an existing order.
@@ -1039,304 +1149,491 @@ async def close_order(
         from app.services.order_processing import generate_unique_10_digit_id
         close_id = await generate_unique_10_digit_id(db, order_model_class, 'close_id')
 
-        try:
-            if isinstance(user_to_operate_on, User):
-                user_type = 'live'
-                group_name = user_to_operate_on.group_name
+        # The rest of the close in the account's turn (see account_actor)
+        async with account_actor.hold(redis_client, user_type, user_to_operate_on.id):
+            try:
+                if isinstance(user_to_operate_on, User):
+                    user_type = 'live'
+                    group_name = user_to_operate_on.group_name
                 
-                sending_orders_normalized = None
-                if group_name:
-                    group_settings = await get_group_settings_cache(redis_client, group_name)
-                    sending_orders = group_settings.get('sending_orders') if group_settings else None
-                    if sending_orders:
-                        sending_orders_normalized = sending_orders.lower() if isinstance(sending_orders, str) else sending_orders
-                    else:
-                        # Fallback to DB if not in cache
-                        db_group = await crud_group.get_group_by_name(db, group_name)
-                        if db_group:
-                            sending_orders_db = getattr(db_group[0] if isinstance(db_group, list) else db_group, 'sending_orders', None)
-                            if sending_orders_db:
-                                sending_orders_normalized = sending_orders_db.lower() if isinstance(sending_orders_db, str) else sending_orders_db
-
-                orders_logger.info(f"User group: {group_name}, sending_orders setting: {sending_orders_normalized}")
+                    sending_orders_normalized = None
+                    if group_name:
+                        group_settings = await get_group_settings_cache(redis_client, group_name)
+                        sending_orders = group_settings.get('sending_orders') if group_settings else None
+                        if sending_orders:
+                            sending_orders_normalized = sending_orders.lower() if isinstance(sending_orders, str) else sending_orders
+                        else:
+                            # Fallback to DB if not in cache
+                            db_group = await crud_group.get_group_by_name(db, group_name)
+                            if db_group:
+                                sending_orders_db = getattr(db_group[0] if isinstance(db_group, list) else db_group, 'sending_orders', None)
+                                if sending_orders_db:
+                                    sending_orders_normalized = sending_orders_db.lower() if isinstance(sending_orders_db, str) else sending_orders_db
+
+                    orders_logger.info(f"User group: {group_name}, sending_orders setting: {sending_orders_normalized}")
                 
-                is_barclays_live_user = (user_type == 'live' and sending_orders_normalized == 'barclays')
-                if is_barclays_live_user:
-                    orders_logger.info(f"Live user {user_to_operate_on.id} from group '{group_name}' has 'sending_orders' set to 'barclays'. Pushing close request to Firebase and skipping local DB update.")
+                    is_barclays_live_user = (user_type == 'live' and sending_orders_normalized == 'barclays')
+                    if is_barclays_live_user:
+                        orders_logger.info(f"Live user {user_to_operate_on.id} from group '{group_name}' has 'sending_orders' set to 'barclays'. Pushing close request to Firebase and skipping local DB update.")
                     
-                    # Fetch the order from DB to get all necessary details for Firebase
-                    db_order_for_firebase = await crud_order.get_order_by_id(db, order_id=order_id, order_model=order_model_class)
-                    if not db_order_for_firebase:
-                        raise HTTPException(status_code=404, detail="Order to be closed not found in database for Firebase operation.")
-
-                    # Check for existing stop loss and take profit before closing the order
-                    # Generate cancel IDs if SL/TP exist and send individual cancellation messages
-                    stoploss_cancel_id = None
-                    takeprofit_cancel_id = None
+                        # Fetch the order from DB to get all necessary details for Firebase
+                        db_order_for_firebase = await crud_order.get_order_by_id(db, order_id=order_id, order_model=order_model_class)
+                        if not db_order_for_firebase:
+                            raise HTTPException(status_code=404, detail="Order to be closed not found in database for Firebase operation.")
+
+                        # Check for existing stop loss and take profit before closing the order
+                        # Generate cancel IDs if SL/TP exist and send individual cancellation messages
+                        stoploss_cancel_id = None
+                        takeprofit_cancel_id = None
                     
-                    # Flag to track if SL or TP exists
-                    has_sl_or_tp = False
+                        # Flag to track if SL or TP exists
+                        has_sl_or_tp = False
                     
-                    # Check if stop_loss exists and is > 0
-                    if db_order_for_firebase.stop_loss is not None and db_order_for_firebase.stop_loss > 0:
-                        has_sl_or_tp = True
-                        stoploss_cancel_id = await generate_unique_10_digit_id(db, order_model_class, 'stoploss_cancel_id')
-                        orders_logger.info(f"Generating stoploss_cancel_id: {stoploss_cancel_id} for order {order_id}")
+                        # Check if stop_loss exists and is > 0
+                        if db_order_for_firebase.stop_loss is not None and db_order_for_firebase.stop_loss > 0:
+                            has_sl_or_tp = True
+                            stoploss_cancel_id = await generate_unique_10_digit_id(db, order_model_class, 'stoploss_cancel_id')
+                            orders_logger.info(f"Generating stoploss_cancel_id: {stoploss_cancel_id} for order {order_id}")
                         
-                        # Send stop loss cancellation to Firebase
-                        sl_cancel_payload = {
-                            "action": "cancel_stoploss",
-                            "status": "TP/SL-CLOSED",  # Updated status for SL cancellation
-                            "stop_loss": db_order_for_firebase.stop_loss,
-                            "order_id": db_order_for_firebase.order_id,
-                            "user_id": user_to_operate_on.id,
-                            "stoploss_id": db_order_for_firebase.stoploss_id,
-                            "stoploss_cancel_id": stoploss_cancel_id,
-                            "order_company_name": db_order_for_firebase.order_company_name,
-                            "order_type": db_order_for_firebase.order_type
-                        }
-                        orders_logger.info(f"[FIREBASE_SL_CANCEL] Sending stop loss cancellation: {sl_cancel_payload}")
-                        background_tasks.add_task(send_order_to_firebase, sl_cancel_payload, "live")
+                            # Send stop loss cancellation to Firebase
+                            sl_cancel_payload = {
+                                "action": "cancel_stoploss",
+                                "status": "TP/SL-CLOSED",  # Updated status for SL cancellation
+                                "stop_loss": db_order_for_firebase.stop_loss,
+                                "order_id": db_order_for_firebase.order_id,
+                                "user_id": user_to_operate_on.id,
+                                "stoploss_id": db_order_for_firebase.stoploss_id,
+                                "stoploss_cancel_id": stoploss_cancel_id,
+                                "order_company_name": db_order_for_firebase.order_company_name,
+                                "order_type": db_order_for_firebase.order_type
+                            }
+                            orders_logger.info(f"[FIREBASE_SL_CANCEL] Sending stop loss cancellation: {sl_cancel_payload}")
+                            background_tasks.add_task(send_order_to_firebase, sl_cancel_payload, "live")
                     
-                    # Check if take_profit exists and is > 0
-                    if db_order_for_firebase.take_profit is not None and db_order_for_firebase.take_profit > 0:
-                        has_sl_or_tp = True
-                        takeprofit_cancel_id = await generate_unique_10_digit_id(db, order_model_class, 'takeprofit_cancel_id')
-                        orders_logger.info(f"Generating takeprofit_cancel_id: {takeprofit_cancel_id} for order {order_id}")
+                        # Check if take_profit exists and is > 0
+                        if db_order_for_firebase.take_profit is not None and db_order_for_firebase.take_profit > 0:
+                            has_sl_or_tp = True
+                            takeprofit_cancel_id = await generate_unique_10_digit_id(db, order_model_class, 'takeprofit_cancel_id')
+                            orders_logger.info(f"Generating takeprofit_cancel_id: {takeprofit_cancel_id} for order {order_id}")
                         
-                        # Send take profit cancellation to Firebase
-                        tp_cancel_payload = {
-                            "action": "cancel_takeprofit",
-                            "status": "TP/SL-CLOSED",  # Updated status for TP cancellation
-                            "take_profit": db_order_for_firebase.take_profit,
+                            # Send take profit cancellation to Firebase
+                            tp_cancel_payload = {
+                                "action": "cancel_takeprofit",
+                                "status": "TP/SL-CLOSED",  # Updated status for TP cancellation
+                                "take_profit": db_order_for_firebase.take_profit,
+                                "order_id": db_order_for_firebase.order_id,
+                                "user_id": user_to_operate_on.id,
+                                "takeprofit_id": db_order_for_firebase.takeprofit_id,
+                                "takeprofit_cancel_id": takeprofit_cancel_id,
+                                "order_company_name": db_order_for_firebase.order_company_name,
+                                "order_type": db_order_for_firebase.order_type
+                            }
+                            orders_logger.info(f"[FIREBASE_TP_CANCEL] Sending take profit cancellation: {tp_cancel_payload}")
+                            background_tasks.add_task(send_order_to_firebase, tp_cancel_payload, "live")
+
+                        # Set the status for the close request based on whether SL/TP exists
+                        close_request_status = "TP/SL-CLOSED" if has_sl_or_tp else close_request.status
+
+                        firebase_close_data = {
                             "order_id": db_order_for_firebase.order_id,
+                            "close_price": str(close_request.close_price),
                             "user_id": user_to_operate_on.id,
-                            "takeprofit_id": db_order_for_firebase.takeprofit_id,
-                            "takeprofit_cancel_id": takeprofit_cancel_id,
+                            "order_type": db_order_for_firebase.order_type,
                             "order_company_name": db_order_for_firebase.order_company_name,
-                            "order_type": db_order_for_firebase.order_type
+                            "order_quantity": str(db_order_for_firebase.order_quantity),
+                            "contract_value": str(db_order_for_firebase.contract_value),
+                            "order_status": close_request.order_status, # Status from the request indicating the action
+                            "status": close_request_status, # Use the status based on SL/TP existence
+                            "action": "close_order",
+                            "close_id": close_id
                         }
-                        orders_logger.info(f"[FIREBASE_TP_CANCEL] Sending take profit cancellation: {tp_cancel_payload}")
-                        background_tasks.add_task(send_order_to_firebase, tp_cancel_payload, "live")
-
-                    # Set the status for the close request based on whether SL/TP exists
-                    close_request_status = "TP/SL-CLOSED" if has_sl_or_tp else close_request.status
-
-                    firebase_close_data = {
-                        "order_id": db_order_for_firebase.order_id,
-                        "close_price": str(close_request.close_price),
-                        "user_id": user_to_operate_on.id,
-                        "order_type": db_order_for_firebase.order_type,
-                        "order_company_name": db_order_for_firebase.order_company_name,
-                        "order_quantity": str(db_order_for_firebase.order_quantity),
-                        "contract_value": str(db_order_for_firebase.contract_value),
-                        "order_status": close_request.order_status, # Status from the request indicating the action
-                        "status": close_request_status, # Use the status based on SL/TP existence
-                        "action": "close_order",
-                        "close_id": close_id
-                    }
 
-                    orders_logger.info(f"[FIREBASE_CLOSE_REQUEST] Preparing to send payload for user-initiated close: {firebase_close_data}")
-                    background_tasks.add_task(send_order_to_firebase, firebase_close_data, "live")
+                        orders_logger.info(f"[FIREBASE_CLOSE_REQUEST] Preparing to send payload for user-initiated close: {firebase_close_data}")
+                        background_tasks.add_task(send_order_to_firebase, firebase_close_data, "live")
                     
-                    db_order_for_response = await crud_order.get_order_by_id(db, order_id=order_id, order_model=order_model_class)
-                    if db_order_for_response:
-                        # Per request, do not change the status. Keep it OPEN until the provider confirms.
-                        # db_order_for_response.order_status = "PENDING_CLOSE" 
-                        db_order_for_response.close_message = "Close request sent to service provider."
-                        db_order_for_response.close_id = close_id # Save close_id in DB
+                        db_order_for_response = await crud_order.get_order_by_id(db, order_id=order_id, order_model=order_model_class)
+                        if db_order_for_response:
+                            # Per request, do not change the status. Keep it OPEN until the provider confirms.
+                            # db_order_for_response.order_status = "PENDING_CLOSE" 
+                            db_order_for_response.close_message = "Close request sent to service provider."
+                            db_order_for_response.close_id = close_id # Save close_id in DB
                         
-                        # Update status field if order has SL or TP
-                        if has_sl_or_tp:
-                            db_order_for_response.status = "TP/SL-CLOSED"
+                            # Update status field if order has SL or TP
+                            if has_sl_or_tp:
+                                db_order_for_response.status = "TP/SL-CLOSED"
                         
-                        # Save the cancel IDs if they were generated
-                        if stoploss_cancel_id:
-                            db_order_for_response.stoploss_cancel_id = stoploss_cancel_id
-                        if takeprofit_cancel_id:
-                            db_order_for_response.takeprofit_cancel_id = takeprofit_cancel_id
+                            # Save the cancel IDs if they were generated
+                            if stoploss_cancel_id:
+                                db_order_for_response.stoploss_cancel_id = stoploss_cancel_id
+                            if takeprofit_cancel_id:
+                                db_order_for_response.takeprofit_cancel_id = takeprofit_cancel_id
                         
-                        await db.commit()
-                        await db.refresh(db_order_for_response)
+                            await db.commit()
+                            await db.refresh(db_order_for_response)
                         
-                        # Log action in OrderActionHistory
-                        user_type_str = "live" if isinstance(user_to_operate_on, User) else "demo"
+                            # Log action in OrderActionHistory
+                            user_type_str = "live" if isinstance(user_to_operate_on, User) else "demo"
                         
-                        # The OrderUpdateRequest was not defined; using a dict instead for tracking.
-                        update_fields_for_history = {
-                            "close_id": close_id,
-                            "close_message": "Close request sent to service provider.",
-                            "close_price": close_price,
-                        }
-                        if has_sl_or_tp:
-                            update_fields_for_history['status'] = "TP/SL-CLOSED"
-                        elif close_request.status is not None:
-                            update_fields_for_history['status'] = close_request.status
-                        if stoploss_cancel_id:
-                            update_fields_for_history['stoploss_cancel_id'] = stoploss_cancel_id
-                        if takeprofit_cancel_id:
-                            update_fields_for_history['takeprofit_cancel_id'] = takeprofit_cancel_id
+                            # The OrderUpdateRequest was not defined; using a dict instead for tracking.
+                            update_fields_for_history = {
+                                "close_id": close_id,
+                                "close_message": "Close request sent to service provider.",
+                                "close_price": close_price,
+                            }
+                            if has_sl_or_tp:
+                                update_fields_for_history['status'] = "TP/SL-CLOSED"
+                            elif close_request.status is not None:
+                                update_fields_for_history['status'] = close_request.status
+                            if stoploss_cancel_id:
+                                update_fields_for_history['stoploss_cancel_id'] = stoploss_cancel_id
+                            if takeprofit_cancel_id:
+                                update_fields_for_history['takeprofit_cancel_id'] = takeprofit_cancel_id
                         
-                        await crud_order.update_order_with_tracking(
-                            db,
-                            db_order_for_response,
-                            update_fields_for_history,
-                            user_id=user_to_operate_on.id,
-                            user_type=user_type_str,
-                            action_type="CLOSE_REQUESTED"
-                        )
-                        await db.commit()
-                        await db.refresh(db_order_for_response)
-                        return OrderResponse.model_validate(db_order_for_response, from_attributes=True)
+                            await crud_order.update_order_with_tracking(
+                                db,
+                                db_order_for_response,
+                                update_fields_for_history,
+                                user_id=user_to_operate_on.id,
+                                user_type=user_type_str,
+                                action_type="CLOSE_REQUESTED"
+                            )
+                            await db.commit()
+                            await db.refresh(db_order_for_response)
+                            return OrderResponse.model_validate(db_order_for_response, from_attributes=True)
+                        else:
+                            raise HTTPException(status_code=404, detail="Order not found for external closure processing.")
                     else:
-                        raise HTTPException(status_code=404, detail="Order not found for external closure processing.")
-                else:
-                    # Fetch user_group by group_name before using it in logs
-                    user_group = await crud_group.get_group_by_name(db, getattr(user_to_operate_on, 'group_name', None))
-                    group_name_str = user_group.group_name if user_group and hasattr(user_group, 'group_name') else 'default'
-                    orders_logger.info(f"Live user {user_to_operate_on.id} from group '{group_name_str}' ('sending_orders' is NOT 'barclays'). Processing close locally.")
-                    # Fix: assign user_group_name before using it
-                    user_group_name = getattr(user_to_operate_on, 'group_name', None) or 'default'
-                    async with db.begin_nested():
-                        db_order = await crud_order.get_order_by_id(db, order_id=order_id, order_model=order_model_class)
-                        if db_order is None:
-                            raise HTTPException(status_code=404, detail="Order not found.")
-                        if db_order.order_user_id != user_to_operate_on.id and not getattr(current_user, 'is_admin', False):
-                            raise HTTPException(status_code=403, detail="Not authorized to close this order.")
-                        if db_order.order_status != 'OPEN':
-                            raise HTTPException(status_code=400, detail=f"Order status is '{db_order.order_status}'. Only 'OPEN' orders can be closed.")
+                        # Fetch user_group by group_name before using it in logs
+                        user_group = await crud_group.get_group_by_name(db, getattr(user_to_operate_on, 'group_name', None))
+                        group_name_str = user_group.group_name if user_group and hasattr(user_group, 'group_name') else 'default'
+                        orders_logger.info(f"Live user {user_to_operate_on.id} from group '{group_name_str}' ('sending_orders' is NOT 'barclays'). Processing close locally.")
+                        # Fix: assign user_group_name before using it
+                        user_group_name = getattr(user_to_operate_on, 'group_name', None) or 'default'
+                        async with db.begin_nested():
+                            db_order = await crud_order.get_order_by_id(db, order_id=order_id, order_model=order_model_class)
+                            if db_order is None:
+                                raise HTTPException(status_code=404, detail="Order not found.")
+                            if db_order.order_user_id != user_to_operate_on.id and not getattr(current_user, 'is_admin', False):
+                                raise HTTPException(status_code=403, detail="Not authorized to close this order.")
+                            if db_order.order_status != 'OPEN':
+                                raise HTTPException(status_code=400, detail=f"Order status is '{db_order.order_status}'. Only 'OPEN' orders can be closed.")
                         
-                        # Lock user for atomic operations
-                        db_user_locked = await get_user_by_id_with_lock(db, user_to_operate_on.id)
-                        if db_user_locked is None:
-                            raise HTTPException(status_code=500, detail="Could not retrieve user data securely.")
-
-                        # Get all open orders for this symbol to recalculate margin
-                        all_open_orders_for_symbol = await crud_order.get_open_orders_by_user_id_and_symbol(
-                            db=db, user_id=db_user_locked.id, symbol=db_order.order_company_name, order_model=order_model_class
-                        )
-
-                        # Calculate margin before closing this order
-                        margin_before_recalc_dict = await calculate_total_symbol_margin_contribution(
-                            db=db,
-                            redis_client=redis_client,
-                            user_id=db_user_locked.id,
-                            symbol=db_order.order_company_name,
-                            open_positions_for_symbol=all_open_orders_for_symbol,
-                            user_type=user_type,
-                            order_model=order_model_class
-                        )
-                        margin_before_recalc = margin_before_recalc_dict["total_margin"]
-                        current_overall_margin = Decimal(str(db_user_locked.margin))
-                        non_symbol_margin = current_overall_margin - margin_before_recalc
-
-                        # Calculate margin after closing this order
-                        remaining_orders_for_symbol_after_close = [o for o in all_open_orders_for_symbol if o.order_id != order_id]
-                        margin_after_symbol_recalc_dict = await calculate_total_symbol_margin_contribution(
-                            db=db,
-                            redis_client=redis_client,
-                            user_id=db_user_locked.id,
-                            symbol=db_order.order_company_name,
-                            open_positions_for_symbol=remaining_orders_for_symbol_after_close,
-                            user_type=user_type,
-                            order_model=order_model_class
-                        )
-                        margin_after_symbol_recalc = margin_after_symbol_recalc_dict["total_margin"]
-
-                        # Update user's margin
-                        db_user_locked.margin = max(Decimal(0), (non_symbol_margin + margin_after_symbol_recalc).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
-
-                        # Rest of the existing code for commission, profit calculation, etc.
-                        quantity = Decimal(str(db_order.order_quantity))
-                        entry_price = Decimal(str(db_order.order_price))
-                        order_type_db = db_order.order_type.upper()
-                        order_symbol = db_order.order_company_name.upper()
-
-                        symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(order_symbol))
-                        symbol_info_result = await db.execute(symbol_info_stmt)
-                        ext_symbol_info = symbol_info_result.scalars().first()
-                        if not ext_symbol_info or ext_symbol_info.contract_size is None or ext_symbol_info.profit is None:
-                            raise HTTPException(status_code=500, detail=f"Missing critical ExternalSymbolInfo for symbol {order_symbol}.")
-                        contract_size = Decimal(str(ext_symbol_info.contract_size))
-                        profit_currency = ext_symbol_info.profit.upper()
-
-                        group_settings = await get_group_symbol_settings_cache(redis_client, user_group_name, order_symbol)
-                        if not group_settings:
-                            raise HTTPException(status_code=500, detail="Group settings not found for commission calculation.")
+                            # Lock user for atomic operations
+                            db_user_locked = await get_user_by_id_with_lock(db, user_to_operate_on.id)
+                            if db_user_locked is None:
+                                raise HTTPException(status_code=500, detail="Could not retrieve user data securely.")
+
+                            # Get all open orders for this symbol to recalculate margin
+                            all_open_orders_for_symbol = await crud_order.get_open_orders_by_user_id_and_symbol(
+                                db=db, user_id=db_user_locked.id, symbol=db_order.order_company_name, order_model=order_model_class
+                            )
+
+                            # Calculate margin before closing this order
+                            margin_before_recalc_dict = await calculate_total_symbol_margin_contribution(
+                                db=db,
+                                redis_client=redis_client,
+                                user_id=db_user_locked.id,
+                                symbol=db_order.order_company_name,
+                                open_positions_for_symbol=all_open_orders_for_symbol,
+                                user_type=user_type,
+                                order_model=order_model_class
+                            )
+                            margin_before_recalc = margin_before_recalc_dict["total_margin"]
+                            current_overall_margin = Decimal(str(db_user_locked.margin))
+                            non_symbol_margin = current_overall_margin - margin_before_recalc
+
+                            # Calculate margin after closing this order
+                            remaining_orders_for_symbol_after_close = [o for o in all_open_orders_for_symbol if o.order_id != order_id]
+                            margin_after_symbol_recalc_dict = await calculate_total_symbol_margin_contribution(
+                                db=db,
+                                redis_client=redis_client,
+                                user_id=db_user_locked.id,
+                                symbol=db_order.order_company_name,
+                                open_positions_for_symbol=remaining_orders_for_symbol_after_close,
+                                user_type=user_type,
+                                order_model=order_model_class
+                            )
+                            margin_after_symbol_recalc = margin_after_symbol_recalc_dict["total_margin"]
+
+                            # Update user's margin
+                            db_user_locked.margin = max(Decimal(0), (non_symbol_margin + margin_after_symbol_recalc).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+
+                            # Rest of the existing code for commission, profit calculation, etc.
+                            quantity = Decimal(str(db_order.order_quantity))
+                            entry_price = Decimal(str(db_order.order_price))
+                            order_type_db = db_order.order_type.upper()
+                            order_symbol = db_order.order_company_name.upper()
+
+                            symbol_info_stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(order_symbol))
+                            symbol_info_result = await db.execute(symbol_info_stmt)
+                            ext_symbol_info = symbol_info_result.scalars().first()
+                            if not ext_symbol_info or ext_symbol_info.contract_size is None or ext_symbol_info.profit is None:
+                                raise HTTPException(status_code=500, detail=f"Missing critical ExternalSymbolInfo for symbol {order_symbol}.")
+                            contract_size = Decimal(str(ext_symbol_info.contract_size))
+                            profit_currency = ext_symbol_info.profit.upper()
+
+                            group_settings = await get_group_symbol_settings_cache(redis_client, user_group_name, order_symbol)
+                            if not group_settings:
+                                raise HTTPException(status_code=500, detail="Group settings not found for commission calculation.")
                         
-                        commission_type = int(group_settings.get('commision_type', -1))
-                        commission_value_type = int(group_settings.get('commision_value_type', -1))
-                        commission_rate = Decimal(str(group_settings.get('commision', "0.0")))
+                            commission_type = int(group_settings.get('commision_type', -1))
+                            commission_value_type = int(group_settings.get('commision_value_type', -1))
+                            commission_rate = Decimal(str(group_settings.get('commision', "0.0")))
                         
-                        # Get existing entry commission from the order
-                        existing_entry_commission = Decimal(str(db_order.commission or "0.0"))
-                        orders_logger.info(f"Existing entry commission for order {order_id}: {existing_entry_commission}")
+                            # Get existing entry commission from the order
+                            existing_entry_commission = Decimal(str(db_order.commission or "0.0"))
+                            orders_logger.info(f"Existing entry commission for order {order_id}: {existing_entry_commission}")
                         
-                        # Only calculate exit commission if applicable
-                        exit_commission = Decimal("0.0")
-                        if commission_type in [0, 2]:  # "Every Trade" or "Out"
-                            if commission_value_type == 0:  # Per lot
-                                exit_commission = quantity * commission_rate
-                            elif commission_value_type == 1:  # Percent of price
-                                calculated_exit_contract_value = quantity * contract_size * close_price
-                                if calculated_exit_contract_value > Decimal("0.0"):
-                                    exit_commission = (commission_rate / Decimal("100")) * calculated_exit_contract_value
+                            # Only calculate exit commission if applicable
+                            exit_commission = Decimal("0.0")
+                            if commission_type in [0, 2]:  # "Every Trade" or "Out"
+                                if commission_value_type == 0:  # Per lot
+                                    exit_commission = quantity * commission_rate
+                                elif commission_value_type == 1:  # Percent of price
+                                    calculated_exit_contract_value = quantity * contract_size * close_price
+                                    if calculated_exit_contract_value > Decimal("0.0"):
+                                        exit_commission = (commission_rate / Decimal("100")) * calculated_exit_contract_value
                         
-                        # Total commission is existing entry commission plus exit commission
-                        total_commission_for_trade = (existing_entry_commission + exit_commission).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                        orders_logger.info(f"Commission calculation for order {order_id}: entry={existing_entry_commission}, exit={exit_commission}, total={total_commission_for_trade}")
+                            # Total commission is existing entry commission plus exit commission
+                            total_commission_for_trade = (existing_entry_commission + exit_commission).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+                            orders_logger.info(f"Commission calculation for order {order_id}: entry={existing_entry_commission}, exit={exit_commission}, total={total_commission_for_trade}")
 
-                        if order_type_db == "BUY": profit = (close_price - entry_price) * quantity * contract_size
-                        elif order_type_db == "SELL": profit = (entry_price - close_price) * quantity * contract_size
-                        else: raise HTTPException(status_code=500, detail="Invalid order type.")
+                            if order_type_db == "BUY": profit = (close_price - entry_price) * quantity * contract_size
+                            elif order_type_db == "SELL": profit = (entry_price - close_price) * quantity * contract_size
+                            else: raise HTTPException(status_code=500, detail="Invalid order type.")
                         
-                        profit_usd = await _convert_to_usd(profit, profit_currency, db_user_locked.id, db_order.order_id, "PnL on Close", db=db, redis_client=redis_client)
-                        if profit_currency != "USD" and profit_usd == profit: 
-                            orders_logger.error(f"Order {db_order.order_id}: PnL conversion failed. Rates missing for {profit_currency}/USD.")
-                            raise HTTPException(status_code=500, detail=f"Critical: Could not convert PnL from {profit_currency} to USD.")
-
-                        db_order.order_status = "CLOSED"
-                        db_order.close_price = close_price
-                        db_order.net_profit = (profit_usd - total_commission_for_trade).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                        db_order.swap = db_order.swap or Decimal("0.0")
-                        db_order.commission = total_commission_for_trade
-                        db_order.close_id = close_id # Save close_id in DB
-
-                        original_wallet_balance = Decimal(str(db_user_locked.wallet_balance))
-                        swap_amount = db_order.swap
-                        db_user_locked.wallet_balance = (original_wallet_balance + db_order.net_profit - swap_amount).quantize(Decimal("0.00000001"), rounding=ROUND_HALF_UP)
-
-                        transaction_time = datetime.datetime.now(datetime.timezone.utc)
-                        wallet_common_data = {"symbol": order_symbol, "order_quantity": quantity, "is_approved": 1, "order_type": db_order.order_type, "transaction_time": transaction_time, "order_id": db_order.order_id}
-                        if isinstance(db_user_locked, DemoUser): wallet_common_data["demo_user_id"] = db_user_locked.id
-                        else: wallet_common_data["user_id"] = db_user_locked.id
-                        if db_order.net_profit != Decimal("0.0"):
-                            transaction_id_profit = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                            db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Profit/Loss", transaction_amount=db_order.net_profit, description=f"P/L for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_profit))
-                        if total_commission_for_trade > Decimal("0.0"):
-                            transaction_id_commission = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                            db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Commission", transaction_amount=-total_commission_for_trade, description=f"Commission for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_commission))
-                        if swap_amount != Decimal("0.0"):
-                            transaction_id_swap = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                            db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Swap", transaction_amount=-swap_amount, description=f"Swap for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_swap))
-
-                    # End of async with db.begin_nested()
-                    # Now, outside the context manager, refresh objects
-                    await db.refresh(db_order)
-                    await db.refresh(db_user_locked)
-                    orders_logger.info(f"[DEBUG] DB commit completed for order {db_order.order_id}. Checking DB state...")
+                            profit_usd = await _convert_to_usd(profit, profit_currency, db_user_locked.id, db_order.order_id, "PnL on Close", db=db, redis_client=redis_client)
+                            if profit_currency != "USD" and profit_usd == profit: 
+                                orders_logger.error(f"Order {db_order.order_id}: PnL conversion failed. Rates missing for {profit_currency}/USD.")
+                                raise HTTPException(status_code=500, detail=f"Critical: Could not convert PnL from {profit_currency} to USD.")
+
+                            db_order.order_status = "CLOSED"
+                            db_order.close_price = close_price
+                            db_order.net_profit = (profit_usd - total_commission_for_trade).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+                            db_order.swap = db_order.swap or Decimal("0.0")
+                            db_order.commission = total_commission_for_trade
+                            db_order.close_id = close_id # Save close_id in DB
+
+                            original_wallet_balance = Decimal(str(db_user_locked.wallet_balance))
+                            swap_amount = db_order.swap
+                            db_user_locked.wallet_balance = (original_wallet_balance + db_order.net_profit - swap_amount).quantize(Decimal("0.00000001"), rounding=ROUND_HALF_UP)
+
+                            transaction_time = datetime.datetime.now(datetime.timezone.utc)
+                            wallet_common_data = {"symbol": order_symbol, "order_quantity": quantity, "is_approved": 1, "order_type": db_order.order_type, "transaction_time": transaction_time, "order_id": db_order.order_id}
+                            if isinstance(db_user_locked, DemoUser): wallet_common_data["demo_user_id"] = db_user_locked.id
+                            else: wallet_common_data["user_id"] = db_user_locked.id
+                            if db_order.net_profit != Decimal("0.0"):
+                                transaction_id_profit = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
+                                db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Profit/Loss", transaction_amount=db_order.net_profit, description=f"P/L for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_profit))
+                            if total_commission_for_trade > Decimal("0.0"):
+                                transaction_id_commission = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
+                                db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Commission", transaction_amount=-total_commission_for_trade, description=f"Commission for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_commission))
+                            if swap_amount != Decimal("0.0"):
+                                transaction_id_swap = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
+                                db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Swap", transaction_amount=-swap_amount, description=f"Swap for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_swap))
+
+                        # End of async with db.begin_nested()
+                        # Now, outside the context manager, refresh objects
+                        await db.refresh(db_order)
+                        await db.refresh(db_user_locked)
+                        orders_logger.info(f"[DEBUG] DB commit completed for order {db_order.order_id}. Checking DB state...")
+                        await db.commit()
+                        orders_logger.info(f"[DEBUG] After commit & refresh: order_id={db_order.order_id}, order_status={db_order.order_status}, close_price={db_order.close_price}, net_profit={db_order.net_profit}, commission={db_order.commission}, close_id={db_order.close_id}, updated_at={db_order.updated_at}")
+                        # Log the user's wallet balance and margin after commit
+                        orders_logger.info(f"AFTER COMMIT: User {db_user_locked.id} wallet_balance={db_user_locked.wallet_balance}, margin={db_user_locked.margin}")
+                    
+                        # Update user data cache with the latest values from db_user_locked
+                        user_data_to_cache = {
+                            "id": db_user_locked.id,
+                            "email": getattr(db_user_locked, 'email', None),
+                            "group_name": db_user_locked.group_name,
+                            "leverage": db_user_locked.leverage,
+                            "user_type": user_type,
+                            "account_number": getattr(db_user_locked, 'account_number', None),
+                            "wallet_balance": db_user_locked.wallet_balance,
+                            "margin": db_user_locked.margin,
+                            "first_name": getattr(db_user_locked, 'first_name', None),
+                            "last_name": getattr(db_user_locked, 'last_name', None),
+                            "country": getattr(db_user_locked, 'country', None),
+                            "phone_number": getattr(db_user_locked, 'phone_number', None)
+                        }
+                        orders_logger.info(f"Setting user data cache for user {db_user_locked.id} with wallet_balance={user_data_to_cache['wallet_balance']}, margin={user_data_to_cache['margin']}")
+                        await set_user_data_cache(redis_client, db_user_locked.id, user_data_to_cache, user_type)
+                        orders_logger.info(f"User data cache updated for user {db_user_locked.id}")
+                    
+                        await update_user_static_orders(db_user_locked.id, db, redis_client, user_type)
+                    
+                        # Publish updates in the correct order
+                        orders_logger.info(f"Publishing order update for user {db_user_locked.id}")
+                        await publish_order_update(redis_client, db_user_locked.id, user_type)
+                    
+                        orders_logger.info(f"Publishing user data update for user {db_user_locked.id}")
+                        await publish_user_data_update(redis_client, db_user_locked.id, user_type)
+                    
+                        orders_logger.info(f"Publishing market data trigger")
+                        await publish_market_data_trigger(redis_client)
+                    
+                        return OrderResponse.model_validate(db_order, from_attributes=True)
+                else:
+                    # Always fetch user_group before logging
+                    user_group = await crud_group.get_group_by_name(db, getattr(user_to_operate_on, 'group_name', None))
+                    group_name_str = (
+                        user_group[0].group_name if user_group and isinstance(user_group, list) and len(user_group) > 0 and hasattr(user_group[0], 'group_name')
+                        else 'default'
+                    )
+                    user_type_str = 'Demo user' if isinstance(user_to_operate_on, DemoUser) else 'Live user'
+                    orders_logger.info(f"{user_type_str} {user_to_operate_on.id} from group '{group_name_str}' ('sending_orders' is NOT 'barclays'). Processing close locally.")
+                    db_order = await crud_order.get_order_by_id(db, order_id=order_id, order_model=order_model_class)
+                    if db_order is None:
+                        raise HTTPException(status_code=404, detail="Order not found.")
+                    if db_order.order_user_id != user_to_operate_on.id and not getattr(current_user, 'is_admin', False):
+                        raise HTTPException(status_code=403, detail="Not authorized to close this order.")
+                    if db_order.order_status != 'OPEN':
+                        raise HTTPException(status_code=400, detail=f"Order status is '{db_order.order_status}'. Only 'OPEN' orders can be closed.")
+
+                    order_symbol = db_order.order_company_name.upper()
+                    quantity = Decimal(str(db_order.order_quantity))
+                    entry_price = Decimal(str(db_order.order_price))
+                    order_type_db = db_order.order_type.upper()
+                    user_group_name = getattr(user_to_operate_on, 'group_name', 'default')
+                    # Use correct lock function for user type
+                    if isinstance(user_to_operate_on, DemoUser):
+                        db_user_locked = await get_demo_user_by_id_with_lock(db, user_to_operate_on.id)
+                        if db_user_locked is None:
+                            # Debug fallback: try plain fetch
+                            from app.crud.user import get_demo_user_by_id
+                            fallback_demo_user = await get_demo_user_by_id(db, user_to_operate_on.id)
+                            if fallback_demo_user is None:
+                                orders_logger.error(f"[DEBUG] DemoUser with ID {user_to_operate_on.id} does NOT exist in DB (plain fetch also failed).")
+                            else:
+                                orders_logger.error(f"[DEBUG] DemoUser with ID {user_to_operate_on.id} exists in DB WITHOUT lock. Problem is with locking.")
+                    else:
+                        db_user_locked = await get_user_by_id_with_lock(db, user_to_operate_on.id)
+                    if db_user_locked is None:
+                        orders_logger.error(f"Could not retrieve and lock user record for user ID: {user_to_operate_on.id}")
+                        raise HTTPException(status_code=500, detail="Could not retrieve user data securely.")
+
+                    # Get all open orders for this symbol to recalculate margin
+                    all_open_orders_for_symbol = await crud_order.get_open_orders_by_user_id_and_symbol(
+                        db=db, user_id=db_user_locked.id, symbol=order_symbol, order_model=order_model_class
+                    )
+
+                    # Calculate margin before closing this order
+                    margin_before_recalc_dict = await calculate_total_symbol_margin_contribution(
+                        db=db,
+                        redis_client=redis_client,
+                        user_id=db_user_locked.id,
+                        symbol=order_symbol,
+                        open_positions_for_symbol=all_open_orders_for_symbol,
+                        user_type=user_type,
+                        order_model=order_model_class
+                    )
+                    margin_before_recalc = margin_before_recalc_dict["total_margin"]
+                    current_overall_margin = Decimal(str(db_user_locked.margin))
+                    non_symbol_margin = current_overall_margin - margin_before_recalc
+
+                    # Calculate margin after closing this order
+                    remaining_orders_for_symbol_after_close = [o for o in all_open_orders_for_symbol if o.order_id != order_id]
+                    margin_after_symbol_recalc_dict = await calculate_total_symbol_margin_contribution(
+                        db=db,
+                        redis_client=redis_client,
+                        user_id=db_user_locked.id,
+                        symbol=order_symbol,
+                        open_positions_for_symbol=remaining_orders_for_symbol_after_close,
+                        user_type=user_type,
+                        order_model=order_model_class
+                    )
+                    margin_after_symbol_recalc = margin_after_symbol_recalc_dict["total_margin"]
+
+                    # Update user's margin
+                    db_user_locked.margin = max(Decimal(0), (non_symbol_margin + margin_after_symbol_recalc).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+
+                    # Rest of the existing code for commission, profit calculation, etc.
+                    symbol_info_stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(order_symbol))
+                    symbol_info_result = await db.execute(symbol_info_stmt)
+                    ext_symbol_info = symbol_info_result.scalars().first()
+                    if not ext_symbol_info or ext_symbol_info.contract_size is None or ext_symbol_info.profit is None:
+                        raise HTTPException(status_code=500, detail=f"Missing critical ExternalSymbolInfo for symbol {order_symbol}.")
+                    contract_size = Decimal(str(ext_symbol_info.contract_size))
+                    profit_currency = ext_symbol_info.profit.upper()
+
+                    group_settings = await get_group_symbol_settings_cache(redis_client, user_group_name, order_symbol)
+                    if not group_settings:
+                        raise HTTPException(status_code=500, detail="Group settings not found for commission calculation.")
+                
+                    commission_type = int(group_settings.get('commision_type', -1))
+                    commission_value_type = int(group_settings.get('commision_value_type', -1))
+                    commission_rate = Decimal(str(group_settings.get('commision', "0.0")))
+                
+                    # Get existing entry commission from the order
+                    existing_entry_commission = Decimal(str(db_order.commission or "0.0"))
+                    orders_logger.info(f"Existing entry commission for order {order_id}: {existing_entry_commission}")
+                
+                    # Only calculate exit commission if applicable
+                    exit_commission = Decimal("0.0")
+                    if commission_type in [0, 2]:  # "Every Trade" or "Out"
+                        if commission_value_type == 0:  # Per lot
+                            exit_commission = quantity * commission_rate
+                        elif commission_value_type == 1:  # Percent of price
+                            calculated_exit_contract_value = quantity * contract_size * close_price
+                            if calculated_exit_contract_value > Decimal("0.0"):
+                                exit_commission = (commission_rate / Decimal("100")) * calculated_exit_contract_value
+                
+                    # Total commission is existing entry commission plus exit commission
+                    total_commission_for_trade = (existing_entry_commission + exit_commission).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+                    orders_logger.info(f"Commission calculation for order {order_id}: entry={existing_entry_commission}, exit={exit_commission}, total={total_commission_for_trade}")
+
+                    if order_type_db == "BUY": profit = (close_price - entry_price) * quantity * contract_size
+                    elif order_type_db == "SELL": profit = (entry_price - close_price) * quantity * contract_size
+                    else: raise HTTPException(status_code=500, detail="Invalid order type.")
+                
+                    profit_usd = await _convert_to_usd(profit, profit_currency, db_user_locked.id, db_order.order_id, "PnL on Close", db=db, redis_client=redis_client)
+                    if profit_currency != "USD" and profit_usd == profit: 
+                        orders_logger.error(f"Order {db_order.order_id}: PnL conversion failed. Rates missing for {profit_currency}/USD.")
+                        raise HTTPException(status_code=500, detail=f"Critical: Could not convert PnL from {profit_currency} to USD.")
+
+                    db_order.order_status = "CLOSED"
+                    db_order.close_price = close_price
+                    db_order.net_profit = (profit_usd - total_commission_for_trade).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+                    db_order.swap = db_order.swap or Decimal("0.0")
+                    db_order.commission = total_commission_for_trade
+                    db_order.close_id = close_id # Save close_id in DB
+
+                    original_wallet_balance = Decimal(str(db_user_locked.wallet_balance))
+                    swap_amount = db_order.swap
+                    db_user_locked.wallet_balance = (original_wallet_balance + db_order.net_profit - swap_amount).quantize(Decimal("0.00000001"), rounding=ROUND_HALF_UP)
+
+                    transaction_time = datetime.datetime.now(datetime.timezone.utc)
+                    wallet_common_data = {"symbol": order_symbol, "order_quantity": quantity, "is_approved": 1, "order_type": db_order.order_type, "transaction_time": transaction_time, "order_id": db_order.order_id}
+                    if isinstance(db_user_locked, DemoUser): wallet_common_data["demo_user_id"] = db_user_locked.id
+                    else: wallet_common_data["user_id"] = db_user_locked.id
+                    if db_order.net_profit != Decimal("0.0"):
+                        transaction_id_profit = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
+                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Profit/Loss", transaction_amount=db_order.net_profit, description=f"P/L for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_profit))
+                    if total_commission_for_trade > Decimal("0.0"):
+                        transaction_id_commission = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
+                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Commission", transaction_amount=-total_commission_for_trade, description=f"Commission for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_commission))
+                    if swap_amount != Decimal("0.0"):
+                        transaction_id_swap = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
+                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Swap", transaction_amount=-swap_amount, description=f"Swap for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_swap))
+
                     await db.commit()
-                    orders_logger.info(f"[DEBUG] After commit & refresh: order_id={db_order.order_id}, order_status={db_order.order_status}, close_price={db_order.close_price}, net_profit={db_order.net_profit}, commission={db_order.commission}, close_id={db_order.close_id}, updated_at={db_order.updated_at}")
+                    await db.refresh(db_order)
+                
                     # Log the user's wallet balance and margin after commit
                     orders_logger.info(f"AFTER COMMIT: User {db_user_locked.id} wallet_balance={db_user_locked.wallet_balance}, margin={db_user_locked.margin}")
-                    
+                
+                    # Define variables needed for WebSocket updates
+                    user_id = db_user_locked.id  # Changed from db_order.order_user_id to db_user_locked.id
+                    user_type_str = 'demo'
+                
                     # Update user data cache with the latest values from db_user_locked
                     user_data_to_cache = {
                         "id": db_user_locked.id,
                         "email": getattr(db_user_locked, 'email', None),
                         "group_name": db_user_locked.group_name,
                         "leverage": db_user_locked.leverage,
-                        "user_type": user_type,
+                        "user_type": user_type_str,
                         "account_number": getattr(db_user_locked, 'account_number', None),
                         "wallet_balance": db_user_locked.wallet_balance,
                         "margin": db_user_locked.margin,
@@ -1345,216 +1642,115 @@ async def close_order(
                         "country": getattr(db_user_locked, 'country', None),
                         "phone_number": getattr(db_user_locked, 'phone_number', None)
                     }
-                    orders_logger.info(f"Setting user data cache for user {db_user_locked.id} with wallet_balance={user_data_to_cache['wallet_balance']}, margin={user_data_to_cache['margin']}")
-                    await set_user_data_cache(redis_client, db_user_locked.id, user_data_to_cache, user_type)
-                    orders_logger.info(f"User data cache updated for user {db_user_locked.id}")
-                    
-                    await update_user_static_orders(db_user_locked.id, db, redis_client, user_type)
-                    
-                    # Publish updates in the correct order
-                    orders_logger.info(f"Publishing order update for user {db_user_locked.id}")
-                    await publish_order_update(redis_client, db_user_locked.id)
-                    
-                    orders_logger.info(f"Publishing user data update for user {db_user_locked.id}")
-                    await publish_user_data_update(redis_client, db_user_locked.id)
-                    
-                    orders_logger.info(f"Publishing market data trigger")
-                    await publish_market_data_trigger(redis_client)
-                    
-                    return OrderResponse.model_validate(db_order, from_attributes=True)
-            else:
-                # Always fetch user_group before logging
-                user_group = await crud_group.get_group_by_name(db, getattr(user_to_operate_on, 'group_name', None))
-                group_name_str = (
-                    user_group[0].group_name if user_group and isinstance(user_group, list) and len(user_group) > 0 and hasattr(user_group[0], 'group_name')
-                    else 'default'
-                )
-                user_type_str = 'Demo user' if isinstance(user_to_operate_on, DemoUser) else 'Live user'
-                orders_logger.info(f"{user_type_str} {user_to_operate_on.id} from group '{group_name_str}' ('sending_orders' is NOT 'barclays'). Processing close locally.")
-                db_order = await crud_order.get_order_by_id(db, order_id=order_id, order_model=order_model_class)
-                if db_order is None:
-                    raise HTTPException(status_code=404, detail="Order not found.")
-                if db_order.order_user_id != user_to_operate_on.id and not getattr(current_user, 'is_admin', False):
-                    raise HTTPException(status_code=403, detail="Not authorized to close this order.")
-                if db_order.order_status != 'OPEN':
-                    raise HTTPException(status_code=400, detail=f"Order status is '{db_order.order_status}'. Only 'OPEN' orders can be closed.")
-
-                order_symbol = db_order.order_company_name.upper()
-                quantity = Decimal(str(db_order.order_quantity))
-                entry_price = Decimal(str(db_order.order_price))
-                order_type_db = db_order.order_type.upper()
-                user_group_name = getattr(user_to_operate_on, 'group_name', 'default')
-                # Use correct lock function for user type
-                if isinstance(user_to_operate_on, DemoUser):
-                    db_user_locked = await get_demo_user_by_id_with_lock(db, user_to_operate_on.id)
-                    if db_user_locked is None:
-                        # Debug fallback: try plain fetch
-                        from app.crud.user import get_demo_user_by_id
-                        fallback_demo_user = await get_demo_user_by_id(db, user_to_operate_on.id)
-                        if fallback_demo_user is None:
-                            orders_logger.error(f"[DEBUG] DemoUser with ID {user_to_operate_on.id} does NOT exist in DB (plain fetch also failed).")
-                        else:
-                            orders_logger.error(f"[DEBUG] DemoUser with ID {user_to_operate_on.id} exists in DB WITHOUT lock. Problem is with locking.")
-                else:
-                    db_user_locked = await get_user_by_id_with_lock(db, user_to_operate_on.id)
-                if db_user_locked is None:
-                    orders_logger.error(f"Could not retrieve and lock user record for user ID: {user_to_operate_on.id}")
-                    raise HTTPException(status_code=500, detail="Could not retrieve user data securely.")
-
-                # Get all open orders for this symbol to recalculate margin
-                all_open_orders_for_symbol = await crud_order.get_open_orders_by_user_id_and_symbol(
-                    db=db, user_id=db_user_locked.id, symbol=order_symbol, order_model=order_model_class
-                )
-
-                # Calculate margin before closing this order
-                margin_before_recalc_dict = await calculate_total_symbol_margin_contribution(
-                    db=db,
-                    redis_client=redis_client,
-                    user_id=db_user_locked.id,
-                    symbol=order_symbol,
-                    open_positions_for_symbol=all_open_orders_for_symbol,
-                    user_type=user_type,
-                    order_model=order_model_class
-                )
-                margin_before_recalc = margin_before_recalc_dict["total_margin"]
-                current_overall_margin = Decimal(str(db_user_locked.margin))
-                non_symbol_margin = current_overall_margin - margin_before_recalc
-
-                # Calculate margin after closing this order
-                remaining_orders_for_symbol_after_close = [o for o in all_open_orders_for_symbol if o.order_id != order_id]
-                margin_after_symbol_recalc_dict = await calculate_total_symbol_margin_contribution(
-                    db=db,
-                    redis_client=redis_client,
-                    user_id=db_user_locked.id,
-                    symbol=order_symbol,
-                    open_positions_for_symbol=remaining_orders_for_symbol_after_close,
-                    user_type=user_type,
-                    order_model=order_model_class
-                )
-                margin_after_symbol_recalc = margin_after_symbol_recalc_dict["total_margin"]
-
-                # Update user's margin
-                db_user_locked.margin = max(Decimal(0), (non_symbol_margin + margin_after_symbol_recalc).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
-
-                # Rest of the existing code for commission, profit calculation, etc.
-                symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(order_symbol))
-                symbol_info_result = await db.execute(symbol_info_stmt)
-                ext_symbol_info = symbol_info_result.scalars().first()
-                if not ext_symbol_info or ext_symbol_info.contract_size is None or ext_symbol_info.profit is None:
-                    raise HTTPException(status_code=500, detail=f"Missing critical ExternalSymbolInfo for symbol {order_symbol}.")
-                contract_size = Decimal(str(ext_symbol_info.contract_size))
-                profit_currency = ext_symbol_info.profit.upper()
-
-                group_settings = await get_group_symbol_settings_cache(redis_client, user_group_name, order_symbol)
-                if not group_settings:
-                    raise HTTPException(status_code=500, detail="Group settings not found for commission calculation.")
-                
-                commission_type = int(group_settings.get('commision_type', -1))
-                commission_value_type = int(group_settings.get('commision_value_type', -1))
-                commission_rate = Decimal(str(group_settings.get('commision', "0.0")))
-                
-                # Get existing entry commission from the order
-                existing_entry_commission = Decimal(str(db_order.commission or "0.0"))
-                orders_logger.info(f"Existing entry commission for order {order_id}: {existing_entry_commission}")
-                
-                # Only calculate exit commission if applicable
-                exit_commission = Decimal("0.0")
-                if commission_type in [0, 2]:  # "Every Trade" or "Out"
-                    if commission_value_type == 0:  # Per lot
-                        exit_commission = quantity * commission_rate
-                    elif commission_value_type == 1:  # Percent of price
-                        calculated_exit_contract_value = quantity * contract_size * close_price
-                        if calculated_exit_contract_value > Decimal("0.0"):
-                            exit_commission = (commission_rate / Decimal("100")) * calculated_exit_contract_value
-                
-                # Total commission is existing entry commission plus exit commission
-                total_commission_for_trade = (existing_entry_commission + exit_commission).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                orders_logger.info(f"Commission calculation for order {order_id}: entry={existing_entry_commission}, exit={exit_commission}, total={total_commission_for_trade}")
-
-                if order_type_db == "BUY": profit = (close_price - entry_price) * quantity * contract_size
-                elif order_type_db == "SELL": profit = (entry_price - close_price) * quantity * contract_size
-                else: raise HTTPException(status_code=500, detail="Invalid order type.")
-                
-                profit_usd = await _convert_to_usd(profit, profit_currency, db_user_locked.id, db_order.order_id, "PnL on Close", db=db, redis_client=redis_client)
-                if profit_currency != "USD" and profit_usd == profit: 
-                    orders_logger.error(f"Order {db_order.order_id}: PnL conversion failed. Rates missing for {profit_currency}/USD.")
-                    raise HTTPException(status_code=500, detail=f"Critical: Could not convert PnL from {profit_currency} to USD.")
-
-                db_order.order_status = "CLOSED"
-                db_order.close_price = close_price
-                db_order.net_profit = (profit_usd - total_commission_for_trade).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                db_order.swap = db_order.swap or Decimal("0.0")
-                db_order.commission = total_commission_for_trade
-                db_order.close_id = close_id # Save close_id in DB
-
-                original_wallet_balance = Decimal(str(db_user_locked.wallet_balance))
-                swap_amount = db_order.swap
-                db_user_locked.wallet_balance = (original_wallet_balance + db_order.net_profit - swap_amount).quantize(Decimal("0.00000001"), rounding=ROUND_HALF_UP)
-
-                transaction_time = datetime.datetime.now(datetime.timezone.utc)
-                wallet_common_data = {"symbol": order_symbol, "order_quantity": quantity, "is_approved": 1, "order_type": db_order.order_type, "transaction_time": transaction_time, "order_id": db_order.order_id}
-                if isinstance(db_user_locked, DemoUser): wallet_common_data["demo_user_id"] = db_user_locked.id
-                else: wallet_common_data["user_id"] = db_user_locked.id
-                if db_order.net_profit != Decimal("0.0"):
-                    transaction_id_profit = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                    db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Profit/Loss", transaction_amount=db_order.net_profit, description=f"P/L for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_profit))
-                if total_commission_for_trade > Decimal("0.0"):
-                    transaction_id_commission = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                    db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Commission", transaction_amount=-total_commission_for_trade, description=f"Commission for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_commission))
-                if swap_amount != Decimal("0.0"):
-                    transaction_id_swap = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                    db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Swap", transaction_amount=-swap_amount, description=f"Swap for closing order {db_order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_swap))
-
-                await db.commit()
-                await db.refresh(db_order)
-                
-                # Log the user's wallet balance and margin after commit
-                orders_logger.info(f"AFTER COMMIT: User {db_user_locked.id} wallet_balance={db_user_locked.wallet_balance}, margin={db_user_locked.margin}")
+                    orders_logger.info(f"Setting user data cache for user {user_id} with wallet_balance={user_data_to_cache['wallet_balance']}, margin={user_data_to_cache['margin']}")
+                    await set_user_data_cache(redis_client, user_id, user_data_to_cache, user_type_str)
+                    orders_logger.info(f"User data cache updated for user {user_id}")
                 
-                # Define variables needed for WebSocket updates
-                user_id = db_user_locked.id  # Changed from db_order.order_user_id to db_user_locked.id
-                user_type_str = 'demo'
+                    await update_user_static_orders(user_id, db, redis_client, user_type_str)
                 
-                # Update user data cache with the latest values from db_user_locked
-                user_data_to_cache = {
-                    "id": db_user_locked.id,
-                    "email": getattr(db_user_locked, 'email', None),
-                    "group_name": db_user_locked.group_name,
-                    "leverage": db_user_locked.leverage,
-                    "user_type": user_type_str,
-                    "account_number": getattr(db_user_locked, 'account_number', None),
-                    "wallet_balance": db_user_locked.wallet_balance,
-                    "margin": db_user_locked.margin,
-                    "first_name": getattr(db_user_locked, 'first_name', None),
-                    "last_name": getattr(db_user_locked, 'last_name', None),
-                    "country": getattr(db_user_locked, 'country', None),
-                    "phone_number": getattr(db_user_locked, 'phone_number', None)
-                }
-                orders_logger.info(f"Setting user data cache for user {user_id} with wallet_balance={user_data_to_cache['wallet_balance']}, margin={user_data_to_cache['margin']}")
-                await set_user_data_cache(redis_client, user_id, user_data_to_cache, user_type_str)
-                orders_logger.info(f"User data cache updated for user {user_id}")
-                
-                await update_user_static_orders(user_id, db, redis_client, user_type_str)
-                
-                # Publish updates in the correct order
-                orders_logger.info(f"Publishing order update for user {user_id}")
-                await publish_order_update(redis_client, user_id)
+                    # Publish updates in the correct order
+                    orders_logger.info(f"Publishing order update for user {user_id}")
+                    await publish_order_update(redis_client, user_id, user_type)
                 
-                orders_logger.info(f"Publishing user data update for user {user_id}")
-                await publish_user_data_update(redis_client, user_id)
+                    orders_logger.info(f"Publishing user data update for user {user_id}")
+                    await publish_user_data_update(redis_client, user_id, user_type)
                 
-                orders_logger.info(f"Publishing market data trigger")
-                await publish_market_data_trigger(redis_client)
+                    orders_logger.info(f"Publishing market data trigger")
+                    await publish_market_data_trigger(redis_client)
                 
-                return OrderResponse.model_validate(db_order, from_attributes=True)
-        except Exception as e:
-            orders_logger.error(f"Error processing close order: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Error processing close order: {str(e)}")
+                    return OrderResponse.model_validate(db_order, from_attributes=True)
+            except Exception as e:
+                orders_logger.error(f"Error processing close order: {str(e)}", exc_info=True)
+                raise HTTPException(status_code=500, detail=f"Error processing close order: {str(e)}")
     except Exception as e:
         orders_logger.error(f"Error in close_order endpoint: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error in close_order endpoint: {str(e)}")
 
 
+async def _resolve_target_user(current_user: User | DemoUser, user_id: Optional[int], token: str,
+                               db: AsyncSession) -> User | DemoUser:
+    """The account to operate on: the caller, or for a service account the requested user."""
+    if user_id is None or user_id == current_user.id:
+        return current_user
+    if not getattr(current_user, 'is_service_account', False):
+        raise HTTPException(status_code=403, detail="Not authorized to specify user_id.")
+    enforce_service_user_id_restriction(user_id, token)
+    target = await get_user_by_id(db, user_id) or await get_demo_user_by_id(db, user_id)
+    if target is None:
+        raise HTTPException(status_code=404, detail="Target user not found for service op.")
+    return target
+
+
+async def _close_positions(
+    db: AsyncSession,
+    redis_client: Redis,
+    current_user: User | DemoUser,
+    user_id: Optional[int],
+    token: str,
+    **selection,
+) -> BatchCloseResponse:
+    from app.services.group_registry import group_symbol_registry
+    account = await _resolve_target_user(current_user, user_id, token, db)
+    user_type = get_user_type(account)
+    if await is_barclays_live_user(account, db, redis_client):
+        raise HTTPException(status_code=400, detail="Orders of this account are closed by the service provider; "
+                                                    "close them individually.")
+    try:
+        closed, skipped = await close_positions(db, redis_client, account, user_type, group_symbol_registry,
+                                                **selection)
+    except OrderProcessingError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        orders_logger.error(f"Error in batch close for user {account.id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error processing batch close: {str(e)}")
+    return BatchCloseResponse(
+        closed=[OrderResponse(**order) for order in closed],
+        skipped=[BatchCloseSkipped(**entry) for entry in skipped],
+    )
+
+
+@router.post("/close-batch", response_model=BatchCloseResponse)
+async def close_orders_batch(
+    close_request: BatchCloseRequest,
+    db: AsyncSession = Depends(get_db),
+    redis_client: Redis = Depends(get_redis_client),
+    current_user: User | DemoUser = Depends(get_user_from_service_or_user_token),
+    token: str = Depends(oauth2_scheme),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Close the listed open orders of one account at their current group prices, in a
+    single transaction (see services/batch_close). Orders that cannot be closed are
+    listed in `skipped`.
+    """
+    return await run_idempotent(
+        redis_client, "close_batch", current_user, idempotency_key, close_request,
+        lambda: _close_positions(db, redis_client, current_user, close_request.user_id, token,
+                                 order_ids=close_request.order_ids)
+    )
+
+
+@router.post("/close-all", response_model=BatchCloseResponse)
+async def close_all_orders(
+    close_request: CloseAllRequest,
+    db: AsyncSession = Depends(get_db),
+    redis_client: Redis = Depends(get_redis_client),
+    current_user: User | DemoUser = Depends(get_user_from_service_or_user_token),
+    token: str = Depends(oauth2_scheme),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Close all open positions of one account, optionally only those of `symbol` and/or
+    only the losing ones, at their current group prices in a single transaction.
+    """
+    return await run_idempotent(
+        redis_client, "close_all", current_user, idempotency_key, close_request,
+        lambda: _close_positions(db, redis_client, current_user, close_request.user_id, token,
+                                 symbol=close_request.symbol, losing_only=close_request.losing_only,
+                                 close_reason="close all")
+    )
+
+
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from redis.asyncio import Redis
@@ -1734,8 +1930,8 @@ async def modify_pending_order(
         await update_user_static_orders_cache_after_order_change(modify_request.user_id, db, redis_client, modify_request.user_type)
 
         # Publish updates to notify WebSocket clients - make sure these are in the right order
-        await publish_order_update(redis_client, modify_request.user_id)
-        await publish_user_data_update(redis_client, modify_request.user_id)
+        await publish_order_update(redis_client, modify_request.user_id, modify_request.user_type)
+        await publish_user_data_update(redis_client, modify_request.user_id, modify_request.user_type)
         
         return {
             "order_id": updated_order.order_id,
@@ -1894,8 +2090,8 @@ async def cancel_pending_order(
             await update_user_static_orders_cache_after_order_change(user_id_for_operation, db, redis_client, cancel_request.user_type)
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id_for_operation)
-            await publish_user_data_update(redis_client, user_id_for_operation)
+            await publish_order_update(redis_client, user_id_for_operation, cancel_request.user_type)
+            await publish_user_data_update(redis_client, user_id_for_operation, cancel_request.user_type)
             
             return {
                 "order_id": updated_order.order_id,
@@ -2054,8 +2250,8 @@ async def add_stoploss(
             await update_user_static_orders(user_id_for_operation, db, redis_client, request.user_type)
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id_for_operation)
-            await publish_user_data_update(redis_client, user_id_for_operation)
+            await publish_order_update(redis_client, user_id_for_operation, request.user_type)
+            await publish_user_data_update(redis_client, user_id_for_operation, request.user_type)
             
             return {
                 "order_id": updated_order.order_id,
@@ -2214,8 +2410,8 @@ async def add_takeprofit(
             await update_user_static_orders(user_id_for_operation, db, redis_client, request.user_type)
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id_for_operation)
-            await publish_user_data_update(redis_client, user_id_for_operation)
+            await publish_order_update(redis_client, user_id_for_operation, request.user_type)
+            await publish_user_data_update(redis_client, user_id_for_operation, request.user_type)
             
             return {
                 "order_id": updated_order.order_id,
@@ -2347,7 +2543,7 @@ async def cancel_stoploss(
             await update_user_static_orders(user_id_for_operation, db, redis_client, request.user_type)
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id_for_operation)
+            await publish_order_update(redis_client, user_id_for_operation, request.user_type)
             
             return {
                 "order_id": request.order_id,
@@ -2477,7 +2673,7 @@ async def cancel_takeprofit(
             await update_user_static_orders(user_id_for_operation, db, redis_client, request.user_type)
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id_for_operation)
+            await publish_order_update(redis_client, user_id_for_operation, request.user_type)
             
             return {
                 "order_id": request.order_id,
@@ -2525,7 +2721,7 @@ async def update_order_by_service_provider(
 
         # Get the order from the database using the new generic search function
         order_model = UserOrder  # Barclays users are always live users
-        db_order = await crud_order.get_order_by_any_id(db, id_to_find, order_model)
+        db_order = await crud_order.get_order_by_any_id(db, id_to_find, order_model, redis_client)
         
         if not db_order:
             orders_logger.error(f"Order not found with provided identifier '{id_to_find}' in request: {update_request.model_dump_json(exclude_unset=True)}")
@@ -2558,7 +2754,7 @@ async def update_order_by_service_provider(
             quantity = Decimal(str(db_order.order_quantity))
             
             # Get external symbol info
-            symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(symbol))
+            symbol_info_stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(symbol))
             symbol_info_result = await db.execute(symbol_info_stmt)
             ext_symbol_info = symbol_info_result.scalars().first()
             
@@ -2684,8 +2880,8 @@ async def update_order_by_service_provider(
             await update_user_static_orders(user_id, db, redis_client, 'live')
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id)
-            await publish_user_data_update(redis_client, user_id)
+            await publish_order_update(redis_client, user_id, 'live')
+            await publish_user_data_update(redis_client, user_id, 'live')
             await publish_market_data_trigger(redis_client)
             
         # Case 2: OPEN -> CLOSED transition (order closure)
@@ -2711,7 +2907,7 @@ async def update_order_by_service_provider(
             close_price = Decimal(str(update_fields['close_price']))
             
             # Get external symbol info
-            symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(symbol))
+            symbol_info_stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(symbol))
             symbol_info_result = await db.execute(symbol_info_stmt)
             ext_symbol_info = symbol_info_result.scalars().first()
             
@@ -2886,8 +3082,8 @@ async def update_order_by_service_provider(
             await update_user_static_orders(user_id, db, redis_client, 'live')
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id)
-            await publish_user_data_update(redis_client, user_id)
+            await publish_order_update(redis_client, user_id, 'live')
+            await publish_user_data_update(redis_client, user_id, 'live')
             await publish_market_data_trigger(redis_client)
             
         # Case 3: PENDING -> OPEN transition (pending order activation)
@@ -2906,7 +3102,7 @@ async def update_order_by_service_provider(
             quantity = Decimal(str(db_order.order_quantity))
             
             # Get external symbol info
-            symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(symbol))
+            symbol_info_stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(symbol))
             symbol_info_result = await db.execute(symbol_info_stmt)
             ext_symbol_info = symbol_info_result.scalars().first()
             
@@ -3041,8 +3237,8 @@ async def update_order_by_service_provider(
             await update_user_static_orders(user_id, db, redis_client, 'live')
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id)
-            await publish_user_data_update(redis_client, user_id)
+            await publish_order_update(redis_client, user_id, 'live')
+            await publish_user_data_update(redis_client, user_id, 'live')
             await publish_market_data_trigger(redis_client)
             
         # Case 4: PENDING -> CANCELLED transition (pending order cancellation)
@@ -3078,8 +3274,8 @@ async def update_order_by_service_provider(
             await update_user_static_orders(user_id, db, redis_client, 'live')
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, user_id)
-            await publish_user_data_update(redis_client, user_id)
+            await publish_order_update(redis_client, user_id, 'live')
+            await publish_user_data_update(redis_client, user_id, 'live')
             
         # Default case: Just update the order with the provided fields
         else:
@@ -3102,7 +3298,7 @@ async def update_order_by_service_provider(
             await update_user_static_orders(db_order.order_user_id, db, redis_client, 'live')
             
             # Publish updates to notify WebSocket clients
-            await publish_order_update(redis_client, db_order.order_user_id)
+            await publish_order_update(redis_client, db_order.order_user_id, 'live')
             
         # Return the updated order
         await db.refresh(db_order)
@@ -3297,8 +3493,8 @@ async def _handle_order_open_transition(
     }
     await set_user_data_cache(redis_client, updated_order_db.order_user_id, user_data_to_cache, 'live')
     await update_user_static_orders(updated_order_db.order_user_id, db, redis_client, 'live')
-    await publish_order_update(redis_client, updated_order_db.order_user_id)
-    await publish_user_data_update(redis_client, updated_order_db.order_user_id)
+    await publish_order_update(redis_client, updated_order_db.order_user_id, 'live')
+    await publish_user_data_update(redis_client, updated_order_db.order_user_id, 'live')
     await publish_market_data_trigger(redis_client)
     return updated_order_db
 
@@ -3328,7 +3524,7 @@ async def service_provider_order_execution(
             raise HTTPException(status_code=400, detail=error_msg)
 
         # Find the order by ID (could be any ID field)
-        db_order = await crud_order.get_order_by_any_id(db, id_to_find, UserOrder)
+        db_order = await crud_order.get_order_by_any_id(db, id_to_find, UserOrder, redis_client)
         if not db_order:
             error_msg = f"Order with ID {id_to_find} not found"
             service_provider_logger.error(f"SERVICE PROVIDER ERROR: {error_msg}")
@@ -3435,7 +3631,7 @@ async def service_provider_order_update(
             service_provider_logger.error(f"SERVICE PROVIDER ERROR: {error_msg}")
             raise HTTPException(status_code=400, detail=error_msg)
         
-        db_order = await crud_order.get_order_by_any_id(db, id_to_find, UserOrder)
+        db_order = await crud_order.get_order_by_any_id(db, id_to_find, UserOrder, redis_client)
         if not db_order:
             error_msg = f"Order with ID {id_to_find} not found"
             service_provider_logger.error(f"SERVICE PROVIDER ERROR: {error_msg}")
@@ -3592,7 +3788,7 @@ async def _handle_order_close_transition(
         raise HTTPException(status_code=400, detail="close_price is required to close an order.")
     close_price = Decimal(str(close_price))
     
-    symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(symbol))
+    symbol_info_stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(symbol))
     symbol_info_result = await db.execute(symbol_info_stmt)
     ext_symbol_info = symbol_info_result.scalars().first()
     if not ext_symbol_info:
@@ -3682,8 +3878,8 @@ async def _handle_order_close_transition(
     }
     await set_user_data_cache(redis_client, user_id, user_data_to_cache, 'live')
     await update_user_static_orders(user_id, db, redis_client, 'live')
-    await publish_order_update(redis_client, user_id)
-    await publish_user_data_update(redis_client, user_id)
+    await publish_order_update(redis_client, user_id, 'live')
+    await publish_user_data_update(redis_client, user_id, 'live')
     await publish_market_data_trigger(redis_client)
 
     return updated_order
@@ -3693,6 +3889,7 @@ async def _handle_order_close_transition(
 async def calculate_half_spread_for_service_provider(
     request: HalfSpreadRequest,
     db: AsyncSession = Depends(get_db),
+    redis_client: Redis = Depends(get_redis_client),
     current_user: User = Depends(get_user_from_service_token)
 ):
     """
@@ -3706,7 +3903,8 @@ async def calculate_half_spread_for_service_provider(
     # 1. Find the order to get the user_id, using any provided ID.
     # Service providers only operate on live users, so we use UserOrder model.
     order_model = UserOrder
-    db_order = await crud_order.get_order_by_any_id(db, generic_id=request.order_id, order_model=order_model)
+    db_order = await crud_order.get_order_by_any_id(db, generic_id=request.order_id, order_model=order_model,
+                                                redis_client=redis_client)
     if not db_order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Order with ID '{request.order_id}' not found.")
 
@@ -3751,6 +3949,7 @@ async def calculate_half_spread_for_service_provider(
 async def get_order_status_by_service_provider(
     id: str = Query(..., description="The ID to search for (can be order_id, close_id, cancel_id, etc.)"),
     db: AsyncSession = Depends(get_db),
+    redis_client: Redis = Depends(get_redis_client),
     current_user: User = Depends(get_user_from_service_token)
 ):
     """
@@ -3763,7 +3962,7 @@ async def get_order_status_by_service_provider(
     order_model = UserOrder
     
     # Use the generic lookup function to find the order by any of its IDs.
-    db_order = await crud_order.get_order_by_any_id(db, generic_id=id, order_model=order_model)
+    db_order = await crud_order.get_order_by_any_id(db, generic_id=id, order_model=order_model, redis_client=redis_client)
 
     if not db_order:
         orders_logger.warning(f"Order not found with provided identifier '{id}' for service provider status check.")
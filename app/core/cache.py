@@ -2,10 +2,11 @@
 
 import json
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterable, Tuple
 from redis.asyncio import Redis
 import decimal # Import Decimal for type hinting and serialization
 import datetime
+import time
 from app.core.firebase import get_latest_market_data
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
@@ -15,6 +16,7 @@ logger = logging.getLogger(__name__)
 
 logger.setLevel(logging.DEBUG)
 from app.core.logging_config import cache_logger
+from app.core.metrics import cache_requests_total
 # Keys for storing data in Redis
 REDIS_USER_DATA_KEY_PREFIX = "user_data:" # Stores group_name, leverage, etc.
 REDIS_USER_PORTFOLIO_KEY_PREFIX = "user_portfolio:" # Stores balance, positions
@@ -28,11 +30,31 @@ REDIS_GROUP_SYMBOL_SETTINGS_KEY_PREFIX = "group_symbol_settings:" # Stores sprea
 REDIS_GROUP_SETTINGS_KEY_PREFIX = "group_settings:" # Stores general group settings like sending_orders
 # New key prefix for last known price
 LAST_KNOWN_PRICE_KEY_PREFIX = "last_price:"
+# Epoch seconds at which a last known price was written, stored with the price
+LAST_KNOWN_PRICE_TIMESTAMP_FIELD = "_cached_at"
+
+REDIS_ORDER_ALIAS_KEY_PREFIX = "order_alias:" # Secondary order id (close_id, stoploss_id, ...) -> order_id
 
 # Redis channels for real-time updates
 REDIS_MARKET_DATA_CHANNEL = 'market_data_updates'
 REDIS_ORDER_UPDATES_CHANNEL = 'order_updates'
 REDIS_USER_DATA_UPDATES_CHANNEL = 'user_data_updates'
+# Order and user-data events are published per account ("order_updates:live:42") so each
+# event only reaches the sockets of that account; the prefixes above are the channel roots.
+ACCOUNT_USER_TYPES = ('live', 'demo')
+
+
+def order_updates_channel(user_type: str, user_id: int) -> str:
+    return f"{REDIS_ORDER_UPDATES_CHANNEL}:{'demo' if user_type == 'demo' else 'live'}:{user_id}"
+
+
+def user_data_updates_channel(user_type: str, user_id: int) -> str:
+    return f"{REDIS_USER_DATA_UPDATES_CHANNEL}:{'demo' if user_type == 'demo' else 'live'}:{user_id}"
+
+
+def account_update_channels(user_type: str, user_id: int) -> Tuple[str, str]:
+    """(order updates, user data updates) channels a socket of the account subscribes to."""
+    return order_updates_channel(user_type, user_id), user_data_updates_channel(user_type, user_id)
 
 # Expiry times (adjust as needed)
 CACHE_EXPIRY = 60 * 60  # Default cache expiry: 1 hour
@@ -43,6 +65,18 @@ USER_STATIC_ORDERS_CACHE_EXPIRY_SECONDS = 30 * 60 # Static order data expires af
 USER_DYNAMIC_PORTFOLIO_CACHE_EXPIRY_SECONDS = 60 # Dynamic portfolio metrics expire after 60 seconds
 GROUP_SYMBOL_SETTINGS_CACHE_EXPIRY_SECONDS = 30 * 24 * 60 * 60 # Example: Group settings change infrequently
 GROUP_SETTINGS_CACHE_EXPIRY_SECONDS = 30 * 24 * 60 * 60 # Example: Group settings change infrequently
+ORDER_ALIAS_CACHE_EXPIRY_SECONDS = 7 * 24 * 60 * 60 # Aliases never change; kept while callbacks for the order may arrive
+
+# --- Cache hit/miss accounting (exported at /metrics) ---
+_CACHE_NAMES = (
+    "user_data", "user_portfolio", "static_orders", "dynamic_portfolio",
+    "group_symbol_settings", "group_settings", "adjusted_market_price", "last_price", "order_alias",
+)
+_CACHE_HITS = {name: cache_requests_total.labels(name, "hit") for name in _CACHE_NAMES}
+_CACHE_MISSES = {name: cache_requests_total.labels(name, "miss") for name in _CACHE_NAMES}
+
+def _count_cache_lookup(cache: str, hit: bool) -> None:
+    (_CACHE_HITS if hit else _CACHE_MISSES)[cache].inc()
 
 # --- Last Known Price Cache ---
 class DecimalEncoder(json.JSONEncoder):
@@ -102,6 +136,7 @@ async def get_user_data_cache(
     key = f"{REDIS_USER_DATA_KEY_PREFIX}{user_type}:{user_id}"
     try:
         data_json = await redis_client.get(key)
+        _count_cache_lookup("user_data", bool(data_json))
         if data_json:
             data = json.loads(data_json, object_hook=decode_decimal)
             cache_logger.debug(f"User data retrieved from cache for user {user_id}")
@@ -184,6 +219,7 @@ async def get_user_portfolio_cache(redis_client: Redis, user_id: int) -> Optiona
     key = f"{REDIS_USER_PORTFOLIO_KEY_PREFIX}{user_id}"
     try:
         portfolio_json = await redis_client.get(key)
+        _count_cache_lookup("user_portfolio", bool(portfolio_json))
         if portfolio_json:
             portfolio_data = json.loads(portfolio_json, object_hook=decode_decimal)
             cache_logger.info(f"Read portfolio cache for user_id={user_id}: {portfolio_data}")
@@ -235,6 +271,7 @@ async def get_user_static_orders_cache(redis_client: Redis, user_id: int) -> Opt
     key = f"{REDIS_USER_STATIC_ORDERS_KEY_PREFIX}{user_id}"
     try:
         data_json = await redis_client.get(key)
+        _count_cache_lookup("static_orders", bool(data_json))
         if data_json:
             data = json.loads(data_json, object_hook=decode_decimal)
             cache_logger.debug(f"Static orders retrieved from cache for user {user_id}")
@@ -275,6 +312,7 @@ async def get_user_dynamic_portfolio_cache(redis_client: Redis, user_id: int) ->
     key = f"{REDIS_USER_DYNAMIC_PORTFOLIO_KEY_PREFIX}{user_id}"
     try:
         data_json = await redis_client.get(key)
+        _count_cache_lookup("dynamic_portfolio", bool(data_json))
         if data_json:
             data = json.loads(data_json, object_hook=decode_decimal)
             cache_logger.debug(f"Dynamic portfolio retrieved from cache for user {user_id}")
@@ -374,6 +412,7 @@ async def get_group_symbol_settings_cache(redis_client: Redis, group_name: str,
         key = f"{REDIS_GROUP_SYMBOL_SETTINGS_KEY_PREFIX}{group_name.lower()}:{symbol.upper()}" # Use lower/upper for consistency
         try:
             settings_json = await redis_client.get(key)
+            _count_cache_lookup("group_symbol_settings", bool(settings_json))
             if settings_json:
                 settings = json.loads(settings_json, object_hook=decode_decimal)
                 cache_logger.debug(f"Group-symbol settings retrieved from cache for group '{group_name}', symbol '{symbol}'.")
@@ -384,9 +423,65 @@ async def get_group_symbol_settings_cache(redis_client: Redis, group_name: str,
             cache_logger.error(f"Error getting group-symbol settings cache for group '{group_name}', symbol '{symbol}': {e}", exc_info=True)
             return None
 
-# You might also want a function to cache ALL settings for a group,
-# or cache ALL group-symbol settings globally if the dataset is small enough.
-# For now, fetching per symbol on demand from cache/DB is a good start.
+async def set_group_symbol_settings_cache_bulk(
+    redis_client: Redis,
+    group_name: str,
+    symbol_settings: Dict[str, Dict[str, Any]],
+    group_settings: Optional[Dict[str, Any]] = None
+):
+    """
+    Stores the settings of all of a group's symbols ({symbol: settings}), and its general
+    settings when given, in one pipelined round trip.
+    """
+    if not redis_client:
+        logger.warning(f"Redis client not available for setting group-symbol settings cache for group '{group_name}'.")
+        return
+    if not symbol_settings and not group_settings:
+        return
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        if group_settings:
+            pipe.set(f"{REDIS_GROUP_SETTINGS_KEY_PREFIX}{group_name.lower()}",
+                     json.dumps(group_settings, cls=DecimalEncoder), ex=GROUP_SETTINGS_CACHE_EXPIRY_SECONDS)
+        for symbol, settings in symbol_settings.items():
+            pipe.set(f"{REDIS_GROUP_SYMBOL_SETTINGS_KEY_PREFIX}{group_name.lower()}:{symbol.upper()}",
+                     json.dumps(settings, cls=DecimalEncoder), ex=GROUP_SYMBOL_SETTINGS_CACHE_EXPIRY_SECONDS)
+        await pipe.execute()
+        cache_logger.debug(f"Group-symbol settings of {len(symbol_settings)} symbols cached for group '{group_name}'.")
+    except Exception as e:
+        logger.error(f"Error setting group-symbol settings cache for group '{group_name}': {e}", exc_info=True)
+
+async def get_group_symbol_settings_cache_many(
+    redis_client: Redis,
+    group_name: str,
+    symbols: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Retrieves the group's settings of `symbols` in one MGET. Returns {SYMBOL: settings};
+    symbols that are not cached are absent.
+    """
+    symbols = [symbol.upper() for symbol in symbols]
+    result: Dict[str, Dict[str, Any]] = {}
+    if not redis_client or not group_name or not symbols:
+        return result
+    try:
+        values = await redis_client.mget(
+            [f"{REDIS_GROUP_SYMBOL_SETTINGS_KEY_PREFIX}{group_name.lower()}:{symbol}" for symbol in symbols]
+        )
+    except Exception as e:
+        cache_logger.error(f"Error getting group-symbol settings cache for group '{group_name}': {e}", exc_info=True)
+        return result
+
+    for symbol, raw in zip(symbols, values):
+        _count_cache_lookup("group_symbol_settings", bool(raw))
+        if not raw:
+            continue
+        try:
+            result[symbol] = json.loads(raw, object_hook=decode_decimal)
+        except (json.JSONDecodeError, TypeError) as e:
+            cache_logger.error(f"Error parsing cached group-symbol settings for {symbol}: {e}")
+    return result
 
 # Add these functions to your app/core/cache.py file
 
@@ -438,6 +533,7 @@ async def get_adjusted_market_price_cache(redis_client: Redis, user_group_name:
     # cache_logger.debug(f"Looking up cache key: {cache_key}")
     try:
         cached_data = await redis_client.get(cache_key)
+        _count_cache_lookup("adjusted_market_price", bool(cached_data))
         if cached_data:
             price_data = json.loads(cached_data)
             # Convert string values back to Decimal
@@ -577,6 +673,7 @@ async def get_group_settings_cache(redis_client: Redis, group_name: str) -> Opti
     key = f"{REDIS_GROUP_SETTINGS_KEY_PREFIX}{group_name.lower()}" # Use lower for consistency
     try:
         settings_json = await redis_client.get(key)
+        _count_cache_lookup("group_settings", bool(settings_json))
         if settings_json:
             settings = json.loads(settings_json, object_hook=decode_decimal)
             cache_logger.debug(f"Group settings retrieved from cache for group '{group_name}'.")
@@ -587,6 +684,50 @@ async def get_group_settings_cache(redis_client: Redis, group_name: str) -> Opti
         cache_logger.error(f"Error getting group settings cache for group '{group_name}': {e}", exc_info=True)
         return None
 
+# --- Order Id Alias Cache ---
+async def get_order_alias_cache(redis_client: Redis, user_type: str, alias: str) -> Optional[str]:
+    """
+    Returns the order_id that a secondary order id (close_id, stoploss_id, ...) belongs to,
+    or None if it is not cached. Mirror of the order_id_alias table.
+    """
+    if not redis_client:
+        return None
+    key = f"{REDIS_ORDER_ALIAS_KEY_PREFIX}{user_type}:{alias}"
+    try:
+        order_id = await redis_client.get(key)
+        _count_cache_lookup("order_alias", bool(order_id))
+        if order_id:
+            return order_id.decode() if isinstance(order_id, bytes) else order_id
+        return None
+    except Exception as e:
+        cache_logger.error(f"Error getting order alias cache for '{alias}' ({user_type}): {e}", exc_info=True)
+        return None
+
+async def set_order_alias_cache(redis_client: Redis, user_type: str, alias: str, order_id: str):
+    """
+    Caches the order_id of a secondary order id.
+    """
+    if not redis_client:
+        return
+    key = f"{REDIS_ORDER_ALIAS_KEY_PREFIX}{user_type}:{alias}"
+    try:
+        await redis_client.set(key, str(order_id), ex=ORDER_ALIAS_CACHE_EXPIRY_SECONDS)
+    except Exception as e:
+        cache_logger.error(f"Error setting order alias cache for '{alias}' ({user_type}): {e}", exc_info=True)
+
+async def delete_order_alias_cache(redis_client: Redis, aliases: Iterable[Tuple[str, str]]):
+    """
+    Drops the cached order_id of each (user_type, alias), so that the next lookup re-checks
+    order_id_alias after another order was given the same id.
+    """
+    keys = [f"{REDIS_ORDER_ALIAS_KEY_PREFIX}{user_type}:{alias}" for user_type, alias in aliases]
+    if not redis_client or not keys:
+        return
+    try:
+        await redis_client.delete(*keys)
+    except Exception as e:
+        cache_logger.error(f"Error deleting {len(keys)} order alias cache entries: {e}", exc_info=True)
+
 # --- Last Known Price Cache ---
 async def set_last_known_price(redis_client: Redis, symbol: str, price_data: dict):
     """
@@ -597,6 +738,7 @@ async def set_last_known_price(redis_client: Redis, symbol: str, price_data: dic
         return
     key = f"last_price:{symbol.upper()}"
     try:
+        price_data = {**price_data, LAST_KNOWN_PRICE_TIMESTAMP_FIELD: time.time()}
         await redis_client.set(key, json.dumps(price_data, cls=DecimalEncoder))
         cache_logger.debug(f"Last known price cached for symbol {symbol}")
     except Exception as e:
@@ -612,6 +754,7 @@ async def get_last_known_price(redis_client: Redis, symbol: str) -> Optional[dic
     key = f"last_price:{symbol.upper()}"
     try:
         data_json = await redis_client.get(key)
+        _count_cache_lookup("last_price", bool(data_json))
         if data_json:
             data = json.loads(data_json, object_hook=decode_decimal)
             cache_logger.debug(f"Last known price retrieved from cache for symbol {symbol}")
@@ -621,10 +764,11 @@ async def get_last_known_price(redis_client: Redis, symbol: str) -> Optional[dic
         cache_logger.error(f"Error getting last known price for symbol {symbol}: {e}", exc_info=True)
         return None
 
-async def publish_order_update(redis_client: Redis, user_id: int):
+async def publish_order_update(redis_client: Redis, user_id: int, user_type: Optional[str] = None):
     """
     Publishes an event to notify that a user's orders have been updated.
-    WebSocket connections can listen to this channel to refresh order data.
+    The event goes to the account's own channel (see order_updates_channel); live and demo
+    ids overlap, so without user_type it is published to both account types.
     """
     if not redis_client:
         logger.warning(f"Redis client not available for publishing order update for user {user_id}.")
@@ -636,15 +780,18 @@ async def publish_order_update(redis_client: Redis, user_id: int):
             "user_id": user_id,
             "timestamp": datetime.datetime.now().isoformat()
         }, cls=DecimalEncoder)
-        result = await redis_client.publish(REDIS_ORDER_UPDATES_CHANNEL, message)
-        cache_logger.info(f"Published order update for user {user_id} to {REDIS_ORDER_UPDATES_CHANNEL}, received by {result} subscribers")
+        for account_type in ((user_type,) if user_type else ACCOUNT_USER_TYPES):
+            channel = order_updates_channel(account_type, user_id)
+            result = await redis_client.publish(channel, message)
+            cache_logger.info(f"Published order update for user {user_id} to {channel}, received by {result} subscribers")
     except Exception as e:
         logger.error(f"Error publishing order update for user {user_id}: {e}", exc_info=True)
 
-async def publish_user_data_update(redis_client: Redis, user_id: int):
+async def publish_user_data_update(redis_client: Redis, user_id: int, user_type: Optional[str] = None):
     """
     Publishes an event to notify that a user's data has been updated.
-    WebSocket connections can listen to this channel to refresh user data.
+    The event goes to the account's own channel (see user_data_updates_channel); without
+    user_type it is published to both account types.
     """
     if not redis_client:
         logger.warning(f"Redis client not available for publishing user data update for user {user_id}.")
@@ -656,8 +803,10 @@ async def publish_user_data_update(redis_client: Redis, user_id: int):
             "user_id": user_id,
             "timestamp": datetime.datetime.now().isoformat()
         }, cls=DecimalEncoder)
-        result = await redis_client.publish(REDIS_USER_DATA_UPDATES_CHANNEL, message)
-        cache_logger.info(f"Published user data update for user {user_id} to {REDIS_USER_DATA_UPDATES_CHANNEL}, received by {result} subscribers")
+        for account_type in ((user_type,) if user_type else ACCOUNT_USER_TYPES):
+            channel = user_data_updates_channel(account_type, user_id)
+            result = await redis_client.publish(channel, message)
+            cache_logger.info(f"Published user data update for user {user_id} to {channel}, received by {result} subscribers")
     except Exception as e:
         logger.error(f"Error publishing user data update for user {user_id}: {e}", exc_info=True)
 
@@ -682,6 +831,36 @@ async def publish_market_data_trigger(redis_client: Redis, symbol: str = "TRIGGE
     except Exception as e:
         logger.error(f"Error publishing market data trigger: {e}", exc_info=True)
 
+async def publish_bulk_order_updates(redis_client: Redis, user_type: str, accounts: Dict[int, Dict[str, Any]]):
+    """
+    After orders were placed on many accounts at once, in one pipelined round trip:
+    per account, stores its user data ({user_id: user_data}), drops its static orders
+    (re-read from the DB on the next use) and publishes one ORDER_UPDATE; then one
+    market data trigger for all of them.
+    """
+    if not redis_client:
+        logger.warning(f"Redis client not available for publishing bulk order updates.")
+        return
+    if not accounts:
+        return
+
+    try:
+        timestamp = datetime.datetime.now().isoformat()
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id, user_data in accounts.items():
+            pipe.set(f"{REDIS_USER_DATA_KEY_PREFIX}{user_type}:{user_id}",
+                     json.dumps(user_data, cls=DecimalEncoder), ex=USER_DATA_CACHE_EXPIRY_SECONDS)
+            pipe.delete(f"{REDIS_USER_STATIC_ORDERS_KEY_PREFIX}{user_id}")
+            pipe.publish(order_updates_channel(user_type, user_id),
+                         json.dumps({"type": "ORDER_UPDATE", "user_id": user_id, "timestamp": timestamp}))
+        pipe.publish(REDIS_MARKET_DATA_CHANNEL, json.dumps({
+            "type": "market_data_update", "symbol": "TRIGGER", "b": "0", "o": "0", "timestamp": timestamp
+        }))
+        await pipe.execute()
+        cache_logger.info(f"Published bulk order updates for {len(accounts)} {user_type} accounts")
+    except Exception as e:
+        logger.error(f"Error publishing bulk order updates for {len(accounts)} accounts: {e}", exc_info=True)
+
 # Add optimized batch cache functions for order placement performance
 
 async def get_order_placement_data_batch(
@@ -817,6 +996,54 @@ async def get_market_data_batch(
         cache_logger.error(f"Error in batch market data fetch: {e}", exc_info=True)
         return {}
 
+async def bootstrap_connection_cache(
+    redis_client: Redis,
+    user_id: int,
+    user_type: str,
+    user_data: Dict[str, Any],
+    portfolio: Dict[str, Any],
+    static_orders: Dict[str, Any],
+    dynamic_portfolio: Dict[str, Any],
+    group_name: str,
+    symbols: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Writes a new WebSocket connection's user caches and reads the group's adjusted and
+    last known prices in one pipelined round trip.
+    Returns {"adjusted": {symbol: {...}}, "last_price": {symbol: {...}}}.
+    """
+    symbols = [symbol.upper() for symbol in symbols]
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(f"{REDIS_USER_DATA_KEY_PREFIX}{user_type}:{user_id}",
+             json.dumps(user_data, cls=DecimalEncoder), ex=USER_DATA_CACHE_EXPIRY_SECONDS)
+    pipe.set(f"{REDIS_USER_PORTFOLIO_KEY_PREFIX}{user_id}",
+             json.dumps(portfolio, cls=DecimalEncoder), ex=USER_PORTFOLIO_CACHE_EXPIRY_SECONDS)
+    pipe.set(f"{REDIS_USER_STATIC_ORDERS_KEY_PREFIX}{user_id}",
+             json.dumps(static_orders, cls=DecimalEncoder), ex=USER_STATIC_ORDERS_CACHE_EXPIRY_SECONDS)
+    pipe.set(f"{REDIS_USER_DYNAMIC_PORTFOLIO_KEY_PREFIX}{user_id}",
+             json.dumps(dynamic_portfolio, cls=DecimalEncoder), ex=USER_DYNAMIC_PORTFOLIO_CACHE_EXPIRY_SECONDS)
+    if symbols:
+        pipe.mget([f"{REDIS_ADJUSTED_MARKET_PRICE_KEY_PREFIX}{group_name}:{symbol}" for symbol in symbols])
+        pipe.mget([f"{LAST_KNOWN_PRICE_KEY_PREFIX}{symbol}" for symbol in symbols])
+    results = await pipe.execute()
+    # The placeholder dynamic portfolio bypassed the coalescing writer: let the next calculation through
+    from app.services.portfolio_writer import dynamic_portfolio_writer
+    dynamic_portfolio_writer.forget(user_type, user_id)
+
+    prices: Dict[str, Dict[str, Any]] = {"adjusted": {}, "last_price": {}}
+    if not symbols:
+        return prices
+    for name, values, object_hook in (("adjusted", results[4], None), ("last_price", results[5], decode_decimal)):
+        for symbol, raw in zip(symbols, values):
+            _count_cache_lookup("adjusted_market_price" if name == "adjusted" else "last_price", bool(raw))
+            if not raw:
+                continue
+            try:
+                prices[name][symbol] = json.loads(raw, object_hook=object_hook)
+            except (json.JSONDecodeError, TypeError) as e:
+                cache_logger.error(f"Error parsing cached {name} for {symbol}: {e}")
+    return prices
+
 # Optimized price fetching function
 async def get_price_for_order_type(
     redis_client: Redis,
@@ -881,6 +1108,85 @@ async def get_price_for_order_type(
         cache_logger.error(f"Error getting price for {symbol} {order_type}: {e}", exc_info=True)
         return None
 
+async def get_order_placement_cache(
+    redis_client: Redis,
+    symbols: List[str],
+    user_id: Optional[int] = None,
+    user_type: str = 'live'
+) -> Dict[str, Any]:
+    """
+    Reads what placing an order needs in one MGET: the user data (when user_id is given)
+    and the last known prices of `symbols`.
+    Returns {"user_data": {...} or None, "last_price": {symbol: {...}}}.
+    """
+    symbols = [symbol.upper() for symbol in symbols]
+    keys = [f"{LAST_KNOWN_PRICE_KEY_PREFIX}{symbol}" for symbol in symbols]
+    if user_id is not None:
+        keys.append(f"{REDIS_USER_DATA_KEY_PREFIX}{user_type}:{user_id}")
+    result: Dict[str, Any] = {"user_data": None, "last_price": {}}
+    if not redis_client or not keys:
+        return result
+    try:
+        values = await redis_client.mget(keys)
+    except Exception as e:
+        cache_logger.error(f"Error reading order placement cache for user {user_id}: {e}", exc_info=True)
+        return result
+
+    for symbol, raw in zip(symbols, values):
+        _count_cache_lookup("last_price", bool(raw))
+        if raw:
+            try:
+                result["last_price"][symbol] = json.loads(raw, object_hook=decode_decimal)
+            except (json.JSONDecodeError, TypeError) as e:
+                cache_logger.error(f"Error parsing cached last_price for {symbol}: {e}")
+    if user_id is not None:
+        raw = values[-1]
+        _count_cache_lookup("user_data", bool(raw))
+        if raw:
+            try:
+                result["user_data"] = json.loads(raw, object_hook=decode_decimal)
+            except (json.JSONDecodeError, TypeError) as e:
+                cache_logger.error(f"Error parsing cached user data for user {user_id}: {e}")
+    return result
+
+async def get_close_prices_cache(
+    redis_client: Redis,
+    group_name: str,
+    symbols: List[str],
+    conversion_symbols: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Reads what closing positions needs in one MGET: the group-adjusted prices of `symbols`
+    and the last known prices of the USD `conversion_symbols`.
+    Returns {"adjusted": {symbol: {...}}, "last_price": {symbol: {...}}}.
+    """
+    symbols = [symbol.upper() for symbol in symbols]
+    conversion_symbols = [symbol.upper() for symbol in conversion_symbols]
+    result: Dict[str, Dict[str, Any]] = {"adjusted": {}, "last_price": {}}
+    keys = ([f"{REDIS_ADJUSTED_MARKET_PRICE_KEY_PREFIX}{group_name}:{symbol}" for symbol in symbols] +
+            [f"{LAST_KNOWN_PRICE_KEY_PREFIX}{symbol}" for symbol in conversion_symbols])
+    if not redis_client or not keys:
+        return result
+    try:
+        values = await redis_client.mget(keys)
+    except Exception as e:
+        cache_logger.error(f"Error reading close prices for group '{group_name}': {e}", exc_info=True)
+        return result
+
+    for name, names, raws, object_hook in (
+        ("adjusted", symbols, values[:len(symbols)], None),
+        ("last_price", conversion_symbols, values[len(symbols):], decode_decimal),
+    ):
+        for symbol, raw in zip(names, raws):
+            _count_cache_lookup("adjusted_market_price" if name == "adjusted" else "last_price", bool(raw))
+            if not raw:
+                continue
+            try:
+                result[name][symbol] = json.loads(raw, object_hook=object_hook)
+            except (json.JSONDecodeError, TypeError) as e:
+                cache_logger.error(f"Error parsing cached {name} for {symbol}: {e}")
+    return result
+
 # Add ultra-optimized batch cache functions for maximum performance
 
 async def get_order_placement_data_batch_ultra(
@@ -1042,24 +1348,15 @@ def ultra_fast_cache(expiry: int = 300):
         return wrapper
     return decorator
 
-# --- Utility: Cache group settings, group symbol settings, and external symbol info for a user ---
+# --- Utility: Cache group settings and group symbol settings for a user ---
 async def cache_user_group_settings_and_symbols(user, db, redis_client):
+    """
+    Caches the general settings of the user's group and the settings of all of its
+    symbols, read with one query and written with one pipeline.
+    """
     from app.crud import group as crud_group
-    from app.crud.external_symbol_info import get_all_external_symbol_info
     group_name = getattr(user, "group_name", None)
     if not group_name:
         return
-    # Cache group settings
-    db_group = await crud_group.get_group_by_name(db, group_name)
-    if db_group:
-        settings = {"sending_orders": getattr(db_group[0] if isinstance(db_group, list) else db_group, 'sending_orders', None)}
-        await set_group_settings_cache(redis_client, group_name, settings)
-    # Cache group symbol settings
-    group_symbol_settings = await crud_group.get_group_symbol_settings_for_all_symbols(db, group_name)
-    for symbol, settings in group_symbol_settings.items():
-        await set_group_symbol_settings_cache(redis_client, group_name, symbol, settings)
-    # Cache all external symbol info (if you have a cache function for this, call it here)
-    all_symbol_info = await get_all_external_symbol_info(db)
-    for info in all_symbol_info:
-        # Optionally cache to Redis if you have a cache function for external symbol info
-        pass
\ No newline at end of file
+    group_settings, symbol_settings = await crud_group.get_group_symbol_settings(db, group_name)
+    await set_group_symbol_settings_cache_bulk(redis_client, group_name, symbol_settings, group_settings)
@@ -74,6 +74,9 @@ class Settings(BaseSettings):
     REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
     REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
     REDIS_PASSWORD: Optional[str] = os.getenv("REDIS_PASSWORD")
+    # Connection pool size of the shared client; every WebSocket holds one for its pub/sub
+    # subscription. Unset keeps redis-py's default (100 in recent versions)
+    REDIS_MAX_CONNECTIONS: Optional[int] = int(os.getenv("REDIS_MAX_CONNECTIONS")) if os.getenv("REDIS_MAX_CONNECTIONS") else None
 
     # --- Firebase Settings ---
     # Use raw string for path to handle backslashes correctlyFIREBASE_PRI
@@ -94,7 +97,82 @@ class Settings(BaseSettings):
     MAIL_FROM: str = os.getenv("MAIL_FROM", "noreply@.")
 
     SLTP_EPSILON: float = 0.00001
-    
+
+    # --- Market Data Pipeline Observability ---
+    # Fraction of ticks whose latency is also broken down per symbol
+    TICK_TRACE_SYMBOL_SAMPLE_RATE: float = float(os.getenv("TICK_TRACE_SYMBOL_SAMPLE_RATE", "0.05"))
+    # Synthetic tick source (replaces the Firebase feed for local load tests and benchmarks)
+    SYNTHETIC_FEED_ENABLED: bool = os.getenv("SYNTHETIC_FEED_ENABLED", "False").lower() in ("true", "1", "t")
+    SYNTHETIC_FEED_SYMBOLS: str = os.getenv("SYNTHETIC_FEED_SYMBOLS", "EURUSD,GBPUSD,USDJPY,AUDUSD,USDCAD,USDCHF,NZDUSD,EURGBP,EURJPY,XAUUSD")
+    SYNTHETIC_FEED_INTERVAL_MS: int = int(os.getenv("SYNTHETIC_FEED_INTERVAL_MS", "100"))
+    # Event-loop lag monitor: heartbeat period and the stall length that triggers a stack capture
+    LOOP_LAG_MONITOR_INTERVAL_MS: int = int(os.getenv("LOOP_LAG_MONITOR_INTERVAL_MS", "50"))
+    LOOP_LAG_THRESHOLD_MS: int = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+
+    # --- All-accounts portfolio sweep ---
+    ACCOUNT_SWEEP_CONCURRENCY: int = int(os.getenv("ACCOUNT_SWEEP_CONCURRENCY", "8"))
+    # Must stay below the 1 minute job interval
+    ACCOUNT_SWEEP_DEADLINE_SECONDS: float = float(os.getenv("ACCOUNT_SWEEP_DEADLINE_SECONDS", "50"))
+    ACCOUNT_SWEEP_BATCH_SIZE: int = int(os.getenv("ACCOUNT_SWEEP_BATCH_SIZE", "500"))
+    # Margin-risk index: accounts re-evaluated on every tick regardless of their trigger price,
+    # and how close (relative price move) to their cutoff price they must be to count
+    MARGIN_RISK_TOP_K: int = int(os.getenv("MARGIN_RISK_TOP_K", "20"))
+    MARGIN_RISK_TOP_K_MAX_DISTANCE: float = float(os.getenv("MARGIN_RISK_TOP_K_MAX_DISTANCE", "0.02"))
+
+    # --- WebSocket outbound queues ---
+    # Order/user-data events a connection may have queued before it is evicted (events are never dropped)
+    WS_SEND_QUEUE_MAX_EVENTS: int = int(os.getenv("WS_SEND_QUEUE_MAX_EVENTS", "256"))
+    # Evict a connection whose oldest undelivered frame is older than this
+    WS_SLOW_CONSUMER_EVICTION_SECONDS: float = float(os.getenv("WS_SLOW_CONSUMER_EVICTION_SECONDS", "10"))
+    # Sequenced account streams: how long a disconnected session stays resumable, and deltas kept per session
+    WS_RESUME_TTL_SECONDS: float = float(os.getenv("WS_RESUME_TTL_SECONDS", "120"))
+    WS_ACCOUNT_STREAM_BUFFER: int = int(os.getenv("WS_ACCOUNT_STREAM_BUFFER", "256"))
+    # Add the tick origin `_timestamp` to market_update frames (load tests measure end-to-end latency with it)
+    WS_FRAME_ORIGIN_TIMESTAMPS: bool = os.getenv("WS_FRAME_ORIGIN_TIMESTAMPS", "False").lower() in ("true", "1", "t")
+    # Group symbol settings are kept in process and re-read from the DB at most this often per group
+    GROUP_SYMBOL_REGISTRY_TTL_SECONDS: float = float(os.getenv("GROUP_SYMBOL_REGISTRY_TTL_SECONDS", "60"))
+    # Order placement prices cached longer ago than this are re-read from the live market data feed
+    ORDER_PRICE_MAX_AGE_SECONDS: float = float(os.getenv("ORDER_PRICE_MAX_AGE_SECONDS", "5"))
+    # Dynamic portfolio cache: at most one write per account per interval, values compared at this many decimals
+    DYNAMIC_PORTFOLIO_MIN_WRITE_INTERVAL_SECONDS: float = float(os.getenv("DYNAMIC_PORTFOLIO_MIN_WRITE_INTERVAL_SECONDS", "1.0"))
+    DYNAMIC_PORTFOLIO_PRECISION: int = int(os.getenv("DYNAMIC_PORTFOLIO_PRECISION", "2"))
+    # Redis pub/sub subscribers: reconnection backoff after a lost connection (doubles per failed attempt)
+    PUBSUB_RECONNECT_INITIAL_BACKOFF_SECONDS: float = float(os.getenv("PUBSUB_RECONNECT_INITIAL_BACKOFF_SECONDS", "0.1"))
+    PUBSUB_RECONNECT_MAX_BACKOFF_SECONDS: float = float(os.getenv("PUBSUB_RECONNECT_MAX_BACKOFF_SECONDS", "30"))
+    # Per-account mutation actor: Redis lease ttl (renewed while held), how long to wait for another
+    # process's lease, and turns served per lease before handing it back
+    ACCOUNT_LEASE_TTL_SECONDS: float = float(os.getenv("ACCOUNT_LEASE_TTL_SECONDS", "10"))
+    ACCOUNT_LEASE_WAIT_SECONDS: float = float(os.getenv("ACCOUNT_LEASE_WAIT_SECONDS", "5"))
+    ACCOUNT_ACTOR_MAX_BATCH: int = int(os.getenv("ACCOUNT_ACTOR_MAX_BATCH", "32"))
+    # Idempotency-Key on order submission: how long a result is replayed, how long an execution may stay
+    # in flight before a retry runs it again, and how long a duplicate waits for the first execution
+    IDEMPOTENCY_RESULT_TTL_SECONDS: float = float(os.getenv("IDEMPOTENCY_RESULT_TTL_SECONDS", "86400"))
+    IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS: float = float(os.getenv("IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS", "60"))
+    IDEMPOTENCY_WAIT_SECONDS: float = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+    # Order ids not found by order_id or order_id_alias are verified with the OR query across all the
+    # id columns of the order table (a full scan); disable once the alias backfill is confirmed complete
+    ORDER_ALIAS_SCAN_FALLBACK: bool = os.getenv("ORDER_ALIAS_SCAN_FALLBACK", "True").lower() in ("true", "1", "t")
+    # SQL statement profiler: per-query latency by endpoint and background task (/admin/metrics/sql), and
+    # the duration from which a statement is logged as slow, with its bind parameters redacted
+    SQL_PROFILER_ENABLED: bool = os.getenv("SQL_PROFILER_ENABLED", "True").lower() in ("true", "1", "t")
+    SQL_SLOW_QUERY_MS: int = int(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+
+    # --- DB connection pool and per-subsystem bulkheads (app/database/bulkheads.py) ---
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "20"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    # Sessions each subsystem may have open at once; keep the sum within DB_POOL_SIZE + DB_MAX_OVERFLOW
+    # so that a flooded subsystem queues on its own bulkhead and never on the shared pool
+    DB_BULKHEAD_API_SIZE: int = int(os.getenv("DB_BULKHEAD_API_SIZE", "10"))
+    DB_BULKHEAD_WS_SIZE: int = int(os.getenv("DB_BULKHEAD_WS_SIZE", "5"))
+    DB_BULKHEAD_TRIGGERS_SIZE: int = int(os.getenv("DB_BULKHEAD_TRIGGERS_SIZE", "6"))
+    # (the portfolio sweep holds ACCOUNT_SWEEP_CONCURRENCY + 1 batch sessions)
+    DB_BULKHEAD_BATCH_SIZE: int = int(os.getenv("DB_BULKHEAD_BATCH_SIZE", "9"))
+    # How long a session request waits for a slot of its subsystem before failing fast (HTTP 503 for the API)
+    DB_BULKHEAD_API_WAIT_SECONDS: float = float(os.getenv("DB_BULKHEAD_API_WAIT_SECONDS", "2"))
+    DB_BULKHEAD_WS_WAIT_SECONDS: float = float(os.getenv("DB_BULKHEAD_WS_WAIT_SECONDS", "2"))
+    DB_BULKHEAD_TRIGGERS_WAIT_SECONDS: float = float(os.getenv("DB_BULKHEAD_TRIGGERS_WAIT_SECONDS", "5"))
+    DB_BULKHEAD_BATCH_WAIT_SECONDS: float = float(os.getenv("DB_BULKHEAD_BATCH_WAIT_SECONDS", "30"))
+
     # Tylt.money Payment Gateway API Credentials
     TYLT_API_KEY: str = os.getenv("TLP_API_KEY", "")
     TYLT_API_SECRET: str = os.getenv("TLP_API_SECRET", "")
@@ -2,7 +2,7 @@
 
 import logging
 import json
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Optional
 import decimal
 from datetime import datetime
 
@@ -101,11 +101,25 @@ async def send_order_to_firebase(order_data: Dict[str, Any], account_type: str =
         firebase_comm_logger.error(f"FIREBASE ERROR: {error_msg}", exc_info=True)
         return False
 
+# Load harness / test hook: called with the symbol (None for all symbols) instead of
+# reading the datafeeds node. Never set in production; see set_market_data_source.
+_market_data_source: Optional[Callable[[Optional[str]], Optional[Dict[str, Any]]]] = None
+
+def set_market_data_source(source: Optional[Callable[[Optional[str]], Optional[Dict[str, Any]]]]) -> None:
+    """
+    Serves get_latest_market_data(_sync) from `source` in place of Firebase, for the load
+    harness and tests (the synthetic feed). None restores Firebase.
+    """
+    global _market_data_source
+    _market_data_source = source
+
 async def get_latest_market_data(symbol: str = None) -> Optional[Dict[str, Any]]:
     """
     Gets the latest market data from Firebase for a specific symbol or all symbols.
     Returns None if data is not available.
     """
+    if _market_data_source is not None:
+        return _market_data_source(symbol)
     try:
         _ensure_firebase_initialized()
         # Ensure db refers to firebase_admin.db
@@ -133,6 +147,8 @@ def get_latest_market_data_sync(symbol: str = None) -> Optional[Dict[str, Any]]:
     Gets the latest market data from Firebase for a specific symbol or all symbols.
     Returns None if data is not available.
     """
+    if _market_data_source is not None:
+        return _market_data_source(symbol)
     try:
         _ensure_firebase_initialized()
         # Ensure db refers to firebase_admin.db
@@ -0,0 +1,198 @@
+# app/core/loop_monitor.py
+
+"""
+Event-loop lag monitor and blocking-call detector.
+
+A heartbeat coroutine sleeps for a fixed interval and measures how late it wakes up;
+that delay is the loop's scheduling lag and is recorded in `event_loop_lag_seconds`.
+
+Lag is only visible after the loop is free again, which is too late to see *what*
+blocked it. So a helper thread watches the heartbeat: when it goes stale for longer
+than the threshold, the thread grabs the loop thread's current stack with
+sys._current_frames() while the blocking call is still running, and attributes the
+stall to the innermost project frame (e.g. a synchronous firebase_admin call,
+smtplib, bcrypt or a blocking file write).
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+event_loop_lag_seconds = registry.histogram(
+    "event_loop_lag_seconds", "How late the loop heartbeat woke up compared to its schedule."
+)
+event_loop_stalls_total = registry.counter(
+    "event_loop_stalls_total", "Loop stalls longer than the blocking threshold."
+)
+
+# Frames from these locations are never blamed for a stall.
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_LIBRARY_PREFIXES = tuple(
+    os.path.abspath(p) for p in {sysconfig.get_paths().get("stdlib"), sysconfig.get_paths().get("purelib"),
+                                 sysconfig.get_paths().get("platlib")} if p
+)
+MAX_TRACKED_OFFENDERS = 200
+
+
+def _is_project_frame(filename: str) -> bool:
+    path = os.path.abspath(filename)
+    if path.startswith(_LIBRARY_PREFIXES) or "site-packages" in path:
+        return False
+    return path.startswith(_PROJECT_ROOT)
+
+
+def _offender_from_stack(stack: traceback.StackSummary) -> Tuple[str, List[str]]:
+    """
+    Picks the innermost project frame of `stack` as the call site to blame.
+    Falls back to the innermost frame when no project frame is present.
+    """
+    formatted = [f"{os.path.relpath(f.filename, _PROJECT_ROOT) if _is_project_frame(f.filename) else f.filename}"
+                 f":{f.lineno} in {f.name}" for f in stack]
+    for frame, text in zip(reversed(stack), reversed(formatted)):
+        if _is_project_frame(frame.filename):
+            return text, formatted
+    return (formatted[-1] if formatted else "<unknown>"), formatted
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop scheduling lag and records the call sites that block the loop.
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.offenders: Dict[str, Dict[str, Any]] = {}
+        # event_loop_stalls_total at the last reset(); the counter itself is never reset
+        self._stalls_at_reset = event_loop_stalls_total.value
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._pending_offender: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- loop side ---
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            event_loop_lag_seconds.observe(lag)
+            offender = self._pending_offender
+            if offender is not None:
+                self._pending_offender = None
+                entry = self.offenders.get(offender)
+                if entry is not None:
+                    entry["total_stall_ms"] += lag * 1000.0
+                    entry["max_stall_ms"] = max(entry["max_stall_ms"], lag * 1000.0)
+                logger.warning(f"Event loop blocked for {lag * 1000.0:.1f}ms by {offender}")
+
+    def start(self) -> None:
+        """
+        Starts the heartbeat on the running loop and the watchdog thread.
+        """
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat_loop())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1.0)
+
+    # --- watchdog thread ---
+
+    def _watch(self) -> None:
+        check_every = min(self.interval, self.threshold) / 2
+        captured_for_heartbeat = None
+        while not self._stop.wait(check_every):
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat
+            if stalled_for < self.interval + self.threshold or captured_for_heartbeat == heartbeat:
+                continue
+            # One capture per stall: the heartbeat value identifies the stall.
+            captured_for_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._record_stall(traceback.extract_stack(frame))
+
+    def _record_stall(self, stack: traceback.StackSummary) -> None:
+        offender, formatted = _offender_from_stack(stack)
+        event_loop_stalls_total.inc()
+        entry = self.offenders.get(offender)
+        if entry is None:
+            if len(self.offenders) >= MAX_TRACKED_OFFENDERS:
+                return
+            entry = self.offenders[offender] = {
+                "count": 0, "total_stall_ms": 0.0, "max_stall_ms": 0.0, "last_seen": 0.0, "stack": []
+            }
+        entry["count"] += 1
+        entry["last_seen"] = time.time()
+        entry["stack"] = formatted[-15:]
+        self._pending_offender = offender
+
+    # --- reporting ---
+
+    def top_offenders(self, limit: int = 10) -> List[Dict[str, Any]]:
+        ranked = sorted(self.offenders.items(),
+                        key=lambda item: (item[1]["total_stall_ms"], item[1]["count"]), reverse=True)
+        return [{"call_site": call_site, **entry} for call_site, entry in ranked[:limit]]
+
+    def snapshot(self, limit: int = 10) -> Dict[str, Any]:
+        return {
+            "interval_ms": self.interval * 1000.0,
+            "threshold_ms": self.threshold * 1000.0,
+            "lag": event_loop_lag_seconds.histogram.snapshot(),
+            "stalls": event_loop_stalls_total.value - self._stalls_at_reset,
+            "top_offenders": self.top_offenders(limit),
+        }
+
+    def reset(self) -> None:
+        """
+        Starts the snapshot over: offenders, the lag histogram and the stall count. The
+        exported event_loop_stalls_total stays cumulative, as Prometheus counters must.
+        """
+        self.offenders.clear()
+        event_loop_lag_seconds.histogram.reset()
+        self._stalls_at_reset = event_loop_stalls_total.value
+
+
+def _load_monitor() -> LoopLagMonitor:
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        return LoopLagMonitor(interval=settings.LOOP_LAG_MONITOR_INTERVAL_MS / 1000.0,
+                              threshold=settings.LOOP_LAG_THRESHOLD_MS / 1000.0)
+    except Exception:
+        return LoopLagMonitor()
+
+
+# Process-wide monitor, started from the application startup event.
+loop_monitor = _load_monitor()
@@ -0,0 +1,250 @@
+# app/core/metrics.py
+
+"""
+Lightweight in-process metrics registry with Prometheus text exposition.
+
+Counters, gauges and histograms are plain Python objects mutated from the event loop.
+Increments are a single attribute add with no locking, so they are cheap enough for
+per-tick and per-message hot paths. Hot call sites should bind labelled children once
+at import time (e.g. `_HIT = cache_requests.labels("user_data", "hit")`) rather than
+calling .labels() on every increment.
+
+Gauges that mirror state owned elsewhere (queue sizes, DB pool usage) are registered
+as callbacks and only evaluated at scrape time.
+"""
+
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.tick_latency import HdrHistogram, REPORT_PERCENTILES, tick_tracer
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric(ABC):
+    """Base of Counter, Gauge and Histogram: name, help text and labelled children."""
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+
+    def _new_child(self) -> "_Metric":
+        return type(self)(self.name, self.documentation)
+
+    def labels(self, *labelvalues: Any) -> "_Metric":
+        """
+        Returns the child metric for the given label values (created on first use).
+        """
+        key = tuple(str(v) for v in labelvalues)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _series(self) -> List[Tuple[Tuple[str, ...], "_Metric"]]:
+        if self.labelnames:
+            return sorted(self._children.items())
+        return [((), self)]
+
+    @abstractmethod
+    def _render_samples(self, labels: str, lines: List[str], labelnames=(), labelvalues=()) -> None:
+        """Appends this series' sample lines to `lines`."""
+
+    def render(self, lines: List[str]) -> None:
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.metric_type}")
+        for labelvalues, child in self._series():
+            child._render_samples(_format_labels(self.labelnames, labelvalues), lines,
+                                  self.labelnames, labelvalues)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value."""
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def _render_samples(self, labels, lines, labelnames=(), labelvalues=()):
+        lines.append(f"{self.name}{labels} {self.value}")
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at scrape time."""
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+        self.callback = callback
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def get(self) -> float:
+        if self.callback is not None:
+            try:
+                return self.callback()
+            except Exception as e:
+                logger.debug(f"Gauge callback for {self.name} failed: {e}")
+                return float("nan")
+        return self.value
+
+    def _render_samples(self, labels, lines, labelnames=(), labelvalues=()):
+        lines.append(f"{self.name}{labels} {self.get()}")
+
+
+class Histogram(_Metric):
+    """
+    Latency/size distribution backed by HdrHistogram, exported as a Prometheus summary.
+    Values are observed in seconds and stored at microsecond resolution.
+    """
+    metric_type = "summary"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.histogram = HdrHistogram()
+
+    def observe(self, seconds: float) -> None:
+        self.histogram.record(int(seconds * 1_000_000))
+
+    def _render_samples(self, labels, lines, labelnames=(), labelvalues=()):
+        h = self.histogram
+        for p in REPORT_PERCENTILES:
+            quantile_labels = _format_labels(labelnames, labelvalues, f'quantile="{p / 100.0:g}"')
+            lines.append(f"{self.name}{quantile_labels} {h.percentile(p) / 1e6:.6f}")
+        lines.append(f"{self.name}_sum{labels} {h.total / 1e6:.6f}")
+        lines.append(f"{self.name}_count{labels} {h.count}")
+
+
+class MetricsRegistry:
+    """
+    Holds all metrics of the process. Metric constructors are get-or-create so that
+    modules can declare the metrics they own at import time without coordination.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Iterable[str], **kwargs) -> Any:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} already registered as {type(metric).__name__}")
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+              callback: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = self._get_or_create(Gauge, name, documentation, labelnames)
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        JSON-friendly view of all metrics (used by admin endpoints and tests).
+        """
+        result: Dict[str, Any] = {}
+        for name, metric in sorted(self._metrics.items()):
+            series = {}
+            for labelvalues, child in metric._series():
+                key = ",".join(f"{n}={v}" for n, v in zip(metric.labelnames, labelvalues)) or "value"
+                if isinstance(child, Histogram):
+                    series[key] = child.histogram.snapshot()
+                elif isinstance(child, Gauge):
+                    series[key] = child.get()
+                else:
+                    series[key] = child.value
+            result[name] = series
+        return result
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        for _, metric in sorted(self._metrics.items()):
+            metric.render(lines)
+        return "\n".join(lines) + "\n" + tick_tracer.render_prometheus()
+
+
+# Process-wide registry
+registry = MetricsRegistry()
+
+
+# --- Metrics shared across modules ---
+
+cache_requests_total = registry.counter(
+    "cache_requests_total", "Redis cache lookups by cache and result (hit/miss).", ("cache", "result")
+)
+pubsub_messages_total = registry.counter(
+    "pubsub_messages_received_total", "Redis pub/sub messages received by subscriber.", ("subscriber",)
+)
+websocket_connections = registry.gauge(
+    "websocket_active_connections", "Currently open /ws/market-data connections."
+)
+pending_order_triggers_total = registry.counter(
+    "pending_order_triggers_total", "Pending orders whose trigger condition was met.", ("order_type",)
+)
+pending_order_trigger_seconds = registry.histogram(
+    "pending_order_trigger_seconds", "Time to execute a triggered pending order."
+)
+margin_cutoff_executions_total = registry.counter(
+    "margin_cutoff_executions_total", "Auto-cutoff executions by user type.", ("user_type",)
+)
+
+
+def cache_hit_ratio(cache: str, requests: Counter = cache_requests_total) -> Optional[float]:
+    """
+    Returns hits / (hits + misses) for a cache, or None if it was never queried.
+    Reads the existing series only; no label children are created.
+    """
+    hits = misses = 0.0
+    for (name, result), child in list(requests._children.items()):
+        if name != cache:
+            continue
+        if result == "hit":
+            hits += child.value
+        elif result == "miss":
+            misses += child.value
+    total = hits + misses
+    return hits / total if total else None
+
+
+def cache_hit_ratios(requests: Counter = cache_requests_total) -> Dict[str, Optional[float]]:
+    """
+    Hit ratio of every cache that has been queried so far.
+    """
+    caches = sorted({cache for cache, _ in list(requests._children)})
+    return {cache: cache_hit_ratio(cache, requests) for cache in caches}
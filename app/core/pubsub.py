@@ -0,0 +1,190 @@
+# app/core/pubsub.py
+
+"""
+Push-based Redis pub/sub consumption.
+
+RedisSubscription is an async iterator over the data messages of a set of channels. It
+waits on the subscribed connection (`pubsub.listen()`), so an idle subscriber costs no
+wakeups and a published message is handed over as soon as it is read; subscribers no
+longer poll `get_message(timeout=...)` with sleeps in between.
+
+When the connection drops, the subscription reconnects with exponential backoff and
+jitter and subscribes to its channels again. Redis does not buffer pub/sub messages for
+a disconnected subscriber, so every reconnect is a possible gap: it is counted in
+`pubsub_gaps_total` and reported to `on_gap`, for consumers that must resync the state
+they keep from the messages.
+
+    async with RedisSubscription(redis_client, [channel], "websocket") as subscription:
+        async for message in subscription:
+            ...
+
+Leaving the block, cancelling the consuming task or calling close() unsubscribes and
+releases the connection.
+"""
+
+import asyncio
+import inspect
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Union
+
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from app.core.metrics import pubsub_messages_total, registry
+
+logger = logging.getLogger(__name__)
+
+# Connection failures that are retried; anything else propagates to the consumer
+RECONNECT_ERRORS = (RedisConnectionError, RedisTimeoutError, OSError)
+DATA_MESSAGE_TYPES = frozenset(("message", "pmessage"))
+
+pubsub_reconnects_total = registry.counter(
+    "pubsub_reconnects_total", "Redis pub/sub reconnection attempts by subscriber.", ("subscriber",)
+)
+pubsub_gaps_total = registry.counter(
+    "pubsub_gaps_total", "Redis pub/sub resubscriptions after a lost connection (messages may be missing).",
+    ("subscriber",)
+)
+
+
+def _load_backoff() -> Tuple[float, float]:
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        return settings.PUBSUB_RECONNECT_INITIAL_BACKOFF_SECONDS, settings.PUBSUB_RECONNECT_MAX_BACKOFF_SECONDS
+    except Exception:
+        return 0.1, 30.0
+
+
+INITIAL_BACKOFF_SECONDS, MAX_BACKOFF_SECONDS = _load_backoff()
+
+
+class RedisSubscription:
+    """
+    Subscription of one consumer (`name`, the `subscriber` metrics label) to `channels`.
+    Iterate it once; messages are the dicts redis-py returns, data messages only.
+    """
+
+    def __init__(
+        self,
+        redis_client: Any,
+        channels: Iterable[str],
+        name: str,
+        on_gap: Optional[Callable[[], Union[Awaitable[Any], Any]]] = None,
+        initial_backoff: Optional[float] = None,
+        max_backoff: Optional[float] = None,
+    ):
+        self._redis = redis_client
+        self.channels = tuple(channels)
+        self.name = name
+        self._on_gap = on_gap
+        self.initial_backoff = INITIAL_BACKOFF_SECONDS if initial_backoff is None else initial_backoff
+        self.max_backoff = MAX_BACKOFF_SECONDS if max_backoff is None else max_backoff
+        self._pubsub = None
+        self._closed = False
+        self.failures = 0  # consecutive failed connections; reset by the next message
+        self.reconnects = 0
+        self.gaps = 0
+        self._messages = pubsub_messages_total.labels(name)
+        self._reconnects = pubsub_reconnects_total.labels(name)
+        self._gaps = pubsub_gaps_total.labels(name)
+
+    async def __aenter__(self) -> "RedisSubscription":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def connect(self) -> None:
+        """Subscribes now, so nothing published after this call is missed."""
+        if self._pubsub is None:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(*self.channels)
+            except BaseException:
+                await self._release(pubsub, unsubscribe=False)
+                raise
+            self._pubsub = pubsub
+
+    async def close(self) -> None:
+        self._closed = True
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            await self._release(pubsub, unsubscribe=True)
+
+    async def _release(self, pubsub: Any, unsubscribe: bool) -> None:
+        try:
+            if unsubscribe:
+                await pubsub.unsubscribe(*self.channels)
+        except Exception:
+            # The connection is already gone; closing it is all that is left
+            pass
+        try:
+            await pubsub.aclose()
+        except Exception as e:
+            logger.debug(f"Pub/sub {self.name}: error closing connection: {e}")
+
+    def backoff(self) -> float:
+        """Delay before the next reconnection attempt: exponential, capped, with jitter."""
+        delay = min(self.max_backoff, self.initial_backoff * (2 ** max(self.failures - 1, 0)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _reconnect(self, error: BaseException) -> None:
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            await self._release(pubsub, unsubscribe=False)
+        while not self._closed:
+            self.failures += 1
+            delay = self.backoff()
+            logger.warning(f"Pub/sub {self.name}: connection lost ({error!r}); "
+                           f"reconnecting in {delay:.2f}s (attempt {self.failures})")
+            await asyncio.sleep(delay)
+            if self._closed:
+                return
+            self.reconnects += 1
+            self._reconnects.inc()
+            try:
+                await self.connect()
+            except RECONNECT_ERRORS as e:
+                error = e
+                continue
+            self.gaps += 1
+            self._gaps.inc()
+            logger.info(f"Pub/sub {self.name}: resubscribed to {len(self.channels)} channel(s)")
+            if self._on_gap is not None:
+                try:
+                    result = self._on_gap()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Pub/sub {self.name}: gap handler failed: {e}", exc_info=True)
+            return
+
+    async def __aiter__(self):
+        try:
+            while not self._closed:
+                try:
+                    await self.connect()
+                    async for message in self._pubsub.listen():
+                        if message.get("type") not in DATA_MESSAGE_TYPES:
+                            continue
+                        self.failures = 0
+                        self._messages.inc()
+                        yield message
+                        if self._closed:
+                            return
+                    if self._closed:
+                        return
+                    # listen() only returns once nothing is subscribed any more
+                    raise RedisConnectionError("subscription ended")
+                except RECONNECT_ERRORS as e:
+                    if self._closed:
+                        return
+                    await self._reconnect(e)
+        finally:
+            await self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"subscriber": self.name, "channels": list(self.channels), "reconnects": self.reconnects,
+                "gaps": self.gaps, "closed": self._closed}
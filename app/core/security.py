@@ -129,7 +129,8 @@ async def connect_to_redis() -> Optional[aioredis.Redis]:
             port=redis_port,
             db=settings.REDIS_DB,
             password=settings.REDIS_PASSWORD,
-            decode_responses=True
+            decode_responses=True,
+            max_connections=settings.REDIS_MAX_CONNECTIONS
         )
         await client.ping()
         
@@ -0,0 +1,353 @@
+# app/core/sql_profiler.py
+
+"""
+SQL statement profiler with endpoint and background task attribution.
+
+Engine events time every statement between before_cursor_execute and
+after_cursor_execute. The statement text is normalized into a fingerprint (literals and
+bind parameters replaced by ?, IN lists and multi-row VALUES collapsed) so that the same
+query with different values is counted once, and the statement is attributed to the
+source that issued it, read from a contextvar:
+
+    "POST /api/v1/orders/"        HTTP requests, by route template (SqlAttributionMiddleware)
+    "WS /api/v1/ws/market-data"   WebSocket connections and the tasks they spawn
+    "task:daily_swap_charge_job"  background work, named with sql_source(), else the
+                                  coroutine of the asyncio task that runs it
+
+Per fingerprint, a latency histogram (`db_statement_seconds`, labelled with a short
+query id) and calls / time per source are kept; sources count their requests or runs,
+which gives calls per request. Statements slower than the threshold are logged with
+their bind parameters redacted to their types. Everything runs on the event loop
+thread (the engine's greenlets run inside the awaiting task), so no locks are taken.
+"""
+
+import asyncio
+import functools
+import hashlib
+import logging
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+db_statement_seconds = registry.histogram(
+    "db_statement_seconds", "Execution time of SQL statements by query fingerprint id.", ("query",)
+)
+db_statements_total = registry.counter(
+    "db_statements_total", "SQL statements executed, by endpoint or background task.", ("source",)
+)
+
+UNATTRIBUTED = "unattributed"
+OTHER_QUERIES = "other"
+# Fingerprints tracked individually; later ones are counted under "other"
+MAX_TRACKED_QUERIES = 1000
+# Statement texts whose fingerprint is remembered (cleared when full)
+MAX_CACHED_STATEMENTS = 5000
+MAX_SLOW_QUERIES = 100
+
+_COMMENTS = re.compile(r"/\*.*?\*/|--[^\n]*", re.S)
+_STRINGS = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_PARAMS = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+|\?")
+_NUMBERS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Normalized text of a statement: comments dropped, literals and bind parameters
+    replaced by ?, lists of them by (...), repeated VALUES rows by one, whitespace collapsed.
+    """
+    text = _COMMENTS.sub(" ", statement)
+    text = _STRINGS.sub("?", text)
+    text = _PARAMS.sub("?", text)
+    text = _NUMBERS.sub("?", text)
+    text = _LISTS.sub("(...)", text)
+    text = _ROWS.sub("(...)", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def query_id(text: str) -> str:
+    """Short stable id of a fingerprint, used as the histogram label."""
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def redact_parameters(parameters: Any) -> Any:
+    """Bind parameters with their values replaced by their type names (for logs)."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: one set of parameters per row
+            return f"{len(parameters)} rows of {redact_parameters(parameters[0])}"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class _Source:
+    """A named unit of work (background task run) that statements are attributed to."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class RequestSource:
+    """An HTTP request or WebSocket connection, named by its route once routing has matched it."""
+
+    def __init__(self, scope: Dict[str, Any]):
+        self.scope = scope
+
+    @property
+    def name(self) -> str:
+        scope = self.scope
+        method = "WS" if scope["type"] == "websocket" else scope.get("method", "GET")
+        route = getattr(scope.get("route"), "path", None)
+        # Unmatched paths are not used as names: any path could create a new source
+        return f"{method} {route or '<unmatched>'}"
+
+
+_current_source: ContextVar[Optional[Any]] = ContextVar("sql_profiler_source", default=None)
+
+
+def current_source() -> str:
+    """
+    Name of the endpoint or task running now: the innermost sql_source()/request, else
+    the coroutine of the current asyncio task.
+    """
+    source = _current_source.get()
+    if source is not None:
+        return source.name
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        coro = task.get_coro()
+        return f"task:{getattr(coro, '__qualname__', task.get_name())}"
+    return UNATTRIBUTED
+
+
+class _QueryStats:
+    __slots__ = ("text", "query_id", "calls", "seconds", "sources", "histogram")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.query_id = query_id(text)
+        self.calls = 0
+        self.seconds = 0.0
+        # {source: [calls, seconds]}
+        self.sources: Dict[str, List[float]] = {}
+        self.histogram = db_statement_seconds.labels(self.query_id)
+
+
+class SqlProfiler:
+    """
+    Statement timings by fingerprint and source. install() hooks an engine; request and
+    task runs are counted by SqlAttributionMiddleware and sql_source().
+    """
+
+    def __init__(self, slow_query_seconds: float = 0.2, enabled: bool = True):
+        self.slow_query_seconds = slow_query_seconds
+        self.enabled = enabled
+        self.queries: Dict[str, _QueryStats] = {}
+        self.runs: Dict[str, int] = {}
+        self.slow_queries: deque = deque(maxlen=MAX_SLOW_QUERIES)
+        self._fingerprints: Dict[str, str] = {}
+
+    # --- Engine hooks ---
+
+    def install(self, engine) -> None:
+        """Listens to the cursor events of `engine` (a sync Engine, e.g. async_engine.sync_engine)."""
+        from sqlalchemy import event
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(engine, "handle_error", self.handle_error)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("sql_profiler_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        started = conn.info.get("sql_profiler_started")
+        if not started:
+            return
+        self.record(statement, parameters, time.perf_counter() - started.pop())
+
+    def handle_error(self, exception_context) -> None:
+        started = exception_context.connection.info.get("sql_profiler_started") \
+            if exception_context.connection is not None else None
+        if started:
+            started.pop()
+
+    # --- Recording ---
+
+    def _fingerprint(self, statement: str) -> str:
+        text = self._fingerprints.get(statement)
+        if text is None:
+            if len(self._fingerprints) >= MAX_CACHED_STATEMENTS:
+                self._fingerprints.clear()
+            text = self._fingerprints[statement] = fingerprint(statement)
+        return text
+
+    def record(self, statement: str, parameters: Any, seconds: float) -> None:
+        if not self.enabled:
+            return
+        text = self._fingerprint(statement)
+        stats = self.queries.get(text)
+        if stats is None:
+            if len(self.queries) >= MAX_TRACKED_QUERIES:
+                text = OTHER_QUERIES
+                stats = self.queries.get(text)
+            if stats is None:
+                stats = self.queries[text] = _QueryStats(text)
+        source = current_source()
+        stats.calls += 1
+        stats.seconds += seconds
+        by_source = stats.sources.get(source)
+        if by_source is None:
+            by_source = stats.sources[source] = [0, 0.0]
+        by_source[0] += 1
+        by_source[1] += seconds
+        stats.histogram.observe(seconds)
+        db_statements_total.labels(source).inc()
+
+        if seconds >= self.slow_query_seconds:
+            entry = {
+                "query_id": stats.query_id,
+                "source": source,
+                "duration_ms": round(seconds * 1000.0, 3),
+                "statement": _SPACES.sub(" ", statement).strip(),
+                "parameters": redact_parameters(parameters),
+                "at": time.time(),
+            }
+            self.slow_queries.append(entry)
+            logger.warning(f"Slow query ({entry['duration_ms']} ms, {source}): {entry['statement']} "
+                           f"parameters={entry['parameters']}")
+
+    def count_run(self, source: str) -> None:
+        """One request or task run of `source` completed (the denominator of calls per request)."""
+        self.runs[source] = self.runs.get(source, 0) + 1
+
+    # --- Report ---
+
+    def snapshot(self, limit: int = 20) -> Dict[str, Any]:
+        queries = list(self.queries.values())
+        by_total = sorted(queries, key=lambda q: q.seconds, reverse=True)[:limit]
+
+        per_request = []
+        for stats in queries:
+            for source, (calls, seconds) in stats.sources.items():
+                runs = self.runs.get(source)
+                if runs:
+                    per_request.append({
+                        "query_id": stats.query_id,
+                        "fingerprint": stats.text,
+                        "source": source,
+                        "calls": calls,
+                        "requests": runs,
+                        "calls_per_request": round(calls / runs, 3),
+                        "ms_per_request": round(1000.0 * seconds / runs, 3),
+                    })
+        per_request.sort(key=lambda row: row["calls_per_request"], reverse=True)
+
+        sources: Dict[str, Dict[str, Any]] = {}
+        for stats in queries:
+            for source, (calls, seconds) in stats.sources.items():
+                totals = sources.setdefault(source, {"requests": self.runs.get(source, 0),
+                                                     "statements": 0, "total_ms": 0.0})
+                totals["statements"] += calls
+                totals["total_ms"] += 1000.0 * seconds
+        for totals in sources.values():
+            totals["total_ms"] = round(totals["total_ms"], 3)
+
+        return {
+            "slow_query_ms": self.slow_query_seconds * 1000.0,
+            "tracked_queries": len(queries),
+            "top_by_total_time": [
+                {
+                    "query_id": stats.query_id,
+                    "fingerprint": stats.text,
+                    "calls": stats.calls,
+                    "total_ms": round(1000.0 * stats.seconds, 3),
+                    "latency": stats.histogram.histogram.snapshot(),
+                    "sources": {source: calls for source, (calls, _) in
+                                sorted(stats.sources.items(), key=lambda item: item[1][1], reverse=True)},
+                }
+                for stats in by_total
+            ],
+            "top_by_calls_per_request": per_request[:limit],
+            "sources": dict(sorted(sources.items(), key=lambda item: item[1]["total_ms"], reverse=True)),
+            "slow_queries": list(self.slow_queries)[-limit:],
+        }
+
+    def reset(self) -> None:
+        for stats in self.queries.values():
+            stats.histogram.histogram.reset()
+        self.queries.clear()
+        self.runs.clear()
+        self.slow_queries.clear()
+
+
+@contextmanager
+def sql_profile_source(name: str) -> Iterator[None]:
+    """Attributes the statements of the block to `name`, counted as one run."""
+    token = _current_source.set(_Source(name))
+    try:
+        yield
+    finally:
+        _current_source.reset(token)
+        sql_profiler.count_run(name)
+
+
+def sql_source(name: str):
+    """Decorator for background jobs: each call of the coroutine function is one run of `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with sql_profile_source(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SqlAttributionMiddleware:
+    """
+    ASGI middleware attributing the statements of each HTTP request and WebSocket
+    connection to its route. The route is read from the scope when a statement runs,
+    after routing has matched it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        source = RequestSource(scope)
+        token = _current_source.set(source)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_source.reset(token)
+            sql_profiler.count_run(source.name)
+
+
+def _load_profiler() -> SqlProfiler:
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        return SqlProfiler(slow_query_seconds=settings.SQL_SLOW_QUERY_MS / 1000.0,
+                           enabled=settings.SQL_PROFILER_ENABLED)
+    except Exception:
+        return SqlProfiler()
+
+
+# Process-wide profiler, hooked to the engine in app/database/session.py.
+sql_profiler = _load_profiler()
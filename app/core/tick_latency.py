@@ -0,0 +1,303 @@
+# app/core/tick_latency.py
+
+"""
+End-to-end latency tracing for market data ticks.
+
+A tick is stamped with `_timestamp` by the Firebase listener (app/firebase_stream.py).
+Every hop that handles the tick afterwards records how long it took the tick to reach
+that hop, measured from the original stamp:
+
+    firebase listener -> redis_publish_queue -> redis_publisher_task -> Redis pub/sub
+        -> adjusted_price_worker (worker_received -> adjusted_cached)
+        -> per_connection_redis_listener (ws_received -> ws_sent)
+
+Latencies are kept in HDR-style log-linear histograms so percentiles stay accurate
+(~1% relative error) from microseconds up to a minute without storing samples.
+Everything here runs on the event loop, so no locks are taken on the record path.
+"""
+
+import math
+import random
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Key used by the Firebase listener to stamp the moment a tick entered the process.
+TICK_ORIGIN_KEY = "_timestamp"
+# Key carrying per-stage timestamps stamped by the publisher, propagated through Redis.
+TICK_TRACE_KEY = "_trace"
+# Keys that are tracing metadata and never symbol price data.
+TICK_METADATA_KEYS = ("type", TICK_ORIGIN_KEY, TICK_TRACE_KEY)
+
+# Pipeline stages in the order a tick passes through them. Each stage is measured
+# cumulatively from the Firebase stamp.
+STAGE_QUEUED = "queued"                    # dequeued from redis_publish_queue
+STAGE_PUBLISH = "publish"                  # Redis acknowledged the PUBLISH
+STAGE_WORKER_RECEIVED = "worker_received"  # adjusted_price_worker got the message
+STAGE_ADJUSTED_CACHED = "adjusted_cached"  # adjusted prices written to Redis
+STAGE_WS_RECEIVED = "ws_received"          # per-connection listener got the message
+STAGE_WS_SENT = "ws_sent"                  # frame written with websocket.send_text
+
+STAGES = (
+    STAGE_QUEUED,
+    STAGE_PUBLISH,
+    STAGE_WORKER_RECEIVED,
+    STAGE_ADJUSTED_CACHED,
+    STAGE_WS_RECEIVED,
+    STAGE_WS_SENT,
+)
+
+# The pipeline forks after PUBLISH; within each path the cumulative latencies are monotonic.
+PIPELINE_PATHS = (
+    (STAGE_QUEUED, STAGE_PUBLISH, STAGE_WORKER_RECEIVED, STAGE_ADJUSTED_CACHED),
+    (STAGE_QUEUED, STAGE_PUBLISH, STAGE_WS_RECEIVED, STAGE_WS_SENT),
+)
+
+REPORT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+# Ticks older than this are treated as clock noise / replays and not recorded.
+MAX_TRACKED_LATENCY_US = 60 * 1_000_000
+# Upper bound on distinct symbols kept in the sampled per-symbol breakdown.
+MAX_TRACKED_SYMBOLS = 500
+
+
+class HdrHistogram:
+    """
+    Log-linear histogram in the spirit of HdrHistogram.
+
+    Values (integer microseconds) below 2**significant_bits are counted exactly; above
+    that each power-of-two range is split into 2**(significant_bits - 1) equal
+    sub-buckets, giving a bounded relative error of 2**-(significant_bits - 1).
+    Buckets are stored sparsely, so an idle histogram costs almost nothing.
+    """
+
+    __slots__ = ("_sub_bits", "_sub_mask", "_counts", "count", "total", "min", "max")
+
+    def __init__(self, significant_bits: int = 7):
+        self._sub_bits = significant_bits
+        self._sub_mask = (1 << significant_bits) - 1
+        self._counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self._sub_bits
+        if shift <= 0:
+            return value
+        return (shift << self._sub_bits) | (value >> shift)
+
+    def _highest_equivalent_value(self, index: int) -> int:
+        shift = index >> self._sub_bits
+        if shift == 0:
+            return index
+        sub_bucket = index & self._sub_mask
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        counts = self._counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float) -> int:
+        """
+        Returns the value at the given percentile (0-100), or 0 if the histogram is empty.
+        """
+        if self.count == 0:
+            return 0
+        target = max(1, math.ceil(self.count * percentile / 100.0))
+        running = 0
+        for index in sorted(self._counts):
+            running += self._counts[index]
+            if running >= target:
+                return min(self._highest_equivalent_value(index), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other: "HdrHistogram") -> None:
+        """
+        Adds the values recorded by `other` (e.g. a histogram from another process).
+        """
+        if other._sub_bits != self._sub_bits:
+            raise ValueError("Cannot merge histograms with different significant_bits")
+        counts = self._counts
+        for index, count in other._counts.items():
+            counts[index] = counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+
+    def reset(self) -> None:
+        self._counts.clear()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def snapshot(self, percentiles: Iterable[float] = REPORT_PERCENTILES) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "min_ms": (self.min or 0) / 1000.0,
+            "mean_ms": round(self.mean() / 1000.0, 3),
+            "max_ms": self.max / 1000.0,
+            "percentiles_ms": {f"p{p:g}": self.percentile(p) / 1000.0 for p in percentiles},
+        }
+
+
+class TickLatencyTracer:
+    """
+    Holds one histogram per pipeline stage plus a sampled per-symbol breakdown.
+    """
+
+    def __init__(self, symbol_sample_rate: float = 0.05):
+        self.symbol_sample_rate = symbol_sample_rate
+        self.stage_histograms: Dict[str, HdrHistogram] = {stage: HdrHistogram() for stage in STAGES}
+        self.symbol_histograms: Dict[Tuple[str, str], HdrHistogram] = {}
+        self.dropped_out_of_range = 0
+        self.started_at = time.time()
+
+    def should_sample(self) -> bool:
+        return random.random() < self.symbol_sample_rate
+
+    def record(self, stage: str, origin_ts: float, now: Optional[float] = None,
+               symbols: Optional[Iterable[str]] = None) -> None:
+        """
+        Records the latency from `origin_ts` (epoch seconds) to `now` for `stage`.
+        When `symbols` is given the sample also goes into the per-symbol breakdown.
+        """
+        if now is None:
+            now = time.time()
+        latency_us = int((now - origin_ts) * 1_000_000)
+        if latency_us < 0 or latency_us > MAX_TRACKED_LATENCY_US:
+            self.dropped_out_of_range += 1
+            return
+        self.stage_histograms[stage].record(latency_us)
+        if symbols:
+            for symbol in symbols:
+                key = (symbol, stage)
+                histogram = self.symbol_histograms.get(key)
+                if histogram is None:
+                    if len(self.symbol_histograms) >= MAX_TRACKED_SYMBOLS * len(STAGES):
+                        continue
+                    histogram = self.symbol_histograms[key] = HdrHistogram()
+                histogram.record(latency_us)
+
+    def reset(self) -> None:
+        for histogram in self.stage_histograms.values():
+            histogram.reset()
+        self.symbol_histograms.clear()
+        self.dropped_out_of_range = 0
+        self.started_at = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        symbols: Dict[str, Dict[str, Any]] = {}
+        for (symbol, stage), histogram in sorted(self.symbol_histograms.items()):
+            symbols.setdefault(symbol, {})[stage] = histogram.snapshot()
+        return {
+            "since": self.started_at,
+            "symbol_sample_rate": self.symbol_sample_rate,
+            "dropped_out_of_range": self.dropped_out_of_range,
+            "stages": {stage: self.stage_histograms[stage].snapshot() for stage in STAGES},
+            "symbols": symbols,
+        }
+
+    def render_prometheus(self) -> str:
+        """
+        Renders the histograms in the Prometheus text exposition format (as summaries).
+        """
+        lines: List[str] = []
+
+        def _summary(name: str, help_text: str, series: List[Tuple[str, HdrHistogram]]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} summary")
+            for labels, histogram in series:
+                for p in REPORT_PERCENTILES:
+                    quantile = f"{p / 100.0:g}"
+                    lines.append(f'{name}{{{labels},quantile="{quantile}"}} {histogram.percentile(p) / 1e6:.6f}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.total / 1e6:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        _summary(
+            "tick_pipeline_latency_seconds",
+            "Time from the Firebase tick stamp until the tick reached each pipeline stage.",
+            [(f'stage="{stage}"', self.stage_histograms[stage]) for stage in STAGES],
+        )
+        if self.symbol_histograms:
+            _summary(
+                "tick_pipeline_symbol_latency_seconds",
+                "Sampled per-symbol time from the Firebase tick stamp until each pipeline stage.",
+                [(f'stage="{stage}",symbol="{symbol}"', histogram)
+                 for (symbol, stage), histogram in sorted(self.symbol_histograms.items())],
+            )
+        lines.append("# HELP tick_pipeline_dropped_total Ticks whose latency was negative or above the tracked range.")
+        lines.append("# TYPE tick_pipeline_dropped_total counter")
+        lines.append(f"tick_pipeline_dropped_total {self.dropped_out_of_range}")
+        return "\n".join(lines) + "\n"
+
+
+def _load_sample_rate() -> float:
+    try:
+        from app.core.config import get_settings
+        return float(get_settings().TICK_TRACE_SYMBOL_SAMPLE_RATE)
+    except Exception:
+        return 0.05
+
+
+# Process-wide tracer used by all pipeline stages.
+tick_tracer = TickLatencyTracer(symbol_sample_rate=_load_sample_rate())
+
+
+# --- Helpers used by the pipeline stages ---
+
+def tick_symbols(message: Dict[str, Any]) -> List[str]:
+    """
+    Returns the symbol keys of a market data message, skipping tracing metadata.
+    """
+    return [k for k in message.keys() if k not in TICK_METADATA_KEYS]
+
+
+def stamp_tick(message: Dict[str, Any], stage: str, now: Optional[float] = None) -> None:
+    """
+    Records `stage` for a tick that is still being built (publisher side) and stores the
+    stage timestamp in the message's `_trace` so it travels with the tick through Redis.
+    The first stamp also decides whether this tick is part of the per-symbol sample.
+    """
+    origin_ts = message.get(TICK_ORIGIN_KEY)
+    if not isinstance(origin_ts, (int, float)):
+        return
+    if now is None:
+        now = time.time()
+    trace = message.get(TICK_TRACE_KEY)
+    if not isinstance(trace, dict):
+        trace = message[TICK_TRACE_KEY] = {"sampled": tick_tracer.should_sample()}
+    trace[stage] = now
+    tick_tracer.record(stage, origin_ts, now, tick_symbols(message) if trace.get("sampled") else None)
+
+
+def observe_tick(message: Dict[str, Any], stage: str, now: Optional[float] = None) -> None:
+    """
+    Records `stage` for a tick received from Redis (read-only; the message is not modified).
+    Messages without a Firebase stamp (e.g. publish_market_data_trigger) are ignored.
+    """
+    origin_ts = message.get(TICK_ORIGIN_KEY)
+    if not isinstance(origin_ts, (int, float)):
+        return
+    trace = message.get(TICK_TRACE_KEY)
+    sampled = isinstance(trace, dict) and trace.get("sampled")
+    tick_tracer.record(stage, origin_ts, now, tick_symbols(message) if sampled else None)
@@ -4,6 +4,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from decimal import Decimal
 from app.database.models import UserOrder, DemoUserOrder, OrderActionHistory
+from app.crud import order_alias
 from app.schemas.order import OrderCreateInternal
 from sqlalchemy.orm import selectinload
 from datetime import datetime
@@ -256,11 +257,35 @@ async def get_order_by_takeprofit_cancel_id(db: AsyncSession, takeprofit_cancel_
     result = await db.execute(select(order_model).filter(order_model.takeprofit_cancel_id == takeprofit_cancel_id))
     return result.scalars().first()
 
-async def get_order_by_any_id(db: AsyncSession, generic_id: str, order_model: Type[Any]) -> Optional[Any]:
+async def get_order_by_any_id(
+    db: AsyncSession, generic_id: str, order_model: Type[Any], redis_client=None
+) -> Optional[Any]:
     """
     Get order by matching the given ID against any of the possible ID fields.
     Searches order_id, cancel_id, close_id, stoploss_id, takeprofit_id, etc.
+
+    order_id is looked up directly, the other ids through order_id_alias (mirrored in
+    Redis when a client is given). Only an id found by neither is verified with the OR
+    query across all the id columns, which scans the order table.
     """
+    order = await get_order_by_id(db, generic_id, order_model)
+    if order is not None:
+        order_alias.order_id_lookups_total.labels("order_id").inc()
+        return order
+
+    user_type = order_alias.alias_user_type(order_model)
+    if user_type is not None:
+        order_id = await order_alias.resolve_alias(db, redis_client, generic_id, user_type)
+        if order_id is not None:
+            order = await get_order_by_id(db, order_id, order_model)
+            if order is not None:
+                order_alias.order_id_lookups_total.labels("alias").inc()
+                return order
+
+    from app.core.config import get_settings
+    if user_type is not None and not get_settings().ORDER_ALIAS_SCAN_FALLBACK:
+        order_alias.order_id_lookups_total.labels("not_found").inc()
+        return None
     result = await db.execute(
         select(order_model).filter(
             or_(
@@ -275,7 +300,14 @@ async def get_order_by_any_id(db: AsyncSession, generic_id: str, order_model: Ty
             )
         )
     )
-    return result.scalars().first()
+    order = result.scalars().first()
+    if order is not None and user_type is not None:
+        orders_crud_logger.warning(
+            f"[ORDER_ALIAS] '{generic_id}' of {user_type} order {order.order_id} found only by the scan; "
+            f"it is missing from order_id_alias"
+        )
+    order_alias.order_id_lookups_total.labels("scan" if order is not None else "not_found").inc()
+    return order
 
 async def get_open_orders_by_user_id_and_symbol(
     db: AsyncSession,
@@ -302,6 +334,91 @@ async def get_open_orders_by_user_id_and_symbol(
         print(f"Error getting open orders: {e}")
         return []
 
+async def get_open_orders_by_user_ids_and_symbol(
+    db: AsyncSession,
+    user_ids: List[int],
+    symbol: str,
+    order_model=UserOrder
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Open orders of a symbol for many users in one query, as {user_id: [order fields used
+    by the margin calculation]}.
+    """
+    stmt = select(
+        order_model.order_user_id, order_model.order_type, order_model.order_quantity, order_model.margin
+    ).where(
+        and_(
+            order_model.order_user_id.in_(user_ids),
+            order_model.order_company_name == symbol,
+            order_model.order_status == 'OPEN'
+        )
+    )
+    result = await db.execute(stmt)
+    orders: Dict[int, List[Dict[str, Any]]] = {}
+    for user_id, order_type, order_quantity, margin in result.all():
+        orders.setdefault(user_id, []).append(
+            {'order_type': order_type, 'order_quantity': order_quantity, 'margin': margin}
+        )
+    return orders
+
+async def create_orders_bulk(
+    db: AsyncSession,
+    rows: List[Dict[str, Any]],
+    order_model=UserOrder
+) -> None:
+    """
+    Inserts many orders with a single multi-row INSERT. Not committed; rows are column
+    dicts (see OrderCreateInternal).
+    """
+    from sqlalchemy import insert
+    if rows:
+        await db.execute(insert(order_model).values(rows))
+        user_type = order_alias.alias_user_type(order_model)
+        if user_type is not None:
+            await order_alias.add_order_aliases_bulk(db, [
+                alias for row in rows for alias in order_alias.alias_rows(row['order_id'], user_type, row)
+            ])
+
+async def close_orders_bulk(
+    db: AsyncSession,
+    closes: Dict[str, Dict[str, Any]],
+    order_model=UserOrder
+) -> int:
+    """
+    Closes many OPEN orders with a single UPDATE. `closes` maps order_id to the column
+    values to set (the same columns for every order). Not committed; returns the number
+    of orders updated, which is less than len(closes) if some were no longer OPEN.
+    """
+    from sqlalchemy import case, update
+    if not closes:
+        return 0
+    columns = next(iter(closes.values())).keys()
+    values = {
+        column: case({order_id: fields[column] for order_id, fields in closes.items()}, value=order_model.order_id)
+        for column in columns
+    }
+    result = await db.execute(
+        update(order_model)
+        .where(and_(order_model.order_id.in_(list(closes)), order_model.order_status == 'OPEN'))
+        .values(order_status='CLOSED', **values)
+        .execution_options(synchronize_session=False)
+    )
+    user_type = order_alias.alias_user_type(order_model)
+    if user_type is not None and result.rowcount:
+        await order_alias.add_order_aliases_bulk(db, [
+            alias for order_id, fields in closes.items() for alias in order_alias.alias_rows(order_id, user_type, fields)
+        ])
+    return result.rowcount
+
+async def create_order_action_history_bulk(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    """
+    Logs many order actions with a single multi-row INSERT into OrderActionHistory. Not
+    committed.
+    """
+    from sqlalchemy import insert
+    if rows:
+        await db.execute(insert(OrderActionHistory).values(rows))
+
 async def get_order_by_id_and_user_id(
     db: AsyncSession,
     order_id: str,
@@ -1,47 +1,36 @@
 # app/crud/external_symbol_info.py
 
-from typing import Optional
+from typing import Dict, Iterable, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.database.models import ExternalSymbolInfo # Import the new model
 
-# Function to get symbol info by fix_symbol from the database
-async def get_external_symbol_info_by_symbol(db: AsyncSession, fix_symbol: str) -> Optional[ExternalSymbolInfo]:
+def fix_symbol_matches(symbol: str):
     """
-    Retrieves external symbol information from the database by its fix_symbol.
+    Case-insensitive match on fix_symbol. Compares against the indexed, database-computed
+    fix_symbol_upper column; fix_symbol ILIKE :symbol scans the whole table.
     """
-    # Perform a case-insensitive query if fix_symbol might have different cases
-    # from sqlalchemy import case, func # Import func and case for case-insensitive query
-    # result = await db.execute(
-    #     select(ExternalSymbolInfo).filter(func.lower(ExternalSymbolInfo.fix_symbol) == func.lower(fix_symbol))
-    # )
-    # Or if fix_symbol in DB is always consistent case, a simple filter is fine:
-    result = await db.execute(select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol == fix_symbol))
-    return result.scalars().first()
-
-# We don't need batch insert functions here as you will insert data manually.
-
-# app/crud/external_symbol_info.py
-
-from typing import Optional
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-
-from app.database.models import ExternalSymbolInfo # Import the new model
+    return ExternalSymbolInfo.fix_symbol_upper == symbol.upper()
 
 # Function to get symbol info by fix_symbol from the database
 async def get_external_symbol_info_by_symbol(db: AsyncSession, fix_symbol: str) -> Optional[ExternalSymbolInfo]:
     """
-    Retrieves external symbol information from the database by its fix_symbol.
+    Retrieves external symbol information from the database by its fix_symbol (case-insensitive).
     """
-    # Perform a case-insensitive query if fix_symbol might have different cases
-    # from sqlalchemy import case, func # Import func and case for case-insensitive query
-    # result = await db.execute(
-    #     select(ExternalSymbolInfo).filter(func.lower(ExternalSymbolInfo.fix_symbol) == func.lower(fix_symbol))
-    # )
-    # Or if fix_symbol in DB is always consistent case, a simple filter is fine:
-    result = await db.execute(select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol == fix_symbol))
+    result = await db.execute(select(ExternalSymbolInfo).filter(fix_symbol_matches(fix_symbol)))
     return result.scalars().first()
 
-# We don't need batch insert functions here as you will insert data manually.
\ No newline at end of file
+# Function to get the symbol info of many symbols with one query
+async def get_external_symbol_infos_by_symbols(db: AsyncSession, symbols: Iterable[str]) -> Dict[str, ExternalSymbolInfo]:
+    """
+    Retrieves the external symbol information of `symbols` (case-insensitive) with a single
+    query. Returns {FIX_SYMBOL: info}; unknown symbols are absent.
+    """
+    wanted = sorted({symbol.upper() for symbol in symbols if symbol})
+    if not wanted:
+        return {}
+    result = await db.execute(select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol_upper.in_(wanted)))
+    return {info.fix_symbol.upper(): info for info in result.scalars().all()}
+
+# We don't need batch insert functions here as you will insert data manually.
@@ -210,11 +210,13 @@ from app.crud import external_symbol_info as crud_external_symbol_info
 
 # app/crud/group.py
 
-from typing import Optional, List, Dict, Any
+from decimal import Decimal
+from typing import Optional, List, Dict, Any, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import func
 
-from app.database.models import Group # Import Group model
+from app.database.models import Group, Symbol, ExternalSymbolInfo # Symbol and ExternalSymbolInfo are joined for the symbol settings
 # Import the external_symbol_info CRUD functions to use get_external_symbol_info_by_symbol
 from app.crud import external_symbol_info as crud_external_symbol_info
 
@@ -245,9 +247,10 @@ async def get_group_symbols_and_external_info(db: AsyncSession, group_name: str)
             unique_symbols_from_groups.add(group_record.symbol)
 
     external_symbol_details = []
+    # One query for the info of all of the group's symbols
+    external_infos = await crud_external_symbol_info.get_external_symbol_infos_by_symbols(db, unique_symbols_from_groups)
     for symbol_value in unique_symbols_from_groups:
-        # Correctly call the function from crud_external_symbol_info
-        external_info = await crud_external_symbol_info.get_external_symbol_info_by_symbol(db, symbol_value)
+        external_info = external_infos.get(symbol_value.upper())
         if external_info:
             external_symbol_details.append({
                 "id": external_info.id,
@@ -290,4 +293,71 @@ async def get_group_symbols_and_external_info(db: AsyncSession, group_name: str)
             "created_at": first_group_record.created_at.isoformat(),
             "updated_at": first_group_record.updated_at.isoformat()
         }
-    }
\ No newline at end of file
+    }
+
+
+def group_symbol_settings(group_record: Group, profit_currency: Optional[str], contract_size: Optional[Decimal],
+                          external_profit_currency: Optional[str] = None) -> Dict[str, Any]:
+    """
+    The cached settings of one of a group's symbols: the Group row's values, the profit
+    currency of its Symbol (else the group's pip currency) and the contract size of its
+    ExternalSymbolInfo (which overrides the group's). `external_contract_size` is None
+    when the symbol has no ExternalSymbolInfo contract size; orders are not priced then.
+    `external_profit_currency` is ExternalSymbolInfo.profit, the currency order margin
+    and realized PnL are converted to USD from (as the per-order paths do).
+    """
+    settings = {
+        "commision_type": getattr(group_record, 'commision_type', None),
+        "commision_value_type": getattr(group_record, 'commision_value_type', None),
+        "type": getattr(group_record, 'type', None),
+        "pip_currency": getattr(group_record, 'pip_currency', "USD"),
+        "show_points": getattr(group_record, 'show_points', None),
+        "swap_buy": getattr(group_record, 'swap_buy', Decimal(0.0)),
+        "swap_sell": getattr(group_record, 'swap_sell', Decimal(0.0)),
+        "commision": getattr(group_record, 'commision', Decimal(0.0)),
+        "margin": getattr(group_record, 'margin', Decimal(0.0)),
+        "spread": getattr(group_record, 'spread', Decimal(0.0)),
+        "deviation": getattr(group_record, 'deviation', Decimal(0.0)),
+        "min_lot": getattr(group_record, 'min_lot', Decimal(0.0)),
+        "max_lot": getattr(group_record, 'max_lot', Decimal(0.0)),
+        "pips": getattr(group_record, 'pips', Decimal(0.0)),
+        "spread_pip": getattr(group_record, 'spread_pip', Decimal(0.0)),
+        "contract_size": getattr(group_record, 'contract_size', Decimal("100000")),
+    }
+    settings["profit_currency"] = profit_currency or getattr(group_record, 'pip_currency', 'USD')
+    settings["external_contract_size"] = contract_size
+    settings["external_profit_currency"] = external_profit_currency.upper() if external_profit_currency else None
+    if contract_size is not None:
+        settings["contract_size"] = contract_size
+    return settings
+
+
+async def get_group_symbol_settings(db: AsyncSession, group_name: str) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Everything the group caches need, with one query whatever the number of symbols: the
+    group's rows joined with the profit currency of their Symbol and the contract size and
+    profit currency of their ExternalSymbolInfo.
+    Returns (group settings, {SYMBOL: settings}); both are empty if the group has no rows.
+    """
+    result = await db.execute(
+        select(Group, Symbol.profit_currency, ExternalSymbolInfo.contract_size, ExternalSymbolInfo.profit)
+        .outerjoin(Symbol, Symbol.name == func.upper(Group.symbol))
+        # Case-insensitive on the indexed fix_symbol_upper, as fix_symbol_matches
+        .outerjoin(ExternalSymbolInfo, ExternalSymbolInfo.fix_symbol_upper == func.upper(Group.symbol))
+        .filter(Group.name == group_name)
+        .order_by(Group.id, Symbol.id)
+    )
+    group_settings: Dict[str, Any] = {}
+    symbol_settings: Dict[str, Dict[str, Any]] = {}
+    seen_rows = set()
+    for group_record, profit_currency, contract_size, external_profit_currency in result.all():
+        # Symbol names are not unique; a row takes its first matching Symbol
+        if group_record.id in seen_rows:
+            continue
+        seen_rows.add(group_record.id)
+        if not group_settings:
+            group_settings = {"sending_orders": group_record.sending_orders}
+        if group_record.symbol:
+            symbol_settings[group_record.symbol.upper()] = group_symbol_settings(
+                group_record, profit_currency, contract_size, external_profit_currency)
+    return group_settings, symbol_settings
@@ -181,7 +181,7 @@ async def update_money_request_status(
             # Publish user data update to WebSocket clients if Redis client is available
             if redis_client:
                 try:
-                    await publish_user_data_update(redis_client, money_request.user_id)
+                    await publish_user_data_update(redis_client, money_request.user_id, "live")
                     money_requests_logger.info(f"Published user data update for user ID {money_request.user_id} after wallet balance update.")
                 except Exception as e:
                     money_requests_logger.warning(f"Failed to publish user data update for user ID {money_request.user_id}: {e}")
@@ -222,7 +222,7 @@ async def update_money_request_status(
             # Publish user data update to WebSocket clients if Redis client is available
             if redis_client:
                 try:
-                    await publish_user_data_update(redis_client, money_request.user_id)
+                    await publish_user_data_update(redis_client, money_request.user_id, "live")
                     money_requests_logger.info(f"Published user data update for user ID {money_request.user_id} after money request rejection.")
                 except Exception as e:
                     money_requests_logger.warning(f"Failed to publish user data update for user ID {money_request.user_id}: {e}")
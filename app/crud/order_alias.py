@@ -0,0 +1,140 @@
+# app/crud/order_alias.py
+
+"""
+order_id_alias: the secondary ids of live and demo orders mapped to their order_id, so
+that an id carried by a service provider callback is found through an index instead of
+an OR across every id column of the order table.
+
+Rows are written in the transaction that assigns the id: a before_flush listener covers
+orders added or updated through the ORM session, and create_orders_bulk/close_orders_bulk
+add theirs next to their statements. Lookups go through the Redis mirror first; it only
+caches an alias that order_id_alias maps to a single order, and the entries of aliases
+written by a transaction are dropped when it commits, so an id given to a second order
+is re-checked instead of resolving to the first one from the mirror.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Type
+
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+
+from app.core.cache import delete_order_alias_cache, get_order_alias_cache, set_order_alias_cache
+from app.core.metrics import registry
+from app.database.models import OrderIdAlias
+
+logger = logging.getLogger('orders_crud')
+
+ALIAS_COLUMNS = (
+    'cancel_id', 'close_id', 'modify_id', 'stoploss_id', 'takeprofit_id', 'stoploss_cancel_id', 'takeprofit_cancel_id',
+)
+# Order tables whose ids are aliased; others (rock orders) are only found by the scan
+_USER_TYPES = {'user_orders': 'live', 'demo_user_orders': 'demo'}
+# Session.info key of the (user_type, alias) pairs written in the current transaction
+_WRITTEN_ALIASES = 'order_aliases_written'
+_invalidations: Set[asyncio.Task] = set()
+
+order_id_lookups_total = registry.counter(
+    "order_id_lookups_total", "get_order_by_any_id lookups by how the id was resolved.", ("resolved_by",)
+)
+
+
+def alias_user_type(order_model: Type[Any]) -> Optional[str]:
+    return _USER_TYPES.get(getattr(order_model, '__tablename__', None))
+
+
+def alias_rows(order_id: str, user_type: str, ids: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """order_id_alias rows for the secondary ids among `ids` ({column: value}) that are set."""
+    return [
+        {'alias': str(value), 'order_id': str(order_id), 'kind': column, 'user_type': user_type}
+        for column, value in ids.items() if column in ALIAS_COLUMNS and value
+    ]
+
+
+async def add_order_aliases_bulk(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    """Inserts alias rows with a single multi-row INSERT. Not committed."""
+    if rows:
+        await db.execute(insert(OrderIdAlias).values(rows))
+        _remember_written(db.info, rows)
+
+
+@event.listens_for(Session, "before_flush")
+def _add_assigned_aliases(session, flush_context, instances):
+    """Adds an alias row for every secondary id set on an order in this flush."""
+    for obj in list(session.new) + list(session.dirty):
+        user_type = alias_user_type(type(obj))
+        if user_type is None or not obj.order_id:
+            continue
+        attrs = inspect(obj).attrs
+        assigned = {}
+        for column in ALIAS_COLUMNS:
+            added = attrs[column].history.added
+            if added:
+                assigned[column] = added[0]
+        rows = alias_rows(obj.order_id, user_type, assigned)
+        for row in rows:
+            session.add(OrderIdAlias(**row))
+        _remember_written(session.info, rows)
+
+
+def _remember_written(info: Dict[str, Any], rows: List[Dict[str, Any]]) -> None:
+    info.setdefault(_WRITTEN_ALIASES, set()).update((row['user_type'], row['alias']) for row in rows)
+
+
+def _mirror_client():
+    """The process' Redis client, if it is connected."""
+    try:
+        from app.dependencies import redis_client as redis_dependency
+    except Exception:
+        return None
+    return redis_dependency.global_redis_client_instance
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_committed_aliases(session):
+    """Drops the Redis mirror entries of the aliases the committed transaction wrote."""
+    written = session.info.pop(_WRITTEN_ALIASES, None)
+    if not written:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    redis_client = _mirror_client()
+    if redis_client is None:
+        return
+    task = loop.create_task(delete_order_alias_cache(redis_client, written))
+    _invalidations.add(task)
+    task.add_done_callback(_invalidations.discard)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_written_aliases(session):
+    session.info.pop(_WRITTEN_ALIASES, None)
+
+
+async def resolve_alias(db: AsyncSession, redis_client, alias: str, user_type: str) -> Optional[str]:
+    """
+    The order_id that `alias` belongs to, from the Redis mirror or order_id_alias. None
+    if unknown, or if it is the id of more than one order; only an alias of a single
+    order is cached.
+    """
+    order_id = await get_order_alias_cache(redis_client, user_type, alias)
+    if order_id:
+        return order_id
+    result = await db.execute(
+        select(OrderIdAlias.order_id)
+        .where(OrderIdAlias.alias == alias, OrderIdAlias.user_type == user_type)
+        .distinct()
+        .limit(2)
+    )
+    order_ids = result.scalars().all()
+    if len(order_ids) != 1:
+        if order_ids:
+            logger.warning(f"[ORDER_ALIAS] '{alias}' ({user_type}) is an id of several orders: {order_ids}")
+        return None
+    await set_order_alias_cache(redis_client, user_type, alias, order_ids[0])
+    return order_ids[0]
@@ -296,6 +296,44 @@ async def get_demo_user_by_id_with_lock(db: AsyncSession, demo_user_id: int) ->
     )
     return result.scalars().first()
 
+async def get_users_by_ids(db: AsyncSession, user_ids: List[int], user_type: str = "live") -> List[User | DemoUser]:
+    """
+    Retrieves many live or demo users by ID in one statement.
+    """
+    model = DemoUser if user_type == "demo" else User
+    result = await db.execute(select(model).filter(model.id.in_(user_ids)))
+    return list(result.scalars().all())
+
+async def get_users_by_ids_with_lock(db: AsyncSession, user_ids: List[int], user_type: str = "live") -> List[User | DemoUser]:
+    """
+    Retrieves many live or demo users with row-level locks in one statement. Rows are
+    locked in id order, so concurrent bulk operations cannot deadlock on each other.
+    """
+    model = DemoUser if user_type == "demo" else User
+    result = await db.execute(
+        select(model)
+        .filter(model.id.in_(user_ids))
+        .order_by(model.id)
+        .with_for_update()
+    )
+    return list(result.scalars().all())
+
+async def update_users_margin_bulk(db: AsyncSession, margins: dict, user_type: str = "live") -> None:
+    """
+    Sets the margin of many users ({user_id: margin}) with a single UPDATE. Not
+    committed; the rows should be locked (get_users_by_ids_with_lock).
+    """
+    from sqlalchemy import case, update
+    if not margins:
+        return
+    model = DemoUser if user_type == "demo" else User
+    await db.execute(
+        update(model)
+        .where(model.id.in_(list(margins)))
+        .values(margin=case(margins, value=model.id))
+        .execution_options(synchronize_session=False)
+    )
+
 async def get_all_demo_users(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[DemoUser]:
     """
     Retrieves a list of all demo users from the database with pagination.
@@ -496,3 +534,65 @@ async def get_all_active_users_both(db: AsyncSession, skip: int = 0, limit: int
     demo_users = await get_all_active_demo_users(db, skip, limit)
     return live_users, demo_users
 
+async def get_active_account_batch(db: AsyncSession, user_type: str, after_id: int = 0, limit: int = 500,
+                                   without_open_orders: bool = False):
+    """
+    Keyset-paginated page of active accounts of one type: (id, group_name) rows with
+    id > after_id, in id order. Pass the last id of a page as `after_id` for the next one.
+    With `without_open_orders`, accounts holding an OPEN order are left out (the sweep
+    visits those first, from get_active_accounts_with_open_orders).
+    """
+    from app.database.models import UserOrder, DemoUserOrder
+    model, order_model = (DemoUser, DemoUserOrder) if user_type == "demo" else (User, UserOrder)
+    query = select(model.id, model.group_name).filter(model.status == 1, model.id > after_id)
+    if without_open_orders:
+        open_owner_ids = select(order_model.order_user_id).filter(order_model.order_status == 'OPEN')
+        query = query.filter(model.id.not_in(open_owner_ids))
+    result = await db.execute(query.order_by(model.id).limit(limit))
+    return result.all()
+
+async def get_active_accounts_with_open_orders(db: AsyncSession, user_type: str):
+    """
+    (id, group_name) of active accounts of one type that currently hold at least one OPEN order.
+    """
+    from app.database.models import UserOrder, DemoUserOrder
+    model, order_model = (DemoUser, DemoUserOrder) if user_type == "demo" else (User, UserOrder)
+    open_owner_ids = select(order_model.order_user_id).filter(order_model.order_status == 'OPEN')
+    result = await db.execute(
+        select(model.id, model.group_name)
+        .filter(model.status == 1, model.id.in_(open_owner_ids))
+        .order_by(model.id)
+    )
+    return result.all()
+
+
+async def get_account_with_active_orders(db: AsyncSession, account_number: str, user_type: str, order_statuses: List[str]):
+    """
+    Loads a user by account_number AND user_type together with its orders in
+    `order_statuses` and its favorite symbol names, in one joined query.
+    Returns (user, orders, favorite_symbols); user is None when not found.
+    """
+    from sqlalchemy import and_, func
+    from app.database.models import UserOrder, DemoUserOrder, Symbol, UserFavoriteSymbol
+    model, order_model = (DemoUser, DemoUserOrder) if user_type == "demo" else (User, UserOrder)
+    # Favorites are not filtered by user_type, same as crud.favorites. On MySQL the list
+    # relies on the raised group_concat_max_len set for every connection (database/session.py)
+    favorites = (
+        select(func.group_concat(Symbol.name))
+        .join(UserFavoriteSymbol, Symbol.id == UserFavoriteSymbol.symbol_id)
+        .where(UserFavoriteSymbol.user_id == model.id)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        select(model, order_model, favorites)
+        .outerjoin(order_model, and_(order_model.order_user_id == model.id,
+                                     order_model.order_status.in_(order_statuses)))
+        .filter(model.account_number == account_number, model.user_type == user_type)
+    )
+    rows = result.all()
+    if not rows:
+        return None, [], []
+    user = rows[0][0]
+    orders = [row[1] for row in rows if row[0] is user and row[1] is not None]
+    favorite_symbols = rows[0][2].split(",") if rows[0][2] else []
+    return user, orders, favorite_symbols
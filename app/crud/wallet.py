@@ -20,7 +20,8 @@ from typing import List
 
 logger = logging.getLogger(__name__) # Get logger for this module
 
-from app.services.order_processing import generate_unique_10_digit_id
+# generate_unique_10_digit_id is imported where it is used: app.services.order_processing
+# imports crud.user, which builds the DB engine, so the queries here stay importable without it
 
 # Changed function signature to accept WalletCreate schema
 async def create_wallet_record(
@@ -39,6 +40,7 @@ async def create_wallet_record(
     """
     try:
         # Generate a unique 10-digit transaction ID
+        from app.services.order_processing import generate_unique_10_digit_id
         transaction_id = await generate_unique_10_digit_id(db, Wallet, 'transaction_id')
         logger.debug(f"Generated transaction ID: {transaction_id}")
 
@@ -86,6 +88,15 @@ async def create_wallet_record(
         await db.rollback()
         return None
 
+async def create_wallet_records_bulk(db: AsyncSession, rows: List[dict]) -> None:
+    """
+    Inserts many wallet transactions with a single multi-row INSERT. Rows are column
+    dicts that already carry their transaction_id. Not committed.
+    """
+    from sqlalchemy import insert
+    if rows:
+        await db.execute(insert(Wallet).values(rows))
+
 # Example function to get wallet records by user ID (Async)
 async def get_wallet_records_by_user_id(
     db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100, transaction_types: List[str] = None
@@ -274,6 +285,7 @@ async def add_funds_to_wallet(db: AsyncSession, user_id: int, amount: Decimal, c
     user.wallet_balance = (user.wallet_balance or Decimal('0')) + amount
     await db.flush()
     # Generate unique transaction_id
+    from app.services.order_processing import generate_unique_10_digit_id
     transaction_id = await generate_unique_10_digit_id(db, Wallet, 'transaction_id')
     # Create wallet transaction record
     wallet_record = Wallet(
@@ -297,6 +309,7 @@ async def withdraw_funds_from_wallet(db: AsyncSession, user_id: int, amount: Dec
         raise Exception("Insufficient funds")
     user.wallet_balance -= amount
     await db.flush()
+    from app.services.order_processing import generate_unique_10_digit_id
     transaction_id = await generate_unique_10_digit_id(db, Wallet, 'transaction_id')
     wallet_record = Wallet(
         user_id=user_id,
@@ -0,0 +1,193 @@
+# app/database/bulkheads.py
+
+"""
+Per-subsystem bulkheads in front of the shared DB connection pool.
+
+One engine serves every part of the process: HTTP endpoints, the WebSocket connections
+(which open sessions on order and user events), the pending and SL/TP trigger loops, and
+the batch jobs (portfolio sweep, swaps, cleanup). Without isolation, a trigger storm
+holds every pooled connection and order placement queues behind it.
+
+Each subsystem gets a bulkhead: at most `size` of its sessions are open at once, and a
+session request waits at most `wait_seconds` for a slot before failing fast with
+DatabaseBusyError, instead of queueing on the pool. With the sizes summing to no more
+than pool_size + max_overflow, a flooded subsystem queues on its own bulkhead and the
+others still find free connections.
+
+    api       HTTP endpoints (get_db) and their background tasks
+    ws        WebSocket connections
+    triggers  pending order and SL/TP triggers, per-tick price work
+    batch     portfolio sweep, swaps, cleanup
+
+Waiters are served in FIFO order. A slot is held from `async with` until the session is
+closed; a session uses at most one connection at a time.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SUBSYSTEMS = ("api", "ws", "triggers", "batch")
+
+db_bulkhead_size = registry.gauge(
+    "db_bulkhead_size", "Sessions a subsystem may have open at once.", ("subsystem",)
+)
+db_bulkhead_in_use = registry.gauge(
+    "db_bulkhead_in_use", "Sessions a subsystem has open.", ("subsystem",)
+)
+db_bulkhead_waiting = registry.gauge(
+    "db_bulkhead_waiting", "Session requests queued on a subsystem's bulkhead.", ("subsystem",)
+)
+db_bulkhead_wait_seconds = registry.histogram(
+    "db_bulkhead_wait_seconds", "Time a session request waited for its subsystem's bulkhead.", ("subsystem",)
+)
+db_bulkhead_rejections_total = registry.counter(
+    "db_bulkhead_rejections_total", "Session requests that timed out on a full bulkhead.", ("subsystem",)
+)
+
+
+class DatabaseBusyError(Exception):
+    """A subsystem's bulkhead stayed full for longer than its wait timeout."""
+
+    def __init__(self, subsystem: str, wait_seconds: float):
+        super().__init__(f"Database busy: no '{subsystem}' session available within {wait_seconds:g}s")
+        self.subsystem = subsystem
+        self.wait_seconds = wait_seconds
+
+
+class Bulkhead:
+    """A FIFO semaphore with a wait timeout and queue metrics."""
+
+    def __init__(self, name: str, size: int, wait_seconds: float):
+        self.name = name
+        self.size = size
+        self.wait_seconds = wait_seconds
+        self.in_use = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._in_use_gauge = db_bulkhead_in_use.labels(name)
+        self._waiting_gauge = db_bulkhead_waiting.labels(name)
+        self._wait_histogram = db_bulkhead_wait_seconds.labels(name)
+        self._rejections = db_bulkhead_rejections_total.labels(name)
+        db_bulkhead_size.labels(name).set(size)
+
+    async def acquire(self) -> None:
+        if self.in_use < self.size and not self._waiters:
+            self.in_use += 1
+            self._in_use_gauge.set(self.in_use)
+            self._wait_histogram.observe(0.0)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._waiting_gauge.set(len(self._waiters))
+        started = time.perf_counter()
+        try:
+            done, _ = await asyncio.wait((waiter,), timeout=self.wait_seconds)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        finally:
+            self._wait_histogram.observe(time.perf_counter() - started)
+        if not done:
+            self._abandon(waiter)
+            self._rejections.inc()
+            raise DatabaseBusyError(self.name, self.wait_seconds)
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        """A waiter gave up (timeout or cancellation): hand on the slot if it was already given one."""
+        if waiter.done() and not waiter.cancelled():
+            self.release()
+            return
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._waiting_gauge.set(len(self._waiters))
+
+    def release(self) -> None:
+        # The slot passes directly to the oldest waiter, so in_use is unchanged
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._waiting_gauge.set(len(self._waiters))
+                return
+        self._waiting_gauge.set(0)
+        self.in_use -= 1
+        self._in_use_gauge.set(self.in_use)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "in_use": self.in_use,
+            "waiting": len(self._waiters),
+            "wait_seconds": self.wait_seconds,
+            "wait": self._wait_histogram.histogram.snapshot(),
+            "rejections": self._rejections.value,
+        }
+
+
+class _BulkheadSession:
+    def __init__(self, session_factory: Callable[[], Any], bulkhead: Bulkhead):
+        self._session_factory = session_factory
+        self._bulkhead = bulkhead
+        self._session = None
+
+    async def __aenter__(self):
+        await self._bulkhead.acquire()
+        try:
+            self._session = self._session_factory()
+            return await self._session.__aenter__()
+        except BaseException:
+            self._bulkhead.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self._session.__aexit__(exc_type, exc, tb)
+        finally:
+            self._bulkhead.release()
+
+
+class BulkheadSessionFactory:
+    """
+    Drop-in for a sessionmaker used as `async with Factory() as db:`; the session is
+    opened once a slot of the subsystem's bulkhead is free.
+    """
+
+    def __init__(self, session_factory: Callable[[], Any], bulkhead: Bulkhead):
+        self.session_factory = session_factory
+        self.bulkhead = bulkhead
+
+    def __call__(self) -> _BulkheadSession:
+        return _BulkheadSession(self.session_factory, self.bulkhead)
+
+
+def _load_bulkheads() -> Dict[str, Bulkhead]:
+    defaults = {"api": (10, 2.0), "ws": (5, 2.0), "triggers": (6, 5.0), "batch": (9, 30.0)}
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        configured = {
+            subsystem: (getattr(settings, f"DB_BULKHEAD_{subsystem.upper()}_SIZE"),
+                        getattr(settings, f"DB_BULKHEAD_{subsystem.upper()}_WAIT_SECONDS"))
+            for subsystem in SUBSYSTEMS
+        }
+    except Exception:
+        configured = defaults
+    return {subsystem: Bulkhead(subsystem, size, wait) for subsystem, (size, wait) in configured.items()}
+
+
+# Process-wide bulkheads, one per subsystem (session factories in app/database/session.py).
+bulkheads = _load_bulkheads()
+
+
+def bulkhead_snapshot() -> Dict[str, Dict[str, Any]]:
+    return {name: bulkhead.snapshot() for name, bulkhead in bulkheads.items()}
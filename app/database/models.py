@@ -8,8 +8,10 @@ from typing import List, Optional
 from sqlalchemy import (
     Boolean,
     Column,
+    Computed,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     UniqueConstraint,
@@ -320,6 +322,13 @@ class Wallet(Base):
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
 
+    # History pages (newest first) and the deposit total, covered by its index
+    __table_args__ = (
+        Index('ix_wallets_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_wallets_demo_user_id_created_at', 'demo_user_id', 'created_at'),
+        Index('ix_wallets_user_id_type_amount', 'user_id', 'transaction_type', 'transaction_amount'),
+    )
+
 
 
 # Shared fields to be added:
@@ -373,6 +382,10 @@ class UserOrder(Base):
     __table_args__ = (
         CheckConstraint("status IS NULL OR length(status) >= 0", name="userorder_status_min_length_0"),
         CheckConstraint("length(status) <= 30", name="userorder_status_max_length_30"),
+        # Hot queries: open/pending orders of a user (and symbol), history pages, system-wide open orders (of a symbol)
+        Index('ix_user_orders_user_status_symbol', 'order_user_id', 'order_status', 'order_company_name'),
+        Index('ix_user_orders_user_created_at', 'order_user_id', 'created_at'),
+        Index('ix_user_orders_status_symbol', 'order_status', 'order_company_name'),
     )
 
 
@@ -419,6 +432,10 @@ class DemoUserOrder(Base):
     __table_args__ = (
         CheckConstraint("status IS NULL OR length(status) >= 10", name="demouserorder_status_min_length_10"),
         CheckConstraint("status IS NULL OR length(status) <= 30", name="demouserorder_status_max_length_30"),
+        # Hot queries: open/pending orders of a user (and symbol), history pages, system-wide open orders (of a symbol)
+        Index('ix_demo_user_orders_user_status_symbol', 'order_user_id', 'order_status', 'order_company_name'),
+        Index('ix_demo_user_orders_user_created_at', 'order_user_id', 'created_at'),
+        Index('ix_demo_user_orders_status_symbol', 'order_status', 'order_company_name'),
     )
 
 
@@ -495,6 +512,28 @@ class OrderActionHistory(Base):
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
 
 
+class OrderIdAlias(Base):
+    """
+    Secondary ids of live and demo orders (cancel_id, close_id, modify_id, stoploss_id,
+    takeprofit_id, stoploss_cancel_id, takeprofit_cancel_id) mapped to their order_id.
+    Only order_id is indexed on the order tables; service provider callbacks that carry
+    another id are resolved here. A row is added in the transaction that assigns the id
+    (see app.crud.order_alias).
+    """
+    __tablename__ = "order_id_alias"
+
+    id = Column(Integer, primary_key=True, index=True)
+    alias = Column(String(64), nullable=False)
+    order_id = Column(String(64), nullable=False)
+    kind = Column(String(30), nullable=False)  # Column the alias was assigned to, e.g. 'close_id'
+    user_type = Column(String(10), nullable=False)  # 'live' or 'demo'
+
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    # Not unique: ids are only drawn unique per column, so two kinds may share a value
+    __table_args__ = (Index('ix_order_id_alias_alias_user_type', 'alias', 'user_type'),)
+
+
 class OTP(Base):
     """
     SQLAlchemy model for the 'otps' table.
@@ -530,6 +569,8 @@ class ExternalSymbolInfo(Base):
 
     # fix_symbol should be unique for lookups
     fix_symbol = Column(String(255), unique=True, index=True, nullable=False)
+    # Upper-cased by the database, for indexed case-insensitive lookups (see crud.external_symbol_info)
+    fix_symbol_upper = Column(String(255), Computed("upper(fix_symbol)", persisted=True), index=True, nullable=True)
     description = Column(String(255), nullable=True)
     # Using SQLDecimal for precise decimal values. Adjust precision and scale as needed.
     digit = Column(SQLDecimal(10, 5), nullable=True)
@@ -32,18 +32,36 @@ logger.info(f"Attempting to connect to database using URL: {DATABASE_URL[:20]}..
 # --- END OF PRINT STATEMENT ---
 
 
+# GROUP_CONCAT results (e.g. favorite symbols in crud.user.get_account_with_active_orders)
+# are cut at MySQL's group_concat_max_len, 1024 bytes by default; raise it for every
+# connection. Other drivers (SQLite in the load harness) have no such limit or option.
+MYSQL_CONNECT_ARGS = {"init_command": "SET SESSION group_concat_max_len = 1048576"}
+
 # --- Database Engine ---
 # Create the asynchronous engine.
 # echo=True will print SQL statements to the console (useful for debugging)
 engine = create_async_engine(
     DATABASE_URL, 
     echo=settings.ECHO_SQL,
-    pool_size=20,
-    max_overflow=10,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
     pool_recycle=1800,  # Recycle connections every 30 minutes
-    pool_pre_ping=True
+    pool_pre_ping=True,
+    connect_args=MYSQL_CONNECT_ARGS if DATABASE_URL.startswith("mysql") else {},
 )
 
+# --- Connection Pool Metrics (exported at /metrics) ---
+from app.core.metrics import registry
+registry.gauge("db_pool_checked_out_connections", "DB connections currently checked out of the pool.",
+               callback=lambda: engine.sync_engine.pool.checkedout())
+registry.gauge("db_pool_overflow_connections", "DB connections opened beyond pool_size.",
+               callback=lambda: max(0, engine.sync_engine.pool.overflow()))
+registry.gauge("db_pool_size", "Configured DB pool size.", callback=lambda: engine.sync_engine.pool.size())
+
+# --- Statement Profiling (per-query latency by endpoint/task, exported at /metrics and /admin/metrics/sql) ---
+from app.core.sql_profiler import sql_profiler
+sql_profiler.install(engine.sync_engine)
+
 # --- Database Session Local ---
 # Create a configured "SessionLocal" class.
 # expire_on_commit=False is often used with async sessions
@@ -53,16 +71,26 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+# --- Per-subsystem session factories ---
+# Used as `async with ApiSessionLocal() as db:`. Each waits for a slot of its subsystem's
+# bulkhead (app/database/bulkheads.py) so that one subsystem cannot hold the whole pool,
+# and raises DatabaseBusyError when none frees up within the subsystem's wait timeout.
+from app.database.bulkheads import BulkheadSessionFactory, bulkheads
+ApiSessionLocal = BulkheadSessionFactory(AsyncSessionLocal, bulkheads["api"])            # HTTP endpoints
+WsSessionLocal = BulkheadSessionFactory(AsyncSessionLocal, bulkheads["ws"])              # WebSocket connections
+TriggerSessionLocal = BulkheadSessionFactory(AsyncSessionLocal, bulkheads["triggers"])   # pending/SL-TP triggers
+BatchSessionLocal = BulkheadSessionFactory(AsyncSessionLocal, bulkheads["batch"])        # sweeps, swaps, cleanup
+
 # --- Dependency to get a database session ---
 # This function will be used in your FastAPI path operations
 # to get an asynchronous database session.
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """
-    Dependency function to get an asynchronous database session.
+    Dependency function to get an asynchronous database session (api bulkhead).
     Yields a session and ensures it's closed after the request.
     """
     db_logger.debug("Creating new database session")
-    async with AsyncSessionLocal() as session:
+    async with ApiSessionLocal() as session:
         try:
             yield session
             db_logger.debug("Database session used successfully")
@@ -74,6 +102,14 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         finally:
             db_logger.debug("Closing database session")
 
+def get_ws_sessions() -> BulkheadSessionFactory:
+    """
+    Dependency for WebSocket endpoints (ws bulkhead). Returns the session factory, not a
+    session: a connection stays open for hours, so it opens a session around each piece
+    of DB work (`async with sessions() as db:`) and holds a slot only while it runs.
+    """
+    return WsSessionLocal
+
 # --- Function to create all tables ---
 # This is useful for initial setup or development.
 # In production, you would typically use database migration tools like Alembic.
@@ -8,6 +8,7 @@ load_dotenv()
 # Import necessary components from fastapi
 from fastapi import FastAPI, Depends, HTTPException, status, Query
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 import asyncio
 import os
@@ -32,7 +33,7 @@ from apscheduler.triggers.interval import IntervalTrigger
 
 # --- Custom Service and DB Session for Scheduler ---
 from app.services.swap_service import apply_daily_swap_charges_for_all_open_orders
-from app.database.session import AsyncSessionLocal
+from app.database.session import BatchSessionLocal, TriggerSessionLocal
 
 # Import portfolio calculator
 from app.services.portfolio_calculator import calculate_user_portfolio
@@ -40,6 +41,8 @@ from app.core.cache import (
     set_user_data_cache,
     get_user_data_cache, 
     get_group_symbol_settings_cache, 
+    get_group_symbol_settings_cache_many,
+    get_order_placement_cache,
     get_adjusted_market_price_cache, 
     set_user_dynamic_portfolio_cache,
     get_last_known_price,
@@ -50,7 +53,7 @@ from app.core.cache import (
     decode_decimal
 )
 from app.crud import crud_order, user as crud_user
-from app.core.firebase import send_order_to_firebase
+from app.core.firebase import send_order_to_firebase, set_market_data_source
 
 # --- CORS Middleware Import ---
 from fastapi.middleware.cors import CORSMiddleware
@@ -136,6 +139,28 @@ from app.services.pending_orders import check_and_trigger_stoploss_takeprofit
 # Import adjusted price worker
 from app.services.adjusted_price_worker import adjusted_price_worker
 
+# Synthetic tick source (replaces Firebase when SYNTHETIC_FEED_ENABLED is set)
+from app.services.synthetic_feed import run_synthetic_feed, latest_market_data
+
+# Runtime metrics registry (exposed at /metrics)
+from app.core.metrics import registry as metrics_registry, margin_cutoff_executions_total
+
+# Push-based Redis pub/sub subscriptions (reconnect + resubscribe)
+from app.core.pubsub import RedisSubscription
+
+# Event-loop lag monitor / blocking-call detector
+from app.core.loop_monitor import loop_monitor
+from app.core.sql_profiler import SqlAttributionMiddleware, sql_source
+from app.database.bulkheads import DatabaseBusyError
+
+# Time-boxed all-accounts sweep for the dynamic portfolio job
+from app.services.account_sweep import AccountSweeper
+
+# Per-tick margin-risk re-evaluation (sub-second auto-cutoff)
+from app.services.margin_risk_index import margin_risk_index, MarginRiskMonitor
+from app.services.portfolio_writer import dynamic_portfolio_writer
+from app.services.account_actor import account_actor
+
 settings = get_settings()
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -166,6 +191,13 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["Content-Type", "Authorization", "X-Total-Count"]
 )
+# Attributes DB statements to the route of the request or WebSocket connection issuing them
+app.add_middleware(SqlAttributionMiddleware)
+
+@app.exception_handler(DatabaseBusyError)
+async def database_busy_handler(request, exc: DatabaseBusyError):
+    """The endpoint's DB bulkhead stayed full: fail fast instead of queueing on the pool."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
 # --- End CORS Settings ---
 
 scheduler: Optional[AsyncIOScheduler] = None
@@ -184,9 +216,10 @@ orders_logger.info("Application starting up - Orders logging initialized")
 orders_logger.info(f"SL/TP Epsilon accuracy configured: {SLTP_EPSILON}")
 
 # --- Scheduled Job Functions ---
+@sql_source("task:daily_swap_charge_job")
 async def daily_swap_charge_job():
     logger.info("APScheduler: Executing daily_swap_charge_job...")
-    async with AsyncSessionLocal() as db:
+    async with BatchSessionLocal() as db:
         if global_redis_client_instance:
             try:
                 await apply_daily_swap_charges_for_all_open_orders(db, global_redis_client_instance)
@@ -197,143 +230,168 @@ async def daily_swap_charge_job():
             logger.error("APScheduler: Cannot execute daily_swap_charge_job - Global Redis client not available.")
 
 # --- New Dynamic Portfolio Update Job ---
+async def forget_idle_account(account: dict):
+    """
+    Sweep callback for an account without open positions: there is no portfolio to
+    compute, only a margin-risk entry left from its last position to drop. No DB access.
+    """
+    margin_risk_index.remove(account["user_type"], account["id"])
+
+
+async def update_account_dynamic_portfolio(db: AsyncSession, account: dict):
+    """
+    Recalculates and caches the dynamic portfolio of one account and triggers the
+    auto-cutoff when its margin level is below the cutoff threshold.
+    """
+    user_id = account["id"]
+    user_type = account["user_type"]
+    group_name = account["group_name"]
+
+    # Get user data from cache or DB
+    user_data = await get_user_data_cache(global_redis_client_instance, user_id, db, user_type)
+    if not user_data:
+        logger.warning(f"No user data found for user {user_id} ({user_type}). Skipping portfolio update.")
+        return
+    
+    # Get group symbol settings
+    if not group_name:
+        logger.warning(f"User {user_id} has no group_name set. Skipping portfolio update.")
+        return
+    group_symbol_settings = await get_group_symbol_settings_cache(global_redis_client_instance, group_name, "ALL")
+    if not group_symbol_settings:
+        logger.warning(f"No group settings found for group {group_name}. Skipping portfolio update for user {user_id}.")
+        return
+    
+    # Get open orders for this user
+    order_model = crud_order.get_order_model(user_type)
+    open_orders_orm = await crud_order.get_all_open_orders_by_user_id(db, user_id, order_model)
+    open_positions = []
+    for o in open_orders_orm:
+        open_positions.append({
+            'order_id': getattr(o, 'order_id', None),
+            'order_company_name': getattr(o, 'order_company_name', None),
+            'order_type': getattr(o, 'order_type', None),
+            'order_quantity': getattr(o, 'order_quantity', None),
+            'order_price': getattr(o, 'order_price', None),
+            'margin': getattr(o, 'margin', None),
+            'contract_value': getattr(o, 'contract_value', None),
+            'stop_loss': getattr(o, 'stop_loss', None),
+            'take_profit': getattr(o, 'take_profit', None),
+            'commission': getattr(o, 'commission', None),
+            'order_status': getattr(o, 'order_status', None),
+            'order_user_id': getattr(o, 'order_user_id', None)
+        })
+    
+    if not open_positions:
+        # Skip portfolio calculation for users without open positions
+        margin_risk_index.remove(user_type, user_id)
+        return
+    
+    # Get adjusted market prices for all relevant symbols
+    adjusted_market_prices = {}
+    for symbol in group_symbol_settings.keys():
+        # Try to get adjusted prices from cache
+        adjusted_prices = await get_adjusted_market_price_cache(global_redis_client_instance, group_name, symbol)
+        if adjusted_prices:
+            adjusted_market_prices[symbol] = {
+                'buy': adjusted_prices.get('buy'),
+                'sell': adjusted_prices.get('sell')
+            }
+        else:
+            # Fallback to last known price
+            last_price = await get_last_known_price(global_redis_client_instance, symbol)
+            if last_price:
+                adjusted_market_prices[symbol] = {
+                    'buy': last_price.get('b'),  # Use raw price as fallback
+                    'sell': last_price.get('o')
+                }
+    
+    # Define margin thresholds based on group settings or defaults
+    margin_call_threshold = Decimal('100.0')  # Default 100%
+    margin_cutoff_threshold = Decimal('50.0')  # Default 50%
+    
+    # Calculate portfolio metrics with margin call detection
+    portfolio_metrics = await calculate_user_portfolio(
+        user_data=user_data,
+        open_positions=open_positions,
+        adjusted_market_prices=adjusted_market_prices,
+        group_symbol_settings=group_symbol_settings,
+        redis_client=global_redis_client_instance,
+        margin_call_threshold=margin_call_threshold
+    )
+    
+    # Cache the dynamic portfolio data
+    dynamic_portfolio_data = {
+        "balance": portfolio_metrics.get("balance", "0.0"),
+        "equity": portfolio_metrics.get("equity", "0.0"),
+        "margin": portfolio_metrics.get("margin", "0.0"),
+        "free_margin": portfolio_metrics.get("free_margin", "0.0"),
+        "profit_loss": portfolio_metrics.get("profit_loss", "0.0"),
+        "margin_level": portfolio_metrics.get("margin_level", "0.0"),
+        "positions_with_pnl": portfolio_metrics.get("positions", []),
+        "margin_call": portfolio_metrics.get("margin_call", False)
+    }
+    await dynamic_portfolio_writer.submit(global_redis_client_instance, user_type, user_id, dynamic_portfolio_data)
+
+    # Re-index the account's distance to cutoff for per-tick re-evaluation
+    margin_risk_index.update(account, portfolio_metrics, group_symbol_settings)
+    
+    # Check for margin call conditions
+    margin_level = Decimal(portfolio_metrics.get("margin_level", "0.0"))
+    if margin_level > Decimal('0') and margin_level < margin_cutoff_threshold:
+        autocutoff_logger.warning(f"[AUTO-CUTOFF] User {user_id} margin level {margin_level}% below cutoff threshold {margin_cutoff_threshold}%. Initiating auto-cutoff.")
+        await handle_margin_cutoff(db, global_redis_client_instance, user_id, user_type, margin_level)
+    elif portfolio_metrics.get("margin_call", False):
+        autocutoff_logger.warning(f"[AUTO-CUTOFF] User {user_id} has margin call condition: margin level {margin_level}%")
+    
+    # After portfolio update or order execution, log details if relevant
+    # orders_logger.info(f"[PENDING_ORDER_EXECUTION][PORTFOLIO_UPDATE] user_id={user_id}, user_type={user_type}, group_name={group_name}, free_margin={dynamic_portfolio_data.get('free_margin', 'N/A')}, margin_level={dynamic_portfolio_data.get('margin_level', 'N/A')}, balance={dynamic_portfolio_data.get('balance', 'N/A')}, equity={dynamic_portfolio_data.get('equity', 'N/A')}")
+
+
+async def evaluate_account_margin_risk(account: dict):
+    async with TriggerSessionLocal() as db:
+        await update_account_dynamic_portfolio(db, account)
+
+
+# Re-evaluates accounts whose estimated cutoff price was crossed, right after each tick's adjusted prices are cached
+margin_risk_monitor = MarginRiskMonitor(margin_risk_index, evaluate_account_margin_risk)
+
+account_sweeper: Optional[AccountSweeper] = None
+
+@sql_source("task:update_all_users_dynamic_portfolio")
 async def update_all_users_dynamic_portfolio():
     """
     Background task that updates the dynamic portfolio data (free_margin, margin_level)
     for all users, regardless of whether they are connected via WebSockets.
     This is critical for autocutoff and validation.
     """
+    global account_sweeper
     try:
         logger.debug("Starting update_all_users_dynamic_portfolio job")
-        async with AsyncSessionLocal() as db:
-            if not global_redis_client_instance:
-                logger.error("Cannot update dynamic portfolios - Redis client not available")
-                return
-                
-            # Get all active users (both live and demo) using the new unified function
-            live_users, demo_users = await crud_user.get_all_active_users_both(db)
-            
-            all_users = []
-            for user in live_users:
-                all_users.append({"id": user.id, "user_type": "live", "group_name": user.group_name})
-            for user in demo_users:
-                all_users.append({"id": user.id, "user_type": "demo", "group_name": user.group_name})
-            
-            logger.debug(f"Found {len(all_users)} active users to update portfolios")
-            
-            # Process each user
-            for user_info in all_users:
-                user_id = user_info["id"]
-                user_type = user_info["user_type"]
-                group_name = user_info["group_name"]
-                
-                try:
-                    # Get user data from cache or DB
-                    user_data = await get_user_data_cache(global_redis_client_instance, user_id, db, user_type)
-                    if not user_data:
-                        logger.warning(f"No user data found for user {user_id} ({user_type}). Skipping portfolio update.")
-                        continue
-                    
-                    # Get group symbol settings
-                    if not group_name:
-                        logger.warning(f"User {user_id} has no group_name set. Skipping portfolio update.")
-                        continue
-                    group_symbol_settings = await get_group_symbol_settings_cache(global_redis_client_instance, group_name, "ALL")
-                    if not group_symbol_settings:
-                        logger.warning(f"No group settings found for group {group_name}. Skipping portfolio update for user {user_id}.")
-                        continue
-                    
-                    # Get open orders for this user
-                    order_model = crud_order.get_order_model(user_type)
-                    open_orders_orm = await crud_order.get_all_open_orders_by_user_id(db, user_id, order_model)
-                    open_positions = []
-                    for o in open_orders_orm:
-                        open_positions.append({
-                            'order_id': getattr(o, 'order_id', None),
-                            'order_company_name': getattr(o, 'order_company_name', None),
-                            'order_type': getattr(o, 'order_type', None),
-                            'order_quantity': getattr(o, 'order_quantity', None),
-                            'order_price': getattr(o, 'order_price', None),
-                            'margin': getattr(o, 'margin', None),
-                            'contract_value': getattr(o, 'contract_value', None),
-                            'stop_loss': getattr(o, 'stop_loss', None),
-                            'take_profit': getattr(o, 'take_profit', None),
-                            'commission': getattr(o, 'commission', None),
-                            'order_status': getattr(o, 'order_status', None),
-                            'order_user_id': getattr(o, 'order_user_id', None)
-                        })
-                    
-                    if not open_positions:
-                        # Skip portfolio calculation for users without open positions
-                        continue
-                    
-                    # Get adjusted market prices for all relevant symbols
-                    adjusted_market_prices = {}
-                    for symbol in group_symbol_settings.keys():
-                        # Try to get adjusted prices from cache
-                        adjusted_prices = await get_adjusted_market_price_cache(global_redis_client_instance, group_name, symbol)
-                        if adjusted_prices:
-                            adjusted_market_prices[symbol] = {
-                                'buy': adjusted_prices.get('buy'),
-                                'sell': adjusted_prices.get('sell')
-                            }
-                        else:
-                            # Fallback to last known price
-                            last_price = await get_last_known_price(global_redis_client_instance, symbol)
-                            if last_price:
-                                adjusted_market_prices[symbol] = {
-                                    'buy': last_price.get('b'),  # Use raw price as fallback
-                                    'sell': last_price.get('o')
-                                }
-                    
-                    # Define margin thresholds based on group settings or defaults
-                    margin_call_threshold = Decimal('100.0')  # Default 100%
-                    margin_cutoff_threshold = Decimal('50.0')  # Default 50%
-                    
-                    # Calculate portfolio metrics with margin call detection
-                    portfolio_metrics = await calculate_user_portfolio(
-                        user_data=user_data,
-                        open_positions=open_positions,
-                        adjusted_market_prices=adjusted_market_prices,
-                        group_symbol_settings=group_symbol_settings,
-                        redis_client=global_redis_client_instance,
-                        margin_call_threshold=margin_call_threshold
-                    )
-                    
-                    # Cache the dynamic portfolio data
-                    dynamic_portfolio_data = {
-                        "balance": portfolio_metrics.get("balance", "0.0"),
-                        "equity": portfolio_metrics.get("equity", "0.0"),
-                        "margin": portfolio_metrics.get("margin", "0.0"),
-                        "free_margin": portfolio_metrics.get("free_margin", "0.0"),
-                        "profit_loss": portfolio_metrics.get("profit_loss", "0.0"),
-                        "margin_level": portfolio_metrics.get("margin_level", "0.0"),
-                        "positions_with_pnl": portfolio_metrics.get("positions", []),
-                        "margin_call": portfolio_metrics.get("margin_call", False)
-                    }
-                    await set_user_dynamic_portfolio_cache(global_redis_client_instance, user_id, dynamic_portfolio_data)
-                    
-                    # Check for margin call conditions
-                    margin_level = Decimal(portfolio_metrics.get("margin_level", "0.0"))
-                    if margin_level > Decimal('0') and margin_level < margin_cutoff_threshold:
-                        autocutoff_logger.warning(f"[AUTO-CUTOFF] User {user_id} margin level {margin_level}% below cutoff threshold {margin_cutoff_threshold}%. Initiating auto-cutoff.")
-                        await handle_margin_cutoff(db, global_redis_client_instance, user_id, user_type, margin_level)
-                    elif portfolio_metrics.get("margin_call", False):
-                        autocutoff_logger.warning(f"[AUTO-CUTOFF] User {user_id} has margin call condition: margin level {margin_level}%")
-                    
-                    # After portfolio update or order execution, log details if relevant
-                    # orders_logger.info(f"[PENDING_ORDER_EXECUTION][PORTFOLIO_UPDATE] user_id={user_id}, user_type={user_type}, group_name={group_name}, free_margin={dynamic_portfolio_data.get('free_margin', 'N/A')}, margin_level={dynamic_portfolio_data.get('margin_level', 'N/A')}, balance={dynamic_portfolio_data.get('balance', 'N/A')}, equity={dynamic_portfolio_data.get('equity', 'N/A')}")
-                    
-                except Exception as user_error:
-                    logger.error(f"Error updating portfolio for user {user_id}: {user_error}", exc_info=True)
-                    continue
-            
-            logger.debug("Finished update_all_users_dynamic_portfolio job")
+        if not global_redis_client_instance:
+            logger.error("Cannot update dynamic portfolios - Redis client not available")
+            return
+        if account_sweeper is None:
+            account_sweeper = AccountSweeper(
+                BatchSessionLocal,
+                update_account_dynamic_portfolio,
+                concurrency=settings.ACCOUNT_SWEEP_CONCURRENCY,
+                deadline_seconds=settings.ACCOUNT_SWEEP_DEADLINE_SECONDS,
+                batch_size=settings.ACCOUNT_SWEEP_BATCH_SIZE,
+                process_idle_account=forget_idle_account,
+            )
+        report = await account_sweeper.run()
+        logger.debug(f"Finished update_all_users_dynamic_portfolio job: {report}")
     except Exception as e:
         logger.error(f"Error in update_all_users_dynamic_portfolio job: {e}", exc_info=True)
 
 # --- Auto-cutoff function for margin calls ---
 async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: int, user_type: str, margin_level: Decimal):
+    """Auto-cutoff in the account's turn; the orders it closes run in the same turn."""
+    async with account_actor.hold(redis_client, user_type, user_id):
+        await _handle_margin_cutoff(db, redis_client, user_id, user_type, margin_level)
+
+async def _handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: int, user_type: str, margin_level: Decimal):
     """
     Handles auto-cutoff for users whose margin level falls below the critical threshold.
     """
@@ -358,6 +416,8 @@ async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: i
         if not open_orders:
             return
 
+        margin_cutoff_executions_total.labels(user_type).inc()
+
         if is_barclays_live_user:
             for order in open_orders:
                 try:
@@ -391,7 +451,7 @@ async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: i
                 except Exception:
                     continue
             
-            await publish_order_update(redis_client, user_id)
+            await publish_order_update(redis_client, user_id, user_type)
             
             user_type_str = 'live'
             user_data_to_cache = {
@@ -412,27 +472,35 @@ async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: i
             
             from app.api.v1.endpoints.orders import update_user_static_orders
             await update_user_static_orders(user_id, db, redis_client, user_type_str)
-            await publish_user_data_update(redis_client, user_id)
+            await publish_user_data_update(redis_client, user_id, user_type)
             await publish_market_data_trigger(redis_client)
 
         else:
-            from app.crud.external_symbol_info import get_external_symbol_info_by_symbol
-            from app.services.portfolio_calculator import _convert_to_usd
-            from app.services.order_processing import calculate_total_symbol_margin_contribution
-            from app.database.models import ExternalSymbolInfo
-            from sqlalchemy import select
+            from app.crud.external_symbol_info import get_external_symbol_infos_by_symbols
+            from app.services.order_placement import conversion_symbols, symbol_margin_contribution, to_usd
+            from app.services.order_processing import generate_unique_10_digit_id_batch
             from app.schemas.wallet import WalletCreate
-            from app.crud.wallet import generate_unique_10_digit_id
             from app.database.models import Wallet
             from decimal import ROUND_HALF_UP
             import datetime
 
+            # What the closes need, read once for all of the orders: symbol info with one
+            # query, last known prices (and the USD conversion pairs) with one MGET, the
+            # group's symbol settings with another.
+            symbols = sorted({order.order_company_name.upper() for order in open_orders})
+            symbol_infos = await get_external_symbol_infos_by_symbols(db, symbols)
+            conversions = sorted({pair for info in symbol_infos.values() if info.profit
+                                  for pair in conversion_symbols(info.profit)} - set(symbols))
+            last_prices = (await get_order_placement_cache(redis_client, symbols + conversions))["last_price"]
+            symbol_settings = await get_group_symbol_settings_cache_many(redis_client, user_for_cutoff.group_name, symbols)
+
             total_net_profit = Decimal('0.0')
+            closes = []
 
             for order in open_orders:
                 try:
                     symbol = order.order_company_name
-                    last_price = await get_last_known_price(redis_client, symbol)
+                    last_price = last_prices.get(symbol.upper())
                     
                     if not last_price:
                         continue
@@ -443,15 +511,11 @@ async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: i
                     if not close_price or close_price <= 0:
                         continue
                     
-                    close_id = await generate_unique_10_digit_id(db, order_model, 'close_id')
-                    
                     quantity = Decimal(str(order.order_quantity))
                     entry_price = Decimal(str(order.order_price))
                     order_type_db = order.order_type.upper()
                     
-                    symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(symbol))
-                    symbol_info_result = await db.execute(symbol_info_stmt)
-                    ext_symbol_info = symbol_info_result.scalars().first()
+                    ext_symbol_info = symbol_infos.get(symbol.upper())
                     
                     if not ext_symbol_info or ext_symbol_info.contract_size is None or ext_symbol_info.profit is None:
                         continue
@@ -459,7 +523,7 @@ async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: i
                     contract_size = Decimal(str(ext_symbol_info.contract_size))
                     profit_currency = ext_symbol_info.profit.upper()
                     
-                    group_settings = await get_group_symbol_settings_cache(redis_client, user_for_cutoff.group_name, symbol)
+                    group_settings = symbol_settings.get(symbol.upper())
                     if not group_settings:
                         continue
                     
@@ -487,27 +551,46 @@ async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: i
                     else:
                         continue
                     
-                    profit_usd = await _convert_to_usd(profit, profit_currency, user_for_cutoff.id, order.order_id, "PnL on Auto-Cutoff", db=db, redis_client=redis_client)
-                    if profit_currency != "USD" and profit_usd == profit:
+                    # Not closed without a USD rate for the profit currency
+                    pairs = conversion_symbols(profit_currency)
+                    if pairs and not any((last_prices.get(pair) or {}).get('b') is not None for pair in pairs):
                         continue
+                    profit_usd = to_usd(profit, profit_currency, last_prices)
                     
                     net_profit = (profit_usd - total_commission_for_trade).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
                     
                     swap_amount = order.swap or Decimal("0.0")
-                    
+                    closes.append((order, close_price, quantity, net_profit, total_commission_for_trade, swap_amount))
+
+                except Exception:
+                    continue
+
+            try:
+                # Close ids and wallet transaction ids, reserved with one probe each
+                close_ids = await generate_unique_10_digit_id_batch(db, order_model, ['close_id'], len(closes))
+                transaction_count = sum(
+                    (net_profit != Decimal("0.0")) + (commission > Decimal("0.0")) + (swap_amount != Decimal("0.0"))
+                    for _, _, _, net_profit, commission, swap_amount in closes
+                )
+                transaction_ids = iter([
+                    ids['transaction_id']
+                    for ids in await generate_unique_10_digit_id_batch(db, Wallet, ['transaction_id'], transaction_count)
+                ])
+                transaction_time = datetime.datetime.now(datetime.timezone.utc)
+
+                for (order, close_price, quantity, net_profit, total_commission_for_trade, swap_amount), ids in zip(closes, close_ids):
                     order.close_price = close_price
                     order.order_status = 'CLOSED'
                     order.close_message = f"Auto-cutoff: margin level {margin_level}%"
                     order.net_profit = net_profit
                     order.commission = total_commission_for_trade
-                    order.close_id = close_id
+                    order.close_id = ids['close_id']
                     order.swap = swap_amount
                     
                     total_net_profit += (net_profit - swap_amount)
                     
-                    transaction_time = datetime.datetime.now(datetime.timezone.utc)
                     wallet_common_data = {
-                        "symbol": symbol,
+                        "symbol": order.order_company_name,
                         "order_quantity": quantity,
                         "is_approved": 1,
                         "order_type": order.order_type,
@@ -521,31 +604,23 @@ async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: i
                         wallet_common_data["user_id"] = user_for_cutoff.id
                     
                     if net_profit != Decimal("0.0"):
-                        transaction_id_profit = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Profit/Loss", transaction_amount=net_profit, description=f"P/L for auto-cutoff order {order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_profit))
+                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Profit/Loss", transaction_amount=net_profit, description=f"P/L for auto-cutoff order {order.order_id}").model_dump(exclude_none=True), transaction_id=next(transaction_ids)))
                     
                     if total_commission_for_trade > Decimal("0.0"):
-                        transaction_id_commission = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Commission", transaction_amount=-total_commission_for_trade, description=f"Commission for auto-cutoff order {order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_commission))
+                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Commission", transaction_amount=-total_commission_for_trade, description=f"Commission for auto-cutoff order {order.order_id}").model_dump(exclude_none=True), transaction_id=next(transaction_ids)))
                     
                     if swap_amount != Decimal("0.0"):
-                        transaction_id_swap = await generate_unique_10_digit_id(db, Wallet, "transaction_id")
-                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Swap", transaction_amount=-swap_amount, description=f"Swap for auto-cutoff order {order.order_id}").model_dump(exclude_none=True), transaction_id=transaction_id_swap))
-
-                except Exception:
-                    continue
-
-            try:
-                remaining_open_orders = await crud_order.get_all_open_orders_by_user_id(db, user_id, order_model)
-                
-                new_total_margin = Decimal('0.0')
-                for remaining_order in remaining_open_orders:
-                    symbol = remaining_order.order_company_name
-                    symbol_orders = await crud_order.get_open_orders_by_user_id_and_symbol(db, user_id, symbol, order_model)
-                    margin_data = await calculate_total_symbol_margin_contribution(
-                        db, redis_client, user_id, symbol, symbol_orders, order_model, user_type
-                    )
-                    new_total_margin += margin_data["total_margin"]
+                        db.add(Wallet(**WalletCreate(**wallet_common_data, transaction_type="Swap", transaction_amount=-swap_amount, description=f"Swap for auto-cutoff order {order.order_id}").model_dump(exclude_none=True), transaction_id=next(transaction_ids)))
+
+                # Hedged margin of the orders left open, once per symbol
+                remaining_by_symbol = {}
+                for order in open_orders:
+                    if order.order_status != 'CLOSED':
+                        remaining_by_symbol.setdefault(order.order_company_name.upper(), []).append(order)
+                new_total_margin = sum(
+                    (symbol_margin_contribution(symbol_orders)["total_margin"] for symbol_orders in remaining_by_symbol.values()),
+                    Decimal('0.0')
+                )
                 
                 original_wallet_balance = Decimal(str(user_for_cutoff.wallet_balance))
                 user_for_cutoff.wallet_balance = (original_wallet_balance + total_net_profit).quantize(Decimal("0.00000001"), rounding=ROUND_HALF_UP)
@@ -572,8 +647,8 @@ async def handle_margin_cutoff(db: AsyncSession, redis_client: Redis, user_id: i
                 
                 from app.api.v1.endpoints.orders import update_user_static_orders
                 await update_user_static_orders(user_id, db, redis_client, user_type_str)
-                await publish_order_update(redis_client, user_id)
-                await publish_user_data_update(redis_client, user_id)
+                await publish_order_update(redis_client, user_id, user_type)
+                await publish_user_data_update(redis_client, user_id, user_type)
                 await publish_market_data_trigger(redis_client)
                 
             except Exception:
@@ -617,6 +692,9 @@ async def startup_event():
     global background_tasks
     global global_redis_client_instance
     logger.info("Application startup initiated")
+
+    # Start watching for blocking calls before anything else runs on the loop
+    loop_monitor.start()
     # import redis.asyncio as redis
 
     # r = redis.Redis(host="127.0.0.1", port=6379)
@@ -695,7 +773,15 @@ async def startup_event():
     
     # Start background tasks
     try:
-        firebase_task = asyncio.create_task(process_firebase_events(firebase_db, path=settings.FIREBASE_DATA_PATH))
+        if settings.SYNTHETIC_FEED_ENABLED:
+            set_market_data_source(latest_market_data)
+            firebase_task = asyncio.create_task(run_synthetic_feed(
+                settings.SYNTHETIC_FEED_SYMBOLS.split(","),
+                interval_ms=settings.SYNTHETIC_FEED_INTERVAL_MS
+            ))
+            logger.info("Synthetic market data feed enabled in place of Firebase")
+        else:
+            firebase_task = asyncio.create_task(process_firebase_events(firebase_db, path=settings.FIREBASE_DATA_PATH))
         background_tasks.add(firebase_task)
         firebase_task.add_done_callback(background_tasks.discard)
         
@@ -705,7 +791,9 @@ async def startup_event():
             redis_task.add_done_callback(background_tasks.discard)
             
             # Start the centralized adjusted price worker
-            adjusted_price_task = asyncio.create_task(adjusted_price_worker(global_redis_client_instance))
+            adjusted_price_task = asyncio.create_task(adjusted_price_worker(
+                global_redis_client_instance, on_prices_cached=margin_risk_monitor.on_tick
+            ))
             background_tasks.add(adjusted_price_task)
             adjusted_price_task.add_done_callback(background_tasks.discard)
             
@@ -756,6 +844,11 @@ async def shutdown_event():
             except Exception:
                 logger.error("Background task cancellation error")
 
+    try:
+        await dynamic_portfolio_writer.flush()
+    except Exception:
+        logger.error("Dynamic portfolio flush error")
+
     if global_redis_client_instance:
         await close_redis_connection(global_redis_client_instance)
         global_redis_client_instance = None
@@ -764,6 +857,8 @@ async def shutdown_event():
     from app.firebase_stream import cleanup_firebase
     cleanup_firebase()
 
+    await loop_monitor.stop()
+
     logger.info("Application shutdown completed")
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
@@ -772,6 +867,11 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 async def read_root():
     return {"message": "Welcome to the Trading App Backend!"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return PlainTextResponse(metrics_registry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 async def run_stoploss_takeprofit_checker():
     """Background task to continuously check for stop loss and take profit conditions"""
     logger = logging.getLogger("stoploss_takeprofit_checker")
@@ -782,7 +882,7 @@ async def run_stoploss_takeprofit_checker():
     logger.addHandler(handler)
     
     from sqlalchemy.ext.asyncio import AsyncSession
-    from app.database.session import AsyncSessionLocal
+    from app.database.session import TriggerSessionLocal
     
     logger.info("Starting stop loss/take profit checker background task")
     
@@ -790,7 +890,7 @@ async def run_stoploss_takeprofit_checker():
         try:
             # Create a new session for each check
             try:
-                async with AsyncSessionLocal() as db:
+                async with TriggerSessionLocal() as db:
                     # Get Redis client
                     try:
                         redis_client = await get_redis_client()
@@ -838,37 +938,38 @@ async def run_pending_order_checker():
     
     while True:
         try:
-            async with AsyncSessionLocal() as db:
-                if global_redis_client_instance:
-                    from app.crud import group as crud_group
+            if global_redis_client_instance:
+                from app.crud import group as crud_group
+                # The session only reads the groups; each triggered order gets its own trigger
+                # session, which must not wait on a slot this loop holds
+                async with TriggerSessionLocal() as db:
                     all_groups = await crud_group.get_groups(db, skip=0, limit=1000)
+                
+                for group in all_groups:
+                    group_name = group.name
+                    group_settings = await get_group_symbol_settings_cache(global_redis_client_instance, group_name, "ALL")
                     
-                    for group in all_groups:
-                        group_name = group.name
-                        group_settings = await get_group_symbol_settings_cache(global_redis_client_instance, group_name, "ALL")
+                    if not group_settings:
+                        continue
                         
-                        if not group_settings:
-                            continue
+                    for symbol in group_settings.keys():
+                        try:
+                            adjusted_prices = await get_adjusted_market_price_cache(global_redis_client_instance, group_name, symbol)
                             
-                        for symbol in group_settings.keys():
-                            try:
-                                adjusted_prices = await get_adjusted_market_price_cache(global_redis_client_instance, group_name, symbol)
-                                
-                                if adjusted_prices:
-                                    from app.api.v1.endpoints.market_data_ws import check_and_trigger_pending_orders
-                                    await check_and_trigger_pending_orders(
-                                        redis_client=global_redis_client_instance,
-                                        db=db,
-                                        symbol=symbol,
-                                        adjusted_prices=adjusted_prices,
-                                        group_name=group_name
-                                    )
-                            except Exception as symbol_error:
-                                logger.error(f"Error processing symbol {symbol}")
-                                continue
-                else:
-                    await asyncio.sleep(5)
-                    continue
+                            if adjusted_prices:
+                                from app.api.v1.endpoints.market_data_ws import check_and_trigger_pending_orders
+                                await check_and_trigger_pending_orders(
+                                    redis_client=global_redis_client_instance,
+                                    symbol=symbol,
+                                    adjusted_prices=adjusted_prices,
+                                    group_name=group_name
+                                )
+                        except Exception as symbol_error:
+                            logger.error(f"Error processing symbol {symbol}")
+                            continue
+            else:
+                await asyncio.sleep(5)
+                continue
                     
         except Exception as e:
             logger.error("Error in pending order checker loop")
@@ -897,33 +998,40 @@ async def run_sltp_checker_on_market_update():
     await asyncio.sleep(5) 
     logger.info("Starting the SL/TP checker task (triggered by market updates).")
     
+    async def check_after_gap():
+        # Ticks published while the subscription was down are lost; check against current prices now
+        logger.warning("Market data subscription resumed after a gap, triggering SL/TP check")
+        async with TriggerSessionLocal() as db:
+            await check_and_trigger_stoploss_takeprofit(db, global_redis_client_instance)
+
     # Subscribe to market data updates
-    pubsub = global_redis_client_instance.pubsub()
-    await pubsub.subscribe(REDIS_MARKET_DATA_CHANNEL)
+    subscription = RedisSubscription(global_redis_client_instance, [REDIS_MARKET_DATA_CHANNEL], "sltp_checker",
+                                     on_gap=check_after_gap)
     
     try:
         while True:
-            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-            if message is None:
-                continue
-                
             try:
-                message_data = json.loads(message['data'], object_hook=decode_decimal)
-                if message_data.get("type") == "market_data_update":
-                    logger.info("Market data update received, triggering SL/TP check")
-                    
-                    # Run SL/TP check with fresh database session
-                    async with AsyncSessionLocal() as db:
-                        await check_and_trigger_stoploss_takeprofit(db, global_redis_client_instance)
-                        
+                async for message in subscription:
+                    try:
+                        message_data = json.loads(message['data'], object_hook=decode_decimal)
+                        if message_data.get("type") == "market_data_update":
+                            logger.info("Market data update received, triggering SL/TP check")
+                            
+                            # Run SL/TP check with fresh database session
+                            async with TriggerSessionLocal() as db:
+                                await check_and_trigger_stoploss_takeprofit(db, global_redis_client_instance)
+                                
+                    except Exception as e:
+                        logger.error(f"Error processing market data for SL/TP check: {e}", exc_info=True)
+                break
             except Exception as e:
-                logger.error(f"Error processing market data for SL/TP check: {e}", exc_info=True)
-                
-    except Exception as e:
-        logger.error(f"Error in SL/TP checker task: {e}", exc_info=True)
+                # Connection errors are retried by the subscription; anything else ended it
+                logger.error(f"Error in SL/TP checker task: {e}; resubscribing", exc_info=True)
+                await asyncio.sleep(1)
+                subscription = RedisSubscription(global_redis_client_instance, [REDIS_MARKET_DATA_CHANNEL],
+                                                 "sltp_checker", on_gap=check_after_gap)
     finally:
-        await pubsub.unsubscribe(REDIS_MARKET_DATA_CHANNEL)
-        await pubsub.close()
+        await subscription.close()
 
 # --- Redis Cleanup Function ---
 async def cleanup_orphaned_redis_orders():
@@ -945,7 +1053,7 @@ async def cleanup_orphaned_redis_orders():
                 await asyncio.sleep(60)
                 continue
                 
-            async with AsyncSessionLocal() as db:
+            async with BatchSessionLocal() as db:
                 from app.services.pending_orders import get_all_pending_orders_from_redis
                 pending_orders = await get_all_pending_orders_from_redis(global_redis_client_instance)
                 
@@ -1,4 +1,4 @@
-from typing import Optional, Any
+from typing import Optional, Any, List
 from pydantic import BaseModel, Field, model_validator
 from decimal import Decimal
 from pydantic import validator
@@ -299,4 +299,61 @@ class HalfSpreadResponse(BaseModel):
 class OrderStatusResponse(BaseModel):
     order_id: str
     status: Optional[str] = None
-    order_status: Optional[str] = None
\ No newline at end of file
+    order_status: Optional[str] = None
+
+# --- Bulk Order (fund manager allocation) Schemas ---
+class BulkOrderAllocation(BaseModel):
+    user_id: int # Live follower account receiving this share of the instruction
+    order_quantity: Decimal = Field(..., gt=0)
+
+
+class BulkOrderRequest(BaseModel):
+    symbol: str
+    order_type: str # Market orders only: "BUY" or "SELL"
+    stop_loss: Optional[Decimal] = None
+    take_profit: Optional[Decimal] = None
+    status: Optional[str] = Field(None, description="Order status string (0-30 chars)")
+    allocations: List[BulkOrderAllocation] = Field(..., min_length=1, max_length=5000)
+
+    @model_validator(mode="after")
+    def validate_instruction(self) -> 'BulkOrderRequest':
+        self.symbol = self.symbol.upper()
+        self.order_type = self.order_type.upper()
+        if self.order_type not in ("BUY", "SELL"):
+            raise ValueError("Bulk orders must be market orders (BUY or SELL).")
+        user_ids = [allocation.user_id for allocation in self.allocations]
+        if len(set(user_ids)) != len(user_ids):
+            raise ValueError("Each account may appear only once in allocations.")
+        return self
+
+
+class BulkOrderRejection(BaseModel):
+    user_id: int
+    reason: str
+
+
+class BulkOrderResponse(BaseModel):
+    orders: List[OrderResponse]
+    rejected: List[BulkOrderRejection] = []
+
+
+# --- Batch Close Schemas ---
+class BatchCloseRequest(BaseModel):
+    order_ids: List[str] = Field(..., min_length=1, max_length=1000)
+    user_id: Optional[int] = None # For service accounts closing orders for other users.
+
+
+class CloseAllRequest(BaseModel):
+    symbol: Optional[str] = None # Only positions of this symbol; all symbols if omitted
+    losing_only: bool = False # Only positions whose net profit at the close price is negative
+    user_id: Optional[int] = None # For service accounts closing orders for other users.
+
+
+class BatchCloseSkipped(BaseModel):
+    order_id: str
+    reason: str
+
+
+class BatchCloseResponse(BaseModel):
+    closed: List[OrderResponse]
+    skipped: List[BatchCloseSkipped] = []
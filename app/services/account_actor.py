@@ -0,0 +1,315 @@
+# app/services/account_actor.py
+
+"""
+Per-account serialization of balance and margin mutations.
+
+Order placement, closes (user, SL/TP and cutoff) and pending triggers each read the
+account's orders and margin, compute, then write. Run concurrently for one account they
+used to queue on `SELECT ... FOR UPDATE` of the user row, each waiter holding a pooled
+connection while the holder did its Redis reads, margin math and id probing under the
+lock. AccountActor hands out turns on an account *before* any DB work starts:
+
+- in process, a mailbox per account (FIFO queue of waiting turns) drained by one
+  worker task, which grants one turn at a time; a turn ends when its holder leaves
+  `hold()`;
+- across processes, the worker holds a Redis lease on the account while it drains the
+  mailbox: SET NX PX with a random token, renewed while held, released by
+  compare-and-delete. Consecutive turns share the lease, up to `max_batch` turns, after
+  which it is released so that other processes get the account.
+
+    async with account_actor.hold(redis_client, user_type, user_id):
+        ...
+
+`hold_many` takes the turns of several accounts at once (bulk placement).
+
+`hold` is re-entrant in the task holding the turn, so a cutoff holding the account can
+close the account's orders through close_order. Tasks started during a turn do not
+share it (they may outlive it): they wait for a turn of their own. The row lock stays
+as a backstop: if Redis cannot be reached the turn proceeds without the lease (logged
+and counted).
+"""
+
+import asyncio
+import logging
+import secrets
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+AccountKey = Tuple[str, int]
+
+DEFAULT_LEASE_TTL_SECONDS = 10.0
+DEFAULT_LEASE_WAIT_SECONDS = 5.0
+DEFAULT_MAX_BATCH = 32
+# Waiting processes poll the lease at most this far apart; a process handing the lease
+# back after max_batch turns waits longer than that before taking it again
+LEASE_POLL_MAX_SECONDS = 0.01
+LEASE_HANDOFF_SECONDS = 2 * LEASE_POLL_MAX_SECONDS
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# (task, accounts whose turn it holds). Tasks started in a turn inherit the context
+# variable, so the owning task is checked before the accounts are trusted.
+_held_accounts: ContextVar[Tuple[Optional[asyncio.Task], FrozenSet[AccountKey]]] = ContextVar(
+    "account_actor_held", default=(None, frozenset())
+)
+
+account_actor_wait_seconds = registry.histogram(
+    "account_actor_wait_seconds", "Time a mutation waited for its turn on the account (queue and lease)."
+)
+account_lease_events_total = registry.counter(
+    "account_lease_events_total", "Redis account lease acquisitions, timeouts and errors.", ("event",)
+)
+_LEASE_ACQUIRED = account_lease_events_total.labels("acquired")
+_LEASE_TIMEOUT = account_lease_events_total.labels("timeout")
+_LEASE_ERROR = account_lease_events_total.labels("error")
+_LEASE_LOST = account_lease_events_total.labels("lost")
+
+
+class AccountBusyError(Exception):
+    """The account's lease was held by another process for longer than the wait timeout."""
+    pass
+
+
+def account_key(user_type: Optional[str], user_id: Any) -> AccountKey:
+    return (str(user_type or 'live').lower(), int(user_id))
+
+
+def lease_key(key: AccountKey) -> str:
+    return f"account_lease:{key[0]}:{key[1]}"
+
+
+def _held_by_current_task() -> FrozenSet[AccountKey]:
+    owner, held = _held_accounts.get()
+    return held if owner is asyncio.current_task() else frozenset()
+
+
+class AccountLease:
+    """Redis lease on one account, held by at most one process at a time."""
+
+    def __init__(self, redis_client, key: AccountKey, ttl: float, wait: float):
+        self.redis_client = redis_client
+        self.key = lease_key(key)
+        self.ttl_ms = max(1, int(ttl * 1000))
+        self.wait = wait
+        self.token = secrets.token_hex(16)
+        self._renewer: Optional[asyncio.Task] = None
+
+    async def acquire(self) -> bool:
+        """
+        True once held; False if Redis failed (the caller proceeds without the lease).
+        Raises AccountBusyError after `wait` seconds of another process holding it.
+        """
+        deadline = time.monotonic() + self.wait
+        delay = 0.002
+        while True:
+            try:
+                if await self.redis_client.set(self.key, self.token, nx=True, px=self.ttl_ms):
+                    _LEASE_ACQUIRED.inc()
+                    self._renewer = asyncio.create_task(self._renew())
+                    return True
+            except Exception as e:
+                _LEASE_ERROR.inc()
+                logger.warning(f"Account lease {self.key} unavailable, continuing without it: {e}")
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _LEASE_TIMEOUT.inc()
+                raise AccountBusyError(f"Account is busy ({self.key})")
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, LEASE_POLL_MAX_SECONDS)
+
+    async def _renew(self) -> None:
+        interval = self.ttl_ms / 3000.0
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await self.redis_client.eval(_RENEW_SCRIPT, 1, self.key, self.token, self.ttl_ms):
+                    _LEASE_LOST.inc()
+                    logger.warning(f"Account lease {self.key} expired while held")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not renew account lease {self.key}: {e}")
+
+    async def release(self) -> None:
+        if self._renewer is not None:
+            self._renewer.cancel()
+            self._renewer = None
+        try:
+            await self.redis_client.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+        except Exception as e:
+            # Expires after the ttl
+            logger.warning(f"Could not release account lease {self.key}: {e}")
+
+
+class AccountActor:
+    """Keyed async mutex with a FIFO mailbox and a Redis lease per account."""
+
+    def __init__(self, lease_ttl: float = DEFAULT_LEASE_TTL_SECONDS,
+                 lease_wait: float = DEFAULT_LEASE_WAIT_SECONDS, max_batch: int = DEFAULT_MAX_BATCH):
+        self.lease_ttl = lease_ttl
+        self.lease_wait = lease_wait
+        self.max_batch = max(1, max_batch)
+        self._mailboxes: Dict[AccountKey, Deque[asyncio.Future]] = {}
+        self._workers: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._mailboxes)
+
+    def _request(self, key: AccountKey, redis_client) -> asyncio.Future:
+        """Queues a turn on the account; the future resolves to the Event that ends it."""
+        turn = asyncio.get_running_loop().create_future()
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            mailbox = self._mailboxes[key] = deque()
+            worker = asyncio.create_task(self._drain(key, mailbox, redis_client))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        mailbox.append(turn)
+        return turn
+
+    @staticmethod
+    def _give_back(turn: asyncio.Future) -> None:
+        """Ends a turn that was granted but will not be used, or withdraws a queued one."""
+        if not turn.done():
+            turn.cancel()
+        elif not turn.cancelled() and turn.exception() is None:
+            turn.result().set()
+
+    @asynccontextmanager
+    async def hold(self, redis_client, user_type: Optional[str], user_id: Any) -> AsyncIterator[None]:
+        """The caller's turn on the account; redis_client=None serializes in process only."""
+        key = account_key(user_type, user_id)
+        held = _held_by_current_task()
+        if key in held:
+            yield
+            return
+
+        started = time.perf_counter()
+        turn = self._request(key, redis_client)
+        try:
+            finished = await turn
+        except asyncio.CancelledError:
+            # Granted while being cancelled: hand the turn back
+            self._give_back(turn)
+            raise
+        account_actor_wait_seconds.observe(time.perf_counter() - started)
+
+        token = _held_accounts.set((asyncio.current_task(), held | {key}))
+        try:
+            yield
+        finally:
+            _held_accounts.reset(token)
+            finished.set()
+
+    @asynccontextmanager
+    async def hold_many(self, redis_client, user_type: Optional[str],
+                        user_ids: Iterable[Any]) -> AsyncIterator[List[int]]:
+        """
+        Turns on several accounts, held together. Yields the ids whose turn could not be
+        had (AccountBusyError); the others are held. All turns are queued before any is
+        awaited, so two hold_many of this process are queued in the same order on every
+        account they share and cannot deadlock; leases are acquired concurrently.
+        """
+        held = _held_by_current_task()
+        keys = [key for key in dict.fromkeys(account_key(user_type, user_id) for user_id in user_ids)
+                if key not in held]
+        started = time.perf_counter()
+        turns = {key: self._request(key, redis_client) for key in keys}
+        granted: Dict[AccountKey, asyncio.Event] = {}
+        busy: List[int] = []
+        try:
+            for key, turn in turns.items():
+                try:
+                    granted[key] = await turn
+                except AccountBusyError:
+                    busy.append(key[1])
+        except BaseException:
+            for turn in turns.values():
+                self._give_back(turn)
+            raise
+        account_actor_wait_seconds.observe(time.perf_counter() - started)
+
+        token = _held_accounts.set((asyncio.current_task(), held | set(granted)))
+        try:
+            yield busy
+        finally:
+            _held_accounts.reset(token)
+            for finished in granted.values():
+                finished.set()
+
+    async def _drain(self, key: AccountKey, mailbox: Deque[asyncio.Future], redis_client) -> None:
+        lease: Optional[AccountLease] = None
+        turns = 0
+        try:
+            while mailbox:
+                turn = mailbox.popleft()
+                if turn.done():
+                    continue
+                if lease is None and redis_client is not None:
+                    lease = AccountLease(redis_client, key, self.lease_ttl, self.lease_wait)
+                    try:
+                        if not await lease.acquire():
+                            lease = None
+                    except AccountBusyError as e:
+                        lease = None
+                        if not turn.done():
+                            turn.set_exception(e)
+                        continue
+                    if turn.done():
+                        continue
+                finished = asyncio.Event()
+                turn.set_result(finished)
+                await finished.wait()
+                turns += 1
+                if lease is not None and turns >= self.max_batch:
+                    await lease.release()
+                    lease = None
+                    turns = 0
+                    if mailbox:
+                        await asyncio.sleep(LEASE_HANDOFF_SECONDS)
+        finally:
+            # Drop the mailbox before awaiting anything, so a new turn starts a new worker
+            if self._mailboxes.get(key) is mailbox:
+                del self._mailboxes[key]
+            while mailbox:
+                turn = mailbox.popleft()
+                if not turn.done():
+                    turn.set_exception(AccountBusyError(f"Account actor for {key} stopped"))
+            if lease is not None:
+                await lease.release()
+
+
+def _load_actor() -> AccountActor:
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        return AccountActor(lease_ttl=settings.ACCOUNT_LEASE_TTL_SECONDS,
+                            lease_wait=settings.ACCOUNT_LEASE_WAIT_SECONDS,
+                            max_batch=settings.ACCOUNT_ACTOR_MAX_BATCH)
+    except Exception:
+        return AccountActor()
+
+
+account_actor = _load_actor()
+
+registry.gauge("account_actor_accounts", "Accounts with a queued or running mutation.",
+               callback=lambda: len(account_actor))
@@ -0,0 +1,235 @@
+# app/services/account_stream.py
+
+"""
+Sequenced account streams for /ws/market-data (opt in with `?stream=delta`).
+
+Instead of the full account_summary on every frame, a connection gets one
+`account_snapshot` followed by `account_delta` frames. Each delta has a sequence
+number that is unique within the stream:
+
+    {"seq": 12, "op": "opened",      "list": "open_orders", "order": {...}}
+    {"seq": 13, "op": "modified",    "list": "open_orders", "order_id": "...", "changes": {...}}
+    {"seq": 14, "op": "pnl_changed", "list": "open_orders", "order_id": "...", "changes": {...}}
+    {"seq": 15, "op": "closed",      "list": "pending_orders", "order_id": "..."}
+    {"seq": 16, "op": "account",     "changes": {"balance": "...", "margin": "..."}}
+
+The last deltas are kept in a ring buffer. After a disconnect the session stays
+resumable for a short TTL: a client that reconnects with `?resume=<stream>&seq=<last
+seq seen>` gets only the deltas it missed, plus the changes made while it was away,
+instead of the full bootstrap.
+"""
+
+import secrets
+import time
+from collections import deque
+from decimal import Decimal
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.metrics import registry
+
+ORDER_LISTS = ("open_orders", "pending_orders")
+# Order fields that change with the market rather than with order activity
+PNL_FIELDS = frozenset(("profit_loss", "current_price", "net_profit"))
+
+account_stream_resumes_total = registry.counter(
+    "account_stream_resumes_total", "Account stream resume attempts by result.", ("result",)
+)
+account_stream_deltas_total = registry.counter(
+    "account_stream_deltas_total", "Account stream deltas by operation.", ("op",)
+)
+
+
+def _plain(value: Any) -> Any:
+    # Cache reads decode numeric strings to Decimal; compare and send them as strings
+    return str(value) if isinstance(value, Decimal) else value
+
+
+class AccountStream:
+    """
+    Snapshot + delta state of one connection session.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.token = secrets.token_urlsafe(16)
+        self.seq = 0
+        self._scalars: Dict[str, Any] = {}
+        self._orders: Dict[str, Dict[str, Dict[str, Any]]] = {name: {} for name in ORDER_LISTS}
+        self._ring: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+
+    def summary(self) -> Dict[str, Any]:
+        summary = dict(self._scalars)
+        for name in ORDER_LISTS:
+            summary[name] = list(self._orders[name].values())
+        return summary
+
+    def snapshot(self, account_summary: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Replaces the stream state and returns the `account_snapshot` frame. Deltas from
+        before a snapshot can no longer be resumed.
+        """
+        self._scalars = {k: _plain(v) for k, v in account_summary.items() if k not in ORDER_LISTS}
+        self._orders = {
+            name: {str(o.get("order_id")): {k: _plain(v) for k, v in o.items()}
+                   for o in account_summary.get(name) or []}
+            for name in ORDER_LISTS
+        }
+        self.seq += 1
+        self._ring.clear()
+        return {"type": "account_snapshot",
+                "data": {"stream": self.token, "seq": self.seq, "account_summary": self.summary()}}
+
+    def _emit(self, delta: Dict[str, Any], deltas: List[Dict[str, Any]]) -> None:
+        self.seq += 1
+        delta["seq"] = self.seq
+        self._ring.append(delta)
+        deltas.append(delta)
+        account_stream_deltas_total.labels(delta["op"]).inc()
+
+    def update(self, account_summary: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Diffs a full account summary against the stream state and returns the new deltas.
+        """
+        deltas: List[Dict[str, Any]] = []
+        for name in ORDER_LISTS:
+            if name not in account_summary:
+                continue
+            current = self._orders[name]
+            incoming = {str(o.get("order_id")): {k: _plain(v) for k, v in o.items()}
+                        for o in account_summary.get(name) or []}
+            for order_id in [oid for oid in current if oid not in incoming]:
+                del current[order_id]
+                self._emit({"op": "closed", "list": name, "order_id": order_id}, deltas)
+            for order_id, order in incoming.items():
+                previous = current.get(order_id)
+                if previous is None:
+                    self._emit({"op": "opened", "list": name, "order": order}, deltas)
+                else:
+                    changes = {k: v for k, v in order.items() if previous.get(k) != v}
+                    changes.update({k: None for k in previous if k not in order})
+                    if changes:
+                        op = "pnl_changed" if PNL_FIELDS.issuperset(changes) else "modified"
+                        self._emit({"op": op, "list": name, "order_id": order_id, "changes": changes}, deltas)
+                current[order_id] = order
+
+        changes = {}
+        for key, value in account_summary.items():
+            if key in ORDER_LISTS:
+                continue
+            value = _plain(value)
+            if self._scalars.get(key) != value:
+                changes[key] = self._scalars[key] = value
+        if changes:
+            self._emit({"op": "account", "changes": changes}, deltas)
+        return deltas
+
+    def delta_frame(self, deltas: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {"type": "account_delta", "data": {"stream": self.token, "deltas": deltas}}
+
+    def since(self, seq: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Deltas after `seq`, or None when they are no longer (or were never) buffered.
+        """
+        if seq == self.seq:
+            return []
+        if seq > self.seq or not self._ring or self._ring[0]["seq"] > seq + 1:
+            return None
+        return [delta for delta in self._ring if delta["seq"] > seq]
+
+
+class AccountSession:
+    """
+    A resumable connection session: the stream plus what the bootstrap established.
+    """
+
+    def __init__(self, user_type: str, user_id: int, account_number: str, group_name: str,
+                 subscription: Any = None, capacity: int = 256):
+        self.user_type = user_type
+        self.user_id = user_id
+        self.account_number = account_number
+        self.group_name = group_name
+        self.subscription = subscription
+        self.stream = AccountStream(capacity)
+        self.attached = True
+        self.detached_at: Optional[float] = None
+
+    @property
+    def token(self) -> str:
+        return self.stream.token
+
+
+class AccountSessionRegistry:
+    """
+    Process-wide sessions by stream token. Detached sessions expire after `ttl` seconds;
+    beyond `max_sessions` the longest-detached ones are dropped first.
+    """
+
+    def __init__(self, ttl: float = 120.0, max_sessions: int = 20000, capacity: int = 256):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.capacity = capacity
+        self._sessions: Dict[str, AccountSession] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self, user_type: str, user_id: int, account_number: str, group_name: str,
+               subscription: Any = None) -> AccountSession:
+        self.prune()
+        session = AccountSession(user_type, user_id, account_number, group_name, subscription, self.capacity)
+        self._sessions[session.token] = session
+        return session
+
+    def detach(self, session: AccountSession) -> None:
+        session.attached = False
+        session.detached_at = time.monotonic()
+        self.prune()
+
+    def resume(self, token: Optional[str], account_number: Any, user_type: str,
+               last_seq: Optional[int]) -> Tuple[Optional[AccountSession], Optional[List[Dict[str, Any]]], str]:
+        """
+        Re-attaches a detached session. Returns (session, buffered deltas after last_seq,
+        result); session is None when the client has to bootstrap again.
+        """
+        self.prune()
+        session = self._sessions.get(token or "")
+        if session is None or str(session.account_number) != str(account_number) or session.user_type != user_type:
+            result, session, missed = "unknown", None, None
+        elif session.attached:
+            result, session, missed = "attached", None, None
+        else:
+            missed = session.stream.since(last_seq) if last_seq is not None else None
+            if missed is None:
+                result, session = "gap", None
+            else:
+                result = "resumed"
+                session.attached = True
+                session.detached_at = None
+        account_stream_resumes_total.labels(result).inc()
+        return session, missed, result
+
+    def prune(self, now: Optional[float] = None) -> None:
+        now = now if now is not None else time.monotonic()
+        detached = [(s.detached_at, token) for token, s in self._sessions.items() if not s.attached]
+        for detached_at, token in detached:
+            if now - detached_at > self.ttl:
+                del self._sessions[token]
+        overflow = len(self._sessions) - self.max_sessions
+        if overflow > 0:
+            for _, token in sorted(d for d in detached if d[1] in self._sessions)[:overflow]:
+                del self._sessions[token]
+
+
+def _load_registry() -> AccountSessionRegistry:
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        return AccountSessionRegistry(ttl=settings.WS_RESUME_TTL_SECONDS,
+                                      capacity=settings.WS_ACCOUNT_STREAM_BUFFER)
+    except Exception:
+        return AccountSessionRegistry()
+
+
+account_sessions = _load_registry()
+
+registry.gauge("account_stream_sessions", "Resumable account stream sessions (attached and detached).",
+               callback=lambda: len(account_sessions))
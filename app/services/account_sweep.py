@@ -0,0 +1,205 @@
+# app/services/account_sweep.py
+
+"""
+Time-boxed sweep over every active live and demo account.
+
+The periodic portfolio job used to load one offset page of users and visit them one
+after another, so most accounts were never reached. AccountSweeper instead:
+
+- visits accounts with OPEN orders first (they are the only ones margin can hit), up
+  to `concurrency` at a time, each in its own DB session,
+- then streams the accounts without open orders with keyset pagination on the primary
+  key. There is no portfolio to compute for them; the pass only hands each one to
+  `process_idle_account`, in the listing loop and without a session of its own. The app
+  uses it to drop accounts whose last position was closed from the margin-risk index.
+  Without `process_idle_account` the pass is skipped,
+- stops dispatching at the sweep deadline and reports the overrun; the next sweep
+  resumes the keyset scan where this one stopped, so every account is eventually visited.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+USER_TYPES = ("live", "demo")
+
+account_sweep_seconds = registry.histogram(
+    "account_sweep_seconds", "Wall time of a full all-accounts sweep."
+)
+account_sweep_accounts_total = registry.counter(
+    "account_sweep_accounts_total", "Accounts visited by the all-accounts sweep.", ("result",)
+)
+account_sweep_overruns_total = registry.counter(
+    "account_sweep_overruns_total", "Sweeps that hit their deadline before visiting every account."
+)
+
+_VISITED_OK = account_sweep_accounts_total.labels("ok")
+_VISITED_IDLE = account_sweep_accounts_total.labels("idle")
+_VISITED_FAILED = account_sweep_accounts_total.labels("failed")
+
+# (id, group_name) rows as returned by the crud helpers
+AccountRows = Sequence[Tuple[int, Optional[str]]]
+
+
+async def _default_fetch_priority(db, user_type: str) -> AccountRows:
+    from app.crud import user as crud_user
+    return await crud_user.get_active_accounts_with_open_orders(db, user_type)
+
+
+async def _default_fetch_batch(db, user_type: str, after_id: int, limit: int) -> AccountRows:
+    from app.crud import user as crud_user
+    return await crud_user.get_active_account_batch(db, user_type, after_id, limit, without_open_orders=True)
+
+
+class AccountSweeper:
+    """
+    Runs `process_account(db, account)` for every active account with open positions and
+    `process_idle_account(account)` for the others, within a time budget. `account` is a
+    dict with id, user_type, group_name and prioritized. `fetch_priority` lists the
+    accounts with open positions; `fetch_batch` pages through the others.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Any],
+        process_account: Callable[[Any, Dict[str, Any]], Awaitable[None]],
+        concurrency: int = 8,
+        deadline_seconds: float = 50.0,
+        batch_size: int = 500,
+        fetch_priority: Callable[[Any, str], Awaitable[AccountRows]] = _default_fetch_priority,
+        fetch_batch: Callable[[Any, str, int, int], Awaitable[AccountRows]] = _default_fetch_batch,
+        process_idle_account: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+    ):
+        self.session_factory = session_factory
+        self.process_account = process_account
+        self.process_idle_account = process_idle_account
+        self.concurrency = max(1, concurrency)
+        self.deadline_seconds = deadline_seconds
+        self.batch_size = batch_size
+        self._fetch_priority = fetch_priority
+        self._fetch_batch = fetch_batch
+        # Keyset resume point per user type for the non-priority pass
+        self.cursors: Dict[str, int] = {user_type: 0 for user_type in USER_TYPES}
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    async def _keyset_scan(self, db, user_type: str, after_id: int, stop_at: Optional[int]):
+        while True:
+            batch = await self._fetch_batch(db, user_type, after_id, self.batch_size)
+            if not batch:
+                return
+            for account_id, group_name in batch:
+                if stop_at is not None and account_id > stop_at:
+                    return
+                yield account_id, group_name
+            after_id = batch[-1][0]
+
+    async def _accounts(self, db):
+        """
+        Yields accounts in sweep order: open-position accounts first, then everyone
+        else from the saved keyset cursor, wrapping around to the start.
+        """
+        prioritized = set()
+        for user_type in USER_TYPES:
+            for account_id, group_name in await self._fetch_priority(db, user_type):
+                prioritized.add((user_type, account_id))
+                yield {"id": account_id, "user_type": user_type, "group_name": group_name, "prioritized": True}
+
+        if self.process_idle_account is None:
+            return
+        for user_type in USER_TYPES:
+            start = self.cursors[user_type]
+            passes = [(start, None)] + ([(0, start)] if start else [])
+            for after_id, stop_at in passes:
+                async for account_id, group_name in self._keyset_scan(db, user_type, after_id, stop_at):
+                    # fetch_batch leaves out open-position accounts; this only catches an account
+                    # that opened its first position after the priority pass
+                    if (user_type, account_id) not in prioritized:
+                        yield {"id": account_id, "user_type": user_type, "group_name": group_name,
+                               "prioritized": False}
+                    # Only reached once the consumer asked for the next account, i.e. this one was dispatched
+                    self.cursors[user_type] = account_id
+            # Completed a full lap for this user type
+            self.cursors[user_type] = 0
+
+    async def _visit(self, account: Dict[str, Any], semaphore: asyncio.Semaphore, stats: Dict[str, int]) -> None:
+        try:
+            async with self.session_factory() as db:
+                await self.process_account(db, account)
+            stats["visited"] += 1
+            _VISITED_OK.inc()
+        except Exception as e:
+            stats["failed"] += 1
+            _VISITED_FAILED.inc()
+            logger.error(f"Account sweep: error processing {account['user_type']} account {account['id']}: {e}",
+                         exc_info=True)
+        finally:
+            semaphore.release()
+
+    async def _visit_idle(self, account: Dict[str, Any], stats: Dict[str, int]) -> None:
+        try:
+            await self.process_idle_account(account)
+            stats["idle"] += 1
+            _VISITED_IDLE.inc()
+        except Exception as e:
+            stats["failed"] += 1
+            _VISITED_FAILED.inc()
+            logger.error(f"Account sweep: error processing idle {account['user_type']} account {account['id']}: {e}",
+                         exc_info=True)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Performs one sweep and returns its report (also kept in `last_report`).
+        """
+        started = time.monotonic()
+        deadline = started + self.deadline_seconds
+        semaphore = asyncio.Semaphore(self.concurrency)
+        in_flight: set = set()
+        stats = {"dispatched": 0, "prioritized": 0, "visited": 0, "idle": 0, "failed": 0}
+        overrun = False
+
+        async with self.session_factory() as listing_db:
+            accounts = self._accounts(listing_db)
+            try:
+                async for account in accounts:
+                    if not account["prioritized"]:
+                        if time.monotonic() >= deadline:
+                            overrun = True
+                            break
+                        stats["dispatched"] += 1
+                        await self._visit_idle(account, stats)
+                        continue
+                    await semaphore.acquire()
+                    if time.monotonic() >= deadline:
+                        semaphore.release()
+                        overrun = True
+                        break
+                    stats["dispatched"] += 1
+                    stats["prioritized"] += 1
+                    task = asyncio.create_task(self._visit(account, semaphore, stats))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+            finally:
+                await accounts.aclose()
+            if in_flight:
+                await asyncio.gather(*in_flight)
+
+        elapsed = time.monotonic() - started
+        account_sweep_seconds.observe(elapsed)
+        report = {
+            **stats,
+            "elapsed_seconds": round(elapsed, 3),
+            "deadline_seconds": self.deadline_seconds,
+            "overrun": overrun,
+            "resume_cursors": dict(self.cursors),
+        }
+        if overrun:
+            account_sweep_overruns_total.inc()
+            logger.warning(f"Account sweep hit its {self.deadline_seconds}s deadline after {stats['dispatched']} accounts; "
+                           f"resuming from {self.cursors} next sweep.")
+        self.last_report = report
+        return report
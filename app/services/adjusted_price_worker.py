@@ -1,16 +1,21 @@
 import asyncio
 import logging
 from decimal import Decimal
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Callable, Awaitable
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.cache import set_adjusted_market_price_cache, get_adjusted_market_price_cache, get_group_symbol_settings_cache, REDIS_MARKET_DATA_CHANNEL
 from app.crud import group as crud_group
-from app.database.session import AsyncSessionLocal
+from app.database.session import TriggerSessionLocal
+from app.core.tick_latency import observe_tick, TICK_METADATA_KEYS, STAGE_WORKER_RECEIVED, STAGE_ADJUSTED_CACHED
+from app.core.pubsub import RedisSubscription
 import json
 
 logger = logging.getLogger("adjusted_price_worker")
 
+# Pause before subscribing again after the subscription failed with an unexpected error
+RESUBSCRIBE_DELAY_SECONDS = 1.0
+
 async def calculate_adjusted_prices_for_group(raw_market_data: Dict[str, Any], group_settings: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
     adjusted_prices = {}
     for symbol, settings in group_settings.items():
@@ -44,50 +49,65 @@ async def calculate_adjusted_prices_for_group(raw_market_data: Dict[str, Any], g
                 logger.error(f"Error adjusting price for {symbol_upper}: {e}", exc_info=True)
     return adjusted_prices
 
-async def adjusted_price_worker(redis_client: Redis):
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(REDIS_MARKET_DATA_CHANNEL)
+async def adjusted_price_worker(
+    redis_client: Redis,
+    on_prices_cached: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None
+):
+    """
+    Caches group-adjusted prices for every market data update (50ms debounce).
+    `on_prices_cached(raw_market_data)` is scheduled once a tick's adjusted prices are
+    in Redis, so consumers never evaluate against the previous tick's prices.
+    """
+    subscription = RedisSubscription(redis_client, [REDIS_MARKET_DATA_CHANNEL], "adjusted_price_worker")
+    await subscription.connect()
     logger.info("Adjusted price worker started. Listening for market data updates.")
     latest_market_data = None
     debounce_delay = 0.05  # 50ms debounce window
     last_update_time = None
     debounce_task = None
     update_event = asyncio.Event()
+    callback_tasks = set()
 
     async def process_latest():
         nonlocal latest_market_data
         if not latest_market_data:
             return
         try:
-            raw_market_data = {k: v for k, v in latest_market_data.items() if k not in ["type", "_timestamp"]}
-            async with AsyncSessionLocal() as db:
+            traced_message = latest_market_data
+            raw_market_data = {k: v for k, v in latest_market_data.items() if k not in TICK_METADATA_KEYS}
+            async with TriggerSessionLocal() as db:
                 groups = await crud_group.get_groups(db, skip=0, limit=1000)
                 group_names = set(g.name for g in groups if g.name)
-                for group_name in group_names:
-                    group_settings = await get_group_symbol_settings_cache(redis_client, group_name, "ALL")
-                    if not group_settings:
-                        continue
-                    adjusted_prices = await calculate_adjusted_prices_for_group(raw_market_data, group_settings)
-                    # Pipeline writes, but only if changed
-                    async with redis_client.pipeline() as pipe:
-                        for symbol, prices in adjusted_prices.items():
-                            # Check cache before writing
-                            cached = await get_adjusted_market_price_cache(redis_client, group_name, symbol)
-                            should_write = False
-                            if not cached:
+            for group_name in group_names:
+                group_settings = await get_group_symbol_settings_cache(redis_client, group_name, "ALL")
+                if not group_settings:
+                    continue
+                adjusted_prices = await calculate_adjusted_prices_for_group(raw_market_data, group_settings)
+                # Pipeline writes, but only if changed
+                async with redis_client.pipeline() as pipe:
+                    for symbol, prices in adjusted_prices.items():
+                        # Check cache before writing
+                        cached = await get_adjusted_market_price_cache(redis_client, group_name, symbol)
+                        should_write = False
+                        if not cached:
+                            should_write = True
+                        else:
+                            # Compare buy, sell, spread_value
+                            if (
+                                Decimal(str(prices['buy'])) != cached['buy'] or
+                                Decimal(str(prices['sell'])) != cached['sell'] or
+                                Decimal(str(prices['spread_value'])) != cached['spread_value']
+                            ):
                                 should_write = True
-                            else:
-                                # Compare buy, sell, spread_value
-                                if (
-                                    Decimal(str(prices['buy'])) != cached['buy'] or
-                                    Decimal(str(prices['sell'])) != cached['sell'] or
-                                    Decimal(str(prices['spread_value'])) != cached['spread_value']
-                                ):
-                                    should_write = True
-                            if should_write:
-                                await set_adjusted_market_price_cache(pipe, group_name, symbol, prices['buy'], prices['sell'], prices['spread_value'])
-                        await pipe.execute()
-                    logger.debug(f"Adjusted prices updated for group {group_name} ({len(adjusted_prices)} symbols)")
+                        if should_write:
+                            await set_adjusted_market_price_cache(pipe, group_name, symbol, prices['buy'], prices['sell'], prices['spread_value'])
+                    await pipe.execute()
+                logger.debug(f"Adjusted prices updated for group {group_name} ({len(adjusted_prices)} symbols)")
+            observe_tick(traced_message, STAGE_ADJUSTED_CACHED)
+            if on_prices_cached is not None:
+                task = asyncio.create_task(on_prices_cached(raw_market_data))
+                callback_tasks.add(task)
+                task.add_done_callback(callback_tasks.discard)
         except Exception as e:
             logger.error(f"Error in process_latest: {e}", exc_info=True)
 
@@ -103,20 +123,26 @@ async def adjusted_price_worker(redis_client: Redis):
     try:
         while True:
             try:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                if not message:
-                    await asyncio.sleep(0.01)
-                    continue
-                try:
-                    message_data = json.loads(message['data'])
-                except Exception:
-                    continue
-                latest_market_data = message_data
-                update_event.set()
+                async for message in subscription:
+                    try:
+                        try:
+                            message_data = json.loads(message['data'])
+                        except Exception:
+                            continue
+                        observe_tick(message_data, STAGE_WORKER_RECEIVED)
+                        latest_market_data = message_data
+                        update_event.set()
+                    except Exception as e:
+                        logger.error(f"Error in adjusted_price_worker main loop: {e}", exc_info=True)
+                break
             except Exception as e:
-                logger.error(f"Error in adjusted_price_worker main loop: {e}", exc_info=True)
-            await asyncio.sleep(0.01)
+                # Connection errors are retried by the subscription itself; anything else ended
+                # it, so subscribe again instead of stopping the worker
+                logger.error(f"Adjusted price worker subscription failed: {e}; resubscribing", exc_info=True)
+                await asyncio.sleep(RESUBSCRIBE_DELAY_SECONDS)
+                subscription = RedisSubscription(redis_client, [REDIS_MARKET_DATA_CHANNEL], "adjusted_price_worker")
     finally:
+        await subscription.close()
         debounce_task.cancel()
         try:
             await debounce_task
@@ -0,0 +1,359 @@
+# app/services/batch_close.py
+
+"""
+Closing many open positions of one account at once: close all, close all of a symbol,
+close all losing positions, or a list of order ids. Per position, /orders/close locks
+the user, re-reads the symbol's open orders twice for the hedged margin, queries
+ExternalSymbolInfo, probes for a close id and up to three wallet transaction ids,
+commits, and publishes three events. Here, in the account's turn:
+
+1. read     One SELECT of the account's open orders.
+2. price    Close prices from the group's resident price snapshot (group_state) for the
+            symbols it received a tick for in the last ORDER_PRICE_MAX_AGE_SECONDS, the
+            adjusted price cache for the others, read with the USD conversion pairs in
+            one MGET; contract size, profit currency (ExternalSymbolInfo.profit) and
+            commission from the resident symbol settings. Profit, commission and the hedged margin of each affected symbol are
+            computed in memory, once per symbol.
+3. commit   Close and wallet transaction ids reserved with one probe each, the user row
+            locked and the open orders re-read under the lock for the released hedged
+            margin, then one UPDATE of the orders, one multi-row INSERT of the wallet
+            transactions, one of the action history, and a single commit.
+
+One pipeline then stores the user data and publishes one ORDER_UPDATE.
+"""
+
+import logging
+import time
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.metrics import registry
+from app.services.account_actor import AccountActor, account_actor
+from app.services.order_placement import (
+    BUY_ORDER_TYPES, CENT, OrderProcessingError, _decimal, conversion_symbols, symbol_margin_contribution, to_usd,
+)
+
+logger = logging.getLogger(__name__)
+
+WALLET_QUANTUM = Decimal("0.00000001")
+
+SKIP_NO_PRICE = "No close price available for the symbol"
+SKIP_NO_SETTINGS = "Symbol settings not found for the account's group"
+SKIP_NO_CONVERSION = "No USD conversion rate for the symbol's profit currency"
+SKIP_NO_SYMBOL_INFO = "External symbol info not found for the symbol"
+SKIP_NOT_OPEN = "Order is not an open order of this account"
+
+batch_close_positions_total = registry.counter(
+    "batch_close_positions_total", "Positions selected by batch closes, by outcome.", ("outcome",)
+)
+_CLOSED = batch_close_positions_total.labels("closed")
+_SKIPPED = batch_close_positions_total.labels("skipped")
+batch_close_seconds = registry.histogram(
+    "batch_close_seconds", "Time to close the selected positions of one account."
+)
+
+
+class BatchCloseStore:
+    """Resident state, Redis and DB access of a batch close (the app's cache and crud helpers)."""
+
+    # Snapshot prices not refreshed by a tick for this many seconds are read from Redis
+    max_price_age = 5.0
+
+    def __init__(self, max_price_age: Optional[float] = None):
+        if max_price_age is not None:
+            self.max_price_age = max_price_age
+
+    async def snapshot_prices(self, group_name: str) -> Dict[str, Dict[str, Any]]:
+        from app.services.group_registry import group_states
+        return (await group_states.get(group_name)).fresh_prices(self.max_price_age)
+
+    async def fetch_prices(self, redis_client, group_name: str, symbols: List[str],
+                           conversions: List[str]) -> Dict[str, Dict[str, Any]]:
+        from app.core.cache import get_close_prices_cache
+        return await get_close_prices_cache(redis_client, group_name, symbols, conversions)
+
+    async def open_orders(self, db, user_id: int, user_type: str) -> List[Any]:
+        from app.crud import crud_order
+        return await crud_order.get_all_open_orders_by_user_id(db, user_id, crud_order.get_order_model(user_type))
+
+    async def reserve_ids(self, db, user_type: str, close_ids: int, transaction_ids: int) -> Tuple[List[str], List[str]]:
+        from app.database.models import Wallet
+        from app.services.order_processing import generate_unique_10_digit_id_batch, get_order_model
+        closes = await generate_unique_10_digit_id_batch(db, get_order_model(user_type), ['close_id'], close_ids)
+        transactions = await generate_unique_10_digit_id_batch(db, Wallet, ['transaction_id'], transaction_ids)
+        return [ids['close_id'] for ids in closes], [ids['transaction_id'] for ids in transactions]
+
+    async def lock_account(self, db, user_id: int, user_type: str) -> Any:
+        from app.crud.user import get_demo_user_by_id_with_lock, get_user_by_id_with_lock
+        if user_type == 'demo':
+            return await get_demo_user_by_id_with_lock(db, user_id)
+        return await get_user_by_id_with_lock(db, user_id)
+
+    async def close_orders(self, db, closes: Dict[str, Dict[str, Any]], user_type: str) -> int:
+        from app.crud import crud_order
+        return await crud_order.close_orders_bulk(db, closes, crud_order.get_order_model(user_type))
+
+    async def insert_wallet_rows(self, db, rows: List[Dict[str, Any]]) -> None:
+        from app.crud.wallet import create_wallet_records_bulk
+        await create_wallet_records_bulk(db, rows)
+
+    async def insert_history(self, db, rows: List[Dict[str, Any]]) -> None:
+        from app.crud.crud_order import create_order_action_history_bulk
+        await create_order_action_history_bulk(db, rows)
+
+    async def publish(self, redis_client, user_type: str, user_id: int, user_data: Dict[str, Any]) -> None:
+        from app.core.cache import publish_bulk_order_updates
+        await publish_bulk_order_updates(redis_client, user_type, {user_id: user_data})
+
+
+def _load_close_store() -> BatchCloseStore:
+    try:
+        from app.core.config import get_settings
+        return BatchCloseStore(max_price_age=get_settings().ORDER_PRICE_MAX_AGE_SECONDS)
+    except Exception:
+        return BatchCloseStore()
+
+
+default_close_store = _load_close_store()
+
+
+def close_price(order_type: str, price: Optional[Dict[str, Any]]) -> Optional[Decimal]:
+    """A buy closes at the group's sell (bid) price, a sell at its buy (ask) price."""
+    value = (price or {}).get('sell' if order_type in BUY_ORDER_TYPES else 'buy')
+    if value is None:
+        return None
+    value = _decimal(value)
+    return value if value > 0 else None
+
+
+def close_values(order: Any, price: Decimal, symbol_settings: Dict[str, Any],
+                 prices: Dict[str, Dict[str, Any]]) -> Dict[str, Decimal]:
+    """
+    Profit, commission and net profit of closing `order` at `price`, computed as
+    /orders/close does. Pure; raises OrderProcessingError when the symbol has no
+    ExternalSymbolInfo profit currency or a USD rate is missing.
+    """
+    quantity = _decimal(order.order_quantity)
+    entry_price = _decimal(order.order_price)
+    contract_size = _decimal(symbol_settings.get('contract_size'), '1')
+    profit_currency = symbol_settings.get('external_profit_currency')
+    if not profit_currency:
+        raise OrderProcessingError(SKIP_NO_SYMBOL_INFO)
+
+    exit_commission = Decimal("0.0")
+    commission_type = int(symbol_settings.get('commision_type', -1) or 0)
+    commission_value_type = int(symbol_settings.get('commision_value_type', -1) or 0)
+    commission_rate = _decimal(symbol_settings.get('commision'), '0.0')
+    if commission_type in [0, 2]:  # "Every Trade" or "Out"
+        if commission_value_type == 0:  # Per lot
+            exit_commission = quantity * commission_rate
+        elif commission_value_type == 1:  # Percent of price
+            exit_contract_value = quantity * contract_size * price
+            if exit_contract_value > Decimal("0.0"):
+                exit_commission = (commission_rate / Decimal("100")) * exit_contract_value
+    commission = (_decimal(order.commission, '0.0') + exit_commission).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    if order.order_type.upper() == "BUY":
+        profit = (price - entry_price) * quantity * contract_size
+    else:
+        profit = (entry_price - price) * quantity * contract_size
+    pairs = conversion_symbols(profit_currency)
+    if pairs and not any((prices.get(pair) or {}).get('b') is not None for pair in pairs):
+        raise OrderProcessingError(SKIP_NO_CONVERSION)
+    profit_usd = to_usd(profit, profit_currency, prices)
+    swap = _decimal(order.swap, '0.0')
+    return {
+        'close_price': price,
+        'commission': commission,
+        'net_profit': (profit_usd - commission).quantize(CENT, rounding=ROUND_HALF_UP),
+        'swap': swap,
+    }
+
+
+def released_margin(open_orders: List[Any], closing: Iterable[str]) -> Decimal:
+    """Decrease of the hedged margin when the `closing` order ids leave `open_orders`, symbol by symbol."""
+    closing = set(closing)
+    by_symbol: Dict[str, List[Any]] = {}
+    for order in open_orders:
+        by_symbol.setdefault(order.order_company_name.upper(), []).append(order)
+    released = Decimal("0")
+    for orders in by_symbol.values():
+        remaining = [order for order in orders if order.order_id not in closing]
+        if len(remaining) == len(orders):
+            continue
+        released += (symbol_margin_contribution(orders)["total_margin"] -
+                     symbol_margin_contribution(remaining)["total_margin"])
+    return released
+
+
+def _order_fields(order: Any, values: Dict[str, Any]) -> Dict[str, Any]:
+    fields = {
+        column: getattr(order, column, None)
+        for column in ('order_id', 'order_user_id', 'order_company_name', 'order_type', 'order_quantity',
+                       'order_price', 'status', 'stop_loss', 'take_profit', 'contract_value', 'margin',
+                       'created_at', 'stoploss_id', 'takeprofit_id')
+    }
+    return {**fields, **values, 'order_status': "CLOSED"}
+
+
+async def close_positions(
+    db,
+    redis_client,
+    account: Any,
+    user_type: str,
+    groups: Any,
+    order_ids: Optional[List[str]] = None,
+    symbol: Optional[str] = None,
+    losing_only: bool = False,
+    close_reason: str = "batch close",
+    store: BatchCloseStore = default_close_store,
+    actor: AccountActor = account_actor,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Closes the account's open positions selected by `order_ids`, else by `symbol` (all
+    symbols if None) and `losing_only`. Returns the fields of the closed orders and the
+    skipped ones ({'order_id', 'reason'}).
+    """
+    started = time.perf_counter()
+    user_id = account.id
+    group_name = account.group_name
+    symbol = symbol.upper() if symbol else None
+    skipped: List[Dict[str, Any]] = []
+
+    async with actor.hold(redis_client, user_type, user_id):
+        # 1. read
+        open_orders = list(await store.open_orders(db, user_id, user_type))
+        if order_ids is not None:
+            open_ids = {order.order_id for order in open_orders}
+            skipped.extend({'order_id': order_id, 'reason': SKIP_NOT_OPEN}
+                           for order_id in dict.fromkeys(order_ids) if order_id not in open_ids)
+            wanted = set(order_ids)
+            selected = [order for order in open_orders if order.order_id in wanted]
+        else:
+            selected = [order for order in open_orders
+                        if symbol is None or order.order_company_name.upper() == symbol]
+
+        # 2. price
+        group_settings = await groups.get(group_name) if group_name else {}
+        symbols = sorted({order.order_company_name.upper() for order in selected})
+        # Only symbols ticked within max_price_age; stale ones are read from the adjusted price cache
+        snapshot = await store.snapshot_prices(group_name) if group_name else {}
+        missing = [s for s in symbols if s not in snapshot]
+        conversions = sorted({pair for s in symbols
+                              for pair in conversion_symbols((group_settings.get(s) or {}).get('external_profit_currency'))})
+        cached = await store.fetch_prices(redis_client, group_name, missing, conversions) \
+            if missing or conversions else {"adjusted": {}, "last_price": {}}
+        group_prices = {**cached.get('adjusted', {}), **snapshot}
+        conversion_prices = cached.get('last_price', {})
+
+        priced: List[Tuple[Any, Dict[str, Any]]] = []
+        for order in selected:
+            order_symbol = order.order_company_name.upper()
+            symbol_settings = group_settings.get(order_symbol)
+            price = close_price(order.order_type.upper(), group_prices.get(order_symbol))
+            if not symbol_settings:
+                skipped.append({'order_id': order.order_id, 'reason': SKIP_NO_SETTINGS})
+                continue
+            if price is None:
+                skipped.append({'order_id': order.order_id, 'reason': SKIP_NO_PRICE})
+                continue
+            try:
+                values = close_values(order, price, symbol_settings, conversion_prices)
+            except OrderProcessingError as e:
+                skipped.append({'order_id': order.order_id, 'reason': str(e)})
+                continue
+            if losing_only and values['net_profit'] >= 0:
+                continue
+            priced.append((order, values))
+
+        if not priced:
+            await db.rollback()
+            _SKIPPED.inc(len(skipped))
+            return [], skipped
+
+        # 3. commit
+        wallet_entries = []
+        for order, values in priced:
+            if values['net_profit'] != Decimal("0.0"):
+                wallet_entries.append((order, "Profit/Loss", values['net_profit'], "P/L"))
+            if values['commission'] > Decimal("0.0"):
+                wallet_entries.append((order, "Commission", -values['commission'], "Commission"))
+            if values['swap'] != Decimal("0.0"):
+                wallet_entries.append((order, "Swap", -values['swap'], "Swap"))
+        try:
+            close_ids, transaction_ids = await store.reserve_ids(db, user_type, len(priced), len(wallet_entries))
+            locked = await store.lock_account(db, user_id, user_type)
+            if locked is None:
+                raise OrderProcessingError("Could not lock user record.")
+            # Re-read under the lock: writers outside the account's turn (service provider,
+            # bulk placement) lock the row, and may have changed the orders since step 1
+            locked_orders = list(await store.open_orders(db, user_id, user_type))
+
+            close_message = f"Closed by {close_reason}"
+            closes = {
+                order.order_id: {**values, 'close_id': close_id, 'close_message': close_message}
+                for (order, values), close_id in zip(priced, close_ids)
+            }
+            if await store.close_orders(db, closes, user_type) != len(closes):
+                raise OrderProcessingError("Some of the selected orders were closed concurrently; nothing was closed.")
+
+            transaction_time = datetime.now(timezone.utc)
+            owner_column = "demo_user_id" if user_type == 'demo' else "user_id"
+            await store.insert_wallet_rows(db, [
+                {
+                    owner_column: user_id,
+                    "symbol": order.order_company_name,
+                    "order_quantity": order.order_quantity,
+                    "is_approved": 1,
+                    "order_type": order.order_type,
+                    "transaction_time": transaction_time,
+                    "order_id": str(order.order_id),
+                    "transaction_type": transaction_type,
+                    "transaction_amount": amount,
+                    "description": f"{label} for closing order {order.order_id}",
+                    "transaction_id": transaction_id,
+                }
+                for (order, transaction_type, amount, label), transaction_id in zip(wallet_entries, transaction_ids)
+            ])
+            await store.insert_history(db, [
+                {"user_id": user_id, "user_type": user_type, "order_id": order_id, "close_id": fields['close_id'],
+                 "action_type": "BATCH_CLOSE"}
+                for order_id, fields in closes.items()
+            ])
+
+            realized = sum((values['net_profit'] - values['swap'] for _, values in priced), Decimal("0"))
+            locked.wallet_balance = (_decimal(locked.wallet_balance) + realized).quantize(WALLET_QUANTUM, rounding=ROUND_HALF_UP)
+            locked.margin = max(Decimal(0), (_decimal(locked.margin) - released_margin(locked_orders, closes))
+                                .quantize(CENT, rounding=ROUND_HALF_UP))
+            # Read before the commit expires the instance
+            user_data = {
+                "id": locked.id,
+                "email": getattr(locked, 'email', None),
+                "group_name": locked.group_name,
+                "leverage": locked.leverage,
+                "user_type": user_type,
+                "account_number": getattr(locked, 'account_number', None),
+                "wallet_balance": locked.wallet_balance,
+                "margin": locked.margin,
+                "first_name": getattr(locked, 'first_name', None),
+                "last_name": getattr(locked, 'last_name', None),
+                "country": getattr(locked, 'country', None),
+                "phone_number": getattr(locked, 'phone_number', None),
+            }
+            closed = [_order_fields(order, closes[order.order_id]) for order, _ in priced]
+            db.add(locked)
+            await db.commit()
+        except BaseException:
+            # Release the row lock now rather than when the request's session closes
+            await db.rollback()
+            raise
+
+    await store.publish(redis_client, user_type, user_id, user_data)
+    _CLOSED.inc(len(closed))
+    _SKIPPED.inc(len(skipped))
+    elapsed = time.perf_counter() - started
+    batch_close_seconds.observe(elapsed)
+    logger.info(f"Batch close for {user_type} user {user_id}: {len(closed)} closed, {len(skipped)} skipped "
+                f"in {elapsed:.3f}s")
+    return closed, skipped
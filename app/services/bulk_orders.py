@@ -0,0 +1,323 @@
+# app/services/bulk_orders.py
+
+"""
+Placement of one instruction on many accounts: a fund manager allocating a market order
+to the live accounts that follow them, each with its own quantity. It runs the phases
+of app.services.order_placement once for the whole allocation instead of once per
+account:
+
+1. prefetch  One SELECT of the accounts, the symbol settings of their groups from the
+             process-resident registry, one MGET for the last known prices of the
+             symbol and its USD conversion pairs, and the order routing of each group.
+2. evaluate  Pure CPU, per account: validation, margin, commission and USD conversion.
+3. commit    One transaction: reserve the ids of all orders (one probe per round),
+             lock the accounts with one SELECT ... FOR UPDATE, read their open orders
+             of the symbol with one SELECT, check each account's hedged margin against
+             its wallet balance, then one multi-row INSERT and one UPDATE of the margins.
+
+One pipeline then stores each account's user data and publishes one ORDER_UPDATE per
+account. An allocation that cannot be placed is rejected on its own (with a reason);
+the others are placed.
+
+All phases run in the turns (account_actor.hold_many) of the allocated accounts, like a
+single placement, so the placement is serialized with the accounts' other mutations in
+this and other processes. An account whose lease another process holds for too long is
+rejected on its own.
+"""
+
+import logging
+import time
+from collections import Counter
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, List, Tuple
+
+from app.core.metrics import registry
+from app.services.account_actor import AccountActor, account_actor
+from app.services.order_placement import (
+    CENT, OrderProcessingError, _decimal, _price_symbols, additional_margin, evaluate_order,
+)
+
+logger = logging.getLogger(__name__)
+
+REJECT_NOT_FOUND = "Account not found"
+REJECT_NOT_MANAGED = "Account is not managed by this fund manager"
+REJECT_DUPLICATE = "Account appears more than once in the allocations"
+REJECT_BUSY = "Account is busy"
+REJECT_ROUTED = "Orders of this account's group are routed externally; place them individually"
+REJECT_INSUFFICIENT_FUNDS = "Not enough wallet balance to cover additional margin."
+
+bulk_order_allocations_total = registry.counter(
+    "bulk_order_allocations_total", "Accounts of bulk order instructions, by outcome.", ("outcome",)
+)
+_PLACED = bulk_order_allocations_total.labels("placed")
+_REJECTED = bulk_order_allocations_total.labels("rejected")
+bulk_order_seconds = registry.histogram(
+    "bulk_order_seconds", "Time to place one bulk order instruction on all of its accounts."
+)
+
+
+class BulkOrderStore:
+    """Redis and DB access of a bulk placement (the app's cache and crud helpers)."""
+
+    async def load_accounts(self, db, user_ids: List[int]) -> List[Any]:
+        from app.crud.user import get_users_by_ids
+        return await get_users_by_ids(db, user_ids, "live")
+
+    async def fetch_prices(self, redis_client, symbols: List[str]) -> Dict[str, Any]:
+        from app.core.cache import get_order_placement_cache
+        return (await get_order_placement_cache(redis_client, symbols)).get('last_price') or {}
+
+    async def market_data(self, symbol: str) -> Dict[str, Any]:
+        from app.core.firebase import get_latest_market_data
+        return await get_latest_market_data(symbol)
+
+    async def routes_externally(self, db, redis_client, group_name: str) -> bool:
+        """Whether the group's live orders are sent to Barclays (see orders.is_barclays_live_user)."""
+        from app.core.cache import get_group_settings_cache
+        from app.crud import group as crud_group
+        group_settings = await get_group_settings_cache(redis_client, group_name)
+        sending_orders = group_settings.get("sending_orders") if group_settings else None
+        if not sending_orders:
+            db_groups = await crud_group.get_group_by_name(db, group_name)
+            sending_orders = getattr(db_groups[0], 'sending_orders', None) if db_groups else None
+        return bool(sending_orders) and sending_orders.lower() == "barclays"
+
+    async def reserve_ids(self, db, columns: List[str], count: int) -> List[Dict[str, str]]:
+        from app.database.models import UserOrder
+        from app.services.order_processing import generate_unique_10_digit_id_batch
+        return await generate_unique_10_digit_id_batch(db, UserOrder, columns, count)
+
+    async def lock_accounts(self, db, user_ids: List[int]) -> List[Any]:
+        from app.crud.user import get_users_by_ids_with_lock
+        return await get_users_by_ids_with_lock(db, user_ids, "live")
+
+    async def open_orders(self, db, user_ids: List[int], symbol: str) -> Dict[int, List[Dict[str, Any]]]:
+        from app.crud import crud_order
+        return await crud_order.get_open_orders_by_user_ids_and_symbol(db, user_ids, symbol)
+
+    async def insert_orders(self, db, rows: List[Dict[str, Any]]) -> None:
+        from app.crud import crud_order
+        await crud_order.create_orders_bulk(db, rows)
+
+    async def update_margins(self, db, margins: Dict[int, Decimal]) -> None:
+        from app.crud.user import update_users_margin_bulk
+        await update_users_margin_bulk(db, margins, "live")
+
+    async def publish(self, redis_client, accounts: Dict[int, Dict[str, Any]]) -> None:
+        from app.core.cache import publish_bulk_order_updates
+        await publish_bulk_order_updates(redis_client, "live", accounts)
+
+
+default_bulk_store = BulkOrderStore()
+
+
+def is_verified(manager: Any) -> bool:
+    """Whether `manager` completed account verification (isActive)."""
+    return getattr(manager, 'isActive', 0) == 1
+
+
+def manages(manager: Any, account: Any) -> bool:
+    """
+    Whether `account` follows `manager`: the manager is verified, the account is not
+    self-trading and names the manager as its fund manager by id or account number
+    (both unique, unlike names).
+    """
+    if not is_verified(manager) or getattr(account, 'is_self_trading', 1) != 0:
+        return False
+    if account.id == manager.id:
+        return False
+    fund_manager = str(getattr(account, 'fund_manager', None) or '').strip()
+    return bool(fund_manager) and fund_manager in {
+        str(value) for value in (manager.id, getattr(manager, 'account_number', None)) if value
+    }
+
+
+def _user_data(account: Any, margin: Decimal) -> Dict[str, Any]:
+    """The account's user data cache entry (same fields as get_user_data_cache)."""
+    return {
+        "id": account.id,
+        "email": account.email,
+        "group_name": account.group_name,
+        "leverage": account.leverage,
+        "user_type": account.user_type,
+        "account_number": getattr(account, 'account_number', None),
+        "wallet_balance": account.wallet_balance,
+        "margin": margin,
+        "first_name": getattr(account, 'first_name', None),
+        "last_name": getattr(account, 'last_name', None),
+        "country": getattr(account, 'country', None),
+        "phone_number": getattr(account, 'phone_number', None),
+    }
+
+
+async def place_bulk_orders(
+    db,
+    redis_client,
+    manager: Any,
+    instruction: Dict[str, Any],
+    allocations: List[Tuple[int, Decimal]],
+    groups: Any,
+    store: BulkOrderStore = default_bulk_store,
+    actor: AccountActor = account_actor,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Places `instruction` (symbol, order_type, stop_loss, take_profit, status) on each
+    (user_id, quantity) of `allocations`. Returns the fields of the orders created and
+    the rejected allocations ({'user_id', 'reason'}).
+    """
+    started = time.perf_counter()
+    symbol = instruction['symbol'].upper()
+    order_type = instruction['order_type'].upper()
+    rejected: List[Dict[str, Any]] = []
+
+    allocated = Counter(user_id for user_id, _ in allocations)
+    single: List[Tuple[int, Decimal]] = []
+    for user_id, quantity in allocations:
+        if allocated[user_id] > 1:
+            # Which of the quantities was meant is unknown: none of them is placed
+            rejected.append({'user_id': user_id, 'reason': REJECT_DUPLICATE})
+        else:
+            single.append((user_id, quantity))
+
+    rows: List[Dict[str, Any]] = []
+    cached: Dict[int, Dict[str, Any]] = {}
+    # The turns are taken before any DB work, as for a single placement, so no pooled
+    # connection is held while waiting for them
+    async with actor.hold_many(redis_client, "live", [user_id for user_id, _ in single]) as busy:
+        if busy:
+            busy = set(busy)
+            rejected.extend({'user_id': user_id, 'reason': REJECT_BUSY} for user_id, _ in single if user_id in busy)
+            single = [(user_id, quantity) for user_id, quantity in single if user_id not in busy]
+        if single:
+            priced = await _prefetch_and_evaluate(db, redis_client, manager, symbol, order_type, single, groups,
+                                                  rejected, store)
+            if priced:
+                await _commit(db, instruction, symbol, order_type, priced, rows, cached, rejected, store)
+    if cached:
+        await store.publish(redis_client, cached)
+
+    _PLACED.inc(len(rows))
+    _REJECTED.inc(len(rejected))
+    elapsed = time.perf_counter() - started
+    bulk_order_seconds.observe(elapsed)
+    logger.info(f"Bulk {order_type} {symbol}: {len(rows)} orders placed, {len(rejected)} rejected "
+                f"in {elapsed:.3f}s")
+    return rows, rejected
+
+
+async def _prefetch_and_evaluate(
+    db,
+    redis_client,
+    manager: Any,
+    symbol: str,
+    order_type: str,
+    allocations: List[Tuple[int, Decimal]],
+    groups: Any,
+    rejected: List[Dict[str, Any]],
+    store: BulkOrderStore,
+) -> Dict[int, Tuple[Decimal, Dict[str, Any]]]:
+    """Phases 1 and 2: returns {user_id: (quantity, priced order)}, appends to `rejected`."""
+    # Phase 1: prefetch
+    user_ids = [user_id for user_id, _ in allocations]
+    accounts = {account.id: account for account in await store.load_accounts(db, user_ids)}
+    group_names = sorted({account.group_name for account in accounts.values() if account.group_name})
+    group_settings, routed, requested = {}, set(), {symbol}
+    for group_name in group_names:
+        group_settings[group_name] = await groups.get(group_name) or {}
+        requested.update(_price_symbols(symbol, group_settings[group_name]))
+        # One statement at a time on the session, and only on a cache miss
+        if await store.routes_externally(db, redis_client, group_name):
+            routed.add(group_name)
+    prices = dict(await store.fetch_prices(redis_client, sorted(requested)))
+    if symbol not in prices:
+        # No tick persisted for the symbol yet
+        market_data = await store.market_data(symbol)
+        if market_data:
+            prices[symbol] = market_data
+
+    # Phase 2: evaluate
+    priced: Dict[int, Tuple[Decimal, Dict[str, Any]]] = {}
+    for user_id, quantity in allocations:
+        account = accounts.get(user_id)
+        if account is None:
+            rejected.append({'user_id': user_id, 'reason': REJECT_NOT_FOUND})
+            continue
+        if not manages(manager, account):
+            rejected.append({'user_id': user_id, 'reason': REJECT_NOT_MANAGED})
+            continue
+        if account.group_name in routed:
+            rejected.append({'user_id': user_id, 'reason': REJECT_ROUTED})
+            continue
+        order = {'symbol': symbol, 'order_type': order_type, 'quantity': quantity, 'order_price': Decimal('0')}
+        inputs = {
+            'user_data': {'leverage': account.leverage},
+            'symbol_settings': group_settings.get(account.group_name, {}).get(symbol),
+            'prices': prices,
+        }
+        try:
+            priced[user_id] = (quantity, evaluate_order(order, inputs))
+        except OrderProcessingError as e:
+            rejected.append({'user_id': user_id, 'reason': str(e)})
+    return priced
+
+
+async def _commit(
+    db,
+    instruction: Dict[str, Any],
+    symbol: str,
+    order_type: str,
+    priced: Dict[int, Tuple[Decimal, Dict[str, Any]]],
+    rows: List[Dict[str, Any]],
+    cached: Dict[int, Dict[str, Any]],
+    rejected: List[Dict[str, Any]],
+    store: BulkOrderStore,
+) -> None:
+    """Phase 3, in the accounts' turns: fills `rows`, `cached` and `rejected`."""
+    id_columns = ['order_id']
+    if instruction.get('stop_loss') is not None:
+        id_columns.append('stoploss_id')
+    if instruction.get('take_profit') is not None:
+        id_columns.append('takeprofit_id')
+    try:
+        ids = await store.reserve_ids(db, id_columns, len(priced))
+        locked = {account.id: account for account in await store.lock_accounts(db, list(priced))}
+        open_orders = await store.open_orders(db, list(priced), symbol)
+        margins: Dict[int, Decimal] = {}
+        for user_id, (quantity, values) in priced.items():
+            account = locked.get(user_id)
+            if account is None:
+                rejected.append({'user_id': user_id, 'reason': REJECT_NOT_FOUND})
+                continue
+            used_margin = _decimal(account.margin)
+            extra = additional_margin(open_orders.get(user_id, []), order_type, quantity, values['margin'])
+            if _decimal(account.wallet_balance) < used_margin + extra:
+                rejected.append({'user_id': user_id, 'reason': REJECT_INSUFFICIENT_FUNDS})
+                continue
+            margins[user_id] = (used_margin + extra).quantize(CENT, rounding=ROUND_HALF_UP)
+            order_ids = ids[len(rows)]
+            rows.append({
+                'order_id': order_ids['order_id'],
+                'order_status': "OPEN",
+                'order_user_id': user_id,
+                'order_company_name': symbol,
+                'order_type': order_type,
+                'order_price': values['price'],
+                'order_quantity': quantity,
+                'contract_value': values['contract_value'],
+                'margin': values['margin'],
+                'commission': values['commission'],
+                'stop_loss': instruction.get('stop_loss'),
+                'take_profit': instruction.get('take_profit'),
+                'stoploss_id': order_ids.get('stoploss_id'),
+                'takeprofit_id': order_ids.get('takeprofit_id'),
+                'status': instruction.get('status'),
+            })
+            # Read before the commit expires the instances
+            cached[user_id] = _user_data(account, margins[user_id])
+        await store.insert_orders(db, rows)
+        await store.update_margins(db, margins)
+        await db.commit()
+    except BaseException:
+        # Release the row locks now rather than when the request's session closes
+        await db.rollback()
+        raise
@@ -0,0 +1,64 @@
+# app/services/group_registry.py
+
+"""
+The group state resident in this process, shared by the /ws/market-data endpoint and
+the order services:
+
+- group_symbol_registry: each group's symbol settings, re-read from the DB at most once
+  per GROUP_SYMBOL_REGISTRY_TTL_SECONDS however many sockets and orders need them,
+- group_states: each group's adjusted price snapshot, built from those settings.
+
+Services import them from here rather than from the endpoint module.
+"""
+
+import logging
+from typing import Any, Dict, Optional
+
+from app.services.group_state import GroupStateRegistry
+from app.services.ws_bootstrap import GroupSymbolRegistry
+
+logger = logging.getLogger(__name__)
+
+
+async def update_group_symbol_settings(group_name: str, db, redis_client) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Caches the group's symbol settings in Redis and returns them as {SYMBOL: settings}
+    (None if they could not be loaded).
+    """
+    from app.core.cache import set_group_symbol_settings_cache_bulk
+    from app.crud import group as crud_group
+
+    if not group_name:
+        logger.warning("Cannot update group-symbol settings: group_name is missing.")
+        return None
+    try:
+        # One joined query for all of the group's symbols, one pipeline to cache them
+        group_settings, cached_settings = await crud_group.get_group_symbol_settings(db, group_name)
+        if not group_settings:
+            logger.warning(f"No group settings found in DB for group '{group_name}'.")
+            return None
+        await set_group_symbol_settings_cache_bulk(redis_client, group_name, cached_settings)
+        logger.debug(f"Cached/updated group-symbol settings for group '{group_name}'.")
+        return cached_settings
+    except Exception as e:
+        logger.error(f"Error caching group-symbol settings for '{group_name}': {e}", exc_info=True)
+        return None
+
+
+async def _load_group_symbol_settings(group_name: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    from app.database.session import WsSessionLocal
+    from app.dependencies.redis_client import get_redis_client
+    async with WsSessionLocal() as db:
+        return await update_group_symbol_settings(group_name, db, await get_redis_client())
+
+
+def _registry_ttl() -> float:
+    try:
+        from app.core.config import get_settings
+        return get_settings().GROUP_SYMBOL_REGISTRY_TTL_SECONDS
+    except Exception:
+        return 60.0
+
+
+group_symbol_registry = GroupSymbolRegistry(_load_group_symbol_settings, ttl=_registry_ttl())
+group_states = GroupStateRegistry(group_symbol_registry.get)
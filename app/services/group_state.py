@@ -0,0 +1,239 @@
+# app/services/group_state.py
+
+"""
+Per-group market state shared by all /ws/market-data connections of a process.
+
+A raw market data message is decoded once per process (MarketTickDecoder), and its
+group-adjusted prices are calculated once per group (GroupState.apply), no matter how
+many sockets receive it. Group state is held as read-only structures that connections
+only reference:
+
+    settings   {SYMBOL: {setting: value}} from the group symbol registry, frozen
+    prices     {SYMBOL: {"buy", "sell", "spread"}} snapshot, replaced (never mutated)
+               on every tick that changes a price; `version` counts the snapshots
+
+A connection keeps a GroupPriceCursor (the group plus the last version it sent) instead
+of its own copies of settings, all-symbols prices and last sent prices.
+"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+from decimal import Decimal
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Deque, Dict, Mapping, Optional, Tuple
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+group_state_ticks_applied_total = registry.counter(
+    "group_state_ticks_applied_total", "Market data messages applied to shared per-group state."
+)
+
+
+class MarketTick:
+    """A decoded market data message; `prices` holds only the symbol entries."""
+
+    __slots__ = ("seq", "data", "prices")
+
+    def __init__(self, seq: int, data: Dict[str, Any], metadata_keys: Tuple[str, ...]):
+        self.seq = seq
+        self.data = data
+        self.prices = {k: v for k, v in data.items() if k not in metadata_keys and isinstance(v, dict)}
+
+
+class MarketTickDecoder:
+    """
+    Decodes each distinct market data payload once per process. Every socket gets its own
+    copy of a published message; the ones seen in the last `history` messages are looked
+    up instead of decoded again. Ticks are numbered in the order they are first decoded.
+    """
+
+    def __init__(self, loads: Callable[[Any], Dict[str, Any]], metadata_keys: Tuple[str, ...] = (),
+                 history: int = 256):
+        self._loads = loads
+        self._metadata_keys = tuple(metadata_keys)
+        self._history = history
+        self._seen: "OrderedDict[Any, MarketTick]" = OrderedDict()
+        self._seq = 0
+
+    def decode(self, payload: Any) -> Tuple[MarketTick, bool]:
+        """Returns (tick, first) where `first` is True for the first decode of this payload."""
+        tick = self._seen.get(payload)
+        if tick is not None:
+            return tick, False
+        self._seq += 1
+        tick = MarketTick(self._seq, self._loads(payload), self._metadata_keys)
+        self._seen[payload] = tick
+        if len(self._seen) > self._history:
+            self._seen.popitem(last=False)
+        return tick, True
+
+
+def freeze_settings(settings: Optional[Dict[str, Dict[str, Any]]]) -> Mapping[str, Mapping[str, Any]]:
+    return MappingProxyType({symbol.upper(): MappingProxyType(dict(symbol_settings or {}))
+                             for symbol, symbol_settings in (settings or {}).items()})
+
+
+def adjusted_price(prices: Dict[str, Any], symbol_settings: Mapping[str, Any]) -> Optional[Dict[str, float]]:
+    """
+    Group-adjusted price of a raw tick entry (Firebase 'b' is Ask, 'o' is Bid): half the
+    configured spread is added to the ask and taken off the bid.
+    """
+    raw_ask_price, raw_bid_price = prices.get('b'), prices.get('o')
+    if raw_ask_price is None or raw_bid_price is None:
+        return None
+    try:
+        spread_pip_setting = Decimal(str(symbol_settings.get('spread_pip', 0)))
+        half_spread = Decimal(str(symbol_settings.get('spread', 0))) * spread_pip_setting / Decimal(2)
+        buy = Decimal(str(raw_ask_price)) + half_spread
+        sell = Decimal(str(raw_bid_price)) - half_spread
+        spread = (buy - sell) / spread_pip_setting if spread_pip_setting > Decimal("0.0") else Decimal("0.0")
+    except Exception as e:
+        logger.error(f"Error adjusting price: {e}", exc_info=True)
+        try:
+            # Send the raw price if the calculation fails
+            buy, sell = Decimal(str(raw_ask_price)), Decimal(str(raw_bid_price))
+        except Exception:
+            return None
+        spread = buy - sell
+    return {'buy': float(buy), 'sell': float(sell), 'spread': float(spread)}
+
+
+class GroupState:
+    """
+    Frozen settings and versioned price snapshots of one group. The last `history`
+    versions remember which symbols they changed, so a connection can ask for the
+    prices changed since the version it last sent.
+    """
+
+    def __init__(self, name: str, settings: Optional[Dict[str, Dict[str, Any]]] = None, history: int = 256):
+        self.name = name
+        self.settings: Mapping[str, Mapping[str, Any]] = EMPTY
+        self.symbols: frozenset = frozenset()
+        self.settings_version = 0
+        self._source: Any = None
+        self.prices: Mapping[str, Dict[str, float]] = EMPTY
+        self.version = 0
+        self._changes: Deque[Tuple[int, Tuple[str, ...]]] = deque(maxlen=history)
+        self._symbol_seq: Dict[str, int] = {}
+        # time.monotonic() of the last tick that carried each symbol
+        self._symbol_ticked_at: Dict[str, float] = {}
+        self.set_settings(settings)
+
+    def set_settings(self, settings: Optional[Dict[str, Dict[str, Any]]]) -> None:
+        """
+        Replaces the settings if `settings` is not the object they were built from.
+        Prices of symbols the new settings no longer have are dropped from the snapshot.
+        """
+        if settings is self._source and self.settings_version:
+            return
+        self._source = settings
+        self.settings = freeze_settings(settings)
+        self.symbols = frozenset(self.settings)
+        self.settings_version += 1
+        removed = [symbol for symbol in self.prices if symbol not in self.symbols]
+        if removed:
+            self.prices = MappingProxyType({s: p for s, p in self.prices.items() if s in self.symbols})
+            for symbol in removed:
+                self._symbol_seq.pop(symbol, None)
+                self._symbol_ticked_at.pop(symbol, None)
+
+    def apply(self, tick: MarketTick) -> Mapping[str, Dict[str, float]]:
+        """
+        Applies a tick once per group: symbols already updated by this or a later tick are
+        skipped, so sockets that process ticks late or in a different order agree.
+        Returns the prices this call changed.
+        """
+        changed = {}
+        symbol_seq, settings, current = self._symbol_seq, self.settings, self.prices
+        ticked_at, now = self._symbol_ticked_at, time.monotonic()
+        for symbol, prices in tick.prices.items():
+            symbol = symbol.upper()
+            symbol_settings = settings.get(symbol)
+            if symbol_settings is None or symbol_seq.get(symbol, 0) >= tick.seq:
+                continue
+            symbol_seq[symbol] = tick.seq
+            ticked_at[symbol] = now
+            price = adjusted_price(prices, symbol_settings)
+            if price is not None and price != current.get(symbol):
+                changed[symbol] = price
+        if not changed:
+            return EMPTY
+        snapshot = dict(current)
+        snapshot.update(changed)
+        self.prices = MappingProxyType(snapshot)
+        self.version += 1
+        self._changes.append((self.version, tuple(changed)))
+        group_state_ticks_applied_total.inc()
+        return changed
+
+    def fresh_prices(self, max_age: float) -> Dict[str, Dict[str, float]]:
+        """
+        Prices of the symbols a tick carried within the last `max_age` seconds. The
+        snapshot only moves while a connection of the group processes ticks; a symbol
+        nobody has received a tick for lately is left out.
+        """
+        oldest = time.monotonic() - max_age
+        ticked_at = self._symbol_ticked_at
+        return {symbol: price for symbol, price in self.prices.items() if ticked_at.get(symbol, 0.0) >= oldest}
+
+    def changed_since(self, version: int) -> Mapping[str, Dict[str, float]]:
+        """Current prices of the symbols changed after `version` (all of them if too old)."""
+        if version >= self.version:
+            return EMPTY
+        if not self._changes or self._changes[0][0] > version + 1:
+            return self.prices
+        if self._changes[-1][0] == version + 1:
+            symbols = self._changes[-1][1]
+        else:
+            symbols = {symbol for v, changed in reversed(self._changes) if v > version for symbol in changed}
+        prices = self.prices
+        # A symbol may have been removed by a settings reload since it changed
+        return {symbol: prices[symbol] for symbol in symbols if symbol in prices}
+
+
+class GroupPriceCursor:
+    """What a connection keeps of its group's prices: the group and the last version sent."""
+
+    __slots__ = ("group", "version")
+
+    def __init__(self, group: GroupState):
+        self.group = group
+        self.version = 0
+
+    def take(self, everything: bool = False) -> Mapping[str, Dict[str, float]]:
+        """Prices to send: all of them, or those changed since the last take."""
+        group = self.group
+        prices = group.prices if everything else group.changed_since(self.version)
+        self.version = group.version
+        return prices
+
+
+class GroupStateRegistry:
+    """
+    GroupState per group for this process. Settings come from `load_settings` (the
+    resident group symbol registry); a GroupState object is never replaced, so cursors
+    keep seeing reloaded settings and new prices.
+    """
+
+    def __init__(self, load_settings: Callable[[str], Awaitable[Optional[Dict[str, Dict[str, Any]]]]],
+                 history: int = 256):
+        self._load_settings = load_settings
+        self._history = history
+        self._groups: Dict[str, GroupState] = {}
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    async def get(self, group_name: str) -> GroupState:
+        settings = await self._load_settings(group_name)
+        state = self._groups.get(group_name)
+        if state is None:
+            state = self._groups[group_name] = GroupState(group_name, settings, self._history)
+        else:
+            state.set_settings(settings)
+        return state
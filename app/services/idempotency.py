@@ -0,0 +1,220 @@
+# app/services/idempotency.py
+
+"""
+Idempotent execution of order submissions keyed by the client's Idempotency-Key.
+
+A Redis record per (scope, account, key) tracks the first execution:
+
+    {"state": "in_flight", "fingerprint": ..., "owner": ...}                  SET NX, in-flight ttl
+    {"state": "done", "fingerprint": ..., "status_code": ..., "body"/"detail": ...}   result ttl
+
+- the first request with a key runs the handler and stores its response, or its 4xx error;
+- a duplicate arriving while the first one runs awaits it: in process through a shared
+  future, across processes by polling the record;
+- a duplicate arriving later gets the stored response without running the handler;
+- the key reused with a different request body is rejected (422);
+- a handler failing with a 5xx or an unexpected exception deletes the record, so the
+  client's retry runs again.
+
+Without a key, or if Redis cannot be reached, the handler just runs.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULT_TTL_SECONDS = 86400.0
+DEFAULT_IN_FLIGHT_TTL_SECONDS = 60.0
+DEFAULT_WAIT_SECONDS = 30.0
+MAX_KEY_LENGTH = 255
+
+STATE_IN_FLIGHT = "in_flight"
+STATE_DONE = "done"
+
+# Deletes the in-flight record only if it is still ours
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+idempotent_requests_total = registry.counter(
+    "idempotent_requests_total", "Requests carrying an Idempotency-Key, by outcome.", ("outcome",)
+)
+_OUTCOMES = {outcome: idempotent_requests_total.labels(outcome)
+             for outcome in ("executed", "joined", "replayed", "conflict", "timeout", "unavailable")}
+
+
+class IdempotencyError(Exception):
+    """A request that must be answered with `status_code` instead of running (or a replayed 4xx)."""
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def request_fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def record_key(scope: str, user_type: Optional[str], user_id: Any, idempotency_key: str) -> str:
+    return f"idempotency:{scope}:{str(user_type or 'live').lower()}:{user_id}:{idempotency_key}"
+
+
+class IdempotencyGuard:
+    """Runs a handler at most once per Idempotency-Key."""
+
+    def __init__(self, result_ttl: float = DEFAULT_RESULT_TTL_SECONDS,
+                 in_flight_ttl: float = DEFAULT_IN_FLIGHT_TTL_SECONDS, wait: float = DEFAULT_WAIT_SECONDS):
+        self.result_ttl_ms = int(result_ttl * 1000)
+        self.in_flight_ttl_ms = int(in_flight_ttl * 1000)
+        self.wait = wait
+        # Executions running in this process: record key -> (fingerprint, future of the done record)
+        self._in_flight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def run(
+        self,
+        redis_client,
+        scope: str,
+        user_type: Optional[str],
+        user_id: Any,
+        idempotency_key: Optional[str],
+        payload: Any,
+        handler: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], Any] = lambda result: result,
+    ) -> Any:
+        """
+        The handler's result, or for a duplicate the first execution's `encode`d result.
+        Raises IdempotencyError for a reused key, a wait timeout or a replayed 4xx.
+        """
+        if idempotency_key is None:
+            return await handler()
+        if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH or not idempotency_key.isprintable():
+            raise IdempotencyError(400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} printable characters")
+
+        key = record_key(scope, user_type, user_id, idempotency_key)
+        fingerprint = request_fingerprint(payload)
+        deadline = time.monotonic() + self.wait
+        delay = 0.005
+        while True:
+            local = self._in_flight.get(key)
+            if local is not None:
+                record = await self._join(local, fingerprint, deadline)
+                if record is None:
+                    # The first execution failed and released the key: run it here
+                    continue
+                return self._replay(record, fingerprint)
+
+            in_flight = json.dumps({"state": STATE_IN_FLIGHT, "fingerprint": fingerprint,
+                                    "owner": secrets.token_hex(8)})
+            # Duplicates in this process join this attempt from here on instead of polling Redis
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = (fingerprint, future)
+            try:
+                claimed = await redis_client.set(key, in_flight, nx=True, px=self.in_flight_ttl_ms)
+                raw = None if claimed else await redis_client.get(key)
+            except Exception as e:
+                _OUTCOMES["unavailable"].inc()
+                logger.warning(f"Idempotency record {key} unavailable, deduplicating in process only: {e}")
+                return await self._execute(None, key, in_flight, fingerprint, future, handler, encode)
+            except BaseException:
+                self._hand_back(key, future)
+                raise
+            if claimed:
+                return await self._execute(redis_client, key, in_flight, fingerprint, future, handler, encode)
+            # Another process has the key: duplicates here check again
+            self._hand_back(key, future)
+            if raw is None:
+                # Expired or released in between
+                continue
+            record = json.loads(raw)
+            if record.get("state") == STATE_DONE or record.get("fingerprint") != fingerprint:
+                return self._replay(record, fingerprint)
+            # Running in another process
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _OUTCOMES["timeout"].inc()
+                raise IdempotencyError(409, "A request with this Idempotency-Key is still being processed")
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.1)
+
+    async def _join(self, local: Tuple[str, asyncio.Future], fingerprint: str,
+                    deadline: float) -> Optional[Dict[str, Any]]:
+        local_fingerprint, future = local
+        if local_fingerprint != fingerprint:
+            _OUTCOMES["conflict"].inc()
+            raise IdempotencyError(422, "Idempotency-Key was already used with a different request")
+        _OUTCOMES["joined"].inc()
+        # asyncio.wait leaves the shared future alone on timeout or cancellation
+        done, _ = await asyncio.wait({future}, timeout=max(0.0, deadline - time.monotonic()))
+        if not done:
+            _OUTCOMES["timeout"].inc()
+            raise IdempotencyError(409, "A request with this Idempotency-Key is still being processed")
+        return future.result()
+
+    def _replay(self, record: Dict[str, Any], fingerprint: str) -> Any:
+        if record.get("fingerprint") != fingerprint:
+            _OUTCOMES["conflict"].inc()
+            raise IdempotencyError(422, "Idempotency-Key was already used with a different request")
+        _OUTCOMES["replayed"].inc()
+        status_code = record.get("status_code", 200)
+        if status_code >= 400:
+            raise IdempotencyError(status_code, record.get("detail"))
+        return record.get("body")
+
+    def _hand_back(self, key: str, future: asyncio.Future) -> None:
+        del self._in_flight[key]
+        future.set_result(None)
+
+    async def _execute(self, redis_client, key: str, in_flight: str, fingerprint: str, future: asyncio.Future,
+                       handler: Callable[[], Awaitable[Any]], encode: Callable[[Any], Any]) -> Any:
+        """Runs the handler; redis_client=None when Redis failed (nothing stored)."""
+        record = None
+        _OUTCOMES["executed"].inc()
+        try:
+            try:
+                result = await handler()
+            except Exception as e:
+                status_code = getattr(e, "status_code", None)
+                if isinstance(status_code, int) and status_code < 500:
+                    # A rejected request stays rejected for its retries
+                    record = {"state": STATE_DONE, "fingerprint": fingerprint, "status_code": status_code,
+                              "detail": getattr(e, "detail", str(e))}
+                raise
+            record = {"state": STATE_DONE, "fingerprint": fingerprint, "status_code": 200, "body": encode(result)}
+            return result
+        finally:
+            del self._in_flight[key]
+            future.set_result(record)
+            if redis_client is not None:
+                try:
+                    if record is not None:
+                        await redis_client.set(key, json.dumps(record, default=str), px=self.result_ttl_ms)
+                    else:
+                        await redis_client.eval(_RELEASE_SCRIPT, 1, key, in_flight)
+                except Exception as e:
+                    logger.warning(f"Could not store idempotency record {key}: {e}")
+
+
+def _load_guard() -> IdempotencyGuard:
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        return IdempotencyGuard(result_ttl=settings.IDEMPOTENCY_RESULT_TTL_SECONDS,
+                                in_flight_ttl=settings.IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS,
+                                wait=settings.IDEMPOTENCY_WAIT_SECONDS)
+    except Exception:
+        return IdempotencyGuard()
+
+
+idempotency_guard = _load_guard()
@@ -31,7 +31,9 @@ from app.core.cache import (
 )
 from app.core.firebase import get_latest_market_data
 from app.crud.crud_symbol import get_symbol_type
+from app.crud.external_symbol_info import fix_symbol_matches
 from app.services.portfolio_calculator import _convert_to_usd, _calculate_adjusted_prices_from_raw
+from app.services.order_placement import single_order_margin
 from app.core.logging_config import orders_logger
 
 logger = logging.getLogger(__name__)
@@ -112,126 +114,16 @@ async def calculate_single_order_margin(
     Reduces Firebase calls and parallelizes operations for sub-500ms performance.
     """
     try:
-        # Step 1: Extract data from parameters (no additional calls needed)
-        contract_size = Decimal(str(external_symbol_info.get('contract_size', '1')))
         profit_currency = external_symbol_info.get('profit_currency', 'USD')
-        digit = int(external_symbol_info.get('digit', '5'))
-        
-        # Step 2: Get adjusted prices from raw market data (no additional Firebase calls)
-        if not raw_market_data or symbol not in raw_market_data:
-            orders_logger.error(f"[MARGIN_CALC] No market data for symbol {symbol}")
-            return None, None, None, None
-        
-        symbol_data = raw_market_data.get(symbol, {})
-        if not symbol_data:
-            orders_logger.error(f"[MARGIN_CALC] No data for symbol {symbol} in market data")
-            return None, None, None, None
-        
-        # Debug: Log the market data we received
-        orders_logger.info(f"[MARGIN_CALC] Market data for {symbol}: {symbol_data}")
-        
-        # Extract prices from market data with better fallback logic
-        bid_price_raw = symbol_data.get('b', symbol_data.get('bid', '0'))
-        ask_price_raw = symbol_data.get('a', symbol_data.get('ask', '0'))
-        
-        # Convert to Decimal with validation
-        try:
-            bid_price = Decimal(str(bid_price_raw)) if bid_price_raw and bid_price_raw != '0' else Decimal('0')
-            ask_price = Decimal(str(ask_price_raw)) if ask_price_raw and ask_price_raw != '0' else Decimal('0')
-        except (ValueError, decimal.InvalidOperation):
-            orders_logger.error(f"[MARGIN_CALC] Invalid price format for {symbol}: bid={bid_price_raw}, ask={ask_price_raw}")
-            return None, None, None, None
-        
-        # Enhanced price validation with fallbacks
-        if bid_price <= 0 and ask_price <= 0:
-            # Try to use order_price if provided
-            if order_price and order_price > 0:
-                # Use order price for both bid and ask with small spread
-                spread = order_price * Decimal('0.0001')  # 1 pip spread
-                bid_price = order_price - spread
-                ask_price = order_price + spread
-                orders_logger.warning(f"[MARGIN_CALC] Using order price as fallback for {symbol}: bid={bid_price}, ask={ask_price}")
-            else:
-                # Try to use open price from market data as last resort
-                open_price_raw = symbol_data.get('o', '0')
-                if open_price_raw and open_price_raw != '0':
-                    try:
-                        open_price = Decimal(str(open_price_raw))
-                        if open_price > 0:
-                            spread = open_price * Decimal('0.0001')  # 1 pip spread
-                            bid_price = open_price - spread
-                            ask_price = open_price + spread
-                            orders_logger.warning(f"[MARGIN_CALC] Using open price as fallback for {symbol}: bid={bid_price}, ask={ask_price}")
-                        else:
-                            orders_logger.error(f"[MARGIN_CALC] Both bid and ask prices are invalid for {symbol}: bid={bid_price}, ask={ask_price}")
-                            return None, None, None, None
-                    except (ValueError, decimal.InvalidOperation):
-                        orders_logger.error(f"[MARGIN_CALC] Both bid and ask prices are invalid for {symbol}: bid={bid_price}, ask={ask_price}")
-                        return None, None, None, None
-                else:
-                    orders_logger.error(f"[MARGIN_CALC] Both bid and ask prices are invalid for {symbol}: bid={bid_price}, ask={ask_price}")
-                    return None, None, None, None
-        
-        # If one price is missing, use the other with a small spread
-        if bid_price <= 0 and ask_price > 0:
-            # Use ask price for both bid and ask (with small spread)
-            spread = ask_price * Decimal('0.0001')  # 1 pip spread
-            bid_price = ask_price - spread
-            orders_logger.warning(f"[MARGIN_CALC] Missing bid price for {symbol}, using ask price with spread: bid={bid_price}, ask={ask_price}")
-        elif ask_price <= 0 and bid_price > 0:
-            # Use bid price for both bid and ask (with small spread)
-            spread = bid_price * Decimal('0.0001')  # 1 pip spread
-            ask_price = bid_price + spread
-            orders_logger.warning(f"[MARGIN_CALC] Missing ask price for {symbol}, using bid price with spread: bid={bid_price}, ask={ask_price}")
-        
-        orders_logger.info(f"[MARGIN_CALC] Using prices for {symbol}: bid={bid_price}, ask={ask_price}")
-        
-        # Step 3: Calculate adjusted prices based on order type
-        if order_type in ['BUY', 'BUY_LIMIT', 'BUY_STOP']:
-            adjusted_price = ask_price  # Use ask price for buy orders
-        elif order_type in ['SELL', 'SELL_LIMIT', 'SELL_STOP']:
-            adjusted_price = bid_price  # Use bid price for sell orders
-        else:
-            # For market orders, use appropriate price
-            adjusted_price = ask_price if order_type == 'BUY' else bid_price
-        
-        # Step 4: Calculate contract value (always quantity * contract_size)
-        contract_value = (quantity * contract_size).quantize(
-            Decimal('0.01'), rounding=ROUND_HALF_UP
+        # Price, margin and commission (pure math, shared with order placement)
+        margin, adjusted_price, contract_value, commission = single_order_margin(
+            symbol, order_type, quantity, user_leverage, group_settings, external_symbol_info,
+            raw_market_data, order_price
         )
-
-        # Step 5: Calculate margin using correct formula
-        group_type = int(group_settings.get('type', 0))
-        margin_from_group = Decimal(str(group_settings.get('margin', 1)))
-        if margin_from_group == 0:
-            margin_from_group = Decimal('1')
-        if user_leverage <= 0:
-            orders_logger.error(f"[MARGIN_CALC] Invalid leverage: {user_leverage}")
+        if margin is None:
             return None, None, None, None
-        if group_type == 4:
-            # Crypto: margin = (contract_value * adjusted_price * margin_from_group) / user_leverage
-            margin = (contract_value * adjusted_price * margin_from_group / user_leverage).quantize(
-                Decimal('0.01'), rounding=ROUND_HALF_UP
-            )
-        else:
-            # Commodities, indices, forex: margin = (contract_value * adjusted_price) / user_leverage
-            margin = (contract_value * adjusted_price / user_leverage).quantize(
-                Decimal('0.01'), rounding=ROUND_HALF_UP
-            )
-
-        # Step 6: Calculate commission in parallel with margin conversion
-        commission = Decimal('0.0')
-        commission_type = int(group_settings.get('commision_type', 0))
-        commission_value_type = int(group_settings.get('commision_value_type', 0))
-        commission_rate = Decimal(str(group_settings.get('commision', '0')))
-        if commission_type in [0, 1]:  # "Every Trade" or "In"
-            if commission_value_type == 0:  # Per lot
-                commission = quantity * commission_rate
-            elif commission_value_type == 1:  # Percent of price
-                commission = ((commission_rate * adjusted_price) / Decimal("100")) * quantity
-        commission = commission.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-
-        # Step 7: Convert margin to USD if needed (only if profit_currency is not USD)
+
+        # Convert margin to USD if needed (only if profit_currency is not USD)
         margin_usd = margin
         if profit_currency != 'USD' and user_id and db:
             # Use cached conversion rates if available
@@ -276,7 +168,7 @@ async def get_external_symbol_info(db: AsyncSession, symbol: str) -> Optional[Di
         from sqlalchemy.future import select
         from app.database.models import ExternalSymbolInfo
         
-        stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(symbol))
+        stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(symbol))
         result = await db.execute(stmt)
         symbol_info = result.scalars().first()
         
@@ -0,0 +1,269 @@
+# app/services/margin_risk_index.py
+
+"""
+Margin-risk priority index for sub-second auto-cutoff detection.
+
+Every full portfolio evaluation (sweep, or a re-evaluation triggered here) stores a
+liquidation-distance estimate for the account: the price of its dominant symbol at
+which the margin level reaches the next threshold (100% margin call, then 50% cutoff),
+assuming all other symbols stay put:
+
+    equity(P) = equity_now + S * (P - P_now)      S = d(equity)/d(price) in USD
+    P*        = P_now + (level / 100 * margin - equity_now) / S
+
+Accounts are indexed per symbol by that trigger price (net long books trigger when the
+bid falls to it, net short books when the ask rises to it) and globally by relative
+distance to the cutoff price. On each tick only accounts whose trigger price was crossed,
+plus the top-K closest to cutoff (covering moves in their other symbols), are re-evaluated.
+A top-K account further than `top_k_max_distance` from its cutoff price is left to the
+sweep: each re-evaluation is a DB round trip, and on a calm book the nearest accounts may
+still be far from any threshold.
+"""
+
+import asyncio
+import bisect
+import logging
+from decimal import Decimal, InvalidOperation
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MARGIN_CALL_LEVEL = Decimal('100.0')
+MARGIN_CUTOFF_LEVEL = Decimal('50.0')
+
+# Trigger a little before the estimated price: the estimate uses group-adjusted prices
+# while ticks carry raw bid/ask, and ignores moves in the account's other symbols.
+TRIGGER_BUFFER = 0.0005
+
+AccountKey = Tuple[str, int]
+# Sorts after every real account key with the same trigger price
+_MAX_KEY = ("\U0010ffff", 0)
+
+margin_risk_reevaluations_total = registry.counter(
+    "margin_risk_reevaluations_total", "Accounts re-evaluated on a tick by the margin-risk index.", ("reason",)
+)
+_REEVALUATED_CROSSED = margin_risk_reevaluations_total.labels("threshold_crossed")
+_REEVALUATED_TOP_K = margin_risk_reevaluations_total.labels("top_k")
+
+
+def _decimal(value: Any, default: str = '0') -> Decimal:
+    try:
+        return Decimal(str(value if value is not None else default))
+    except (InvalidOperation, ValueError):
+        return Decimal(default)
+
+
+def estimate_liquidation(
+    portfolio_metrics: Dict[str, Any],
+    group_symbol_settings: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Liquidation-distance estimate from the output of calculate_user_portfolio.
+    Returns None when the account has no margin or no price-sensitive exposure.
+    """
+    equity = _decimal(portfolio_metrics.get("equity"))
+    margin = _decimal(portfolio_metrics.get("margin"))
+    if margin <= 0:
+        return None
+
+    # USD equity change per unit price move, per symbol
+    sensitivity: Dict[str, Decimal] = {}
+    current_prices: Dict[str, Decimal] = {}
+    for position in portfolio_metrics.get("positions", []):
+        symbol = str(position.get('order_company_name') or '').upper()
+        current_price = _decimal(position.get('current_price'))
+        if not symbol or current_price <= 0:
+            continue
+        quantity = _decimal(position.get('order_quantity'))
+        entry_price = _decimal(position.get('order_price'))
+        contract_size = _decimal(group_symbol_settings.get(symbol, {}).get('contract_size', '100000'), '100000')
+        sign = Decimal(1) if position.get('order_type') == 'BUY' else Decimal(-1)
+
+        # PnL-currency -> USD factor, recovered from the PnL the calculator produced
+        raw_pnl = sign * (current_price - entry_price) * quantity * contract_size
+        pnl_usd = _decimal(position.get('profit_loss')) + _decimal(position.get('commission'))
+        fx_factor = pnl_usd / raw_pnl if raw_pnl != 0 else Decimal(1)
+
+        sensitivity[symbol] = sensitivity.get(symbol, Decimal(0)) + sign * quantity * contract_size * fx_factor
+        current_prices[symbol] = current_price
+
+    exposures = {s: abs(v) * current_prices[s] for s, v in sensitivity.items() if v != 0}
+    if not exposures:
+        return None
+    symbol = max(exposures, key=exposures.get)
+    slope = sensitivity[symbol]
+    price_now = current_prices[symbol]
+
+    def price_at(level: Decimal) -> Decimal:
+        return price_now + (level / 100 * margin - equity) / slope
+
+    margin_level = equity / margin * 100
+    cutoff_price = price_at(MARGIN_CUTOFF_LEVEL)
+    margin_call_price = price_at(MARGIN_CALL_LEVEL)
+    in_margin_call = margin_level < MARGIN_CALL_LEVEL
+    return {
+        "symbol": symbol,
+        "direction": "long" if slope > 0 else "short",
+        "price": float(price_now),
+        "margin_level": float(margin_level),
+        "cutoff_price": float(cutoff_price),
+        "margin_call_price": float(margin_call_price),
+        # Index the next threshold the account has not crossed yet
+        "trigger_price": float(cutoff_price if in_margin_call else margin_call_price),
+        "distance": max(0.0, float((price_now - cutoff_price) / price_now) * (1 if slope > 0 else -1)),
+    }
+
+
+class MarginRiskIndex:
+    """
+    Accounts ordered by distance to auto-cutoff, with per-symbol trigger price lists.
+    """
+
+    def __init__(self, top_k: int = 20, top_k_max_distance: float = 0.02):
+        self.top_k = top_k
+        # Relative price move to cutoff within which a top-K account is re-evaluated on every tick
+        self.top_k_max_distance = top_k_max_distance
+        self.accounts: Dict[AccountKey, Dict[str, Any]] = {}
+        self._estimates: Dict[AccountKey, Dict[str, Any]] = {}
+        # symbol -> sorted [(trigger_price, key)]
+        self._longs: Dict[str, List[Tuple[float, AccountKey]]] = {}
+        self._shorts: Dict[str, List[Tuple[float, AccountKey]]] = {}
+        # sorted [(distance, key)]
+        self._by_distance: List[Tuple[float, AccountKey]] = []
+
+    def __len__(self) -> int:
+        return len(self._estimates)
+
+    @staticmethod
+    def _discard(sorted_list: List[Tuple[float, AccountKey]], item: Tuple[float, AccountKey]) -> None:
+        i = bisect.bisect_left(sorted_list, item)
+        if i < len(sorted_list) and sorted_list[i] == item:
+            sorted_list.pop(i)
+
+    def remove(self, user_type: str, user_id: int) -> None:
+        key = (user_type, user_id)
+        estimate = self._estimates.pop(key, None)
+        self.accounts.pop(key, None)
+        if estimate is None:
+            return
+        side = self._longs if estimate["direction"] == "long" else self._shorts
+        self._discard(side.get(estimate["symbol"], []), (estimate["trigger_price"], key))
+        self._discard(self._by_distance, (estimate["distance"], key))
+
+    def update(self, account: Dict[str, Any], portfolio_metrics: Dict[str, Any],
+               group_symbol_settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Re-indexes an account after a full portfolio evaluation.
+        """
+        user_type, user_id = account["user_type"], account["id"]
+        self.remove(user_type, user_id)
+        estimate = estimate_liquidation(portfolio_metrics, group_symbol_settings)
+        if estimate is None:
+            return None
+        key = (user_type, user_id)
+        self._estimates[key] = estimate
+        self.accounts[key] = {"id": user_id, "user_type": user_type, "group_name": account.get("group_name")}
+        side = self._longs if estimate["direction"] == "long" else self._shorts
+        bisect.insort(side.setdefault(estimate["symbol"], []), (estimate["trigger_price"], key))
+        bisect.insort(self._by_distance, (estimate["distance"], key))
+        return estimate
+
+    def accounts_to_evaluate(self, raw_market_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Accounts whose trigger price was crossed by this tick, then the top-K most at risk
+        that are within top_k_max_distance of their cutoff price.
+        `raw_market_data` is a tick: {SYMBOL: {"o": bid, "b": ask}, ...}.
+        """
+        selected: Dict[AccountKey, None] = {}
+        for symbol, prices in raw_market_data.items():
+            if not isinstance(prices, dict):
+                continue
+            try:
+                bid = float(prices.get('o')) if prices.get('o') is not None else None
+                ask = float(prices.get('b')) if prices.get('b') is not None else None
+            except (TypeError, ValueError):
+                continue
+            longs = self._longs.get(symbol.upper())
+            if longs and bid is not None:
+                # Long books trigger when bid <= trigger_price
+                start = bisect.bisect_left(longs, (bid * (1 - TRIGGER_BUFFER),))
+                for _, key in longs[start:]:
+                    selected[key] = None
+            shorts = self._shorts.get(symbol.upper())
+            if shorts and ask is not None:
+                # Short books trigger when ask >= trigger_price
+                end = bisect.bisect_right(shorts, (ask * (1 + TRIGGER_BUFFER), _MAX_KEY))
+                for _, key in shorts[:end]:
+                    selected[key] = None
+        _REEVALUATED_CROSSED.inc(len(selected))
+        for distance, key in self._by_distance[:self.top_k]:
+            if distance > self.top_k_max_distance:
+                break
+            if key not in selected:
+                selected[key] = None
+                _REEVALUATED_TOP_K.inc()
+        return [self.accounts[key] for key in selected]
+
+    def snapshot(self, limit: int = 20) -> List[Dict[str, Any]]:
+        return [{"user_type": key[0], "user_id": key[1], **self._estimates[key]}
+                for _, key in self._by_distance[:limit]]
+
+
+class MarginRiskMonitor:
+    """
+    Re-evaluates the accounts selected by the index on each tick. `evaluate_account`
+    must recompute the portfolio, call MarginRiskIndex.update() and run the cutoff.
+    """
+
+    def __init__(self, index: MarginRiskIndex,
+                 evaluate_account: Callable[[Dict[str, Any]], Awaitable[None]],
+                 concurrency: int = 8):
+        self.index = index
+        self.evaluate_account = evaluate_account
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._in_flight: set = set()
+
+    async def _evaluate(self, account: Dict[str, Any]) -> None:
+        key = (account["user_type"], account["id"])
+        try:
+            async with self._semaphore:
+                await self.evaluate_account(account)
+        except Exception as e:
+            logger.error(f"Margin risk re-evaluation failed for {key}: {e}", exc_info=True)
+        finally:
+            self._in_flight.discard(key)
+
+    async def on_tick(self, raw_market_data: Dict[str, Any]) -> int:
+        """
+        Re-evaluates at-risk accounts for a tick; accounts still being evaluated from a
+        previous tick are skipped. Returns the number of accounts evaluated.
+        """
+        batch = []
+        for account in self.index.accounts_to_evaluate(raw_market_data):
+            key = (account["user_type"], account["id"])
+            if key in self._in_flight:
+                continue
+            self._in_flight.add(key)
+            batch.append(self._evaluate(account))
+        if batch:
+            await asyncio.gather(*batch)
+        return len(batch)
+
+
+def _load_index() -> MarginRiskIndex:
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        return MarginRiskIndex(top_k=settings.MARGIN_RISK_TOP_K,
+                               top_k_max_distance=settings.MARGIN_RISK_TOP_K_MAX_DISTANCE)
+    except Exception:
+        return MarginRiskIndex()
+
+
+# Process-wide index, fed by every full portfolio evaluation
+margin_risk_index = _load_index()
+
+registry.gauge("margin_risk_index_accounts", "Accounts tracked by the margin-risk index.",
+               callback=lambda: len(margin_risk_index))
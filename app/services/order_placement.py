@@ -0,0 +1,485 @@
+# app/services/order_placement.py
+
+"""
+Placement of a new order in three phases.
+
+1. prefetch  Inputs read concurrently, none through the DB session: the group's symbol
+             settings (contract size, profit currency, margin/commission settings) from
+             the process-resident registry, and one Redis MGET for the user data and the
+             last known prices of the symbol and of its USD conversion pairs. A price
+             older than ORDER_PRICE_MAX_AGE_SECONDS is re-read from the live feed.
+2. evaluate  Pure CPU: validation, margin, commission and conversion to USD.
+3. commit    One short transaction on the request's session: reserve the order ids,
+             then lock the user row, read the open orders of the symbol under the lock,
+             check the hedged margin against the wallet balance and store it.
+
+An AsyncSession must not be used by concurrent tasks, so the session is only touched in
+phase 3 (and for the user data on a cache miss), one statement at a time. All phases
+run in the account's turn (account_actor), so concurrent mutations of the account see
+each other's orders and margin without queueing on the row lock. The row lock stays the
+guarantee for writers outside the actor and for turns run without the Redis lease, which
+is why the open orders are read after it is taken.
+"""
+
+import asyncio
+import logging
+import time
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.cache import LAST_KNOWN_PRICE_TIMESTAMP_FIELD
+from app.core.metrics import registry
+from app.services.account_actor import AccountActor, account_actor
+
+logger = logging.getLogger(__name__)
+
+BUY_ORDER_TYPES = ('BUY', 'BUY_LIMIT', 'BUY_STOP')
+SELL_ORDER_TYPES = ('SELL', 'SELL_LIMIT', 'SELL_STOP')
+CENT = Decimal('0.01')
+
+PHASE_PREFETCH = "prefetch"
+PHASE_EVALUATE = "evaluate"
+PHASE_COMMIT = "commit"
+
+order_placement_phase_seconds = registry.histogram(
+    "order_placement_phase_seconds", "Time spent in each phase of new order placement.", ("phase",)
+)
+_PHASE_SECONDS = {phase: order_placement_phase_seconds.labels(phase)
+                  for phase in (PHASE_PREFETCH, PHASE_EVALUATE, PHASE_COMMIT)}
+
+
+class OrderProcessingError(Exception):
+    """Custom exception for errors during order processing."""
+    pass
+
+
+class InsufficientFundsError(Exception):
+    """Custom exception for insufficient funds during order placement."""
+    pass
+
+
+def _decimal(value: Any, default: str = '0') -> Decimal:
+    return Decimal(str(value if value is not None else default))
+
+
+# --- Phase 2: pure margin math ---
+
+def single_order_margin(
+    symbol: str,
+    order_type: str,
+    quantity: Decimal,
+    user_leverage: Decimal,
+    group_settings: Dict[str, Any],
+    external_symbol_info: Dict[str, Any],
+    raw_market_data: Dict[str, Any],
+    order_price: Optional[Decimal] = None
+) -> Tuple[Optional[Decimal], Optional[Decimal], Optional[Decimal], Optional[Decimal]]:
+    """
+    (margin, price, contract_value, commission) of one order, margin in the symbol's
+    profit currency; all None when the market data or the settings are unusable.
+    """
+    contract_size = Decimal(str(external_symbol_info.get('contract_size', '1')))
+
+    symbol_data = (raw_market_data or {}).get(symbol)
+    if not symbol_data:
+        logger.error(f"[MARGIN_CALC] No market data for symbol {symbol}")
+        return None, None, None, None
+
+    bid_price_raw = symbol_data.get('b', symbol_data.get('bid', '0'))
+    ask_price_raw = symbol_data.get('a', symbol_data.get('ask', '0'))
+    try:
+        bid_price = Decimal(str(bid_price_raw)) if bid_price_raw and bid_price_raw != '0' else Decimal('0')
+        ask_price = Decimal(str(ask_price_raw)) if ask_price_raw and ask_price_raw != '0' else Decimal('0')
+    except (ValueError, InvalidOperation):
+        logger.error(f"[MARGIN_CALC] Invalid price format for {symbol}: bid={bid_price_raw}, ask={ask_price_raw}")
+        return None, None, None, None
+
+    if bid_price <= 0 and ask_price <= 0:
+        # Fall back to the order price, then to the open price, with a 1 pip spread
+        fallback_price = order_price if order_price and order_price > 0 else None
+        if fallback_price is None:
+            try:
+                fallback_price = Decimal(str(symbol_data.get('o', '0') or '0'))
+            except (ValueError, InvalidOperation):
+                fallback_price = None
+        if not fallback_price or fallback_price <= 0:
+            logger.error(f"[MARGIN_CALC] Both bid and ask prices are invalid for {symbol}: bid={bid_price}, ask={ask_price}")
+            return None, None, None, None
+        spread = fallback_price * Decimal('0.0001')
+        bid_price = fallback_price - spread
+        ask_price = fallback_price + spread
+        logger.warning(f"[MARGIN_CALC] Using fallback price for {symbol}: bid={bid_price}, ask={ask_price}")
+
+    # If one price is missing, use the other with a 1 pip spread
+    if bid_price <= 0 < ask_price:
+        bid_price = ask_price - ask_price * Decimal('0.0001')
+    elif ask_price <= 0 < bid_price:
+        ask_price = bid_price + bid_price * Decimal('0.0001')
+
+    # Buys fill at the ask, everything else at the bid
+    adjusted_price = ask_price if order_type in BUY_ORDER_TYPES else bid_price
+    contract_value = (quantity * contract_size).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    group_type = int(group_settings.get('type', 0) or 0)
+    margin_from_group = Decimal(str(group_settings.get('margin', 1)))
+    if margin_from_group == 0:
+        margin_from_group = Decimal('1')
+    if user_leverage <= 0:
+        logger.error(f"[MARGIN_CALC] Invalid leverage: {user_leverage}")
+        return None, None, None, None
+    if group_type == 4:
+        # Crypto: margin = (contract_value * adjusted_price * margin_from_group) / user_leverage
+        margin = (contract_value * adjusted_price * margin_from_group / user_leverage).quantize(CENT, rounding=ROUND_HALF_UP)
+    else:
+        # Commodities, indices, forex: margin = (contract_value * adjusted_price) / user_leverage
+        margin = (contract_value * adjusted_price / user_leverage).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    commission = Decimal('0.0')
+    commission_type = int(group_settings.get('commision_type', 0) or 0)
+    commission_value_type = int(group_settings.get('commision_value_type', 0) or 0)
+    commission_rate = Decimal(str(group_settings.get('commision', '0') or '0'))
+    if commission_type in [0, 1]:  # "Every Trade" or "In"
+        if commission_value_type == 0:  # Per lot
+            commission = quantity * commission_rate
+        elif commission_value_type == 1:  # Percent of price
+            commission = ((commission_rate * adjusted_price) / Decimal("100")) * quantity
+    commission = commission.quantize(CENT, rounding=ROUND_HALF_UP)
+
+    return margin, adjusted_price, contract_value, commission
+
+
+def conversion_symbols(currency: Optional[str]) -> List[str]:
+    """Pairs whose last known price converts `currency` to USD (direct first)."""
+    currency = (currency or 'USD').upper()
+    return [] if currency == 'USD' else [f"{currency}USD", f"USD{currency}"]
+
+
+def to_usd(amount: Decimal, currency: Optional[str], prices: Dict[str, Dict[str, Any]]) -> Decimal:
+    """
+    Same conversion as portfolio_calculator._convert_to_usd, from prefetched last known
+    prices: the bid of CURUSD, else division by the bid of USDCUR, else unconverted.
+    """
+    for pair, inverse in zip(conversion_symbols(currency), (False, True)):
+        rate_str = (prices.get(pair) or {}).get('b')
+        if rate_str is None:
+            continue
+        try:
+            rate = Decimal(str(rate_str))
+        except (InvalidOperation, TypeError):
+            continue
+        if rate <= 0:
+            return amount
+        return amount / rate if inverse else amount * rate
+    if conversion_symbols(currency):
+        logger.error(f"[CURRENCY_CONVERT] No conversion rate found for {currency} to USD; amount left unconverted")
+    return amount
+
+
+def symbol_margin_contribution(open_positions_for_symbol: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Hedged margin of a symbol's positions (ORM objects or dicts): the highest margin per
+    lot times the larger of the total buy and total sell quantities.
+    """
+    total_buy_quantity = Decimal(0)
+    total_sell_quantity = Decimal(0)
+    all_margins_per_lot: List[Decimal] = []
+    contributing_orders_count = 0
+
+    for i, position in enumerate(open_positions_for_symbol or ()):
+        try:
+            if isinstance(position, dict):
+                position_quantity = Decimal(str(position.get('quantity') or position.get('order_quantity', '0')))
+                position_type = str(position.get('order_type', '')).upper()
+                position_full_margin = Decimal(str(position.get('margin', '0')))
+            else:
+                position_quantity = Decimal(str(position.order_quantity))
+                position_type = position.order_type.upper()
+                position_full_margin = Decimal(str(position.margin))
+
+            if position_quantity > 0:
+                all_margins_per_lot.append(position_full_margin / position_quantity)
+                if position_full_margin > Decimal("0.0"):
+                    contributing_orders_count += 1
+
+            if position_type in BUY_ORDER_TYPES:
+                total_buy_quantity += position_quantity
+            elif position_type in SELL_ORDER_TYPES:
+                total_sell_quantity += position_quantity
+        except Exception as e:
+            logger.error(f"[MARGIN_TOTAL_CONTRIB_POS_ERROR] Error processing position {i}: {position}. Error: {e}", exc_info=True)
+            continue
+
+    net_quantity = max(total_buy_quantity, total_sell_quantity)
+    highest_margin_per_lot = max(all_margins_per_lot) if all_margins_per_lot else Decimal(0)
+    total_margin = (highest_margin_per_lot * net_quantity).quantize(CENT, rounding=ROUND_HALF_UP)
+    return {"total_margin": total_margin, "contributing_orders_count": contributing_orders_count}
+
+
+def additional_margin(open_orders: List[Any], order_type: str, quantity: Decimal, margin: Decimal) -> Decimal:
+    """Increase of the symbol's hedged margin if the new order is added to `open_orders`."""
+    new_order = {'order_quantity': quantity, 'order_type': order_type, 'margin': margin}
+    before = symbol_margin_contribution(open_orders)["total_margin"]
+    after = symbol_margin_contribution(list(open_orders) + [new_order])["total_margin"]
+    return max(Decimal("0.0"), after - before)
+
+
+def evaluate_order(order: Dict[str, Any], inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Phase 2: validates the prefetched inputs and prices the order. No I/O."""
+    symbol = order['symbol']
+    symbol_settings = inputs['symbol_settings']
+    if not symbol_settings:
+        raise OrderProcessingError(f"Group settings not found for symbol {symbol}")
+    if symbol_settings.get('external_contract_size') is None or not symbol_settings.get('external_profit_currency'):
+        # The group's contract size and pip currency are only defaults; never price an order with them
+        raise OrderProcessingError(f"External symbol info not found for {symbol}")
+    if not inputs['prices'].get(symbol):
+        raise OrderProcessingError("Failed to get market data")
+    if order['quantity'] <= 0:
+        raise OrderProcessingError("Order quantity must be positive")
+
+    leverage = _decimal(inputs['user_data'].get('leverage'), '1.0')
+    margin, price, contract_value, commission = single_order_margin(
+        symbol, order['order_type'], order['quantity'], leverage, symbol_settings, symbol_settings,
+        inputs['prices'], order['order_price']
+    )
+    if margin is None:
+        raise OrderProcessingError("Margin calculation failed")
+    return {
+        'margin': to_usd(margin, symbol_settings.get('external_profit_currency'), inputs['prices']),
+        'price': price,
+        'contract_value': contract_value,
+        'commission': commission,
+    }
+
+
+# --- Phase 1 and 3: I/O ---
+
+class OrderPlacementStore:
+    """Redis and DB access of the placement phases (the app's cache and crud helpers)."""
+
+    # Cached prices older than this many seconds are not used to price an order
+    max_price_age = 5.0
+
+    def __init__(self, max_price_age: Optional[float] = None):
+        if max_price_age is not None:
+            self.max_price_age = max_price_age
+
+    async def fetch(self, redis_client, symbols: List[str], user_id: Optional[int] = None,
+                    user_type: str = 'live') -> Dict[str, Any]:
+        from app.core.cache import get_order_placement_cache
+        return await get_order_placement_cache(redis_client, symbols, user_id, user_type)
+
+    async def load_user_data(self, db, redis_client, user_id: int, user_type: str) -> Optional[Dict[str, Any]]:
+        from app.core.cache import get_user_data_cache
+        return await get_user_data_cache(redis_client, user_id, db, user_type)
+
+    async def market_data(self, symbol: str) -> Optional[Dict[str, Any]]:
+        from app.core.firebase import get_latest_market_data
+        return await get_latest_market_data(symbol)
+
+    def is_fresh(self, price: Dict[str, Any], now: float) -> bool:
+        """Whether a last known price was cached within max_price_age seconds of `now`."""
+        cached_at = price.get(LAST_KNOWN_PRICE_TIMESTAMP_FIELD)
+        try:
+            return cached_at is not None and now - float(cached_at) <= self.max_price_age
+        except (TypeError, ValueError):
+            return False
+
+    async def reserve_ids(self, db, user_type: str, columns: List[str]) -> Dict[str, str]:
+        from app.services.order_processing import generate_unique_10_digit_ids, get_order_model
+        return await generate_unique_10_digit_ids(db, get_order_model(user_type), columns)
+
+    async def lock_account(self, db, user_id: int, user_type: str) -> Any:
+        from app.crud.user import get_demo_user_by_id_with_lock, get_user_by_id_with_lock
+        if user_type == 'demo':
+            return await get_demo_user_by_id_with_lock(db, user_id)
+        return await get_user_by_id_with_lock(db, user_id)
+
+    async def open_orders(self, db, user_id: int, symbol: str, user_type: str) -> List[Any]:
+        from app.crud import crud_order
+        from app.services.order_processing import get_order_model
+        return await crud_order.get_open_orders_by_user_id_and_symbol(db, user_id, symbol, get_order_model(user_type))
+
+    def cache_user_data(self, redis_client, user_id: int, user_type: str, user_data: Dict[str, Any]) -> None:
+        from app.core.cache import set_user_data_cache
+        asyncio.create_task(set_user_data_cache(redis_client, user_id, user_data, user_type))
+
+
+def _load_store() -> OrderPlacementStore:
+    try:
+        from app.core.config import get_settings
+        return OrderPlacementStore(max_price_age=get_settings().ORDER_PRICE_MAX_AGE_SECONDS)
+    except Exception:
+        return OrderPlacementStore()
+
+
+default_store = _load_store()
+
+
+def _price_symbols(symbol: str, group_settings: Optional[Dict[str, Dict[str, Any]]]) -> List[str]:
+    currency = ((group_settings or {}).get(symbol) or {}).get('external_profit_currency')
+    return [symbol] + conversion_symbols(currency)
+
+
+async def prefetch_order_inputs(
+    db,
+    redis_client,
+    user_id: int,
+    user_type: str,
+    symbol: str,
+    groups: Any,
+    group_name: Optional[str] = None,
+    store: OrderPlacementStore = default_store,
+) -> Dict[str, Any]:
+    """
+    Phase 1. With the caller's group_name and the group resident in `groups` (a
+    GroupSymbolRegistry), this is one Redis round trip and no DB access.
+    """
+    requested = _price_symbols(symbol, groups.peek(group_name) if group_name else None)
+    if group_name:
+        group_settings, cached = await asyncio.gather(
+            groups.get(group_name), store.fetch(redis_client, requested, user_id, user_type)
+        )
+    else:
+        group_settings, cached = None, await store.fetch(redis_client, requested, user_id, user_type)
+
+    user_data = cached.get('user_data')
+    if not user_data:
+        # Cache miss: the only statement phase 1 may run on the session
+        user_data = await store.load_user_data(db, redis_client, user_id, user_type)
+        if not user_data:
+            raise OrderProcessingError("User data not found")
+    if group_settings is None:
+        group_name = user_data.get('group_name')
+        group_settings = await groups.get(group_name) if group_name else {}
+
+    cached_prices = dict(cached.get('last_price') or {})
+    missing = [s for s in _price_symbols(symbol, group_settings) if s not in requested]
+    if missing:
+        cached_prices.update((await store.fetch(redis_client, missing)).get('last_price') or {})
+    now = time.time()
+    prices = {s: price for s, price in cached_prices.items() if store.is_fresh(price, now)}
+    # No tick persisted for the symbol yet, or a cached price the feed has not refreshed
+    # lately (e.g. the WebSocket listeners that persist prices are down): read the feed
+    live = sorted(s for s in cached_prices.keys() | {symbol} if s not in prices)
+    if live:
+        for s, market_data in zip(live, await asyncio.gather(*(store.market_data(s) for s in live))):
+            if market_data:
+                prices[s] = market_data
+
+    return {
+        'user_data': user_data,
+        'group_name': group_name,
+        'symbol_settings': (group_settings or {}).get(symbol),
+        'prices': prices,
+    }
+
+
+async def commit_order_margin(
+    db,
+    user_id: int,
+    user_type: str,
+    order: Dict[str, Any],
+    margin: Decimal,
+    id_columns: List[str],
+    reserve_margin: bool = True,
+    store: OrderPlacementStore = default_store,
+) -> Tuple[Dict[str, str], Optional[Dict[str, Any]]]:
+    """
+    Phase 3, in the account's turn. Returns the reserved ids and, when margin was
+    reserved, the account values written. The user row is locked for the final
+    read-modify-write of its margin: the open orders are read under the lock, so a
+    margin writer that does not take the account's turn cannot interleave.
+    """
+    ids = await store.reserve_ids(db, user_type, id_columns)
+    if not reserve_margin:
+        return ids, None
+    try:
+        account = await store.lock_account(db, user_id, user_type)
+        if account is None:
+            raise OrderProcessingError("Could not lock user record.")
+        open_orders = await store.open_orders(db, user_id, order['symbol'], user_type)
+        extra = additional_margin(open_orders, order['order_type'], order['quantity'], margin)
+        wallet_balance = _decimal(account.wallet_balance)
+        used_margin = _decimal(account.margin)
+        if wallet_balance < used_margin + extra:
+            raise InsufficientFundsError("Not enough wallet balance to cover additional margin.")
+        account.margin = (used_margin + extra).quantize(CENT, rounding=ROUND_HALF_UP)
+        # Read before the commit expires the instance
+        values = {
+            "wallet_balance": account.wallet_balance,
+            "leverage": account.leverage,
+            "group_name": account.group_name,
+            "margin": account.margin,
+        }
+        db.add(account)
+        await db.commit()
+    except BaseException:
+        # Release the row lock now rather than when the request's session closes
+        await db.rollback()
+        raise
+    return ids, values
+
+
+async def place_new_order(
+    db,
+    redis_client,
+    user_id: int,
+    order_data: Dict[str, Any],
+    user_type: str,
+    groups: Any,
+    group_name: Optional[str] = None,
+    is_barclays_live_user: bool = False,
+    store: OrderPlacementStore = default_store,
+    actor: AccountActor = account_actor,
+) -> Dict[str, Any]:
+    """
+    Runs the three phases in the account's turn; returns the fields of the order to
+    create. Callers that insert the order should hold the turn until then (`hold` is
+    re-entrant).
+    """
+    order = {
+        'symbol': order_data.get('order_company_name', '').upper(),
+        'order_type': order_data.get('order_type', '').upper(),
+        'quantity': Decimal(str(order_data.get('order_quantity', '0.0'))),
+        'order_price': Decimal(str(order_data.get('order_price', '0') or '0')),
+    }
+    id_columns = ['order_id']
+    if order_data.get('stop_loss') is not None:
+        id_columns.append('stoploss_id')
+    if order_data.get('take_profit') is not None:
+        id_columns.append('takeprofit_id')
+
+    async with actor.hold(redis_client, user_type, user_id):
+        started = time.perf_counter()
+        inputs = await prefetch_order_inputs(db, redis_client, user_id, user_type, order['symbol'], groups,
+                                             group_name, store)
+        prefetched = time.perf_counter()
+        priced = evaluate_order(order, inputs)
+        evaluated = time.perf_counter()
+        ids, account_values = await commit_order_margin(db, user_id, user_type, order, priced['margin'],
+                                                        id_columns, not is_barclays_live_user, store)
+    _PHASE_SECONDS[PHASE_PREFETCH].observe(prefetched - started)
+    _PHASE_SECONDS[PHASE_EVALUATE].observe(evaluated - prefetched)
+    _PHASE_SECONDS[PHASE_COMMIT].observe(time.perf_counter() - evaluated)
+
+    if account_values is not None:
+        store.cache_user_data(redis_client, user_id, user_type, {**inputs['user_data'], **account_values})
+
+    return {
+        'order_id': ids['order_id'],
+        'order_status': "PROCESSING" if is_barclays_live_user else "OPEN",
+        'order_user_id': user_id,
+        'order_company_name': order['symbol'],
+        'order_type': order['order_type'],
+        'order_price': priced['price'],
+        'order_quantity': order['quantity'],
+        'contract_value': priced['contract_value'],
+        'margin': priced['margin'],
+        'commission': priced['commission'],
+        'stop_loss': order_data.get('stop_loss'),
+        'take_profit': order_data.get('take_profit'),
+        'stoploss_id': ids.get('stoploss_id'),
+        'takeprofit_id': ids.get('takeprofit_id'),
+        'status': order_data.get('status'),
+    }
@@ -44,6 +44,7 @@ from app.database.models import User, DemoUser, UserOrder, DemoUserOrder, Extern
 from app.crud import crud_order
 from app.crud.user import update_user_margin, get_user_by_id, get_demo_user_by_id
 from app.crud.crud_order import get_open_orders_by_user_id_and_symbol, get_order_model
+from app.crud.external_symbol_info import fix_symbol_matches
 from app.schemas.order import PendingOrderPlacementRequest, OrderPlacementRequest
 from app.schemas.wallet import WalletCreate
 # Import ALL necessary functions from order_processing to ensure consistency
@@ -55,6 +56,7 @@ from app.services.order_processing import (
     generate_unique_10_digit_id
 )
 from app.core.logging_config import orders_logger
+from app.services.account_actor import account_actor
 
 logger = logging.getLogger("orders")
 
@@ -156,6 +158,16 @@ async def trigger_pending_order(
     redis_client: Redis,
     order: Dict[str, Any],
     current_price: Decimal
+) -> None:
+    """Trigger a pending order in the account's turn (see account_actor)."""
+    async with account_actor.hold(redis_client, order.get('user_type'), order['order_user_id']):
+        await _trigger_pending_order(db, redis_client, order, current_price)
+
+async def _trigger_pending_order(
+    db,
+    redis_client: Redis,
+    order: Dict[str, Any],
+    current_price: Decimal
 ) -> None:
     """
     Trigger a pending order for any user type.
@@ -179,7 +191,7 @@ async def trigger_pending_order(
                 return
 
         group_name = user_data.get('group_name')
-        group_settings = await get_group_settings_cache(redis_client, group_name)
+        group_settings = await get_group_settings_cache(redis_client, group_name, db)
         if not group_settings:
             orders_logger.error(f"[PENDING_ORDER] Group settings not found for group {group_name} when triggering order {order_id}. Skipping.")
             return
@@ -539,7 +551,7 @@ async def trigger_pending_order(
                 orders_logger.error(f"[PENDING_ORDER] Error updating user data cache: {str(cache_error)}", exc_info=True)
             
             # Publish user data update notification to WebSocket clients using the existing cache function
-            await publish_user_data_update(redis_client, user_id)
+            await publish_user_data_update(redis_client, user_id, user_type)
         except Exception as margin_update_error:
             orders_logger.error(f"[PENDING_ORDER] Error updating user margin: {str(margin_update_error)}", exc_info=True)
             return
@@ -940,10 +952,34 @@ async def get_user_data_cache(redis_client: Redis, user_id: int, db: AsyncSessio
         logger.error(f"Error getting user data for user {user_id}: {e}", exc_info=True)
         return {}
 
-async def get_group_settings_cache(redis_client: Redis, group_name: str) -> dict:
+async def get_group_settings_cache(redis_client: Redis, group_name: str, db: Optional[AsyncSession] = None) -> dict:
     """
-    Get group settings from cache or database.
+    Get group settings from cache or database. A caller that holds a trigger session
+    passes it as `db`, so that the fallback does not wait for a second slot of the
+    triggers bulkhead.
     """
+    async def load_group(session: AsyncSession) -> dict:
+        from app.crud.group import get_group_by_name
+        group = await get_group_by_name(session, group_name)
+        if not group:
+            return {}
+
+        # Handle case where get_group_by_name returns a list
+        group_obj = group[0] if isinstance(group, list) else group
+
+        return {
+            "id": group_obj.id,
+            "name": group_obj.name,
+            "sending_orders": getattr(group_obj, 'sending_orders', None)
+        }
+
+    async def load_from_database() -> dict:
+        if db is not None:
+            return await load_group(db)
+        from app.database.session import TriggerSessionLocal
+        async with TriggerSessionLocal() as session:
+            return await load_group(session)
+
     try:
         if not group_name:
             return {}
@@ -951,23 +987,7 @@ async def get_group_settings_cache(redis_client: Redis, group_name: str) -> dict
         if not redis_client:
             logger.warning(f"Redis client not available for getting group settings for group {group_name}")
             # Fallback to database
-            from app.crud.group import get_group_by_name
-            from sqlalchemy.ext.asyncio import AsyncSession
-            from app.database.session import AsyncSessionLocal
-            
-            async with AsyncSessionLocal() as db:
-                group = await get_group_by_name(db, group_name)
-                if not group:
-                    return {}
-                
-                # Handle case where get_group_by_name returns a list
-                group_obj = group[0] if isinstance(group, list) else group
-                    
-                return {
-                    "id": group_obj.id,
-                    "name": group_obj.name,
-                    "sending_orders": getattr(group_obj, 'sending_orders', None)
-                }
+            return await load_from_database()
         
         # Try to get from cache
         group_key = f"group_settings:{group_name}"
@@ -981,31 +1001,17 @@ async def get_group_settings_cache(redis_client: Redis, group_name: str) -> dict
                 return {}
         
         # Fallback to database if not in cache
-        from app.crud.group import get_group_by_name
-        from sqlalchemy.ext.asyncio import AsyncSession
-        from app.database.session import AsyncSessionLocal
-        
-        async with AsyncSessionLocal() as db:
-            group = await get_group_by_name(db, group_name)
-            if not group:
-                return {}
-            
-            # Handle case where get_group_by_name returns a list
-            group_obj = group[0] if isinstance(group, list) else group
-                
-            group_data = {
-                "id": group_obj.id,
-                "name": group_obj.name,
-                "sending_orders": getattr(group_obj, 'sending_orders', None)
-            }
-            
-            # Cache the group data
-            try:
-                await redis_client.set(group_key, json.dumps(group_data), ex=300)  # 5 minutes expiry
-            except Exception as e:
-                logger.error(f"Error caching group data for group {group_name}: {e}", exc_info=True)
+        group_data = await load_from_database()
+        if not group_data:
+            return {}
             
-            return group_data
+        # Cache the group data
+        try:
+            await redis_client.set(group_key, json.dumps(group_data), ex=300)  # 5 minutes expiry
+        except Exception as e:
+            logger.error(f"Error caching group data for group {group_name}: {e}", exc_info=True)
+        
+        return group_data
     except Exception as e:
         logger.error(f"Error getting group settings for group {group_name}: {e}", exc_info=True)
         return {}
@@ -1060,6 +1066,19 @@ async def close_order(
     execution_price: Decimal,
     close_reason: str,
     user_type: str
+) -> None:
+    """Close an order in the account's turn (see account_actor)."""
+    user_id = order.get('order_user_id') if isinstance(order, dict) else getattr(order, 'order_user_id', None)
+    async with account_actor.hold(redis_client, user_type, user_id):
+        await _close_order(db, redis_client, order, execution_price, close_reason, user_type)
+
+async def _close_order(
+    db: AsyncSession,
+    redis_client: Redis,
+    order,
+    execution_price: Decimal,
+    close_reason: str,
+    user_type: str
 ) -> None:
     """
     Close an order with the given execution price and reason.
@@ -1163,7 +1182,7 @@ async def close_order(
         # Get contract size and profit currency from ExternalSymbolInfo
         from app.database.models import ExternalSymbolInfo
         from sqlalchemy.future import select
-        symbol_info_stmt = select(ExternalSymbolInfo).filter(ExternalSymbolInfo.fix_symbol.ilike(order_company_name))
+        symbol_info_stmt = select(ExternalSymbolInfo).filter(fix_symbol_matches(order_company_name))
         symbol_info_result = await db.execute(symbol_info_stmt)
         ext_symbol_info = symbol_info_result.scalars().first()
         if not ext_symbol_info or ext_symbol_info.contract_size is None or ext_symbol_info.profit is None:
@@ -1291,8 +1310,8 @@ async def close_order(
         await set_user_data_cache(redis_client, db_user_locked.id, user_data_to_cache)
         from app.api.v1.endpoints.orders import update_user_static_orders, publish_order_update, publish_user_data_update, publish_market_data_trigger
         await update_user_static_orders(db_user_locked.id, db, redis_client, user_type_str)
-        await publish_order_update(redis_client, db_user_locked.id)
-        await publish_user_data_update(redis_client, db_user_locked.id)
+        await publish_order_update(redis_client, db_user_locked.id, user_type)
+        await publish_user_data_update(redis_client, db_user_locked.id, user_type)
         await publish_market_data_trigger(redis_client)
     except Exception as e:
         logger.error(f"[ORDER_CLOSE] Error closing order {get_attr(order, 'order_id')}: {e}", exc_info=True)
@@ -0,0 +1,223 @@
+# app/services/portfolio_writer.py
+
+"""
+Write coalescing for the `user_dynamic_portfolio:{id}` cache.
+
+Every connected socket of an account recalculates the portfolio on every tick, and the
+minute sweep does it too. Instead of a SET per calculation, the writer keeps per account
+(user type and id, so live and demo accounts sharing an id are tracked apart):
+
+- the fingerprint of the last written value: money fields compared at
+  DYNAMIC_PORTFOLIO_PRECISION decimals, the live `current_price` of positions ignored;
+- a dirty value, when a calculation changed but came within the minimum write interval
+  of the previous write. It is written by a deferred flush at the end of the interval,
+  so readers (trigger_pending_order, order placement) are at most one interval stale.
+
+Unchanged values are rewritten only to keep the key from expiring. An account whose last
+write is older than that refresh interval and has nothing pending is dropped: its next
+value would be written anyway, so the entry carries no information.
+
+Writes made outside the writer (the connection bootstrap's placeholder value) must call
+`forget`, otherwise the stored fingerprint would hold back the next calculation until the
+refresh interval.
+"""
+
+import asyncio
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Compared at the configured precision
+MONEY_FIELDS = frozenset(("balance", "equity", "margin", "free_margin", "profit_loss", "margin_level", "net_profit"))
+# Follows every tick; not worth a write on its own
+IGNORED_POSITION_FIELDS = frozenset(("current_price",))
+
+dynamic_portfolio_writes_total = registry.counter(
+    "dynamic_portfolio_writes_total", "Dynamic portfolio cache write requests by outcome.", ("result",)
+)
+_WRITTEN = dynamic_portfolio_writes_total.labels("written")
+_FLUSHED = dynamic_portfolio_writes_total.labels("flushed")
+_REFRESHED = dynamic_portfolio_writes_total.labels("refreshed")
+_DEFERRED = dynamic_portfolio_writes_total.labels("deferred")
+_UNCHANGED = dynamic_portfolio_writes_total.labels("unchanged")
+
+
+def _money(value: Any, quantum: Decimal) -> Any:
+    try:
+        return Decimal(str(value)).quantize(quantum)
+    except (InvalidOperation, ValueError):
+        return value
+
+
+def portfolio_fingerprint(data: Dict[str, Any], precision: int = 2) -> Tuple:
+    """Comparable form of a dynamic portfolio value at `precision` decimals."""
+    quantum = Decimal(1).scaleb(-precision)
+    items = []
+    for key, value in data.items():
+        if key == "positions_with_pnl":
+            value = tuple(
+                tuple(sorted((k, _money(v, quantum) if k in MONEY_FIELDS else str(v))
+                             for k, v in (position or {}).items() if k not in IGNORED_POSITION_FIELDS))
+                for position in value or ()
+            )
+        elif key in MONEY_FIELDS:
+            value = _money(value, quantum)
+        else:
+            value = str(value)
+        items.append((key, value))
+    return tuple(sorted(items))
+
+
+async def _default_write(redis_client, user_id: int, data: Dict[str, Any]) -> None:
+    from app.core.cache import set_user_dynamic_portfolio_cache
+    await set_user_dynamic_portfolio_cache(redis_client, user_id, data)
+
+
+class _AccountState:
+    __slots__ = ("fingerprint", "written_at", "dirty", "redis_client", "flush_task")
+
+    def __init__(self):
+        self.fingerprint: Optional[Tuple] = None
+        self.written_at = float("-inf")
+        self.dirty: Optional[Dict[str, Any]] = None
+        self.redis_client = None
+        self.flush_task: Optional[asyncio.Task] = None
+
+
+class DynamicPortfolioWriter:
+    """
+    Coalesces dynamic portfolio cache writes per account: at most one write per
+    `min_interval` seconds, and only when the value changed at `precision` decimals
+    (or the last write is older than `refresh_after`, ahead of the key's expiry).
+    """
+
+    def __init__(
+        self,
+        write: Callable[[Any, int, Dict[str, Any]], Awaitable[None]] = _default_write,
+        min_interval: float = 1.0,
+        precision: int = 2,
+        refresh_after: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._write = write
+        self.min_interval = min_interval
+        self.precision = precision
+        self.refresh_after = refresh_after
+        self._clock = clock
+        self._accounts: Dict[Tuple[str, int], _AccountState] = {}
+        self._pruned_at = clock()
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def pending(self, user_type: str, user_id: int) -> Optional[Dict[str, Any]]:
+        """Latest calculated value not yet written, if any."""
+        state = self._accounts.get((user_type, user_id))
+        return state.dirty if state is not None else None
+
+    def forget(self, user_type: str, user_id: int) -> None:
+        """
+        Drops the account's state after its key was written elsewhere: the next calculation
+        is written right away and a pending flush of an older value is cancelled.
+        """
+        state = self._accounts.pop((user_type, user_id), None)
+        if state is not None and state.flush_task is not None and not state.flush_task.done():
+            state.flush_task.cancel()
+
+    async def _write_now(self, state: _AccountState, redis_client, user_id: int, data: Dict[str, Any],
+                         fingerprint: Tuple) -> None:
+        state.fingerprint = fingerprint
+        state.written_at = self._clock()
+        state.dirty = None
+        await self._write(redis_client, user_id, data)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Drops idle accounts (see the module docstring). Returns the number dropped."""
+        now = now if now is not None else self._clock()
+        self._pruned_at = now
+        idle = [account for account, state in self._accounts.items()
+                if state.dirty is None and now - state.written_at >= self.refresh_after]
+        for account in idle:
+            del self._accounts[account]
+        return len(idle)
+
+    async def submit(self, redis_client, user_type: str, user_id: int, data: Dict[str, Any]) -> bool:
+        """
+        Records a freshly calculated value. Returns True if it was written now; a changed
+        value within the interval is written by the deferred flush instead.
+        """
+        if self._clock() - self._pruned_at >= self.refresh_after:
+            self.prune()
+        state = self._accounts.get((user_type, user_id))
+        if state is None:
+            state = self._accounts[(user_type, user_id)] = _AccountState()
+        fingerprint = portfolio_fingerprint(data, self.precision)
+        elapsed = self._clock() - state.written_at
+
+        if fingerprint == state.fingerprint:
+            # Back to what is stored: a pending change is moot
+            state.dirty = None
+            if elapsed < self.refresh_after:
+                _UNCHANGED.inc()
+                return False
+            _REFRESHED.inc()
+            await self._write_now(state, redis_client, user_id, data, fingerprint)
+            return True
+
+        if elapsed >= self.min_interval:
+            _WRITTEN.inc()
+            await self._write_now(state, redis_client, user_id, data, fingerprint)
+            return True
+
+        _DEFERRED.inc()
+        state.dirty = data
+        state.redis_client = redis_client
+        if state.flush_task is None or state.flush_task.done():
+            state.flush_task = asyncio.create_task(self._flush_later(user_id, state, self.min_interval - elapsed))
+        return False
+
+    async def _flush_later(self, user_id: int, state: _AccountState, delay: float) -> None:
+        await asyncio.sleep(max(0.0, delay))
+        data = state.dirty
+        if data is None:
+            return
+        try:
+            _FLUSHED.inc()
+            await self._write_now(state, state.redis_client, user_id, data,
+                                  portfolio_fingerprint(data, self.precision))
+        except Exception as e:
+            logger.error(f"Error flushing dynamic portfolio cache for user {user_id}: {e}", exc_info=True)
+
+    async def flush(self) -> int:
+        """Writes every dirty value now (shutdown, tests). Returns the number written."""
+        written = 0
+        for (_, user_id), state in list(self._accounts.items()):
+            if state.flush_task is not None and not state.flush_task.done():
+                state.flush_task.cancel()
+            if state.dirty is not None:
+                _FLUSHED.inc()
+                await self._write_now(state, state.redis_client, user_id, state.dirty,
+                                      portfolio_fingerprint(state.dirty, self.precision))
+                written += 1
+        return written
+
+
+def _load_writer() -> DynamicPortfolioWriter:
+    try:
+        from app.core.config import get_settings
+        settings = get_settings()
+        return DynamicPortfolioWriter(min_interval=settings.DYNAMIC_PORTFOLIO_MIN_WRITE_INTERVAL_SECONDS,
+                                      precision=settings.DYNAMIC_PORTFOLIO_PRECISION)
+    except Exception:
+        return DynamicPortfolioWriter()
+
+
+dynamic_portfolio_writer = _load_writer()
+
+registry.gauge("dynamic_portfolio_writer_accounts", "Accounts tracked by the dynamic portfolio writer.",
+               callback=lambda: len(dynamic_portfolio_writer))
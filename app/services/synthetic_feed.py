@@ -0,0 +1,117 @@
+# app/services/synthetic_feed.py
+
+"""
+Synthetic market data source.
+
+Produces random-walk ticks in exactly the shape the Firebase listener puts onto
+redis_publish_queue ({SYMBOL: {"o": bid, "b": ask}, "_timestamp": epoch_seconds}),
+so the whole downstream pipeline (publisher, adjusted price worker, WebSocket
+listeners) can be exercised without a Firebase connection. The app's startup installs
+latest_market_data with firebase.set_market_data_source when the feed is enabled, so
+order placement and portfolio PnL read the feed's prices in place of the datafeeds node.
+"""
+
+import asyncio
+import random
+import time
+import logging
+from decimal import Decimal
+from typing import Dict, Any, Iterable, Optional
+
+from app.shared_state import redis_publish_queue
+
+logger = logging.getLogger(__name__)
+
+# {SYMBOL: {"o": bid, "b": ask}} of the feed running for the app; None while none runs
+latest_datafeeds: Optional[Dict[str, Dict[str, str]]] = None
+
+
+def latest_market_data(symbol: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """The running feed's latest prices, in the shape of the Firebase datafeeds node."""
+    if latest_datafeeds is None:
+        return None
+    if symbol:
+        return latest_datafeeds.get(symbol.upper())
+    return dict(latest_datafeeds) or None
+
+
+# Rough starting mid prices; unknown symbols start at 1.0
+_DEFAULT_START_PRICES = {
+    "EURUSD": Decimal("1.08500"), "GBPUSD": Decimal("1.27000"), "USDJPY": Decimal("151.200"),
+    "AUDUSD": Decimal("0.66000"), "USDCAD": Decimal("1.36000"), "USDCHF": Decimal("0.90000"),
+    "NZDUSD": Decimal("0.61000"), "EURGBP": Decimal("0.85400"), "EURJPY": Decimal("164.000"),
+    "XAUUSD": Decimal("2350.00"),
+}
+
+
+class SyntheticTickSource:
+    """
+    Random-walk tick generator. Each call to next_tick() moves a random subset of
+    symbols and returns a queue-ready message for them.
+    """
+
+    def __init__(self, symbols: Iterable[str], seed: Optional[int] = None,
+                 start_prices: Optional[Dict[str, Decimal]] = None):
+        self.symbols = [s.strip().upper() for s in symbols if s and s.strip()]
+        self._rng = random.Random(seed)
+        prices = start_prices or _DEFAULT_START_PRICES
+        self.mid_prices: Dict[str, Decimal] = {s: prices.get(s, Decimal("1.00000")) for s in self.symbols}
+
+    def _spread(self, mid: Decimal) -> Decimal:
+        return (mid * Decimal("0.00002")).quantize(Decimal("0.00001")) or Decimal("0.00001")
+
+    def next_tick(self, symbols_per_tick: Optional[int] = None) -> Dict[str, Any]:
+        count = symbols_per_tick or self._rng.randint(1, max(1, len(self.symbols)))
+        moved = self._rng.sample(self.symbols, min(count, len(self.symbols)))
+        tick: Dict[str, Any] = {}
+        for symbol in moved:
+            mid = self.mid_prices[symbol]
+            step = mid * Decimal(str(self._rng.gauss(0, 0.0001)))
+            mid = max(Decimal("0.00001"), (mid + step).quantize(Decimal("0.00001")))
+            self.mid_prices[symbol] = mid
+            half_spread = self._spread(mid) / 2
+            # Firebase convention: 'o' is bid, 'b' is ask
+            tick[symbol] = {"o": str(mid - half_spread), "b": str(mid + half_spread)}
+        tick["_timestamp"] = time.time()
+        return tick
+
+
+async def run_synthetic_feed(
+    symbols: Iterable[str],
+    interval_ms: int = 100,
+    queue: Optional[asyncio.Queue] = None,
+    max_ticks: Optional[int] = None,
+    seed: Optional[int] = None
+) -> int:
+    """
+    Pushes synthetic ticks onto `queue` (redis_publish_queue by default) every
+    `interval_ms` milliseconds. Runs until cancelled or `max_ticks` were produced.
+    Returns the number of ticks queued. Feeding the app's queue, it also keeps
+    latest_datafeeds up to date.
+    """
+    global latest_datafeeds
+    target_queue = queue if queue is not None else redis_publish_queue
+    datafeeds = {} if queue is None else None
+    source = SyntheticTickSource(symbols, seed=seed)
+    logger.info(f"Synthetic feed started for {len(source.symbols)} symbols every {interval_ms}ms.")
+    produced = 0
+    if datafeeds is not None:
+        latest_datafeeds = datafeeds
+    try:
+        while max_ticks is None or produced < max_ticks:
+            tick = source.next_tick()
+            try:
+                target_queue.put_nowait(tick)
+                produced += 1
+                if datafeeds is not None:
+                    datafeeds.update((symbol, prices) for symbol, prices in tick.items() if symbol != "_timestamp")
+            except asyncio.QueueFull:
+                logger.warning("Synthetic feed: redis_publish_queue is full. Dropping tick.")
+            await asyncio.sleep(interval_ms / 1000.0)
+    except asyncio.CancelledError:
+        logger.info("Synthetic feed cancelled.")
+        raise
+    finally:
+        if datafeeds is not None and latest_datafeeds is datafeeds:
+            latest_datafeeds = None
+    return produced
@@ -0,0 +1,214 @@
+# app/services/ws_bootstrap.py
+
+"""
+Cache-first bootstrap of a /ws/market-data connection.
+
+Everything the first frame needs is resolved with:
+
+- one joined DB query: the user, its open + pending orders and its favorite symbols,
+- the group's symbol settings from a process-resident registry (refreshed from the DB
+  at most once per TTL per group, however many sockets connect at once),
+- one pipelined Redis round trip that writes the user caches and reads the adjusted
+  and last known prices of every group symbol.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PENDING_ORDER_STATUSES = ["BUY_LIMIT", "SELL_LIMIT", "BUY_STOP", "SELL_STOP", "PENDING"]
+ACTIVE_ORDER_STATUSES = ["OPEN"] + PENDING_ORDER_STATUSES
+STATIC_ORDER_FIELDS = ['order_id', 'order_company_name', 'order_type', 'order_quantity', 'order_price', 'margin',
+                       'contract_value', 'stop_loss', 'take_profit', 'order_user_id', 'order_status']
+
+websocket_time_to_first_frame_seconds = registry.histogram(
+    "websocket_time_to_first_frame_seconds", "Time from WebSocket connect to the first market_update frame."
+)
+group_symbol_registry_loads_total = registry.counter(
+    "group_symbol_registry_loads_total", "Group symbol settings loaded into the resident registry."
+)
+
+
+def static_order_dict(order: Any) -> Dict[str, Any]:
+    """Same shape as the static orders cache entries built by update_static_orders_cache."""
+    order_dict = {attr: str(v) if isinstance(v := getattr(order, attr, None), Decimal) else v
+                  for attr in STATIC_ORDER_FIELDS}
+    order_dict['commission'] = str(getattr(order, 'commission', '0.0'))
+    created_at = getattr(order, 'created_at', None)
+    if created_at:
+        order_dict['created_at'] = created_at.isoformat() if isinstance(created_at, datetime.datetime) else str(created_at)
+    return order_dict
+
+
+def initial_price(adjusted: Optional[Dict[str, Any]], last_price: Optional[Dict[str, Any]],
+                  symbol_settings: Optional[Dict[str, Any]]) -> Optional[Dict[str, float]]:
+    """
+    Price of a symbol for the first frame: the cached adjusted price, else the last
+    known raw price adjusted with the group's spread.
+    """
+    spread_pip = Decimal(str((symbol_settings or {}).get('spread_pip', 0) or 0))
+    if adjusted and adjusted.get('buy') is not None and adjusted.get('sell') is not None:
+        buy, sell = Decimal(str(adjusted['buy'])), Decimal(str(adjusted['sell']))
+    elif last_price and last_price.get('b') and last_price.get('o') and symbol_settings:
+        half_spread = Decimal(str(symbol_settings.get('spread', 0) or 0)) * spread_pip / Decimal(2)
+        buy = Decimal(str(last_price['b'])) + half_spread   # Ask
+        sell = Decimal(str(last_price['o'])) - half_spread  # Bid
+    else:
+        return None
+    spread = (buy - sell) / spread_pip if spread_pip > 0 else Decimal("0.0")
+    return {'buy': float(buy), 'sell': float(sell), 'spread': float(spread)}
+
+
+class GroupSymbolRegistry:
+    """
+    Process-resident {group: {SYMBOL: settings}}. A group is (re)loaded when missing or
+    older than `ttl`; concurrent callers share one in-flight load. A load returning None
+    (or raising) keeps the previous settings and is retried on the next call.
+    """
+
+    def __init__(self, load: Callable[[str], Awaitable[Optional[Dict[str, Dict[str, Any]]]]], ttl: float = 60.0):
+        self._load = load
+        self.ttl = ttl
+        self._groups: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def peek(self, group_name: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        return self._groups.get(group_name)
+
+    def invalidate(self, group_name: Optional[str] = None) -> None:
+        if group_name is None:
+            self._loaded_at.clear()
+        else:
+            self._loaded_at.pop(group_name, None)
+
+    async def _refresh(self, group_name: str) -> Dict[str, Dict[str, Any]]:
+        try:
+            settings = await self._load(group_name)
+        except Exception as e:
+            logger.error(f"Error loading symbol settings for group '{group_name}': {e}", exc_info=True)
+            settings = None
+        if settings is None:
+            # Keep serving the previous settings, retry on the next call
+            return self._groups.get(group_name, {})
+        group_symbol_registry_loads_total.inc()
+        self._groups[group_name] = settings
+        self._loaded_at[group_name] = time.monotonic()
+        return settings
+
+    async def get(self, group_name: str) -> Dict[str, Dict[str, Any]]:
+        loaded_at = self._loaded_at.get(group_name)
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl:
+            return self._groups[group_name]
+        pending = self._loading.get(group_name)
+        if pending is None:
+            pending = self._loading[group_name] = asyncio.ensure_future(self._refresh(group_name))
+            pending.add_done_callback(lambda _: self._loading.pop(group_name, None))
+        return await asyncio.shield(pending)
+
+
+async def _default_load_account(db, account_number: str, user_type: str):
+    from app.crud.user import get_account_with_active_orders
+    return await get_account_with_active_orders(db, account_number, user_type, ACTIVE_ORDER_STATUSES)
+
+
+async def _default_exchange_cache(redis_client, **kwargs):
+    from app.core.cache import bootstrap_connection_cache
+    return await bootstrap_connection_cache(redis_client, **kwargs)
+
+
+async def bootstrap_connection(
+    sessions: Callable[[], Any],
+    redis_client,
+    account_number: str,
+    user_type: str,
+    groups: GroupSymbolRegistry,
+    load_account: Callable[..., Awaitable[Any]] = _default_load_account,
+    exchange_cache: Callable[..., Awaitable[Dict[str, Dict[str, Any]]]] = _default_exchange_cache,
+) -> Optional[Dict[str, Any]]:
+    """
+    Loads and caches everything a new connection needs before its first frame.
+    Returns None when the account does not exist; the caller checks `user` for status.
+    `sessions` opens the session the account is read with (`async with sessions() as db:`);
+    it is closed before the group settings are loaded, since a registry load opens a
+    session of its own.
+    """
+    async with sessions() as db:
+        user, orders, favorite_symbols = await load_account(db, account_number, user_type)
+    if user is None:
+        return None
+    if not getattr(user, 'isActive', True):
+        # Rejected by the caller; nothing is cached for inactive accounts
+        return {"user": user}
+    user_id = getattr(user, 'id', None)
+    group_name = getattr(user, 'group_name', None) or 'default'
+    group_settings = await groups.get(group_name)
+
+    open_orders, pending_orders = [], []
+    for order in orders:
+        (open_orders if getattr(order, 'order_status', None) == 'OPEN' else pending_orders).append(static_order_dict(order))
+
+    wallet_balance = Decimal(str(getattr(user, 'wallet_balance', 0.0)))
+    margin = Decimal(str(getattr(user, 'margin', 0.0)))
+    user_data = {
+        "id": user_id,
+        "email": getattr(user, 'email', None),
+        "account_number": account_number,
+        "group_name": group_name,
+        "leverage": Decimal(str(getattr(user, 'leverage', 1.0))),
+        "wallet_balance": wallet_balance,
+        "margin": margin,
+        "user_type": user_type,
+        "first_name": getattr(user, 'first_name', None),
+        "last_name": getattr(user, 'last_name', None),
+        "country": getattr(user, 'country', None),
+        "phone_number": getattr(user, 'phone_number', None)
+    }
+    static_orders = {"open_orders": open_orders, "pending_orders": pending_orders,
+                     "updated_at": datetime.datetime.now().isoformat()}
+    portfolio = {
+        "balance": str(wallet_balance),
+        "equity": "0.0",
+        "margin": str(sum(Decimal(str(o['margin'])) for o in open_orders if o.get('margin') is not None)),
+        "free_margin": "0.0",
+        "profit_loss": "0.0",
+        "margin_level": "0.0",
+        "positions": open_orders
+    }
+    dynamic_portfolio = {
+        "balance": str(wallet_balance),
+        "equity": str(wallet_balance),
+        "margin": str(margin),
+        "free_margin": str(wallet_balance),
+        "profit_loss": "0.0",
+        "margin_level": "0.0",
+        "positions_with_pnl": []
+    }
+    cached_prices = await exchange_cache(
+        redis_client, user_id=user_id, user_type=user_type, user_data=user_data, portfolio=portfolio,
+        static_orders=static_orders, dynamic_portfolio=dynamic_portfolio, group_name=group_name,
+        symbols=list(group_settings)
+    )
+    initial_prices = {}
+    for symbol, symbol_settings in group_settings.items():
+        price = initial_price(cached_prices["adjusted"].get(symbol), cached_prices["last_price"].get(symbol), symbol_settings)
+        if price is not None:
+            initial_prices[symbol] = price
+
+    return {
+        "user": user,
+        "user_id": user_id,
+        "group_name": group_name,
+        "group_settings": group_settings,
+        "user_data": user_data,
+        "static_orders": static_orders,
+        "favorite_symbols": favorite_symbols,
+        "initial_prices": initial_prices,
+    }
@@ -0,0 +1,195 @@
+# app/services/ws_codec.py
+
+"""
+Frame encodings for /ws/market-data.
+
+JSON (default, existing clients): the same frames as before, serialized without the
+padding spaces of json.dumps' default separators.
+
+msgpack (negotiated with `?format=msgpack` or the `msgpack.v1` subprotocol): binary
+frames with a compact array layout. Every frame is a msgpack array whose first item
+is the frame kind:
+
+    [0, {...}]                                  any other frame, as a plain map
+    [1, new_symbols, prices, account]           market_update
+
+    new_symbols  [[symbol_id, "EURUSD", price_decimals], ...]
+                 entries added to the session's symbol dictionary by this frame
+    prices       flat [symbol_id, buy, sell, spread, symbol_id, ...]; buy/sell are
+                 integers scaled by 10**price_decimals, spread by 10**SPREAD_DECIMALS
+    account      null, or [balance, margin, open_orders, pending_orders, extras?]
+                 where an orders slot is null when unchanged since the previous frame,
+                 else a list of rows laid out as ORDER_FIELDS (symbol as symbol_id),
+                 with a trailing map of any other order keys
+
+Symbol ids and the last sent order lists are per connection: frames must be encoded
+in the order they are written to the socket, which ConnectionSendQueue guarantees.
+Compression is left to the server's permessage-deflate negotiation.
+"""
+
+import json
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import msgpack
+
+from app.core.metrics import registry
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+MSGPACK_SUBPROTOCOL = "msgpack.v1"
+
+FRAME_GENERIC = 0
+FRAME_MARKET_UPDATE = 1
+
+DEFAULT_PRICE_DECIMALS = 5
+SPREAD_DECIMALS = 3
+
+# Row layout of open / pending orders in binary market_update frames
+ORDER_FIELDS = (
+    "order_id", "order_company_name", "order_type", "order_quantity", "order_price", "margin",
+    "contract_value", "stop_loss", "take_profit", "commission", "order_status", "created_at",
+)
+# Redundant on a per-user connection
+_DROPPED_ORDER_FIELDS = ("order_user_id",)
+
+websocket_connections_total = registry.counter(
+    "websocket_connections_total", "Market data WebSocket connections by frame format and compression.",
+    ("format", "compression")
+)
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, Decimal):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not serializable")
+
+
+def negotiate_frame_format(query_format: Optional[str], offered_subprotocols: Optional[str]) -> Tuple[str, Optional[str]]:
+    """
+    Returns (frame format, subprotocol to accept) from the `format` query parameter
+    and the Sec-WebSocket-Protocol header. Anything unrecognised falls back to JSON.
+    """
+    offered = [p.strip() for p in (offered_subprotocols or "").split(",") if p.strip()]
+    if MSGPACK_SUBPROTOCOL in offered:
+        return FORMAT_MSGPACK, MSGPACK_SUBPROTOCOL
+    if (query_format or "").lower() == FORMAT_MSGPACK:
+        return FORMAT_MSGPACK, None
+    return FORMAT_JSON, None
+
+
+def permessage_deflate_offered(extensions_header: Optional[str]) -> bool:
+    return "permessage-deflate" in (extensions_header or "").lower()
+
+
+class JsonFrameCodec:
+    """Existing JSON frames, compact separators."""
+
+    format = FORMAT_JSON
+    binary = False
+
+    def encode(self, frame: Dict[str, Any]) -> str:
+        return json.dumps(frame, separators=(",", ":"), default=_default)
+
+
+class MsgpackFrameCodec:
+    """
+    Binary frames for one connection (see module docstring). `price_decimals` maps
+    symbol -> decimals used to scale its prices; it may be filled in after creation.
+    """
+
+    format = FORMAT_MSGPACK
+    binary = True
+
+    def __init__(self, price_decimals: Optional[Dict[str, int]] = None):
+        self.price_decimals: Dict[str, int] = dict(price_decimals or {})
+        self._symbol_ids: Dict[str, int] = {}
+        self._scales: List[int] = []
+        self._new_symbols: List[List[Any]] = []
+        self._last_orders: Dict[str, Any] = {"open_orders": None, "pending_orders": None}
+        self._packer = msgpack.Packer(default=_default, use_bin_type=True)
+
+    def _symbol_id(self, symbol: str) -> int:
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is None:
+            decimals = self.price_decimals.get(symbol, DEFAULT_PRICE_DECIMALS)
+            symbol_id = self._symbol_ids[symbol] = len(self._scales)
+            self._scales.append(10 ** decimals)
+            self._new_symbols.append([symbol_id, symbol, decimals])
+        return symbol_id
+
+    def _prices(self, market_prices: Dict[str, Any]) -> List[Any]:
+        flat = []
+        spread_scale = 10 ** SPREAD_DECIMALS
+        for symbol, price in market_prices.items():
+            symbol_id = self._symbol_id(symbol)
+            scale = self._scales[symbol_id]
+            flat.extend((
+                symbol_id,
+                round(float(price.get("buy", 0)) * scale),
+                round(float(price.get("sell", 0)) * scale),
+                round(float(price.get("spread", 0)) * spread_scale),
+            ))
+        return flat
+
+    def _order_row(self, order: Dict[str, Any]) -> List[Any]:
+        row = []
+        for field in ORDER_FIELDS:
+            value = order.get(field)
+            if field == "order_company_name" and value is not None:
+                value = self._symbol_id(str(value))
+            row.append(value)
+        extras = {k: v for k, v in order.items() if k not in ORDER_FIELDS and k not in _DROPPED_ORDER_FIELDS}
+        if extras:
+            row.append(extras)
+        return row
+
+    def _orders(self, key: str, orders: Optional[List[Dict[str, Any]]]) -> Optional[List[Any]]:
+        if orders is None or orders == self._last_orders[key]:
+            return None
+        self._last_orders[key] = orders
+        return [self._order_row(order) for order in orders]
+
+    def _account(self, summary: Optional[Dict[str, Any]]) -> Optional[List[Any]]:
+        if summary is None:
+            return None
+        account = [
+            summary.get("balance"),
+            summary.get("margin"),
+            self._orders("open_orders", summary.get("open_orders")),
+            self._orders("pending_orders", summary.get("pending_orders")),
+        ]
+        extras = {k: v for k, v in summary.items()
+                  if k not in ("balance", "margin", "open_orders", "pending_orders")}
+        if extras:
+            account.append(extras)
+        return account
+
+    def encode(self, frame: Dict[str, Any]) -> bytes:
+        data = frame.get("data")
+        if frame.get("type") != "market_update" or not isinstance(data, dict) or \
+                set(data) - {"market_prices", "account_summary"}:
+            return self._packer.pack([FRAME_GENERIC, frame])
+        prices = self._prices(data.get("market_prices") or {})
+        account = self._account(data.get("account_summary"))
+        new_symbols, self._new_symbols = self._new_symbols, []
+        return self._packer.pack([FRAME_MARKET_UPDATE, new_symbols, prices, account])
+
+
+def create_frame_codec(frame_format: str, price_decimals: Optional[Dict[str, int]] = None):
+    if frame_format == FORMAT_MSGPACK:
+        return MsgpackFrameCodec(price_decimals)
+    return JsonFrameCodec()
+
+
+def price_decimals_from_group_settings(group_settings: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """Symbol -> price decimals from the group's `show_points` settings, where set."""
+    decimals = {}
+    for symbol, settings in (group_settings or {}).items():
+        try:
+            points = int((settings or {}).get("show_points"))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= points <= 10:
+            decimals[symbol] = points
+    return decimals
@@ -0,0 +1,295 @@
+# app/services/ws_send_queue.py
+
+"""
+Bounded per-connection outbound queue for /ws/market-data.
+
+The Redis listener of a connection enqueues frames and never awaits the socket, so a
+client on a slow link cannot hold up tick processing. A writer task drains the queue:
+
+- market prices conflate per symbol (latest price wins),
+- the account summary is a single slot (a newer summary replaces an unsent one),
+- order / user-data events are kept in order and are never dropped.
+
+Market prices and the account summary are delivered together as one `market_update`
+frame, the same shape clients already receive. With an account stream attached, the
+conflated account summary is diffed into one sequenced `account_delta` frame when it is
+written, so a slow client gets the net change instead of a delta per tick.
+
+If the oldest undelivered data (prices, account summary or delta, events) has been
+queued longer than the eviction deadline, or the event backlog overflows, the connection
+is evicted (closed with 1013 "try again later") instead of dropping events.
+
+With `stamp_origin` (WS_FRAME_ORIGIN_TIMESTAMPS, for load tests), a market_update frame
+also carries the `_timestamp` origin stamp of the newest tick it includes, so clients can
+measure end-to-end latency.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import weakref
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+websocket_send_lag_seconds = registry.histogram(
+    "websocket_send_lag_seconds", "Time from enqueue to socket write of outbound WebSocket frames."
+)
+websocket_frames_conflated_total = registry.counter(
+    "websocket_frames_conflated_total", "Market prices / account summaries replaced before they were sent."
+)
+websocket_frames_sent_total = registry.counter(
+    "websocket_frames_sent_total", "Outbound WebSocket frames by kind.", ("kind",)
+)
+websocket_outbound_bytes_total = registry.counter(
+    "websocket_outbound_bytes_total", "Serialized bytes written to WebSocket clients."
+)
+websocket_slow_consumer_evictions_total = registry.counter(
+    "websocket_slow_consumer_evictions_total", "Connections closed because their send queue stayed saturated.",
+    ("reason",)
+)
+
+_SENT_MARKET = websocket_frames_sent_total.labels("market_update")
+_SENT_EVENT = websocket_frames_sent_total.labels("event")
+
+# Live queues, for the admin per-socket view
+active_send_queues: "weakref.WeakSet[ConnectionSendQueue]" = weakref.WeakSet()
+
+
+class SlowConsumerEvicted(Exception):
+    """Raised by put_* once the connection has been evicted."""
+
+
+class ConnectionSendQueue:
+    """
+    Outbound queue + writer task of one WebSocket connection.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        label: str = "",
+        serialize: Callable[[Dict[str, Any]], str] = json.dumps,
+        max_events: int = 256,
+        eviction_deadline: float = 10.0,
+        on_evict: Optional[Callable[[str], Awaitable[None]]] = None,
+        account_stream: Optional[Any] = None,
+        stamp_origin: bool = False,
+    ):
+        self._send = send
+        self.label = label
+        self._serialize = serialize
+        self.max_events = max_events
+        self.eviction_deadline = eviction_deadline
+        self._on_evict = on_evict
+        self.account_stream = account_stream
+        self.stamp_origin = stamp_origin
+
+        self._prices: Dict[str, Any] = {}
+        self._account: Optional[Dict[str, Any]] = None
+        self._market_since: Optional[float] = None  # enqueue time of the oldest unsent market data
+        self._tick_origin: Optional[float] = None  # origin stamp of the newest tick in the market frame
+        self._events: Deque[Tuple[float, Dict[str, Any]]] = deque()
+        self._in_flight_since: Optional[float] = None  # enqueue time of the frame inside send()
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+        self.evicted: Optional[str] = None
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_conflated = 0
+        self.last_send_lag = 0.0
+        active_send_queues.add(self)
+
+    # --- producer side ---
+
+    def _ensure_open(self) -> None:
+        if self.evicted:
+            raise SlowConsumerEvicted(self.evicted)
+
+    def put_market_update(self, market_prices: Dict[str, Any],
+                          account_summary: Optional[Dict[str, Any]] = None) -> None:
+        self._ensure_open()
+        now = time.monotonic()
+        replaced = sum(1 for symbol in market_prices if symbol in self._prices)
+        self._prices.update(market_prices)
+        if account_summary is not None:
+            if self._account is not None:
+                replaced += 1
+            self._account = account_summary
+        if replaced:
+            self.frames_conflated += replaced
+            websocket_frames_conflated_total.inc(replaced)
+        if self._market_since is None:
+            self._market_since = now
+        self._wakeup.set()
+        self.check()
+
+    def note_tick_origin(self, origin: Optional[float]) -> None:
+        """Origin stamp of the tick being processed; sent with the next market frame."""
+        if self.stamp_origin and origin is not None:
+            self._tick_origin = origin
+
+    def put_event(self, frame: Dict[str, Any]) -> None:
+        """
+        Enqueues a frame that must be delivered as-is and in order (order/user updates).
+        """
+        self._ensure_open()
+        data = frame.get("data")
+        if self.account_stream is not None and frame.get("type") == "market_update" \
+                and isinstance(data, dict) and data.get("account_summary") is not None:
+            self.put_market_update(data.get("market_prices") or {}, data["account_summary"])
+            return
+        self._events.append((time.monotonic(), frame))
+        self._wakeup.set()
+        self.check()
+
+    @property
+    def account_pending(self) -> bool:
+        """True while an account summary is queued but not yet written to the socket."""
+        return self._account is not None
+
+    @property
+    def depth(self) -> int:
+        pending = len(self._events) + (1 if self._market_since is not None else 0)
+        return pending + (1 if self._in_flight_since is not None and not self._events else 0)
+
+    def lag(self, now: Optional[float] = None) -> float:
+        """Age of the oldest undelivered data in seconds (0 when the queue is empty)."""
+        now = now if now is not None else time.monotonic()
+        candidates = (self._market_since, self._in_flight_since, self._events[0][0] if self._events else None)
+        oldest = [t for t in candidates if t is not None]
+        return now - min(oldest) if oldest else 0.0
+
+    def check(self) -> Optional[str]:
+        """
+        Evicts the connection if its queue is saturated. Called on every enqueue and
+        periodically by the owner, since the writer may be stuck inside send().
+        """
+        if self.evicted:
+            return self.evicted
+        reason = None
+        if len(self._events) > self.max_events:
+            reason = "event_backlog"
+        elif self.lag() > self.eviction_deadline:
+            reason = "lag_deadline"
+        if reason:
+            self._evict(reason)
+        return self.evicted
+
+    def _evict(self, reason: str) -> None:
+        self.evicted = reason
+        websocket_slow_consumer_evictions_total.labels(reason).inc()
+        logger.warning(f"Evicting slow WebSocket consumer {self.label}: {reason} "
+                       f"(lag={self.lag():.2f}s, queued events={len(self._events)})")
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+        if self._on_evict is not None:
+            asyncio.get_running_loop().create_task(self._on_evict(reason))
+
+    # --- writer side ---
+
+    def _take_market_frames(self) -> Tuple[float, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Returns (enqueue time, account_delta frame, market_update frame); with an account
+        stream the summary is diffed here, against what the client was last sent.
+        """
+        since, account = self._market_since, self._account
+        delta_frame = None
+        if self.account_stream is not None and account is not None:
+            deltas = self.account_stream.update(account)
+            if deltas:
+                delta_frame = self.account_stream.delta_frame(deltas)
+            account = None
+        frame = None
+        if self.account_stream is None or self._prices:
+            frame = {"type": "market_update", "data": {"market_prices": self._prices}}
+            if account is not None:
+                frame["data"]["account_summary"] = account
+            if self._tick_origin is not None:
+                frame["_timestamp"] = self._tick_origin
+        self._prices, self._account, self._market_since, self._tick_origin = {}, None, None, None
+        return since, delta_frame, frame
+
+    async def _write(self, enqueued_at: float, frame: Dict[str, Any]) -> None:
+        self._in_flight_since = enqueued_at
+        payload = self._serialize(frame)
+        try:
+            await self._send(payload)
+        finally:
+            self._in_flight_since = None
+        self.bytes_sent += len(payload)
+        websocket_outbound_bytes_total.inc(len(payload))
+        self.last_send_lag = time.monotonic() - enqueued_at
+        websocket_send_lag_seconds.observe(self.last_send_lag)
+        self.frames_sent += 1
+
+    async def run(self) -> None:
+        try:
+            while not self.evicted:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                # Events first, in order; then one conflated market frame
+                while self._events:
+                    enqueued_at, frame = self._events[0]
+                    await self._write(enqueued_at, frame)
+                    self._events.popleft()
+                    _SENT_EVENT.inc()
+                if self._market_since is not None:
+                    since, delta_frame, frame = self._take_market_frames()
+                    if delta_frame is not None:
+                        await self._write(since, delta_frame)
+                        _SENT_EVENT.inc()
+                    if frame is not None:
+                        await self._write(since, frame)
+                        _SENT_MARKET.inc()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Socket went away mid-send; the owner sees `evicted` and stops producing
+            logger.info(f"WebSocket send failed for {self.label}: {e}")
+            self.evicted = "send_failed"
+
+    def start(self) -> asyncio.Task:
+        if self._writer is None:
+            self._writer = asyncio.create_task(self.run())
+        return self._writer
+
+    async def close(self) -> None:
+        active_send_queues.discard(self)
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connection": self.label,
+            "lag_seconds": round(self.lag(), 4),
+            "last_send_lag_seconds": round(self.last_send_lag, 4),
+            "depth": self.depth,
+            "queued_events": len(self._events),
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "frames_conflated": self.frames_conflated,
+            "evicted": self.evicted,
+        }
+
+
+def send_queue_stats(limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Per-socket queue stats of open connections, most lagging first.
+    """
+    stats = [q.stats() for q in list(active_send_queues)]
+    stats.sort(key=lambda s: s["lag_seconds"], reverse=True)
+    return stats[:limit]
+
+
+registry.gauge("websocket_send_queue_max_lag_seconds", "Largest send queue lag across open connections.",
+               callback=lambda: max((q.lag() for q in list(active_send_queues)), default=0.0))
@@ -0,0 +1,213 @@
+# app/services/ws_subscriptions.py
+
+"""
+Per-connection symbol subscriptions for /ws/market-data.
+
+Clients manage the set of symbols they receive prices for with control messages:
+
+    {"action": "subscribe", "symbols": ["EURUSD", "XAUUSD"]}
+    {"action": "unsubscribe", "symbols": ["XAUUSD"]}
+    {"action": "set_watchlist", "symbols": ["EURUSD", "GBPUSD"]}
+    {"action": "subscribe_all"}
+
+and get a `{"type": "subscription", ...}` frame back. The default subscription is the
+user's favorite symbols plus the symbols of their open and pending orders; a user with
+neither receives every symbol of the group, as before.
+
+Each group has a grow-only symbol -> bit table shared by all of its connections; a
+connection keeps the bitmask of its subscribed symbols, so filtering a price frame is
+one dict lookup and one AND per symbol.
+"""
+
+import json
+import logging
+from typing import Any, Dict, Iterable, Optional, Set
+
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBE = "subscribe"
+UNSUBSCRIBE = "unsubscribe"
+SET_WATCHLIST = "set_watchlist"
+SUBSCRIBE_ALL = "subscribe_all"
+CONTROL_ACTIONS = (SUBSCRIBE, UNSUBSCRIBE, SET_WATCHLIST, SUBSCRIBE_ALL)
+
+# Matches every bit of any Python int
+ALL_SYMBOLS_MASK = -1
+
+websocket_subscription_changes_total = registry.counter(
+    "websocket_subscription_changes_total", "Symbol subscription control messages handled.", ("action",)
+)
+
+
+class SymbolBits:
+    """
+    Symbol -> bit table of one group. Bits are only ever appended, so masks built
+    earlier stay valid when new symbols appear in the group.
+    """
+
+    def __init__(self):
+        self.bits: Dict[str, int] = {}
+
+    def bit(self, symbol: str) -> int:
+        bit = self.bits.get(symbol)
+        if bit is None:
+            bit = self.bits[symbol] = 1 << len(self.bits)
+        return bit
+
+    def mask(self, symbols: Iterable[str]) -> int:
+        mask = 0
+        for symbol in symbols:
+            mask |= self.bit(symbol)
+        return mask
+
+
+_group_bits: Dict[str, SymbolBits] = {}
+
+
+def group_symbol_bits(group_name: str) -> SymbolBits:
+    bits = _group_bits.get(group_name)
+    if bits is None:
+        bits = _group_bits[group_name] = SymbolBits()
+    return bits
+
+
+def position_symbols(static_orders: Optional[Dict[str, Any]]) -> Set[str]:
+    """Symbols of the open and pending orders in a static orders cache entry."""
+    symbols = set()
+    for key in ("open_orders", "pending_orders"):
+        for order in (static_orders or {}).get(key, []) or []:
+            symbol = order.get("order_company_name")
+            if symbol:
+                symbols.add(str(symbol).upper())
+    return symbols
+
+
+class SymbolSubscription:
+    """
+    Symbols one connection receives prices for. `allowed` is the group's symbol set;
+    symbols outside it are rejected. An empty subscription means all symbols.
+    With `group` (the shared GroupState), `allowed` is read from the group on every use,
+    so a settings reload applies to connections that are already open.
+    """
+
+    __slots__ = ("_bits", "_allowed", "_group", "symbols", "mask")
+
+    def __init__(self, group_name: str, symbols: Iterable[str] = (),
+                 allowed: Optional[Iterable[str]] = None, group: Any = None):
+        self._bits = group_symbol_bits(group_name)
+        self._group = group
+        if allowed is None or isinstance(allowed, frozenset):
+            self._allowed = allowed
+        else:
+            self._allowed = frozenset(s.upper() for s in allowed)
+        self.symbols: Set[str] = set()
+        self.mask = ALL_SYMBOLS_MASK
+        self._set(self._split(symbols)[0])
+
+    @property
+    def allowed(self) -> Optional[frozenset]:
+        if self._group is not None:
+            return self._group.symbols or None
+        return self._allowed
+
+    @property
+    def subscribes_all(self) -> bool:
+        return self.mask == ALL_SYMBOLS_MASK
+
+    def _set(self, symbols: Set[str], empty_means_all: bool = True) -> None:
+        self.symbols = symbols
+        if symbols:
+            self.mask = self._bits.mask(symbols)
+        else:
+            self.mask = ALL_SYMBOLS_MASK if empty_means_all else 0
+
+    def _split(self, symbols: Iterable[str]):
+        accepted, rejected = set(), []
+        for symbol in symbols:
+            if not isinstance(symbol, str) or not symbol:
+                continue
+            symbol = symbol.upper()
+            if self.allowed is None or symbol in self.allowed:
+                accepted.add(symbol)
+            else:
+                rejected.append(symbol)
+        return accepted, rejected
+
+    def follow(self, symbols: Iterable[str]) -> Set[str]:
+        """
+        Adds symbols the client must see (e.g. a newly opened position) unless it already
+        receives every symbol. Returns the symbols that were added.
+        """
+        if self.subscribes_all:
+            return set()
+        added = {s.upper() for s in symbols} - self.symbols
+        if added:
+            self._set(self.symbols | added)
+        return added
+
+    def filter(self, market_prices: Dict[str, Any]) -> Dict[str, Any]:
+        if self.mask == ALL_SYMBOLS_MASK:
+            return market_prices
+        bits, mask = self._bits.bits, self.mask
+        return {symbol: price for symbol, price in market_prices.items() if bits.get(symbol, 0) & mask}
+
+    def apply(self, action: str, symbols: Iterable[str] = ()) -> Dict[str, Any]:
+        """
+        Applies a control action and returns the reply frame. `data.added` lists the
+        symbols the client did not receive before, so their current prices can be sent.
+        """
+        before_all, before = self.subscribes_all, set(self.symbols)
+        accepted, rejected = self._split(symbols)
+        if action == SUBSCRIBE:
+            if not self.subscribes_all:
+                # An empty watchlist stays empty when every requested symbol is rejected
+                self._set(self.symbols | accepted, empty_means_all=False)
+        elif action == UNSUBSCRIBE:
+            current = self.symbols
+            if self.subscribes_all:
+                if self.allowed is None:
+                    accepted = set()
+                current = set(self.allowed or ())
+            if accepted:
+                # Unsubscribing the last symbol leaves an empty watchlist, not "all symbols"
+                self._set(current - accepted, empty_means_all=False)
+        elif action == SET_WATCHLIST:
+            self._set(accepted, empty_means_all=False)
+        elif action == SUBSCRIBE_ALL:
+            self._set(set())
+        else:
+            raise ValueError(f"Unknown subscription action: {action}")
+        websocket_subscription_changes_total.labels(action).inc()
+        now = set(self.allowed or ()) if self.subscribes_all else self.symbols
+        added = [] if before_all else sorted(now - before)
+        return {
+            "type": "subscription",
+            "data": {
+                "all": self.subscribes_all,
+                "symbols": sorted(self.symbols),
+                "added": added,
+                "rejected": rejected,
+            },
+        }
+
+
+def parse_control_message(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parses a client message into {"action", "symbols"}; returns None for anything that
+    is not a subscription control message (pings and other client chatter are ignored).
+    Raises ValueError for a control message with invalid symbols.
+    """
+    try:
+        message = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(message, dict) or message.get("action") not in CONTROL_ACTIONS:
+        return None
+    symbols = message.get("symbols", [])
+    if isinstance(symbols, str):
+        symbols = [symbols]
+    if not isinstance(symbols, list):
+        raise ValueError("'symbols' must be a list of symbol names")
+    return {"action": message["action"], "symbols": symbols}
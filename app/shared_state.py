@@ -16,6 +16,13 @@ redis_publish_queue: asyncio.Queue = asyncio.Queue(maxsize=500) # Increased size
 # websocket_queue: asyncio.Queue = asyncio.Queue(maxsize=100) # Can be removed
 
 logger.info(f"Initialized redis_publish_queue in shared_state with maxsize={redis_publish_queue.maxsize}.")
+
+# Exported at /metrics; evaluated only when scraped.
+from app.core.metrics import registry
+registry.gauge("redis_publish_queue_size", "Market data messages waiting in redis_publish_queue.",
+               callback=redis_publish_queue.qsize)
+registry.gauge("redis_publish_queue_capacity", "Maximum size of redis_publish_queue.",
+               callback=lambda: redis_publish_queue.maxsize)
 # logger.info("websocket_queue is not used for market data with Redis Pub/Sub.")
 
 
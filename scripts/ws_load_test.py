@@ -0,0 +1,585 @@
+# scripts/ws_load_test.py
+
+"""
+Load / soak harness for the /ws/market-data fan-out path.
+
+    python scripts/ws_load_test.py --live 2000 --demo 1000 --duration 300 --output ws_load_result.json
+
+One command runs the whole test on this machine:
+
+1. Starts a throwaway Redis (`redis-server` on PATH) unless --redis-port is given, and
+   creates a SQLite database in a temporary directory.
+2. Seeds a group with the synthetic feed symbols and --live / --demo active accounts
+   with --positions open positions each, and mints a JWT per account.
+3. Starts the app (uvicorn app.main:app) against them, with the synthetic tick source in
+   place of Firebase and WS_FRAME_ORIGIN_TIMESTAMPS on, so every market_update frame
+   carries the origin stamp of its newest tick.
+4. Opens one WebSocket client per account from --workers processes (ramped up over
+   --ramp seconds) and keeps them connected for --duration seconds. --stream-ratio of
+   the clients use the sequenced account stream (?stream=delta).
+5. Writes a JSON result with per-message end-to-end latency (tick origin -> client),
+   throughput, late frames (older than --late-ms on arrival), dropped frames (gaps in
+   account stream sequence numbers), failed connections and unexpected disconnects,
+   reconnects after "Server busy" refusals (which the clients retry with backoff),
+   and a timeline of server RSS, event-loop lag and slow-consumer evictions.
+
+The exit status is 1 when a --max-* threshold is exceeded, so the command can gate a
+deploy. Requires the packages of requirements.txt plus aiosqlite and websockets.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from app.core.tick_latency import HdrHistogram
+
+DEFAULT_SYMBOLS = "EURUSD,GBPUSD,USDJPY,AUDUSD,USDCAD,USDCHF,NZDUSD,EURGBP,EURJPY,XAUUSD"
+GROUP_NAME = "loadtest"
+# Any bcrypt-shaped value; the harness never logs in with a password
+SEEDED_PASSWORD_HASH = "$2b$12$" + "x" * 53
+# First reconnect delay after a "Server busy" (1013) refusal; doubles up to 5s
+BUSY_RETRY_SECONDS = 0.5
+
+
+class ClientState:
+    __slots__ = ("connected_at", "first_frame_at", "seq")
+
+    def __init__(self, connected_at: float):
+        self.connected_at = connected_at
+        self.first_frame_at: Optional[float] = None
+        self.seq: Optional[int] = None
+
+
+class ClientStats:
+    """
+    What the clients of one worker process saw. Workers send it to the parent, which
+    merges them into the run result.
+    """
+
+    def __init__(self, late_after: float = 1.0):
+        self.late_after = late_after
+        self.latency = HdrHistogram()
+        self.time_to_first_frame = HdrHistogram()
+        self.connected = 0
+        self.connect_failures = 0
+        self.busy_retries = 0
+        self.disconnects: Dict[str, int] = {}
+        self.frames = 0
+        self.market_frames = 0
+        self.bytes = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+
+    def observe(self, frame: Dict[str, Any], size: int, received_at: float, client: ClientState) -> None:
+        self.frames += 1
+        self.bytes += size
+        kind = frame.get("type")
+        if client.first_frame_at is None and kind != "loading":
+            client.first_frame_at = received_at
+            self.time_to_first_frame.record(int((received_at - client.connected_at) * 1_000_000))
+        if kind == "market_update":
+            self.market_frames += 1
+            origin = frame.get("_timestamp")
+            if origin is not None:
+                latency = received_at - origin
+                self.latency.record(int(latency * 1_000_000))
+                if latency > self.late_after:
+                    self.late_frames += 1
+        elif kind == "account_snapshot":
+            client.seq = frame["data"]["seq"]
+        elif kind == "account_delta":
+            for delta in frame["data"].get("deltas", []):
+                seq = delta.get("seq")
+                if seq is None:
+                    continue
+                if client.seq is not None and seq > client.seq + 1:
+                    self.dropped_frames += seq - client.seq - 1
+                if client.seq is None or seq > client.seq:
+                    client.seq = seq
+
+    def disconnected(self, reason: str) -> None:
+        self.disconnects[reason] = self.disconnects.get(reason, 0) + 1
+
+    def merge(self, other: "ClientStats") -> None:
+        self.latency.merge(other.latency)
+        self.time_to_first_frame.merge(other.time_to_first_frame)
+        for name in ("connected", "connect_failures", "busy_retries", "frames", "market_frames", "bytes",
+                     "late_frames", "dropped_frames"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for reason, count in other.disconnects.items():
+            self.disconnects[reason] = self.disconnects.get(reason, 0) + count
+
+
+def parse_prometheus(text: str) -> Dict[str, float]:
+    """`name{labels}` -> value for every sample of a text exposition."""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        try:
+            samples[name] = float(value)
+        except ValueError:
+            continue
+    return samples
+
+
+def sum_samples(samples: Dict[str, float], name: str) -> float:
+    """Sum over all label values of a metric."""
+    return sum(v for k, v in samples.items() if k == name or k.startswith(name + "{"))
+
+
+def summarize(stats: ClientStats, timeline: List[Dict[str, Any]], elapsed: float, target_clients: int,
+              args: Dict[str, Any]) -> Dict[str, Any]:
+    rss = [s["rss_mb"] for s in timeline if s.get("rss_mb") is not None]
+    last = timeline[-1] if timeline else {}
+    unexpected = sum(stats.disconnects.values())
+    result = {
+        "config": args,
+        "elapsed_seconds": round(elapsed, 1),
+        "clients": {
+            "target": target_clients,
+            "connected": stats.connected,
+            "connect_failures": stats.connect_failures,
+            "busy_retries": stats.busy_retries,
+            "unexpected_disconnects": unexpected,
+            "disconnect_reasons": stats.disconnects,
+        },
+        "throughput": {
+            "frames": stats.frames,
+            "market_frames": stats.market_frames,
+            "bytes": stats.bytes,
+            "frames_per_second": round(stats.frames / elapsed, 1) if elapsed else 0.0,
+            "megabytes_per_second": round(stats.bytes / elapsed / 1e6, 3) if elapsed else 0.0,
+        },
+        "latency": stats.latency.snapshot(),
+        "time_to_first_frame": stats.time_to_first_frame.snapshot(),
+        "late_frames": stats.late_frames,
+        "late_threshold_ms": stats.late_after * 1000.0,
+        "dropped_frames": stats.dropped_frames,
+        "server": {
+            "rss_mb": {"start": rss[0] if rss else None, "max": max(rss) if rss else None,
+                       "end": rss[-1] if rss else None},
+            "event_loop_lag_ms": {k: last.get(k) for k in ("loop_lag_p99_ms", "loop_lag_p999_ms")},
+            "event_loop_stalls": last.get("loop_stalls"),
+            "slow_consumer_evictions": last.get("evictions"),
+            "timeline": timeline,
+        },
+    }
+    return result
+
+
+def check_thresholds(result: Dict[str, Any], max_p99_ms: Optional[float], max_late_ratio: float,
+                     max_dropped: int, max_failed_ratio: float) -> List[str]:
+    failures = []
+    clients = result["clients"]
+    p99 = result["latency"]["percentiles_ms"].get("p99", 0.0)
+    if max_p99_ms is not None and p99 > max_p99_ms:
+        failures.append(f"p99 latency {p99:.1f} ms > {max_p99_ms} ms")
+    market_frames = result["throughput"]["market_frames"]
+    if market_frames and result["late_frames"] / market_frames > max_late_ratio:
+        failures.append(f"late frames {result['late_frames']}/{market_frames} > {max_late_ratio:.2%}")
+    if result["dropped_frames"] > max_dropped:
+        failures.append(f"dropped frames {result['dropped_frames']} > {max_dropped}")
+    failed = clients["connect_failures"] + clients["unexpected_disconnects"]
+    if clients["target"] and failed / clients["target"] > max_failed_ratio:
+        failures.append(f"failed or dropped connections {failed}/{clients['target']} > {max_failed_ratio:.2%}")
+    if market_frames == 0:
+        failures.append("no market_update frames received")
+    return failures
+
+
+# --- environment ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _raise_fd_limit() -> None:
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def _wait_for_port(port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout:.0f}s")
+
+
+def start_redis(workdir: str) -> Tuple[subprocess.Popen, int]:
+    binary = shutil.which("redis-server")
+    if binary is None:
+        raise SystemExit("redis-server not found on PATH; start a Redis you can flush and pass --redis-port")
+    port = _free_port()
+    proc = subprocess.Popen([binary, "--port", str(port), "--bind", "127.0.0.1", "--save", "",
+                             "--appendonly", "no", "--dir", workdir, "--maxclients", "100000"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _wait_for_port(port, 10)
+    return proc, port
+
+
+def server_env(database_url: str, redis_port: int, secret_key: str, symbols: List[str], tick_ms: int) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "ASYNC_DATABASE_URL": database_url,
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": str(redis_port),
+        "REDIS_DB": "0",
+        # Each socket holds a pooled connection for its subscription; redis-py's default is 100
+        "REDIS_MAX_CONNECTIONS": "20000",
+        "SECRET_KEY": secret_key,
+        "ALGORITHM": "HS256",
+        "SYNTHETIC_FEED_ENABLED": "true",
+        "SYNTHETIC_FEED_SYMBOLS": ",".join(symbols),
+        "SYNTHETIC_FEED_INTERVAL_MS": str(tick_ms),
+        "WS_FRAME_ORIGIN_TIMESTAMPS": "true",
+    })
+    return env
+
+
+def start_server(env: Dict[str, str], port: int, log_path: str, timeout: float = 60) -> subprocess.Popen:
+    log = open(log_path, "wb")
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning", "--no-access-log"],
+                            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"App exited with status {proc.returncode} during startup; see {log_path}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2) as response:
+                if response.status == 200:
+                    return proc
+        except OSError:
+            time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError(f"App did not answer /metrics within {timeout:.0f}s; see {log_path}")
+
+
+def stop(proc: Optional[subprocess.Popen], timeout: float = 20) -> None:
+    if proc is None or proc.poll() is not None:
+        return
+    proc.send_signal(2)  # SIGINT: uvicorn runs the shutdown handlers
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def server_sample(pid: int, port: int, started_at: float) -> Dict[str, Any]:
+    sample: Dict[str, Any] = {"t": round(time.monotonic() - started_at, 1), "rss_mb": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    sample["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                    break
+    except OSError:
+        pass
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            metrics = parse_prometheus(response.read().decode())
+    except OSError as e:
+        sample["error"] = str(e)
+        return sample
+    sample.update({
+        "connections": metrics.get("websocket_active_connections"),
+        "loop_lag_p99_ms": round(metrics.get('event_loop_lag_seconds{quantile="0.99"}', 0.0) * 1000, 2),
+        "loop_lag_p999_ms": round(metrics.get('event_loop_lag_seconds{quantile="0.999"}', 0.0) * 1000, 2),
+        "loop_stalls": sum_samples(metrics, "event_loop_stalls_total"),
+        "evictions": sum_samples(metrics, "websocket_slow_consumer_evictions_total"),
+        "send_lag_p99_ms": round(metrics.get('websocket_send_lag_seconds{quantile="0.99"}', 0.0) * 1000, 2),
+    })
+    return sample
+
+
+# --- seeding ---
+
+async def seed_accounts(database_url: str, symbols: List[str], live: int, demo: int,
+                        positions: int) -> List[Tuple[str, int, str]]:
+    """
+    Creates the schema, one group with every symbol and the accounts with their open
+    positions. Returns (user_type, user_id, account_number) per account.
+    """
+    from sqlalchemy import insert
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from app.database.base import Base
+    from app.database import models
+    from app.services.synthetic_feed import SyntheticTickSource
+
+    prices = SyntheticTickSource(symbols).mid_prices
+    engine = create_async_engine(database_url)
+    accounts: List[Tuple[str, int, str]] = []
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(models.Symbol), [
+            {"name": s, "type": 1, "pips": Decimal("0.0001"), "spread_pip": Decimal("0.0001"),
+             "market_price": prices[s], "show_points": 5, "profit_currency": "USD"} for s in symbols
+        ])
+        await conn.execute(insert(models.ExternalSymbolInfo), [
+            {"fix_symbol": s, "contract_size": Decimal("100000"), "profit": "USD", "is_subscribed": True}
+            for s in symbols
+        ])
+        await conn.execute(insert(models.Group), [
+            {"symbol": s, "name": GROUP_NAME, "commision_type": 0, "commision_value_type": 0, "type": 1,
+             "pip_currency": "USD", "show_points": 5, "commision": Decimal("0"), "margin": Decimal("100"),
+             "spread": Decimal("1.5"), "deviation": Decimal("0"), "min_lot": Decimal("0.01"),
+             "max_lot": Decimal("100"), "pips": Decimal("0.0001"), "spread_pip": Decimal("0.0001")}
+            for s in symbols
+        ])
+        for user_type, model, order_model, count, prefix in (
+                ("live", models.User, models.UserOrder, live, "LT"),
+                ("demo", models.DemoUser, models.DemoUserOrder, demo, "DM")):
+            if not count:
+                continue
+            users, orders = [], []
+            for user_id in range(1, count + 1):
+                account_number = f"{prefix}{user_id:07d}"
+                users.append({
+                    "id": user_id, "name": f"Load {account_number}", "email": f"{account_number.lower()}@loadtest.local",
+                    "phone_number": f"9{user_id:09d}", "hashed_password": SEEDED_PASSWORD_HASH,
+                    "user_type": user_type, "account_number": account_number, "group_name": GROUP_NAME,
+                    "wallet_balance": Decimal("100000"), "leverage": Decimal("100"), "margin": Decimal("0"),
+                    "net_profit": Decimal("0"), "status": 1, "isActive": 1,
+                })
+                for i in range(positions):
+                    symbol = symbols[(user_id + i) % len(symbols)]
+                    quantity = Decimal("0.10")
+                    contract_value = quantity * Decimal("100000") * prices[symbol]
+                    orders.append({
+                        "order_id": f"{prefix}{user_id:07d}-{i}", "order_user_id": user_id,
+                        "order_company_name": symbol, "order_type": "BUY" if (user_id + i) % 2 else "SELL",
+                        "order_status": "OPEN", "order_price": prices[symbol], "order_quantity": quantity,
+                        "contract_value": contract_value, "margin": contract_value / 100,
+                        "commission": Decimal("0"), "swap": Decimal("0"),
+                    })
+                accounts.append((user_type, user_id, account_number))
+            await conn.execute(insert(model), users)
+            if orders:
+                await conn.execute(insert(order_model), orders)
+    await engine.dispose()
+    return accounts
+
+
+def mint_tokens(accounts: List[Tuple[str, int, str]], secret_key: str, ttl_seconds: float) -> List[str]:
+    from jose import jwt
+    now = int(time.time())
+    return [jwt.encode({"sub": str(user_id), "user_type": user_type, "account_number": account_number,
+                        "iat": now, "exp": now + int(ttl_seconds)}, secret_key, algorithm="HS256")
+            for user_type, user_id, account_number in accounts]
+
+
+# --- clients ---
+
+async def run_client(url: str, stats: ClientStats, start_at: float, end_at: float) -> None:
+    import websockets
+
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    client: Optional[ClientState] = None
+    backoff = BUSY_RETRY_SECONDS
+    while True:
+        try:
+            connection = await websockets.connect(url, max_size=None, open_timeout=60, close_timeout=5)
+        except Exception:
+            stats.connect_failures += 1
+            return
+        if client is None:
+            # Time to first frame counts from the first attempt, busy retries included
+            stats.connected += 1
+            client = ClientState(time.time())
+        try:
+            while True:
+                remaining = end_at - time.time()
+                if remaining <= 0:
+                    return
+                try:
+                    raw = await asyncio.wait_for(connection.recv(), remaining)
+                except asyncio.TimeoutError:
+                    return
+                received_at = time.time()
+                stats.observe(json.loads(raw), len(raw), received_at, client)
+        except websockets.ConnectionClosed as e:
+            code = e.rcvd.code if e.rcvd is not None else None
+            # 1013 before the first frame is the DB bulkhead turning the bootstrap away;
+            # retry like a real client would. After it, it is a slow-consumer eviction.
+            if code == 1013 and client.first_frame_at is None and time.time() + backoff < end_at:
+                stats.busy_retries += 1
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+            stats.disconnected(f"closed_{code}" if code is not None else "connection_lost")
+            return
+        except Exception as e:
+            stats.disconnected(type(e).__name__)
+            return
+        finally:
+            await connection.close()
+
+
+async def _run_worker(urls: List[Tuple[str, float]], end_at: float, late_after: float) -> ClientStats:
+    stats = ClientStats(late_after)
+    await asyncio.gather(*(run_client(url, stats, start_at, end_at) for url, start_at in urls))
+    return stats
+
+
+def worker_main(worker_id: int, urls: List[Tuple[str, float]], end_at: float, late_after: float,
+                results: "multiprocessing.Queue") -> None:
+    _raise_fd_limit()
+    try:
+        results.put((worker_id, asyncio.run(_run_worker(urls, end_at, late_after)), None))
+    except BaseException as e:
+        results.put((worker_id, None, repr(e)))
+
+
+def client_urls(port: int, tokens: List[str], stream_ratio: float, start_at: float,
+                ramp: float) -> List[Tuple[str, float]]:
+    """(url, start time) per client; the first stream_ratio of every 100 use ?stream=delta."""
+    urls = []
+    stream_every = round(stream_ratio * 100)
+    for i, token in enumerate(tokens):
+        url = f"ws://127.0.0.1:{port}/api/v1/ws/market-data?token={token}"
+        if i % 100 < stream_every:
+            url += "&stream=delta"
+        urls.append((url, start_at + ramp * i / max(1, len(tokens))))
+    return urls
+
+
+# --- run ---
+
+def run(args: argparse.Namespace) -> int:
+    _raise_fd_limit()
+    symbols = [s.strip().upper() for s in args.symbols.split(",") if s.strip()]
+    workdir = tempfile.mkdtemp(prefix="ws_load_")
+    database_url = f"sqlite+aiosqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    secret_key = secrets.token_urlsafe(32)
+    redis_proc = server = None
+    try:
+        if args.redis_port:
+            redis_port = args.redis_port
+        else:
+            redis_proc, redis_port = start_redis(workdir)
+
+        print(f"Seeding {args.live} live + {args.demo} demo accounts with {args.positions} positions each...")
+        accounts = asyncio.run(seed_accounts(database_url, symbols, args.live, args.demo, args.positions))
+        tokens = mint_tokens(accounts, secret_key, args.ramp + args.duration + 3600)
+
+        app_port = _free_port()
+        log_path = os.path.join(workdir, "app.log")
+        server = start_server(server_env(database_url, redis_port, secret_key, symbols, args.tick_ms),
+                              app_port, log_path)
+        print(f"App started on port {app_port} (pid {server.pid}, log {log_path})")
+
+        started_at = time.monotonic()
+        start_at = time.time() + 2.0
+        end_at = start_at + args.ramp + args.duration
+        urls = client_urls(app_port, tokens, args.stream_ratio, start_at, args.ramp)
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        workers = [context.Process(target=worker_main, args=(w, urls[w::args.workers], end_at, args.late_ms / 1000.0,
+                                                             results), daemon=True)
+                   for w in range(args.workers)]
+        for worker in workers:
+            worker.start()
+
+        timeline = [server_sample(server.pid, app_port, started_at)]
+        stats, errors, pending = ClientStats(args.late_ms / 1000.0), [], len(workers)
+        hard_deadline = end_at + 120
+        while pending and time.time() < hard_deadline:
+            try:
+                _, worker_stats, error = results.get(timeout=args.sample_seconds)
+            except queue.Empty:
+                timeline.append(server_sample(server.pid, app_port, started_at))
+                continue
+            pending -= 1
+            if error:
+                errors.append(error)
+            else:
+                stats.merge(worker_stats)
+        timeline.append(server_sample(server.pid, app_port, started_at))
+        for worker in workers:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+        if pending:
+            errors.append(f"{pending} worker(s) did not report before the deadline")
+
+        result = summarize(stats, timeline, args.ramp + args.duration, len(urls), vars(args))
+        result["worker_errors"] = errors
+        failures = check_thresholds(result, args.max_p99_ms, args.max_late_ratio, args.max_dropped,
+                                    args.max_failed_ratio) + errors
+        result["failures"] = failures
+        result["passed"] = not failures
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+        latency = result["latency"]["percentiles_ms"]
+        print(f"{stats.connected}/{len(urls)} clients, {result['throughput']['frames_per_second']} frames/s, "
+              f"latency p50 {latency.get('p50')} ms p99 {latency.get('p99')} ms, late {stats.late_frames}, "
+              f"dropped {stats.dropped_frames}, server RSS max {result['server']['rss_mb']['max']} MB")
+        for failure in failures:
+            print(f"FAILED: {failure}")
+        print(f"Result written to {args.output}")
+        return 0 if not failures else 1
+    finally:
+        stop(server)
+        stop(redis_proc, timeout=5)
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="WebSocket load / soak test for /ws/market-data")
+    parser.add_argument("--live", type=int, default=1000, help="live accounts (one client each)")
+    parser.add_argument("--demo", type=int, default=1000, help="demo accounts (one client each)")
+    parser.add_argument("--positions", type=int, default=3, help="open positions per account")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="client processes")
+    parser.add_argument("--ramp", type=float, default=30, help="seconds over which clients connect")
+    parser.add_argument("--duration", type=float, default=120, help="seconds to stay connected after the ramp")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="share of clients on ?stream=delta")
+    parser.add_argument("--symbols", default=DEFAULT_SYMBOLS)
+    parser.add_argument("--tick-ms", type=int, default=100, help="synthetic feed interval")
+    parser.add_argument("--redis-port", type=int, help="use this Redis (db 0) instead of starting one")
+    parser.add_argument("--sample-seconds", type=float, default=5, help="server RSS / metrics sampling period")
+    parser.add_argument("--late-ms", type=float, default=1000, help="frames older than this on arrival are late")
+    parser.add_argument("--max-p99-ms", type=float, default=500)
+    parser.add_argument("--max-late-ratio", type=float, default=0.01)
+    parser.add_argument("--max-dropped", type=int, default=0)
+    parser.add_argument("--max-failed-ratio", type=float, default=0.0)
+    parser.add_argument("--output", default="ws_load_result.json")
+    parser.add_argument("--keep", action="store_true", help="keep the database, Redis dir and app log")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-account actor (app/services/account_actor.py): FIFO turns per account,
+re-entrancy, the Redis lease between processes, and a contention benchmark of 100
+concurrent orders on one account while other accounts place orders, comparing the
+previous flow (user row locked first, then Redis reads, id probing and margin math
+under the lock) with placement in the account's turn (lock only for the final write).
+"""
+
+import asyncio
+import time
+
+from app.services.account_actor import AccountActor, AccountBusyError, lease_key
+from test_order_placement import (
+    DB_POOL_SIZE, ORDER, PRICES, SETTINGS,
+    SimulatedDB, SimulatedRedis, SimulatedSession, SimulatedStore,
+    _account, _create_order, _registry, additional_margin, place_new_order, single_order_margin,
+)
+
+HOT_ORDERS = 100
+OTHER_ACCOUNTS = 100
+
+
+class TimedSession(SimulatedSession):
+    """Records how long row locks were waited for and held."""
+
+    async def execute(self, result=None, lock=None):
+        started = time.perf_counter()
+        result = await super().execute(result, lock)
+        if lock is not None:
+            self.db.lock_waits.append(time.perf_counter() - started)
+            self._locked_at = time.perf_counter()
+        return result
+
+    def _end(self):
+        if self._rows:
+            self.db.lock_holds.append(time.perf_counter() - self._locked_at)
+        super()._end()
+
+
+class TimedDB(SimulatedDB):
+    def __init__(self):
+        super().__init__()
+        self.lock_waits = []
+        self.lock_holds = []
+
+
+def _p99(values):
+    values = sorted(values)
+    return 1000 * values[int(len(values) * 0.99) - 1]
+
+
+async def locked_first_placement(session, redis, store, account):
+    """Previous order of work: user row locked first, everything else under the lock."""
+    locked = await store.lock_account(session, account.id, "live")      # get_user_by_id_with_lock
+    await redis.round_trip()                                            # get_user_data_cache
+    await store.fetch(redis, ["EURUSD"], account.id)                    # group settings and prices
+    await store.reserve_ids(session, "live", ["order_id"])              # generate_unique_10_digit_id
+    open_orders = await store.open_orders(session, account.id, "EURUSD", "live")
+    quantity = ORDER['order_quantity']
+    margin = single_order_margin("EURUSD", "BUY", quantity, account.leverage, SETTINGS["EURUSD"],
+                                 SETTINGS["EURUSD"], PRICES)[0]
+    locked.margin += additional_margin(open_orders, "BUY", quantity, margin)
+    await session.commit()
+    return {'order_company_name': "EURUSD", 'order_type': "BUY", 'order_quantity': quantity, 'margin': margin}
+
+
+async def _contention(flow):
+    db = TimedDB()
+    redis = SimulatedRedis()
+    accounts = {n: _account(n, wallet_balance="1000000") for n in range(OTHER_ACCOUNTS + 1)}
+    store = SimulatedStore(redis, accounts)
+    groups = _registry()
+    actor = AccountActor()
+    hot, other = [], []
+
+    async def order(account, latencies):
+        session = TimedSession(db)
+        started = time.perf_counter()
+        if flow == "locked first":
+            placed = await locked_first_placement(session, redis, store, account)
+            await _create_order(session, account, placed)
+        else:
+            # The endpoint holds the turn until the order is inserted
+            async with actor.hold(redis, "live", account.id):
+                placed = await place_new_order(session, redis, account.id, ORDER, "live", groups,
+                                               group_name=account.group_name, store=store, actor=actor)
+                await _create_order(session, account, placed)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[order(accounts[0], hot) for _ in range(HOT_ORDERS)],
+                         *[order(accounts[n], other) for n in range(1, OTHER_ACCOUNTS + 1)])
+    total = time.perf_counter() - started
+    # Let the workers hand their leases back
+    await asyncio.sleep(0.005)
+    return {
+        "hot_total_ms": 1000 * total,
+        "hot_p99_ms": _p99(hot),
+        "other_p99_ms": _p99(other),
+        "lock_hold_ms": 1000 * sum(db.lock_holds) / len(db.lock_holds),
+        "lock_wait_max_ms": 1000 * max(db.lock_waits),
+        "connection_ms_per_order": 1000 * db.connection_seconds / (HOT_ORDERS + OTHER_ACCOUNTS),
+        "accounts": accounts,
+        "pool_released": db.pool._value == DB_POOL_SIZE,
+        "leases_left": [key for key in redis.keys if key.startswith("account_lease:")],
+        "actor_accounts": len(actor),
+    }
+
+
+def test_turns_are_fifo_and_per_account():
+    async def run():
+        actor = AccountActor()
+        entered, active, overlap = [], {1: 0, 2: 0}, []
+
+        async def turn(user_id, n):
+            async with actor.hold(None, "live", user_id):
+                entered.append((user_id, n))
+                active[user_id] += 1
+                overlap.append(dict(active))
+                await asyncio.sleep(0.002)
+                active[user_id] -= 1
+
+        await asyncio.gather(*(turn(1 + n % 2, n) for n in range(20)))
+        assert [n for user_id, n in entered if user_id == 1] == list(range(0, 20, 2))
+        assert all(counts[1] <= 1 and counts[2] <= 1 for counts in overlap)
+        # Different accounts ran side by side
+        assert any(counts[1] and counts[2] for counts in overlap)
+        assert len(actor) == 0
+
+    asyncio.run(run())
+
+
+def test_hold_is_reentrant_and_survives_cancelled_waiters():
+    async def run():
+        actor = AccountActor()
+        closed = []
+
+        async def close_order(n):
+            async with actor.hold(None, "live", 7):
+                closed.append(n)
+
+        spawned = []
+
+        async def cutoff():
+            async with actor.hold(None, "live", 7):
+                # Closes through close_order in this turn
+                await close_order(1)
+                # A task started in the turn does not inherit it, it waits for its own
+                spawned.append(asyncio.create_task(close_order(2)))
+                await asyncio.sleep(0.002)
+                closed.append(3)
+
+        await asyncio.wait_for(cutoff(), 1)
+        await asyncio.wait_for(spawned[0], 1)
+        assert closed == [1, 3, 2]
+
+        release = asyncio.Event()
+
+        async def long_turn():
+            async with actor.hold(None, "live", 7):
+                await release.wait()
+
+        holder = asyncio.create_task(long_turn())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(close_order(4))
+        await asyncio.sleep(0.001)
+        waiter.cancel()
+        release.set()
+        await holder
+        await asyncio.wait_for(close_order(5), 1)
+        assert closed == [1, 3, 2, 5] and len(actor) == 0
+
+    asyncio.run(run())
+
+
+def test_hold_many_does_not_deadlock():
+    async def run():
+        actor = AccountActor()
+        active, overlap = {n: 0 for n in range(1, 6)}, []
+
+        async def instruction(user_ids):
+            async with actor.hold_many(None, "live", user_ids) as busy:
+                assert busy == []
+                for n in user_ids:
+                    active[n] += 1
+                overlap.append(max(active.values()))
+                await asyncio.sleep(0.002)
+                for n in user_ids:
+                    active[n] -= 1
+
+        # Overlapping accounts requested in opposite orders, and single turns in between
+        async def single(n):
+            async with actor.hold(None, "live", n):
+                active[n] += 1
+                overlap.append(active[n])
+                await asyncio.sleep(0.001)
+                active[n] -= 1
+
+        await asyncio.wait_for(asyncio.gather(
+            instruction([1, 2, 3, 4]), instruction([4, 3, 2, 1]), single(2), instruction([3, 5, 1]), single(5),
+        ), 1)
+        assert max(overlap) == 1 and len(actor) == 0
+
+    asyncio.run(run())
+
+
+def test_lease_excludes_other_processes():
+    async def run():
+        redis = SimulatedRedis()
+        # Two processes sharing Redis; a lease is handed back every 2 turns
+        processes = [AccountActor(max_batch=2), AccountActor(max_batch=2)]
+        active, owners = [0], []
+
+        async def turn(actor, name):
+            async with actor.hold(redis, "live", 3):
+                active[0] += 1
+                assert active[0] == 1
+                owners.append(name)
+                await asyncio.sleep(0.001)
+                active[0] -= 1
+
+        await asyncio.gather(*(turn(processes[n % 2], n % 2) for n in range(20)))
+        assert sorted(owners) == [0] * 10 + [1] * 10
+        # Handed over after at most max_batch turns while the other process waited
+        runs = [len(run) for run in "".join(map(str, owners)).replace("01", "0 1").replace("10", "1 0").split()]
+        assert max(runs) <= 2 and len(runs) >= 8
+        # Released by the worker once the mailbox is empty
+        await asyncio.sleep(0.005)
+        assert lease_key(("live", 3)) not in redis.keys
+
+    asyncio.run(run())
+
+
+def test_lease_wait_times_out():
+    async def run():
+        redis = SimulatedRedis()
+        first, second = AccountActor(), AccountActor(lease_wait=0.02)
+        release = asyncio.Event()
+
+        async def long_turn():
+            async with first.hold(redis, "demo", 5):
+                await release.wait()
+
+        holder = asyncio.create_task(long_turn())
+        await asyncio.sleep(0.005)
+        try:
+            async with second.hold(redis, "demo", 5):
+                raise AssertionError("lease held by the other process")
+        except AccountBusyError:
+            pass
+        # Another account is not affected
+        async with second.hold(redis, "demo", 6):
+            pass
+        release.set()
+        await holder
+        async with second.hold(redis, "demo", 5):
+            pass
+        await asyncio.sleep(0.001)
+        assert len(first) == len(second) == 0 and not redis.keys
+
+    asyncio.run(run())
+
+
+def test_same_account_contention_benchmark():
+    results = {flow: asyncio.run(_contention(flow)) for flow in ("locked first", "account actor")}
+    print(f"{HOT_ORDERS} concurrent orders on one account + {OTHER_ACCOUNTS} orders on other accounts, "
+          f"DB pool {DB_POOL_SIZE}")
+    for flow, r in results.items():
+        print(f"  {flow:14s} hot account {r['hot_total_ms']:6.1f} ms total, p99 {r['hot_p99_ms']:6.1f} ms | "
+              f"other accounts p99 {r['other_p99_ms']:6.1f} ms | row lock held {r['lock_hold_ms']:4.1f} ms, "
+              f"max wait {r['lock_wait_max_ms']:6.1f} ms | connection {r['connection_ms_per_order']:5.1f} ms/order")
+
+    old, new = results["locked first"], results["account actor"]
+    # Waiting moved out of the DB: no row lock queue, no pooled connections held while waiting
+    assert new["lock_hold_ms"] < old["lock_hold_ms"] * 0.75
+    assert new["lock_wait_max_ms"] < old["lock_wait_max_ms"] * 0.1
+    assert new["connection_ms_per_order"] < old["connection_ms_per_order"] * 0.5
+    assert new["other_p99_ms"] < old["other_p99_ms"] * 0.5
+    # The hot account itself is bounded by its turns, which now also cover the order insert
+    assert new["hot_total_ms"] < old["hot_total_ms"] * 2
+    for r in results.values():
+        assert r["pool_released"] and not r["leases_left"]
+        for account in r["accounts"].values():
+            assert account.margin == sum(o['margin'] for o in account.orders)
+    assert len(new["accounts"][0].orders) == HOT_ORDERS and new["actor_accounts"] == 0
+
+
+if __name__ == "__main__":
+    test_turns_are_fifo_and_per_account()
+    test_hold_is_reentrant_and_survives_cancelled_waiters()
+    test_hold_many_does_not_deadlock()
+    test_lease_excludes_other_processes()
+    test_lease_wait_times_out()
+    test_same_account_contention_benchmark()
+    print("Account actor tests passed.")
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Tests for sequenced account streams: a client that applies the snapshot + deltas must
+end up with the server's account state, including when it disconnects in the middle
+of order activity and resumes with its last sequence number.
+"""
+
+import asyncio
+import copy
+import random
+
+from app.services.account_stream import AccountSessionRegistry, AccountStream
+from app.services.ws_send_queue import ConnectionSendQueue
+
+
+class StreamClient:
+    """Reference client: rebuilds the account summary from snapshot + delta frames."""
+
+    def __init__(self):
+        self.stream = None
+        self.seq = 0
+        self.summary = None
+        self.replayed = 0
+
+    def _apply(self, delta):
+        assert delta["seq"] == self.seq + 1, f"sequence gap: {self.seq} -> {delta['seq']}"
+        self.seq = delta["seq"]
+        op = delta["op"]
+        if op == "account":
+            self.summary.update(delta["changes"])
+            return
+        orders = self.summary[delta["list"]]
+        if op == "opened":
+            orders.append(dict(delta["order"]))
+        elif op == "closed":
+            orders[:] = [o for o in orders if str(o["order_id"]) != delta["order_id"]]
+        else:
+            order = next(o for o in orders if str(o["order_id"]) == delta["order_id"])
+            for key, value in delta["changes"].items():
+                if value is None:
+                    order.pop(key, None)
+                else:
+                    order[key] = value
+
+    def receive(self, frame):
+        data = frame.get("data", {})
+        if frame["type"] == "account_snapshot":
+            self.stream, self.seq = data["stream"], data["seq"]
+            self.summary = copy.deepcopy(data["account_summary"])
+        elif frame["type"] == "account_delta":
+            for delta in data["deltas"]:
+                self._apply(delta)
+        elif frame["type"] == "account_resumed":
+            self.replayed += len(data["deltas"])
+            for delta in data["deltas"]:
+                self._apply(delta)
+
+    def state(self):
+        return _normalized(self.summary)
+
+
+def _normalized(summary):
+    return {k: sorted(v, key=lambda o: str(o["order_id"])) if isinstance(v, list) else v
+            for k, v in summary.items()}
+
+
+class Account:
+    """Server-side truth with random order activity."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.next_id = 1
+        self.summary = {"balance": "1000.00", "margin": "0.00", "open_orders": [], "pending_orders": []}
+
+    def step(self):
+        s, rng = self.summary, self.rng
+        action = rng.random()
+        if action < 0.35 or not (s["open_orders"] or s["pending_orders"]):
+            target = "open_orders" if rng.random() < 0.7 else "pending_orders"
+            s[target] = s[target] + [{"order_id": str(self.next_id), "order_company_name": "EURUSD",
+                                      "order_type": "BUY", "order_quantity": "0.10", "stop_loss": None}]
+            self.next_id += 1
+        elif action < 0.55 and s["open_orders"]:
+            s["open_orders"] = s["open_orders"][1:]
+            s["balance"] = f"{float(s['balance']) + rng.uniform(-5, 5):.2f}"
+        elif action < 0.75 and s["pending_orders"]:
+            # Pending order triggers
+            order = dict(s["pending_orders"][0], order_status="OPEN")
+            s["pending_orders"] = s["pending_orders"][1:]
+            s["open_orders"] = s["open_orders"] + [order]
+        elif s["open_orders"]:
+            i = rng.randrange(len(s["open_orders"]))
+            s["open_orders"] = list(s["open_orders"])
+            s["open_orders"][i] = dict(s["open_orders"][i], stop_loss=f"1.0{rng.randint(100, 999)}")
+        s["margin"] = f"{len(s['open_orders']) * 21.7:.2f}"
+        return copy.deepcopy(s)
+
+
+def test_resume_after_disconnects_during_order_activity():
+    rng = random.Random(11)
+    account = Account(rng)
+    sessions = AccountSessionRegistry(ttl=60, capacity=512)
+    client = StreamClient()
+
+    async def connect(session, resumed_deltas=None):
+        received = []
+
+        async def send(frame_text):
+            # Slow link: frames still queued at disconnect time are lost
+            await asyncio.sleep(0.001)
+            received.append(frame_text)
+
+        queue = ConnectionSendQueue(send, serialize=lambda f: f, account_stream=session.stream, eviction_deadline=60)
+        queue.start()
+        if resumed_deltas is not None:
+            queue.put_event({"type": "account_resumed", "data": {"stream": session.token, "seq": session.stream.seq,
+                                                                 "deltas": resumed_deltas}})
+        return queue, received
+
+    async def run():
+        session = sessions.create("live", 7, "ACC7", "standard")
+        client.receive(session.stream.snapshot(copy.deepcopy(account.summary)))
+        resumes = 0
+        for _ in range(8):
+            queue, received = await connect(session, None if resumes == 0 else replay)
+            for _ in range(rng.randint(5, 40)):
+                queue.put_market_update({"EURUSD": {"buy": 1.1}}, account.step())
+                await asyncio.sleep(0.0005 if rng.random() < 0.5 else 0)
+            # Drop the connection mid-activity
+            await queue.close()
+            sessions.detach(session)
+            for frame in received:
+                client.receive(frame)
+            # Orders keep changing while the client is away
+            for _ in range(rng.randint(0, 5)):
+                account.step()
+            session, replay, result = sessions.resume(client.stream, "ACC7", "live", client.seq)
+            assert result == "resumed"
+            replay = replay + session.stream.update(copy.deepcopy(account.summary))
+            resumes += 1
+        # Final connection delivers the replay
+        queue, received = await connect(session, replay)
+        await asyncio.sleep(0.05)
+        await queue.close()
+        for frame in received:
+            client.receive(frame)
+        return resumes
+
+    resumes = asyncio.run(run())
+    assert resumes == 8
+    assert client.state() == _normalized(account.summary)
+    assert client.replayed > 0
+
+
+def test_slow_stream_consumer_gets_conflated_deltas():
+    rng = random.Random(5)
+    account = Account(rng)
+    sessions = AccountSessionRegistry(ttl=60, capacity=512)
+    client = StreamClient()
+
+    async def run(eviction_deadline, updates):
+        session = sessions.create("live", 9, "ACC9", "standard")
+        client.receive(session.stream.snapshot(copy.deepcopy(account.summary)))
+        received, unblock = [], asyncio.Event()
+
+        async def send(frame):
+            await unblock.wait()
+            received.append(frame)
+
+        queue = ConnectionSendQueue(send, serialize=lambda f: f, account_stream=session.stream,
+                                    max_events=16, eviction_deadline=eviction_deadline)
+        queue.start()
+        queue.put_market_update({"EURUSD": {"buy": 1.0}}, account.step())
+        await asyncio.sleep(0)  # the writer is now stuck in send()
+        for n in range(updates):
+            queue.put_market_update({"EURUSD": {"buy": 1.0 + n / 1e5}}, account.step())
+        assert queue.stats()["queued_events"] == 0 and queue.evicted is None
+        await asyncio.sleep(0.02)
+        queue.check()
+        unblock.set()
+        await asyncio.sleep(0.01)
+        await queue.close()
+        return queue, received
+
+    queue, received = asyncio.run(run(eviction_deadline=60, updates=1000))
+    deltas = [frame for frame in received if frame["type"] == "account_delta"]
+    # One frame for the stuck write, one with the net change of the other 1000 summaries
+    assert len(deltas) == 2 and len(received) == 4
+    for frame in received:
+        client.receive(frame)
+    assert client.state() == _normalized(account.summary)
+
+    # The lag deadline evicts a stuck stream consumer just like any other
+    queue, received = asyncio.run(run(eviction_deadline=0.01, updates=1))
+    assert queue.evicted == "lag_deadline"
+
+
+def test_resume_is_refused_outside_the_buffer_or_ttl():
+    sessions = AccountSessionRegistry(ttl=60, capacity=4)
+    session = sessions.create("live", 1, "ACC1", "standard")
+    session.stream.snapshot({"balance": "1", "open_orders": [], "pending_orders": []})
+
+    # Still attached: a half-open old socket must not share the stream
+    assert sessions.resume(session.token, "ACC1", "live", 1)[2] == "attached"
+    sessions.detach(session)
+    assert sessions.resume(session.token, "ACC2", "live", 1)[2] == "unknown"
+    assert sessions.resume(session.token, "ACC1", "demo", 1)[2] == "unknown"
+
+    for n in range(10):
+        session.stream.update({"balance": str(n)})
+    assert sessions.resume(session.token, "ACC1", "live", 1)[2] == "gap"
+    resumed, missed, result = sessions.resume(session.token, "ACC1", "live", session.stream.seq - 2)
+    assert result == "resumed" and [d["seq"] for d in missed] == [session.stream.seq - 1, session.stream.seq]
+
+    sessions.detach(resumed)
+    sessions.prune(now=resumed.detached_at + 61)
+    assert len(sessions) == 0
+
+
+def test_deltas_classify_order_changes():
+    stream = AccountStream()
+    order = {"order_id": "1", "order_quantity": "0.1", "profit_loss": "0"}
+    stream.snapshot({"balance": "10", "open_orders": [order], "pending_orders": []})
+    ops = [d["op"] for d in stream.update({"balance": "10", "open_orders": [dict(order, profit_loss="3.2")]})]
+    assert ops == ["pnl_changed"]
+    ops = [d["op"] for d in stream.update({"balance": "12", "open_orders": [dict(order, order_quantity="0.2", profit_loss="3.2")],
+                                           "pending_orders": [{"order_id": "2"}]})]
+    assert ops == ["modified", "opened", "account"]
+    assert stream.update({"balance": "12", "open_orders": [], "pending_orders": [{"order_id": "2"}]})[0]["op"] == "closed"
+
+
+if __name__ == "__main__":
+    test_resume_after_disconnects_during_order_activity()
+    test_slow_stream_consumer_gets_conflated_deltas()
+    test_resume_is_refused_outside_the_buffer_or_ttl()
+    test_deltas_classify_order_changes()
+    print("Account stream tests passed.")
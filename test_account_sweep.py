@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Tests for the time-boxed all-accounts sweep: prioritisation of accounts with open
+positions, bounded concurrency, idle accounts handled without a session, deadline
+overrun + resume, and a 50k account keyset-pagination benchmark on SQLite.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.services.account_sweep import AccountSweeper
+
+
+class _NullSession:
+    opened = 0
+
+    async def __aenter__(self):
+        _NullSession.opened += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def _in_memory_sources(live_ids, demo_ids, open_position_ids, rows_read=None):
+    tables = {"live": sorted(live_ids), "demo": sorted(demo_ids)}
+
+    async def fetch_priority(db, user_type):
+        return [(i, "standard") for i in tables[user_type] if (user_type, i) in open_position_ids]
+
+    async def fetch_batch(db, user_type, after_id, limit):
+        rows = [(i, "standard") for i in tables[user_type]
+                if i > after_id and (user_type, i) not in open_position_ids][:limit]
+        if rows_read is not None:
+            rows_read.extend((user_type, i) for i, _ in rows)
+        return rows
+
+    return fetch_priority, fetch_batch
+
+
+def _sqlite_sources(rows_read):
+    """The queries of crud.user.get_active_accounts_with_open_orders / get_active_account_batch."""
+    from sqlalchemy import select
+    from app.database.models import User, DemoUser, UserOrder, DemoUserOrder
+
+    def tables(user_type):
+        return (DemoUser, DemoUserOrder) if user_type == "demo" else (User, UserOrder)
+
+    async def fetch_priority(db, user_type):
+        model, order_model = tables(user_type)
+        open_owner_ids = select(order_model.order_user_id).filter(order_model.order_status == 'OPEN')
+        result = await db.execute(select(model.id, model.group_name)
+                                  .filter(model.status == 1, model.id.in_(open_owner_ids)).order_by(model.id))
+        return result.all()
+
+    async def fetch_batch(db, user_type, after_id, limit):
+        model, order_model = tables(user_type)
+        open_owner_ids = select(order_model.order_user_id).filter(order_model.order_status == 'OPEN')
+        result = await db.execute(select(model.id, model.group_name)
+                                  .filter(model.status == 1, model.id > after_id, model.id.not_in(open_owner_ids))
+                                  .order_by(model.id).limit(limit))
+        rows = result.all()
+        rows_read[0] += len(rows)
+        return rows
+
+    return fetch_priority, fetch_batch
+
+
+def test_priority_concurrency_and_full_coverage():
+    open_positions = {("live", 900), ("demo", 5)}
+    rows_read = []
+    fetch_priority, fetch_batch = _in_memory_sources(range(1, 1001), range(1, 201), open_positions, rows_read)
+    visited = []
+    idle = []
+    active = {"now": 0, "max": 0}
+
+    async def process(db, account):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        visited.append((account["user_type"], account["id"]))
+        await asyncio.sleep(0)
+        active["now"] -= 1
+
+    async def process_idle(account):
+        idle.append((account["user_type"], account["id"]))
+
+    _NullSession.opened = 0
+    sweeper = AccountSweeper(_NullSession, process, concurrency=4, deadline_seconds=30, batch_size=64,
+                             fetch_priority=fetch_priority, fetch_batch=fetch_batch,
+                             process_idle_account=process_idle)
+    report = asyncio.run(sweeper.run())
+
+    assert set(visited) == open_positions
+    assert len(idle) == len(set(idle)) == 1198 and not open_positions & set(idle)
+    assert report["prioritized"] == 2 and report["idle"] == 1198 and not report["overrun"]
+    assert active["max"] <= 4
+    # A session for the listing and one per open-position account; none for the idle ones
+    assert _NullSession.opened == 1 + len(open_positions)
+    # The keyset pass does not read the accounts the priority pass visited
+    assert len(rows_read) == 1198 and not open_positions & set(rows_read)
+
+
+def test_without_an_idle_handler_the_keyset_pass_is_skipped():
+    rows_read = []
+    fetch_priority, fetch_batch = _in_memory_sources(range(1, 101), [], {("live", 50)}, rows_read)
+    visited = []
+
+    async def process(db, account):
+        visited.append(account["id"])
+
+    sweeper = AccountSweeper(_NullSession, process, fetch_priority=fetch_priority, fetch_batch=fetch_batch)
+    report = asyncio.run(sweeper.run())
+    assert visited == [50] and not rows_read and report["idle"] == 0
+
+
+def test_deadline_overrun_resumes_where_it_stopped():
+    fetch_priority, fetch_batch = _in_memory_sources(range(1, 301), [], set())
+    visited = []
+
+    async def process(db, account):
+        raise AssertionError("no account has open positions")
+
+    async def slow_process_idle(account):
+        visited.append(account["id"])
+        await asyncio.sleep(0.002)
+
+    sweeper = AccountSweeper(_NullSession, process, concurrency=2, deadline_seconds=0.1, batch_size=50,
+                             fetch_priority=fetch_priority, fetch_batch=fetch_batch,
+                             process_idle_account=slow_process_idle)
+    first = asyncio.run(sweeper.run())
+    assert first["overrun"]
+    assert 0 < first["dispatched"] < 300
+    assert sweeper.cursors["live"] == max(visited)
+
+    # Enough sweeps visit every account even though each one is cut short
+    for _ in range(20):
+        if set(visited) >= set(range(1, 301)):
+            break
+        asyncio.run(sweeper.run())
+    assert set(visited) == set(range(1, 301))
+
+
+def test_sweep_50k_accounts_on_sqlite():
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import insert
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.database.models import Base, User, DemoUser, UserOrder, DemoUserOrder
+
+    total_accounts = 50_000
+    rows_read = [0]
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all,
+                                tables=[User.__table__, DemoUser.__table__, UserOrder.__table__, DemoUserOrder.__table__])
+            for model, count in ((User, total_accounts // 2), (DemoUser, total_accounts // 2)):
+                rows = [{"id": i, "name": f"u{i}", "email": f"u{i}@example.com", "phone_number": str(i),
+                         "hashed_password": "x", "status": 1, "group_name": "standard"} for i in range(1, count + 1)]
+                await conn.execute(insert(model), rows)
+            await conn.execute(insert(UserOrder), [
+                {"order_id": f"L{i}", "order_user_id": i, "order_company_name": "EURUSD", "order_type": "BUY",
+                 "order_status": "OPEN", "order_price": 1, "order_quantity": 1}
+                for i in range(1, total_accounts // 2 + 1, 100)
+            ])
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        fetch_priority, fetch_batch = _sqlite_sources(rows_read)
+        visited = 0
+
+        async def process(db, account):
+            nonlocal visited
+            visited += 1
+
+        async def process_idle(account):
+            nonlocal visited
+            visited += 1
+
+        sweeper = AccountSweeper(session_factory, process, concurrency=8, deadline_seconds=300, batch_size=1000,
+                                 fetch_priority=fetch_priority, fetch_batch=fetch_batch,
+                                 process_idle_account=process_idle)
+        started = time.perf_counter()
+        report = await sweeper.run()
+        elapsed = time.perf_counter() - started
+        await engine.dispose()
+        return report, visited, elapsed
+
+    report, visited, elapsed = asyncio.run(run())
+    print(f"Swept {visited} accounts in {elapsed:.2f}s ({report['prioritized']} prioritized)")
+    assert visited == total_accounts
+    assert report["prioritized"] == total_accounts // 200
+    assert rows_read[0] == report["idle"] == total_accounts - report["prioritized"]
+    assert not report["overrun"]
+
+
+if __name__ == "__main__":
+    test_priority_concurrency_and_full_coverage()
+    test_without_an_idle_handler_the_keyset_pass_is_skipped()
+    test_deadline_overrun_resumes_where_it_stopped()
+    test_sweep_50k_accounts_on_sqlite()
+    print("Account sweep tests passed.")
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Tests for batch closes (app/services/batch_close.py): the same wallet balance, margin
+and order values as closing the positions one by one, the close-all selectors, skipped
+positions, rollback when an order was closed concurrently, the margin refund computed
+from the orders read under the row lock, and a benchmark of closing
+300 positions of one account against one /orders/close call per position.
+"""
+
+import asyncio
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from types import SimpleNamespace
+
+from app.services.account_actor import AccountActor
+from app.services.batch_close import (
+    SKIP_NO_CONVERSION, SKIP_NO_PRICE, SKIP_NOT_OPEN,
+    BatchCloseStore, close_positions, close_price, close_values,
+)
+from app.services.order_placement import OrderProcessingError, symbol_margin_contribution
+from test_bulk_orders import RowLockingSession
+from test_order_placement import DB_POOL_SIZE, SETTINGS, SimulatedDB, SimulatedRedis, SimulatedSession, _registry
+
+POSITIONS = 300
+SYMBOLS = ("EURUSD", "EURJPY")
+# Group-adjusted prices in the resident snapshot
+SNAPSHOT = {
+    "EURUSD": {"buy": 1.0861, "sell": 1.0859, "spread": 1.5},
+    "EURJPY": {"buy": 162.76, "sell": 162.74, "spread": 1.5},
+}
+LAST_PRICES = {"USDJPY": {"b": Decimal("150.000"), "o": Decimal("149.980")}}
+
+
+def _order(n, symbol="EURUSD", order_type="BUY", quantity="0.1", price=None, swap="0"):
+    quantity = Decimal(quantity)
+    price = Decimal(price or ("1.0800" if symbol == "EURUSD" else "163.00"))
+    margin = (quantity * Decimal("100000") * price / Decimal("100")).quantize(Decimal("0.01"))
+    if symbol == "EURJPY":
+        margin = (margin / Decimal("150")).quantize(Decimal("0.01"))
+    return SimpleNamespace(order_id=str(3000000000 + n), order_user_id=7, order_company_name=symbol,
+                           order_type=order_type, order_status="OPEN", order_quantity=quantity, order_price=price,
+                           margin=margin, contract_value=quantity * Decimal("100000"), commission=Decimal("0.20"),
+                           swap=Decimal(swap), status="ACTIVE", stop_loss=None, take_profit=None,
+                           stoploss_id=None, takeprofit_id=None, created_at=None)
+
+
+def _account(orders):
+    margin = Decimal("0")
+    for symbol in SYMBOLS:
+        margin += symbol_margin_contribution([o for o in orders if o.order_company_name == symbol])["total_margin"]
+    return SimpleNamespace(id=7, group_name="standard", wallet_balance=Decimal("100000"), margin=margin,
+                           leverage=Decimal("100"), email="trader@example.com", account_number="L7", orders=orders)
+
+
+class SimulatedCloseStore(BatchCloseStore):
+    def __init__(self, redis, account, snapshot=SNAPSHOT, cached_prices=None, last_prices=LAST_PRICES,
+                 closed_elsewhere=()):
+        self.redis = redis
+        self.account = account
+        self.snapshot = snapshot
+        self.cached_prices = cached_prices or {}
+        self.last_prices = last_prices
+        self.closed_elsewhere = set(closed_elsewhere)
+        self.wallet_rows = []
+        self.history = []
+        self.published = []
+        self.fetched = []
+
+    async def snapshot_prices(self, group_name):
+        return self.snapshot
+
+    async def fetch_prices(self, redis_client, group_name, symbols, conversions):
+        self.fetched.append((list(symbols), list(conversions)))
+        return await self.redis.round_trip({
+            "adjusted": {s: self.cached_prices[s] for s in symbols if s in self.cached_prices},
+            "last_price": {s: self.last_prices[s] for s in conversions if s in self.last_prices},
+        })
+
+    async def open_orders(self, db, user_id, user_type):
+        orders = [o for o in self.account.orders if o.order_status == "OPEN"]
+        return await db.execute(orders, rows=len(orders))
+
+    async def reserve_ids(self, db, user_type, close_ids, transaction_ids):
+        await db.execute(rows=close_ids)
+        await db.execute(rows=transaction_ids)
+        return ([str(4000000000 + n) for n in range(close_ids)], [str(5000000000 + n) for n in range(transaction_ids)])
+
+    async def lock_account(self, db, user_id, user_type):
+        return await db.execute(self.account, lock=(user_type, user_id))
+
+    async def close_orders(self, db, closes, user_type):
+        await db.execute(rows=len(closes))
+        # Applied at commit in the real UPDATE; here the test inspects them after commit only
+        self.pending = closes
+        return sum(1 for order_id in closes if order_id not in self.closed_elsewhere)
+
+    async def insert_wallet_rows(self, db, rows):
+        await db.execute(rows=len(rows))
+        self.pending_wallet = rows
+
+    async def insert_history(self, db, rows):
+        await db.execute(rows=len(rows))
+        self.pending_history = rows
+
+    async def publish(self, redis_client, user_type, user_id, user_data):
+        self.published.append(user_data)
+        await self.redis.round_trip()
+
+
+class CommittingSession(RowLockingSession):
+    """Applies the store's pending order updates and inserts on commit, drops them on rollback."""
+
+    def __init__(self, db, store, snapshot_account):
+        super().__init__(db)
+        self.store = store
+        self.saved = (snapshot_account.wallet_balance, snapshot_account.margin)
+        self.account = snapshot_account
+
+    async def commit(self):
+        store = self.store
+        for order in self.account.orders:
+            fields = getattr(store, 'pending', {}).get(order.order_id)
+            if fields:
+                order.order_status = "CLOSED"
+                for column, value in fields.items():
+                    setattr(order, column, value)
+        store.wallet_rows.extend(getattr(store, 'pending_wallet', []))
+        store.history.extend(getattr(store, 'pending_history', []))
+        store.pending, store.pending_wallet, store.pending_history = {}, [], []
+        await super().commit()
+
+    async def rollback(self):
+        self.account.wallet_balance, self.account.margin = self.saved
+        self.store.pending, self.store.pending_wallet, self.store.pending_history = {}, [], []
+        await super().rollback()
+
+
+def _mixed_orders(count):
+    orders = []
+    for n in range(count):
+        symbol = SYMBOLS[n % 2]
+        order_type = "SELL" if n % 3 == 0 else "BUY"
+        price = ("1.0800" if n % 5 else "1.0900") if symbol == "EURUSD" else ("163.00" if n % 5 else "162.00")
+        orders.append(_order(n, symbol, order_type, quantity=str(Decimal("0.1") * (1 + n % 4)), price=price,
+                             swap="0.5" if n % 7 == 0 else "0"))
+    return orders
+
+
+def _close_one_by_one(account, orders):
+    """Reference: /orders/close's arithmetic applied to each position in turn."""
+    prices = {**LAST_PRICES}
+    for order in orders:
+        symbol = order.order_company_name
+        open_for_symbol = [o for o in account.orders if o.order_status == "OPEN" and o.order_company_name == symbol]
+        before = symbol_margin_contribution(open_for_symbol)["total_margin"]
+        after = symbol_margin_contribution([o for o in open_for_symbol if o is not order])["total_margin"]
+        non_symbol = account.margin - before
+        account.margin = max(Decimal(0), (non_symbol + after).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+        values = close_values(order, close_price(order.order_type, SNAPSHOT[symbol]), SETTINGS[symbol], prices)
+        order.order_status = "CLOSED"
+        account.wallet_balance = (account.wallet_balance + values['net_profit'] - values['swap']).quantize(
+            Decimal("0.00000001"), rounding=ROUND_HALF_UP)
+
+
+def _run(account, store, actor=None, **selection):
+    async def run():
+        db = SimulatedDB()
+        session = CommittingSession(db, store, account)
+        try:
+            return await close_positions(session, store.redis, account, "live", _registry(), store=store,
+                                         actor=actor or AccountActor(), **selection)
+        finally:
+            assert db.pool._value == DB_POOL_SIZE and not any(lock.locked() for lock in db.row_locks.values())
+
+    return asyncio.run(run())
+
+
+def test_close_all_matches_closing_one_by_one():
+    reference = _account(_mixed_orders(40))
+    _close_one_by_one(reference, list(reference.orders))
+
+    account = _account(_mixed_orders(40))
+    store = SimulatedCloseStore(SimulatedRedis(), account)
+    closed, skipped = _run(account, store)
+    assert not skipped and len(closed) == 40
+    assert account.wallet_balance == reference.wallet_balance
+    assert account.margin == reference.margin == 0
+    assert all(o.order_status == "CLOSED" and o.close_id and o.close_message == "Closed by batch close"
+               for o in account.orders)
+    # P/L (non-zero), commission and swap rows, each with its own transaction id
+    types = [row["transaction_type"] for row in store.wallet_rows]
+    assert types.count("Commission") == 40 and types.count("Swap") == len([n for n in range(40) if n % 7 == 0])
+    assert len({row["transaction_id"] for row in store.wallet_rows}) == len(store.wallet_rows)
+    assert all(row["user_id"] == 7 and "demo_user_id" not in row for row in store.wallet_rows)
+    assert [h["action_type"] for h in store.history] == ["BATCH_CLOSE"] * 40
+    # Resident snapshot: only the JPY conversion pair read from Redis, one publish
+    assert store.fetched == [([], ["JPYUSD", "USDJPY"])]
+    assert len(store.published) == 1 and store.published[0]["margin"] == account.margin
+
+
+def test_selectors_and_skipped_positions():
+    orders = _mixed_orders(12)
+    account = _account(orders)
+    reference = _account(_mixed_orders(12))
+    eurusd = [o for o in reference.orders if o.order_company_name == "EURUSD"]
+    losing = [o for o in eurusd
+              if close_values(o, close_price(o.order_type, SNAPSHOT["EURUSD"]), SETTINGS["EURUSD"], LAST_PRICES)
+              ['net_profit'] < 0]
+    assert 0 < len(losing) < len(eurusd)
+    _close_one_by_one(reference, losing)
+
+    store = SimulatedCloseStore(SimulatedRedis(), account)
+    closed, skipped = _run(account, store, symbol="eurusd", losing_only=True)
+    assert sorted(o['order_id'] for o in closed) == sorted(o.order_id for o in losing) and not skipped
+    assert all(o['net_profit'] < 0 and o['order_status'] == "CLOSED" for o in closed)
+    assert account.margin == reference.margin and account.wallet_balance == reference.wallet_balance
+    assert all(o.order_status == "OPEN" for o in orders if o.order_company_name == "EURJPY")
+
+    # Explicit ids: unknown or already closed ids are skipped, the rest closed
+    still_open = [o.order_id for o in orders if o.order_status == "OPEN"][:3]
+    closed, skipped = _run(account, store, order_ids=still_open + [losing[0].order_id, "9999999999"])
+    assert [o['order_id'] for o in closed] == still_open
+    assert {s['order_id']: s['reason'] for s in skipped} == {losing[0].order_id: SKIP_NOT_OPEN,
+                                                             "9999999999": SKIP_NOT_OPEN}
+
+    # A symbol missing from the snapshot comes from the adjusted price cache, or is skipped
+    account = _account(_mixed_orders(4))
+    store = SimulatedCloseStore(SimulatedRedis(), account, snapshot={"EURUSD": SNAPSHOT["EURUSD"]})
+    closed, skipped = _run(account, store)
+    assert store.fetched == [(["EURJPY"], ["JPYUSD", "USDJPY"])]
+    assert len(closed) == 2 and {s['reason'] for s in skipped} == {SKIP_NO_PRICE}
+    store = SimulatedCloseStore(SimulatedRedis(), account, last_prices={})
+    closed, skipped = _run(account, store)
+    assert not closed and [s['reason'] for s in skipped] == [SKIP_NO_CONVERSION] * 2
+
+
+def test_concurrently_closed_order_rolls_back():
+    account = _account(_mixed_orders(6))
+    balance, margin = account.wallet_balance, account.margin
+    store = SimulatedCloseStore(SimulatedRedis(), account, closed_elsewhere={account.orders[2].order_id})
+    try:
+        _run(account, store)
+        raise AssertionError("partial close committed")
+    except OrderProcessingError:
+        pass
+    assert (account.wallet_balance, account.margin) == (balance, margin)
+    assert all(o.order_status == "OPEN" for o in account.orders)
+    assert not store.wallet_rows and not store.history and not store.published
+
+
+def test_margin_is_released_from_the_orders_read_under_the_lock():
+    # A writer outside the account's turn opens a hedging EURUSD sell between the read and
+    # the row lock; the refund must be computed against it
+    account = _account(_mixed_orders(6))
+    closing = [o for o in account.orders if o.order_company_name == "EURUSD" and o.order_type == "BUY"][:1]
+    hedge = _order(99, "EURUSD", "SELL", quantity=str(closing[0].order_quantity))
+
+    class ConcurrentWriterStore(SimulatedCloseStore):
+        async def lock_account(self, db, user_id, user_type):
+            if hedge not in self.account.orders:
+                self.account.orders.append(hedge)
+                self.account.margin = _account(self.account.orders).margin
+            return await super().lock_account(db, user_id, user_type)
+
+    store = ConcurrentWriterStore(SimulatedRedis(), account)
+    closed, skipped = _run(account, store, order_ids=[closing[0].order_id])
+    assert [o['order_id'] for o in closed] == [closing[0].order_id] and not skipped
+    assert account.margin == _account([o for o in account.orders if o.order_status == "OPEN"]).margin
+
+
+async def _close_per_request(account, redis, db):
+    """One /orders/close per position: statements and round trips of its local close path, in order."""
+    actor = AccountActor()
+    for order in list(account.orders):
+        session = SimulatedSession(db)
+        await session.execute()                                   # generate_unique_10_digit_id(close_id)
+        async with actor.hold(redis, "live", account.id):
+            await session.execute(order)                          # get_order_by_id
+            await session.execute(account, lock=("live", 7))      # get_user_by_id_with_lock
+            await session.execute()                               # get_open_orders_by_user_id_and_symbol
+            await session.execute()                               # ExternalSymbolInfo
+            await redis.round_trip()                              # get_group_symbol_settings_cache
+            for _ in range(2):
+                await session.execute()                           # wallet transaction ids (P/L, commission)
+            for _ in range(4):
+                await session.execute()                           # flush: order, user, two wallet rows
+            await session.commit()
+            for _ in range(2):
+                await session.execute()                           # refresh order and user
+            order.order_status = "CLOSED"
+            await redis.round_trip()                              # set_user_data_cache
+            await session.execute()                               # update_user_static_orders (DB read)
+            await redis.round_trip()                              #   and its cache write
+            for _ in range(3):
+                await redis.round_trip()                          # order, user data, market trigger
+            await session.commit()
+
+
+def test_close_300_positions_benchmark():
+    results = {}
+
+    one_by_one = _account(_mixed_orders(POSITIONS))
+    db, redis = SimulatedDB(), SimulatedRedis()
+    started = time.perf_counter()
+    asyncio.run(_close_per_request(one_by_one, redis, db))
+    results["one /orders/close per position"] = (time.perf_counter() - started, db.queries,
+                                                 redis.round_trips + redis.lease_calls)
+
+    account = _account(_mixed_orders(POSITIONS))
+    redis = SimulatedRedis()
+    store = SimulatedCloseStore(redis, account)
+
+    async def batch():
+        db = SimulatedDB()
+        started = time.perf_counter()
+        closed, skipped = await close_positions(CommittingSession(db, store, account), redis, account, "live",
+                                                _registry(), store=store, actor=AccountActor())
+        assert len(closed) == POSITIONS and not skipped
+        return time.perf_counter() - started, db.queries
+
+    elapsed, queries = asyncio.run(batch())
+    results["batch close"] = (elapsed, queries, redis.round_trips + redis.lease_calls)
+
+    print(f"Closing {POSITIONS} positions of one account ({len(SYMBOLS)} symbols)")
+    for name, (elapsed, queries, round_trips) in results.items():
+        print(f"  {name:32s} {1000 * elapsed:8.1f} ms  {queries:5d} DB statements  {round_trips:5d} Redis round trips")
+    single, bulk = results["one /orders/close per position"], results["batch close"]
+    assert bulk[1] <= 10 and single[1] >= 10 * POSITIONS
+    assert bulk[2] <= 5 and single[2] >= 7 * POSITIONS
+    assert bulk[0] < single[0] * 0.2
+    assert account.margin == 0 and all(o.order_status == "CLOSED" for o in account.orders)
+
+
+if __name__ == "__main__":
+    test_close_all_matches_closing_one_by_one()
+    test_selectors_and_skipped_positions()
+    test_concurrently_closed_order_rolls_back()
+    test_margin_is_released_from_the_orders_read_under_the_lock()
+    test_close_300_positions_benchmark()
+    print("Batch close tests passed.")
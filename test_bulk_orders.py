@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Tests for bulk order placement (app/services/bulk_orders.py): the same margin as one
+order per account, per-account rejections (unmanaged, duplicated and busy accounts),
+the row locks released on failure, and a
+benchmark of one fund manager instruction allocated to 1k follower accounts, compared
+with one POST /orders/ per follower (authentication, placement in the account's turn,
+insert, and the three publishes of each order).
+"""
+
+import asyncio
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+from app.services.account_actor import AccountActor
+from app.services.ws_bootstrap import GroupSymbolRegistry
+from app.services.bulk_orders import (
+    REJECT_BUSY, REJECT_DUPLICATE, REJECT_INSUFFICIENT_FUNDS, REJECT_NOT_FOUND, REJECT_NOT_MANAGED, REJECT_ROUTED,
+    BulkOrderStore, manages, place_bulk_orders,
+)
+from test_order_placement import (
+    DB_POOL_SIZE, ORDER, PRICES, SETTINGS, SimulatedDB, SimulatedRedis, SimulatedSession, SimulatedStore,
+    _account, _create_order, _registry, place_new_order,
+)
+
+FOLLOWERS = 1000
+# Client requests in flight when replicating one POST per follower
+CLIENT_CONCURRENCY = 50
+# Extra cost per row of a multi-row statement
+DB_ROW_SECONDS = 0.00001
+
+MANAGER = SimpleNamespace(id=1000000, account_number="FM1001", name="Alpha Fund", isActive=1)
+INSTRUCTION = {'symbol': 'EURUSD', 'order_type': 'BUY', 'stop_loss': None, 'take_profit': None, 'status': 'ACTIVE'}
+
+
+def _follower(n, wallet_balance="100000", fund_manager="FM1001", group_name="standard", is_self_trading=0):
+    account = _account(n, wallet_balance)
+    account.fund_manager = fund_manager
+    account.is_self_trading = is_self_trading
+    account.group_name = group_name
+    account.email = f"follower{n}@example.com"
+    account.user_type = "live"
+    return account
+
+
+class RowLockingSession(SimulatedSession):
+    """Multi-row statements: cost per row, and row locks taken in the given order."""
+
+    async def execute(self, result=None, lock=None, rows=0, locks=()):
+        result = await super().execute(result, lock)
+        for key in locks:
+            row = self.db.row_locks.setdefault(key, asyncio.Lock())
+            await row.acquire()
+            self._rows.append(row)
+        if rows:
+            await asyncio.sleep(rows * DB_ROW_SECONDS)
+        return result
+
+
+class SimulatedBulkStore(BulkOrderStore):
+    def __init__(self, redis, accounts, routed=(), fail_insert=False):
+        self.redis = redis
+        self.accounts = accounts
+        self.routed = set(routed)
+        self.fail_insert = fail_insert
+        self.pipelines = []
+
+    async def load_accounts(self, db, user_ids):
+        return await db.execute([self.accounts[i] for i in user_ids if i in self.accounts], rows=len(user_ids))
+
+    async def fetch_prices(self, redis_client, symbols):
+        return await self.redis.round_trip({s: PRICES[s] for s in symbols if s in PRICES})
+
+    async def market_data(self, symbol):
+        raise AssertionError("prices are cached")
+
+    async def routes_externally(self, db, redis_client, group_name):
+        return await self.redis.round_trip(group_name in self.routed)
+
+    async def reserve_ids(self, db, columns, count):
+        return await db.execute([{column: str(2000000000 + n * len(columns) + i) for i, column in enumerate(columns)}
+                                 for n in range(count)], rows=count)
+
+    async def lock_accounts(self, db, user_ids):
+        user_ids = sorted(i for i in user_ids if i in self.accounts)
+        return await db.execute([self.accounts[i] for i in user_ids], rows=len(user_ids),
+                                locks=[("live", i) for i in user_ids])
+
+    async def open_orders(self, db, user_ids, symbol):
+        return await db.execute({i: [o for o in self.accounts[i].orders if o['order_company_name'] == symbol]
+                                 for i in user_ids}, rows=len(user_ids))
+
+    async def insert_orders(self, db, rows):
+        if self.fail_insert:
+            raise RuntimeError("Duplicate entry")
+        await db.execute(rows=len(rows))
+        for row in rows:
+            self.accounts[row['order_user_id']].orders.append(
+                {key: row[key] for key in ('order_company_name', 'order_type', 'order_quantity', 'margin')})
+
+    async def update_margins(self, db, margins):
+        await db.execute(rows=len(margins))
+        for user_id, margin in margins.items():
+            self.accounts[user_id].margin = margin
+
+    async def publish(self, redis_client, accounts):
+        # SET user data + DEL static orders + PUBLISH per account, one trigger, one round trip
+        self.pipelines.append(3 * len(accounts) + 1)
+        await self.redis.round_trip()
+
+
+def test_bulk_margin_matches_single_orders():
+    async def run():
+        db, redis = SimulatedDB(), SimulatedRedis()
+        quantities = [Decimal("0.1"), Decimal("0.25"), Decimal("1"), Decimal("0.05")]
+        singles = {n: _follower(n) for n in range(10, 14)}
+        bulk = {n: _follower(n) for n in range(10, 14)}
+        for accounts in (singles, bulk):
+            # Follower 11 holds a hedged SELL already
+            accounts[11].orders.append({'order_company_name': 'EURUSD', 'order_type': 'SELL',
+                                        'order_quantity': Decimal("0.2"), 'margin': Decimal("216.00")})
+            accounts[11].margin = Decimal("216.00")
+
+        store = SimulatedStore(redis, singles)
+        for (user_id, account), quantity in zip(singles.items(), quantities):
+            session = SimulatedSession(db)
+            placed = await place_new_order(session, redis, user_id, {**ORDER, 'order_quantity': quantity}, "live",
+                                           _registry(), "standard", store=store, actor=AccountActor())
+            await _create_order(session, account, placed)
+
+        bulk_store = SimulatedBulkStore(redis, bulk)
+        rows, rejected = await place_bulk_orders(RowLockingSession(db), redis, MANAGER, INSTRUCTION,
+                                                 list(zip(bulk, quantities)), _registry(), bulk_store)
+        assert not rejected and [row['order_user_id'] for row in rows] == list(bulk)
+        for user_id in bulk:
+            assert bulk[user_id].margin == singles[user_id].margin
+            assert bulk[user_id].orders == singles[user_id].orders
+        assert len({row['order_id'] for row in rows}) == len(rows)
+        assert all(row['order_status'] == "OPEN" and row['status'] == "ACTIVE" for row in rows)
+        assert bulk_store.pipelines == [3 * len(bulk) + 1]
+        assert db.pool._value == DB_POOL_SIZE
+
+    asyncio.run(run())
+
+
+def test_allocations_are_rejected_individually():
+    async def run():
+        db, redis = SimulatedDB(), SimulatedRedis()
+        accounts = {
+            1: _follower(1),
+            2: _follower(2, fund_manager="Someone Else"),
+            3: _follower(3, fund_manager=None),
+            4: _follower(4, group_name="routed"),
+            5: _follower(5, wallet_balance="10"),
+            6: _follower(6, fund_manager=" 1000000 "),
+            7: _follower(7, group_name="empty"),
+            # Names are not unique: naming the manager does not make the account a follower
+            8: _follower(8, fund_manager="Alpha Fund"),
+            9: _follower(9, is_self_trading=1),
+            10: _follower(10),
+        }
+        store = SimulatedBulkStore(redis, accounts, routed={"routed"})
+
+        async def load(group_name):
+            return {} if group_name == "empty" else SETTINGS
+
+        allocations = [(user_id, Decimal("0.1")) for user_id in (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 99)]
+        allocations.append((10, Decimal("5")))
+        rows, rejected = await place_bulk_orders(
+            RowLockingSession(db), redis, MANAGER, {**INSTRUCTION, 'stop_loss': Decimal("1.07")}, allocations,
+            GroupSymbolRegistry(load), store)
+        assert [row['order_user_id'] for row in rows] == [1, 6]
+        assert all(row['stoploss_id'] and row['takeprofit_id'] is None for row in rows)
+        reasons = {r['user_id']: r['reason'] for r in rejected}
+        assert reasons == {
+            2: REJECT_NOT_MANAGED, 3: REJECT_NOT_MANAGED, 4: REJECT_ROUTED, 5: REJECT_INSUFFICIENT_FUNDS,
+            7: "Group settings not found for symbol EURUSD", 8: REJECT_NOT_MANAGED, 9: REJECT_NOT_MANAGED,
+            10: REJECT_DUPLICATE, 99: REJECT_NOT_FOUND,
+        }
+        # Both allocations of a duplicated account are rejected, not merged
+        assert [r['user_id'] for r in rejected].count(10) == 2
+        assert all(accounts[n].margin == 0 and not accounts[n].orders for n in (2, 3, 4, 5, 7, 8, 9, 10))
+        assert store.pipelines == [3 * 2 + 1]
+
+        # Nothing placeable: no transaction, no publish
+        rows, rejected = await place_bulk_orders(RowLockingSession(db), redis, MANAGER, INSTRUCTION,
+                                                 [(2, Decimal("1"))], _registry(), store)
+        assert not rows and len(rejected) == 1 and store.pipelines == [7]
+        assert not manages(SimpleNamespace(id=2, account_number=None, isActive=1), _follower(8, fund_manager=""))
+        # An unverified manager manages nobody
+        assert manages(MANAGER, accounts[1])
+        assert not manages(SimpleNamespace(id=1000000, account_number="FM1001", isActive=0), accounts[1])
+
+    asyncio.run(run())
+
+
+def test_placement_runs_in_the_accounts_turns():
+    async def run():
+        db, redis = SimulatedDB(), SimulatedRedis()
+        accounts = {n: _follower(n) for n in range(1, 5)}
+        store = SimulatedBulkStore(redis, accounts)
+        other_process, actor = AccountActor(), AccountActor(lease_wait=0.02)
+        release = asyncio.Event()
+
+        async def long_turn():
+            async with other_process.hold(redis, "live", 3):
+                await release.wait()
+
+        holder = asyncio.create_task(long_turn())
+        await asyncio.sleep(0.005)
+        # A turn of this process on account 2 is queued before the instruction
+        in_turn = []
+
+        async def close_in_turn():
+            async with actor.hold(redis, "live", 2):
+                await asyncio.sleep(0.005)
+                in_turn.append(accounts[2].margin)
+
+        closing = asyncio.create_task(close_in_turn())
+        await asyncio.sleep(0)
+        rows, rejected = await place_bulk_orders(RowLockingSession(db), redis, MANAGER, INSTRUCTION,
+                                                 [(n, Decimal("0.1")) for n in accounts], _registry(), store,
+                                                 actor=actor)
+        await closing
+        assert [row['order_user_id'] for row in rows] == [1, 2, 4]
+        assert rejected == [{'user_id': 3, 'reason': REJECT_BUSY}] and accounts[3].margin == 0
+        # The queued turn ran first, with the account untouched
+        assert in_turn == [0] and accounts[2].margin > 0
+        release.set()
+        await holder
+        await asyncio.sleep(0.005)
+        assert len(actor) == 0 and not any(key.startswith("account_lease:") for key in redis.keys)
+
+    asyncio.run(run())
+
+
+def test_failed_insert_releases_the_row_locks():
+    async def run():
+        db, redis = SimulatedDB(), SimulatedRedis()
+        accounts = {n: _follower(n) for n in range(5)}
+        store = SimulatedBulkStore(redis, accounts, fail_insert=True)
+        try:
+            await place_bulk_orders(RowLockingSession(db), redis, MANAGER, INSTRUCTION,
+                                    [(n, Decimal("0.1")) for n in accounts], _registry(), store)
+            raise AssertionError("insert failure swallowed")
+        except RuntimeError:
+            pass
+        assert not any(lock.locked() for lock in db.row_locks.values()) and db.pool._value == DB_POOL_SIZE
+        assert all(a.margin == 0 and not a.orders for a in accounts.values()) and not store.pipelines
+
+    asyncio.run(run())
+
+
+async def _per_follower_requests(accounts):
+    """One POST /orders/ per follower: auth, placement in the account's turn, insert, 3 publishes."""
+    db, redis = SimulatedDB(), SimulatedRedis()
+    store, groups, actor = SimulatedStore(redis, accounts), _registry(), AccountActor()
+    in_flight = asyncio.Semaphore(CLIENT_CONCURRENCY)
+
+    async def request(account):
+        async with in_flight:
+            session = SimulatedSession(db)
+            await session.execute()                           # get_current_user (service token, user lookup)
+            async with actor.hold(redis, "live", account.id):
+                placed = await place_new_order(session, redis, account.id, ORDER, "live", groups,
+                                               group_name=account.group_name, store=store, actor=actor)
+                await _create_order(session, account, placed)
+            for _ in range(3):                                # order update, user data update, market trigger
+                await redis.round_trip()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request(account) for account in accounts.values()))
+    return time.perf_counter() - started, db, redis
+
+
+async def _bulk_request(accounts):
+    db, redis = SimulatedDB(), SimulatedRedis()
+    store = SimulatedBulkStore(redis, accounts)
+    started = time.perf_counter()
+    rows, rejected = await place_bulk_orders(RowLockingSession(db), redis, MANAGER, INSTRUCTION,
+                                             [(n, ORDER['order_quantity']) for n in accounts], _registry(), store)
+    assert len(rows) == len(accounts) and not rejected
+    return time.perf_counter() - started, db, redis
+
+
+def test_allocation_to_1k_followers_benchmark():
+    results = {}
+    for name, flow in (("one POST per follower", _per_follower_requests), ("bulk instruction", _bulk_request)):
+        accounts = {n: _follower(n) for n in range(100, 100 + FOLLOWERS)}
+        elapsed, db, redis = asyncio.run(flow(accounts))
+        results[name] = {
+            "ms": 1000 * elapsed,
+            "statements": db.queries,
+            "redis_round_trips": redis.round_trips,
+            "lease_calls": redis.lease_calls,
+            "connection_ms": 1000 * db.connection_seconds,
+            "margins": {n: a.margin for n, a in accounts.items()},
+            "pool_released": db.pool._value == DB_POOL_SIZE,
+        }
+    print(f"Allocation of one instruction to {FOLLOWERS} follower accounts, DB pool {DB_POOL_SIZE}")
+    for name, r in results.items():
+        print(f"  {name:22s} {r['ms']:7.1f} ms  {r['statements']:5d} DB statements  "
+              f"{r['redis_round_trips']:5d} Redis round trips + {r['lease_calls']:5d} account lease calls  "
+              f"connections held {r['connection_ms']:7.1f} ms")
+
+    single, bulk = results["one POST per follower"], results["bulk instruction"]
+    assert bulk["margins"] == single["margins"]
+    assert bulk["statements"] <= 8 and single["statements"] >= 5 * FOLLOWERS
+    assert bulk["redis_round_trips"] <= 5 and single["redis_round_trips"] >= 4 * FOLLOWERS
+    # Both take (concurrently, for the bulk instruction) and release each follower's lease
+    assert bulk["lease_calls"] == single["lease_calls"] == 2 * FOLLOWERS
+    assert bulk["ms"] < single["ms"] * 0.5
+    assert bulk["pool_released"] and single["pool_released"]
+
+
+if __name__ == "__main__":
+    test_bulk_margin_matches_single_orders()
+    test_allocations_are_rejected_individually()
+    test_placement_runs_in_the_accounts_turns()
+    test_failed_insert_releases_the_row_locks()
+    test_allocation_to_1k_followers_benchmark()
+    print("Bulk order tests passed.")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-subsystem DB bulkheads (app/database/bulkheads.py): FIFO hand-off,
+fail-fast timeouts, cancellation, and a flood of the triggers subsystem against a
+simulated shared pool (pool_size + max_overflow connections, per-statement latency)
+while API requests run, with and without bulkheads in front of the pool. The flood is
+compared by the API requests that queue on the pool and by their p99 relative to the
+shared pool's, not against a wall-clock target.
+"""
+
+import asyncio
+import time
+
+from app.database.bulkheads import Bulkhead, BulkheadSessionFactory, DatabaseBusyError
+
+POOL_CONNECTIONS = 30          # pool_size=20 + max_overflow=10
+SIZES = {"api": 10, "ws": 5, "triggers": 6, "batch": 9}
+TRIGGERS = 600                 # one session per triggered order, all at once
+TRIGGER_STATEMENTS = 3
+TRIGGER_STATEMENT_SECONDS = 0.005
+API_CLIENTS = 10
+API_REQUESTS_PER_CLIENT = 5
+API_STATEMENTS = 4
+API_STATEMENT_SECONDS = 0.001
+
+
+class SimulatedPool:
+    def __init__(self):
+        self.connections = asyncio.Semaphore(POOL_CONNECTIONS)
+        self.peak_checked_out = 0
+        self.checked_out = 0
+        # Sessions per subsystem that found every connection checked out
+        self.waits = {subsystem: 0 for subsystem in SIZES}
+
+
+class PooledSession:
+    """Checks out a pooled connection on its first statement and returns it when closed."""
+
+    def __init__(self, pool, subsystem):
+        self.pool = pool
+        self.subsystem = subsystem
+        self.connected = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.connected:
+            self.pool.checked_out -= 1
+            self.pool.connections.release()
+
+    async def execute(self, seconds):
+        if not self.connected:
+            if self.pool.connections.locked():
+                self.pool.waits[self.subsystem] += 1
+            await self.pool.connections.acquire()
+            self.connected = True
+            self.pool.checked_out += 1
+            self.pool.peak_checked_out = max(self.pool.peak_checked_out, self.pool.checked_out)
+        await asyncio.sleep(seconds)
+
+
+def _factories(pool, bulkheaded):
+    def session_factory(subsystem):
+        return lambda: PooledSession(pool, subsystem)
+
+    if not bulkheaded:
+        return {subsystem: session_factory(subsystem) for subsystem in SIZES}
+    return {subsystem: BulkheadSessionFactory(session_factory(subsystem), Bulkhead(f"bench_{subsystem}", size, 5.0))
+            for subsystem, size in SIZES.items()}
+
+
+async def _flood(bulkheaded):
+    pool = SimulatedPool()
+    factories = _factories(pool, bulkheaded)
+    latencies = []
+
+    async def trigger():
+        async with factories["triggers"]() as db:
+            for _ in range(TRIGGER_STATEMENTS):
+                await db.execute(TRIGGER_STATEMENT_SECONDS)
+
+    async def api_client():
+        for _ in range(API_REQUESTS_PER_CLIENT):
+            started = time.perf_counter()
+            async with factories["api"]() as db:
+                for _ in range(API_STATEMENTS):
+                    await db.execute(API_STATEMENT_SECONDS)
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    triggers = [asyncio.create_task(trigger()) for _ in range(TRIGGERS)]
+    await asyncio.sleep(0)  # the storm holds the pool before the first request arrives
+    await asyncio.gather(*(api_client() for _ in range(API_CLIENTS)))
+    api_done = time.perf_counter() - started
+    await asyncio.gather(*triggers)
+    latencies.sort()
+    return {
+        "api_p50_ms": 1000 * latencies[len(latencies) // 2],
+        "api_p99_ms": 1000 * latencies[int(len(latencies) * 0.99) - 1],
+        "api_done_s": api_done,
+        "triggers_done_s": time.perf_counter() - started,
+        "peak_connections": pool.peak_checked_out,
+        "api_pool_waits": pool.waits["api"],
+    }
+
+
+def test_fifo_handoff_and_fail_fast():
+    async def run():
+        bulkhead = Bulkhead("test_fifo", 2, 0.05)
+        order = []
+
+        async def hold(n, seconds):
+            await bulkhead.acquire()
+            order.append(n)
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                bulkhead.release()
+
+        # Waiters are served in arrival order
+        await asyncio.gather(*(hold(n, 0.01) for n in range(6)))
+        assert order == list(range(6))
+        assert bulkhead.in_use == 0 and not bulkhead._waiters
+
+        # Waiting longer than wait_seconds fails fast instead of queueing
+        results = await asyncio.gather(*(hold(n, 0.2) for n in range(5)), return_exceptions=True)
+        busy = [r for r in results if isinstance(r, DatabaseBusyError)]
+        assert len(busy) == 3 and busy[0].subsystem == "test_fifo"
+        assert bulkhead.snapshot()["rejections"] == 3
+        assert bulkhead.in_use == 0 and not bulkhead._waiters
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiters_do_not_leak_slots():
+    async def run():
+        bulkhead = Bulkhead("test_cancel", 1, 5.0)
+        await bulkhead.acquire()
+        waiters = [asyncio.create_task(bulkhead.acquire()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        # The slot is handed to waiters that are being cancelled; each passes it on to the next
+        waiters[0].cancel()
+        bulkhead.release()
+        waiters[1].cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert waiters[2].done() and not waiters[2].cancelled()
+        assert bulkhead.in_use == 1 and not bulkhead._waiters
+        bulkhead.release()
+        assert bulkhead.in_use == 0
+
+        # A session factory holds the slot for the session's lifetime, also when the block raises
+        factory = BulkheadSessionFactory(lambda: PooledSession(SimulatedPool(), "api"), bulkhead)
+        try:
+            async with factory() as db:
+                await db.execute(0)
+                assert bulkhead.in_use == 1
+                raise ValueError("endpoint error")
+        except ValueError:
+            pass
+        assert bulkhead.in_use == 0
+
+    asyncio.run(run())
+
+
+def test_trigger_storm_does_not_starve_the_api():
+    shared = asyncio.run(_flood(bulkheaded=False))
+    isolated = asyncio.run(_flood(bulkheaded=True))
+    print(f"{TRIGGERS} triggers flooding a {POOL_CONNECTIONS} connection pool, "
+          f"{API_CLIENTS * API_REQUESTS_PER_CLIENT} API requests")
+    for name, result in (("shared pool", shared), ("bulkheads", isolated)):
+        print(f"  {name:12s} API p50 {result['api_p50_ms']:7.1f} ms  p99 {result['api_p99_ms']:7.1f} ms  "
+              f"queued on the pool {result['api_pool_waits']:3d}  "
+              f"triggers done in {result['triggers_done_s']:.2f}s  peak connections {result['peak_connections']}")
+    # On the shared pool API requests queue behind the storm; with bulkheads none does
+    assert shared["api_pool_waits"] > 0
+    assert isolated["api_pool_waits"] == 0
+    assert isolated["api_p99_ms"] * 5 < shared["api_p99_ms"]
+    assert isolated["peak_connections"] <= POOL_CONNECTIONS
+
+
+if __name__ == "__main__":
+    test_fifo_handoff_and_fail_fast()
+    test_cancelled_waiters_do_not_leak_slots()
+    test_trigger_storm_does_not_starve_the_api()
+    print("DB bulkhead tests passed.")
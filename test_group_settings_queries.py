@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Query-count tests for loading a group's symbol settings (update_group_symbol_settings,
+cache_user_group_settings_and_symbols) and the symbol info of many symbols (margin
+cutoff, group details) on SQLite: statements are counted with the engine's
+before_cursor_execute event, and must not depend on the number of symbols in the group.
+"""
+
+import asyncio
+
+import pytest
+
+GROUP = "standard"
+
+
+class RecordingRedis:
+    """Round trips and stored keys of the cache writers."""
+
+    def __init__(self):
+        self.round_trips = 0
+        self.keys = {}
+
+    def pipeline(self, transaction=True):
+        return RecordingPipeline(self)
+
+    async def mget(self, keys):
+        self.round_trips += 1
+        return [self.keys.get(key) for key in keys]
+
+
+class RecordingPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value))
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        self.redis.keys.update(self.commands)
+        return [True] * len(self.commands)
+
+
+def _count_queries(symbol_count):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import event, insert
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.core.cache import cache_user_group_settings_and_symbols, get_group_symbol_settings_cache_many
+    from app.crud import group as crud_group
+    from app.crud.external_symbol_info import get_external_symbol_infos_by_symbols
+    from app.database.models import Base, Group, Symbol, ExternalSymbolInfo
+
+    symbols = [f"SYM{n:02d}USD" for n in range(symbol_count)]
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all,
+                                tables=[Group.__table__, Symbol.__table__, ExternalSymbolInfo.__table__])
+            await conn.execute(insert(Group), [
+                {"symbol": symbol, "name": name, "commision_type": 0, "commision_value_type": 0, "type": 1,
+                 "pip_currency": "USD", "commision": 2, "margin": 100, "spread": 1, "deviation": 0,
+                 "min_lot": "0.01", "max_lot": 100, "pips": "0.0001", "sending_orders": "Rock"}
+                for name in (GROUP, "other") for symbol in symbols
+            ])
+            await conn.execute(insert(Symbol), [
+                {"name": symbol, "type": 1, "pips": "0.0001", "market_price": 1, "profit_currency": "JPY"}
+                for symbol in symbols[::2]
+            ])
+            await conn.execute(insert(ExternalSymbolInfo), [
+                # Some external symbols spelled in another case than the group's
+                {"fix_symbol": symbol.lower() if n % 3 == 1 else symbol, "contract_size": 1000, "profit": "USD"}
+                for n, symbol in enumerate(symbols)
+            ])
+
+        statements = []
+        event.listen(engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        counts = {}
+        redis = RecordingRedis()
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        async with session_factory() as db:
+            statements.clear()
+            group_settings, symbol_settings = await crud_group.get_group_symbol_settings(db, GROUP)
+            counts["get_group_symbol_settings"] = len(statements)
+
+            statements.clear()
+            user = type("User", (), {"group_name": GROUP})()
+            await cache_user_group_settings_and_symbols(user, db, redis)
+            counts["cache_user_group_settings_and_symbols"] = len(statements)
+            counts["redis round trips"] = redis.round_trips
+
+            statements.clear()
+            infos = await get_external_symbol_infos_by_symbols(db, [symbol.lower() for symbol in symbols])
+            counts["get_external_symbol_infos_by_symbols"] = len(statements)
+
+            statements.clear()
+            details = await crud_group.get_group_symbols_and_external_info(db, GROUP)
+            counts["get_group_symbols_and_external_info"] = len(statements)
+
+        cached = await get_group_symbol_settings_cache_many(redis, GROUP, symbols)
+        await engine.dispose()
+        return counts, group_settings, symbol_settings, infos, details, cached
+
+    counts, group_settings, symbol_settings, infos, details, cached = asyncio.run(run())
+    assert group_settings == {"sending_orders": "Rock"}
+    assert sorted(symbol_settings) == symbols
+    assert symbol_settings[symbols[0]]["profit_currency"] == "JPY"
+    if symbol_count > 1:
+        # No Symbol row: the group's pip currency
+        assert symbol_settings[symbols[1]]["profit_currency"] == "USD"
+    assert all(settings["contract_size"] == 1000 for settings in symbol_settings.values())
+    # Margin and PnL are converted from ExternalSymbolInfo.profit, not the Symbol's currency
+    assert all(settings["external_profit_currency"] == "USD" for settings in symbol_settings.values())
+    assert sorted(infos) == symbols
+    assert len(details["external_symbols_info"]) == symbol_count
+    assert sorted(cached) == symbols
+    return counts
+
+
+def test_query_count_does_not_depend_on_symbol_count():
+    few, many = _count_queries(5), _count_queries(50)
+    for name in few:
+        print(f"  {name:40s} {few[name]} (5 symbols)  {many[name]} (50 symbols)")
+    assert few == many
+    assert few["get_group_symbol_settings"] == 1
+    assert few["cache_user_group_settings_and_symbols"] == 1
+    assert few["redis round trips"] == 1
+    assert few["get_external_symbol_infos_by_symbols"] == 1
+
+
+if __name__ == "__main__":
+    test_query_count_does_not_depend_on_symbol_count()
+    print("Group settings query tests passed.")
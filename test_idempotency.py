@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Tests for Idempotency-Key handling of order submission (app/services/idempotency.py):
+parallel duplicates in one process and across processes run the pipeline once, later
+duplicates are answered from the stored record without touching the DB, rejected
+requests stay rejected, failed ones can be retried, and a retry storm benchmark.
+"""
+
+import asyncio
+import json
+import time
+
+from app.services.idempotency import IdempotencyError, IdempotencyGuard, record_key
+
+REDIS_RTT_SECONDS = 0.0002
+PIPELINE_SECONDS = 0.02
+CLIENTS = 200
+RETRIES = 3
+
+
+class FakeRedis:
+    """SET NX PX, GET and the compare-and-delete script, with a round trip each."""
+
+    def __init__(self):
+        self.values = {}
+        self.round_trips = 0
+        self.down = False
+
+    async def _round_trip(self):
+        if self.down:
+            raise ConnectionError("Redis unavailable")
+        self.round_trips += 1
+        await asyncio.sleep(REDIS_RTT_SECONDS)
+
+    def _live(self, key):
+        entry = self.values.get(key)
+        if entry is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            entry = None
+        return entry
+
+    async def set(self, key, value, nx=False, px=None):
+        await self._round_trip()
+        if nx and self._live(key) is not None:
+            return None
+        self.values[key] = (value, time.monotonic() + px / 1000.0 if px else float("inf"))
+        return True
+
+    async def get(self, key):
+        await self._round_trip()
+        entry = self._live(key)
+        return entry[0] if entry else None
+
+    async def eval(self, script, numkeys, key, value):
+        await self._round_trip()
+        entry = self._live(key)
+        if entry is None or entry[0] != value:
+            return 0
+        del self.values[key]
+        return 1
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code, detail):
+        self.status_code = status_code
+        self.detail = detail
+
+
+class Response:
+    def __init__(self, order_id):
+        self.order_id = order_id
+
+    def model_dump(self):
+        return {"order_id": self.order_id, "order_status": "OPEN"}
+
+
+class Pipeline:
+    """Placement stand-in: DB statements, id probing, Firebase push and pubsub events."""
+
+    def __init__(self, fail_with=None):
+        self.runs = 0
+        self.db_statements = 0
+        self.fail_with = fail_with
+
+    async def __call__(self):
+        self.runs += 1
+        self.db_statements += 6
+        await asyncio.sleep(PIPELINE_SECONDS)
+        if self.fail_with is not None:
+            raise self.fail_with
+        return Response(f"10000000{self.runs:02d}")
+
+
+ORDER = {"symbol": "EURUSD", "order_type": "BUY", "order_quantity": "0.1", "order_price": "1.085"}
+
+
+def _submit(guard, redis, pipeline, key="retry-1", payload=ORDER, user_id=7):
+    return guard.run(redis, "place_order", "live", user_id, key, payload, pipeline,
+                     encode=lambda response: response.model_dump())
+
+
+def _body(result):
+    return result.model_dump() if isinstance(result, Response) else result
+
+
+def test_parallel_duplicates_run_once():
+    async def run():
+        redis, guard, pipeline = FakeRedis(), IdempotencyGuard(), Pipeline()
+        results = await asyncio.gather(*(_submit(guard, redis, pipeline) for _ in range(50)))
+        assert pipeline.runs == 1
+        assert all(_body(r) == {"order_id": "1000000001", "order_status": "OPEN"} for r in results)
+        # The first caller gets the handler's own response
+        assert sum(isinstance(r, Response) for r in results) == 1
+
+        # A later retry is answered from Redis: no pipeline, no DB
+        statements = pipeline.db_statements
+        assert await _submit(guard, redis, pipeline) == {"order_id": "1000000001", "order_status": "OPEN"}
+        assert pipeline.runs == 1 and pipeline.db_statements == statements
+        stored = json.loads(redis.values[record_key("place_order", "live", 7, "retry-1")][0])
+        assert stored["state"] == "done" and stored["status_code"] == 200
+
+        # Keys are per account, and no key means no deduplication
+        await _submit(guard, redis, pipeline, user_id=8)
+        await _submit(guard, redis, pipeline, key=None)
+        await _submit(guard, redis, pipeline, key=None)
+        assert pipeline.runs == 4
+
+    asyncio.run(run())
+
+
+def test_duplicates_across_processes_run_once():
+    async def run():
+        redis, pipeline = FakeRedis(), Pipeline()
+        processes = [IdempotencyGuard(), IdempotencyGuard(), IdempotencyGuard()]
+        results = await asyncio.gather(*(_submit(processes[n % 3], redis, pipeline) for n in range(30)))
+        assert pipeline.runs == 1
+        assert all(_body(r)["order_id"] == "1000000001" for r in results)
+
+    asyncio.run(run())
+
+
+def test_reused_key_and_invalid_key_are_rejected():
+    async def run():
+        redis, guard, pipeline = FakeRedis(), IdempotencyGuard(), Pipeline()
+        other_order = {**ORDER, "order_quantity": "1.0"}
+        first = asyncio.create_task(_submit(guard, redis, pipeline))
+        await asyncio.sleep(0.001)
+        for attempt in range(2):
+            # While the first runs (joined in process) and after it finished (stored record)
+            try:
+                await _submit(guard, redis, pipeline, payload=other_order)
+                raise AssertionError("different request with the same key")
+            except IdempotencyError as e:
+                assert e.status_code == 422
+            await first
+        for key in ("", "x" * 256, "bad\nkey"):
+            try:
+                await _submit(guard, redis, pipeline, key=key)
+                raise AssertionError("invalid key accepted")
+            except IdempotencyError as e:
+                assert e.status_code == 400
+        assert pipeline.runs == 1
+
+    asyncio.run(run())
+
+
+def test_rejections_are_replayed_and_failures_retried():
+    async def run():
+        redis, guard = FakeRedis(), IdempotencyGuard()
+        rejected = Pipeline(fail_with=HTTPError(400, "Insufficient margin"))
+        outcomes = await asyncio.gather(*(_submit(guard, redis, rejected, key="r") for _ in range(5)),
+                                        return_exceptions=True)
+        assert rejected.runs == 1
+        assert sum(isinstance(o, HTTPError) for o in outcomes) == 1
+        assert all(o.status_code == 400 for o in outcomes)
+        try:
+            await _submit(guard, redis, rejected, key="r")
+            raise AssertionError("rejection not replayed")
+        except IdempotencyError as e:
+            assert (e.status_code, e.detail) == (400, "Insufficient margin")
+        assert rejected.runs == 1
+
+        # A 5xx releases the key: the joined duplicates and later retries run it again
+        failing = Pipeline(fail_with=HTTPError(500, "Error processing order"))
+        outcomes = await asyncio.gather(*(_submit(guard, redis, failing, key="f") for _ in range(3)),
+                                        return_exceptions=True)
+        assert failing.runs == 3 and all(isinstance(o, HTTPError) for o in outcomes)
+        failing.fail_with = None
+        assert _body(await _submit(guard, redis, failing, key="f"))["order_id"] == "1000000004"
+        assert await _submit(guard, redis, failing, key="f") == {"order_id": "1000000004", "order_status": "OPEN"}
+        assert failing.runs == 4
+        assert not guard._in_flight
+
+    asyncio.run(run())
+
+
+def test_waiting_on_another_process_times_out():
+    async def run():
+        redis, pipeline = FakeRedis(), Pipeline()
+        first, second = IdempotencyGuard(), IdempotencyGuard(wait=0.005)
+        running = asyncio.create_task(_submit(first, redis, pipeline))
+        await asyncio.sleep(0.002)
+        try:
+            await _submit(second, redis, pipeline)
+            raise AssertionError("did not time out")
+        except IdempotencyError as e:
+            assert e.status_code == 409
+        await running
+        assert (await _submit(second, redis, pipeline))["order_id"] == "1000000001"
+        assert pipeline.runs == 1
+
+    asyncio.run(run())
+
+
+def test_redis_down_deduplicates_in_process():
+    async def run():
+        redis, guard, pipeline = FakeRedis(), IdempotencyGuard(), Pipeline()
+        redis.down = True
+        results = await asyncio.gather(*(_submit(guard, redis, pipeline) for _ in range(10)))
+        assert pipeline.runs == 1 and all(_body(r)["order_id"] == "1000000001" for r in results)
+
+    asyncio.run(run())
+
+
+def test_retry_storm_benchmark():
+    async def storm(with_keys):
+        redis, pipeline = FakeRedis(), Pipeline()
+        processes = [IdempotencyGuard(), IdempotencyGuard()]
+
+        async def client(n):
+            key = f"client-{n}" if with_keys else None
+            # The original request plus retries sent after client-side timeouts, to any process
+            attempts = []
+            for attempt in range(RETRIES):
+                attempts.append(asyncio.create_task(
+                    _submit(processes[(n + attempt) % 2], redis, pipeline, key=key, user_id=n)))
+                await asyncio.sleep(PIPELINE_SECONDS / 4)
+            await asyncio.gather(*attempts)
+
+        await asyncio.gather(*(client(n) for n in range(CLIENTS)))
+        return pipeline
+
+    without, with_keys = asyncio.run(storm(False)), asyncio.run(storm(True))
+    print(f"{CLIENTS} clients x {RETRIES} submissions (original + retries)")
+    print(f"  without Idempotency-Key  pipeline runs {without.runs:4d}  DB statements {without.db_statements:5d}")
+    print(f"  with Idempotency-Key     pipeline runs {with_keys.runs:4d}  DB statements {with_keys.db_statements:5d}")
+    assert without.runs == CLIENTS * RETRIES
+    assert with_keys.runs == CLIENTS
+
+
+if __name__ == "__main__":
+    test_parallel_duplicates_run_once()
+    test_duplicates_across_processes_run_once()
+    test_reused_key_and_invalid_key_are_rejected()
+    test_rejections_are_replayed_and_failures_retried()
+    test_waiting_on_another_process_times_out()
+    test_redis_down_deduplicates_in_process()
+    test_retry_storm_benchmark()
+    print("Idempotency tests passed.")
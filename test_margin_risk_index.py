@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test for the margin-risk priority index: in a synthetic crash, auto-cutoff must fire on
+the first tick whose price takes the margin level below 50%, while accounts far from
+their cutoff price are not re-evaluated, on the crash's ticks or as top-K accounts.
+"""
+
+import asyncio
+from decimal import Decimal
+
+from app.services.margin_risk_index import MarginRiskIndex, MarginRiskMonitor, estimate_liquidation
+
+CONTRACT_SIZE = Decimal("100000")
+GROUP_SETTINGS = {"EURUSD": {"contract_size": "100000"}}
+
+
+def _portfolio(account, bid, ask):
+    """Same shape as calculate_user_portfolio's output for a single EURUSD position."""
+    price = bid if account["side"] == "BUY" else ask
+    sign = 1 if account["side"] == "BUY" else -1
+    pnl = sign * (price - account["entry"]) * account["lots"] * CONTRACT_SIZE
+    equity = account["balance"] + pnl
+    margin = account["margin"]
+    return {
+        "balance": str(account["balance"]), "equity": str(equity), "margin": str(margin),
+        "margin_level": str(equity / margin * 100),
+        "positions": [{
+            "order_company_name": "EURUSD", "order_type": account["side"], "order_quantity": str(account["lots"]),
+            "order_price": str(account["entry"]), "commission": "0", "profit_loss": str(pnl),
+            "current_price": str(price),
+        }],
+    }
+
+
+def _run_crash(accounts, prices, top_k):
+    index = MarginRiskIndex(top_k=top_k)
+    market = {"bid": prices[0], "ask": prices[0] + Decimal("0.0001")}
+    cutoffs = {}
+    evaluated_per_tick = []
+    tick_no = {"n": 0}
+
+    async def evaluate(account_ref):
+        account = accounts[account_ref["id"]]
+        metrics = _portfolio(account, market["bid"], market["ask"])
+        if Decimal(metrics["margin_level"]) < 50:
+            cutoffs[account_ref["id"]] = tick_no["n"]
+            index.remove(account_ref["user_type"], account_ref["id"])
+        else:
+            index.update(account_ref, metrics, GROUP_SETTINGS)
+
+    async def run():
+        # Initial sweep indexes everyone
+        for account_id, account in accounts.items():
+            index.update({"id": account_id, "user_type": "live", "group_name": "standard"},
+                         _portfolio(account, market["bid"], market["ask"]), GROUP_SETTINGS)
+        monitor = MarginRiskMonitor(index, evaluate)
+        for n, bid in enumerate(prices[1:], start=1):
+            tick_no["n"] = n
+            market["bid"], market["ask"] = bid, bid + Decimal("0.0001")
+            tick = {"EURUSD": {"o": str(market["bid"]), "b": str(market["ask"])}, "_timestamp": 0}
+            evaluated_per_tick.append(await monitor.on_tick(tick))
+
+    asyncio.run(run())
+    return cutoffs, evaluated_per_tick
+
+
+def _first_tick_below_cutoff(account, prices):
+    for n, bid in enumerate(prices):
+        if Decimal(_portfolio(account, bid, bid + Decimal("0.0001"))["margin_level"]) < 50:
+            return n
+    return None
+
+
+def test_crash_triggers_cutoff_within_one_tick():
+    # 1 lot long EURUSD at 1.1000 with 1100 margin; cutoff when equity < 550
+    accounts = {
+        1: {"side": "BUY", "entry": Decimal("1.1000"), "lots": Decimal("1"), "balance": Decimal("600"), "margin": Decimal("1100")},
+        2: {"side": "BUY", "entry": Decimal("1.1000"), "lots": Decimal("1"), "balance": Decimal("900"), "margin": Decimal("1100")},
+        3: {"side": "SELL", "entry": Decimal("1.1000"), "lots": Decimal("1"), "balance": Decimal("900"), "margin": Decimal("1100")},
+    }
+    # Far-away accounts that must never be re-evaluated during the crash
+    for account_id in range(10, 210):
+        accounts[account_id] = {"side": "BUY", "entry": Decimal("1.1000"), "lots": Decimal("0.01"),
+                                "balance": Decimal("100000"), "margin": Decimal("11")}
+    prices = [Decimal("1.1000") - Decimal("0.0001") * i for i in range(80)]
+
+    cutoffs, evaluated_per_tick = _run_crash(accounts, prices, top_k=0)
+
+    assert cutoffs[1] == _first_tick_below_cutoff(accounts[1], prices)
+    assert cutoffs[2] == _first_tick_below_cutoff(accounts[2], prices)
+    assert 3 not in cutoffs  # short book profits from the crash
+    assert max(evaluated_per_tick) <= 2
+
+
+def test_top_k_covers_accounts_without_crossing():
+    accounts = {1: {"side": "BUY", "entry": Decimal("1.1000"), "lots": Decimal("1"),
+                    "balance": Decimal("600"), "margin": Decimal("1100")}}
+    prices = [Decimal("1.1000")] * 5
+    _, evaluated_per_tick = _run_crash(accounts, prices, top_k=1)
+    assert evaluated_per_tick == [1, 1, 1, 1]
+
+
+def test_top_k_skips_accounts_far_from_cutoff():
+    # Nearest account of a calm book, but a 99% move away from its cutoff: left to the sweep
+    accounts = {1: {"side": "BUY", "entry": Decimal("1.1000"), "lots": Decimal("0.01"),
+                    "balance": Decimal("100000"), "margin": Decimal("11")}}
+    prices = [Decimal("1.1000")] * 5
+    _, evaluated_per_tick = _run_crash(accounts, prices, top_k=1)
+    assert evaluated_per_tick == [0, 0, 0, 0]
+
+
+def test_liquidation_estimate():
+    account = {"side": "BUY", "entry": Decimal("1.1000"), "lots": Decimal("1"),
+               "balance": Decimal("1200"), "margin": Decimal("1100")}
+    estimate = estimate_liquidation(_portfolio(account, Decimal("1.1000"), Decimal("1.1001")), GROUP_SETTINGS)
+    assert estimate["direction"] == "long"
+    assert abs(estimate["cutoff_price"] - 1.0935) < 1e-9   # equity 1200 -> 550
+    assert abs(estimate["margin_call_price"] - 1.099) < 1e-9  # equity 1200 -> 1100
+    assert estimate["trigger_price"] == estimate["margin_call_price"]
+
+
+if __name__ == "__main__":
+    test_crash_triggers_cutoff_within_one_tick()
+    test_top_k_covers_accounts_without_crossing()
+    test_top_k_skips_accounts_far_from_cutoff()
+    test_liquidation_estimate()
+    print("Margin risk index tests passed.")
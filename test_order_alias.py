@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Benchmark of resolving a service provider's order id (get_order_by_any_id) on SQLite:
+the OR across the eight id columns of user_orders, of which only order_id is indexed,
+against order_id plus the order_id_alias table. The tables, indexes and backfill are
+those of the f3a9c1d27b64 migration. Half of the looked up ids are unknown, measured
+without the verification scan (ORDER_ALIAS_SCAN_FALLBACK off). ORDER_ALIAS_BENCH_ORDERS
+sets the table size (5000000 for the full benchmark). Also checks that the Redis mirror
+drops an alias when another order is given the same id.
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import time
+
+import pytest
+
+ORDERS = int(os.getenv("ORDER_ALIAS_BENCH_ORDERS", "200000"))
+LOOKUPS = 50
+ALIAS_COLUMNS = (
+    'cancel_id', 'close_id', 'modify_id', 'stoploss_id', 'takeprofit_id', 'stoploss_cancel_id', 'takeprofit_cancel_id',
+)
+
+OR_QUERY = ("SELECT * FROM user_orders WHERE " +
+            " OR ".join(f"{column} = :id" for column in ('order_id',) + ALIAS_COLUMNS) + " LIMIT 1")
+BY_ORDER_ID = "SELECT * FROM user_orders WHERE order_id = :id LIMIT 1"
+BY_ALIAS = "SELECT DISTINCT order_id FROM order_id_alias WHERE alias = :id AND user_type = 'live' LIMIT 2"
+
+
+def _database(orders):
+    db = sqlite3.connect(":memory:")
+    db.executescript(f"""
+        CREATE TABLE user_orders (
+            id INTEGER PRIMARY KEY, order_id VARCHAR(64) NOT NULL, order_user_id INTEGER NOT NULL,
+            order_company_name VARCHAR(255) NOT NULL, order_status VARCHAR(20) NOT NULL,
+            {", ".join(f"{column} VARCHAR(64)" for column in ALIAS_COLUMNS)},
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE UNIQUE INDEX ix_user_orders_order_id ON user_orders (order_id);
+        CREATE TABLE order_id_alias (
+            id INTEGER PRIMARY KEY, alias VARCHAR(64) NOT NULL, order_id VARCHAR(64) NOT NULL,
+            kind VARCHAR(30) NOT NULL, user_type VARCHAR(10) NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    rng = random.Random(46)
+    ids = rng.sample(range(10**9, 10**10), orders * 4)
+
+    def rows():
+        for n in range(orders):
+            order_id, close_id, stoploss_id, takeprofit_id = (str(i) for i in ids[4 * n:4 * n + 4])
+            closed = n % 3 == 0
+            # Every order has a stop loss id, a third are closed, a half have a take profit
+            yield (order_id, n % 5000, "EURUSD", "CLOSED" if closed else "OPEN", None,
+                   close_id if closed else None, None, stoploss_id, takeprofit_id if n % 2 else None, None, None)
+
+    db.executemany(f"INSERT INTO user_orders (order_id, order_user_id, order_company_name, order_status, "
+                   f"{', '.join(ALIAS_COLUMNS)}) VALUES ({', '.join('?' * 11)})", rows())
+    # Backfill, as in the migration
+    for column in ALIAS_COLUMNS:
+        db.execute(f"INSERT INTO order_id_alias (alias, order_id, kind, user_type, created_at) "
+                   f"SELECT {column}, order_id, '{column}', 'live', created_at FROM user_orders "
+                   f"WHERE {column} IS NOT NULL AND {column} <> ''")
+    db.execute("CREATE INDEX ix_order_id_alias_alias_user_type ON order_id_alias (alias, user_type)")
+    db.commit()
+    return db
+
+
+def _by_any_id_scan(db, generic_id):
+    return db.execute(OR_QUERY, {'id': generic_id}).fetchone()
+
+
+def _by_any_id_alias(db, generic_id):
+    """get_order_by_any_id without the Redis mirror: order_id, then order_id_alias."""
+    order = db.execute(BY_ORDER_ID, {'id': generic_id}).fetchone()
+    if order is not None:
+        return order
+    order_ids = [row[0] for row in db.execute(BY_ALIAS, {'id': generic_id})]
+    if len(order_ids) == 1:
+        return db.execute(BY_ORDER_ID, {'id': order_ids[0]}).fetchone()
+    return None
+
+
+def _plan(db, query):
+    return " | ".join(row[-1] for row in db.execute(f"EXPLAIN QUERY PLAN {query}", {'id': '1'}))
+
+
+def test_alias_lookup_benchmark():
+    started = time.perf_counter()
+    db = _database(ORDERS)
+    built = time.perf_counter() - started
+    aliases = db.execute("SELECT COUNT(*) FROM order_id_alias").fetchone()[0]
+
+    # The backfill covers every secondary id set on an order
+    expected = sum(db.execute(f"SELECT COUNT(*) FROM user_orders WHERE {column} IS NOT NULL").fetchone()[0]
+                   for column in ALIAS_COLUMNS)
+    assert aliases == expected
+
+    scan_plan, alias_plan = _plan(db, OR_QUERY), _plan(db, BY_ALIAS)
+    assert "SCAN user_orders" in scan_plan
+    assert "USING INDEX ix_order_id_alias_alias_user_type" in alias_plan and "SCAN" not in alias_plan
+    assert "USING INDEX ix_user_orders_order_id" in _plan(db, BY_ORDER_ID)
+
+    rng = random.Random(7)
+    sampled = [row[0] for row in db.execute(
+        "SELECT alias FROM order_id_alias WHERE kind IN ('close_id', 'stoploss_id', 'takeprofit_id') "
+        "ORDER BY id LIMIT 10000")]
+    wanted = rng.sample(sampled, LOOKUPS // 2) + [str(rng.randrange(10**9, 10**10)) for _ in range(LOOKUPS // 2)]
+
+    results = {}
+    for name, lookup in (("OR across id columns", _by_any_id_scan), ("order_id + alias", _by_any_id_alias)):
+        started = time.perf_counter()
+        found = [lookup(db, generic_id) for generic_id in wanted]
+        results[name] = ((time.perf_counter() - started) / len(wanted), found)
+
+    scan, alias = results["OR across id columns"], results["order_id + alias"]
+    assert [order and order[1] for order in alias[1]] == [order and order[1] for order in scan[1]]
+    assert sum(order is not None for order in alias[1]) == LOOKUPS // 2
+
+    print(f"get_order_by_any_id on {ORDERS} orders ({aliases} aliases, built in {built:.1f}s), "
+          f"{LOOKUPS} lookups, half of them unknown ids")
+    for name, (per_lookup, _) in results.items():
+        print(f"  {name:22s} {1000 * per_lookup:9.3f} ms per lookup")
+    print(f"  plan, OR:    {scan_plan}")
+    print(f"  plan, alias: {alias_plan}")
+    assert alias[0] * 50 < scan[0]
+
+
+
+class MirrorRedis:
+    """GET, SET EX and DELETE of the order alias mirror."""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+def test_mirror_drops_an_alias_given_to_another_order():
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.crud import order_alias
+    from app.database.models import Base, OrderIdAlias
+
+    redis = MirrorRedis()
+    mirror_client = order_alias._mirror_client
+    order_alias._mirror_client = lambda: redis
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all, tables=[OrderIdAlias.__table__])
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def assign(order_id, close_id):
+            async with session_factory() as db:
+                await order_alias.add_order_aliases_bulk(db, order_alias.alias_rows(order_id, "live", {"close_id": close_id}))
+                await db.commit()
+            # Let the invalidation scheduled by the commit run
+            await asyncio.gather(*order_alias._invalidations)
+
+        await assign("ORDER1", "C1")
+        async with session_factory() as db:
+            assert await order_alias.resolve_alias(db, redis, "C1", "live") == "ORDER1"
+        assert redis.values == {"order_alias:live:C1": "ORDER1"}
+
+        await assign("ORDER2", "C1")
+        assert redis.values == {}
+        async with session_factory() as db:
+            assert await order_alias.resolve_alias(db, redis, "C1", "live") is None
+        # An ambiguous alias is not cached
+        assert redis.values == {}
+        await engine.dispose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        order_alias._mirror_client = mirror_client
+
+
+if __name__ == "__main__":
+    test_alias_lookup_benchmark()
+    test_mirror_drops_an_alias_given_to_another_order()
+    print("Order alias tests passed.")
@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+Tests for the three-phase order placement (app/services/order_placement.py): the margin
+math, a prefetch that never touches the DB session, the locked commit, and a benchmark
+of 200 concurrent clients against a simulated DB (bounded pool, per-statement latency,
+row locks, sessions that reject concurrent use like AsyncSession) and Redis, comparing
+statements and Redis round trips per order with the previous process_new_order
+(latency is printed, not asserted).
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from decimal import Decimal, ROUND_HALF_UP
+from types import SimpleNamespace
+
+from app.services.order_placement import (
+    InsufficientFundsError,
+    OrderPlacementStore,
+    OrderProcessingError,
+    additional_margin,
+    evaluate_order,
+    place_new_order,
+    prefetch_order_inputs,
+    single_order_margin,
+    to_usd,
+)
+from app.services.ws_bootstrap import GroupSymbolRegistry
+
+CLIENTS = 200
+ORDERS_PER_CLIENT = 5
+ACCOUNTS = 100
+DB_POOL_SIZE = 20
+DB_QUERY_SECONDS = 0.001
+DB_COMMIT_SECONDS = 0.002
+REDIS_RTT_SECONDS = 0.0002
+FIREBASE_SECONDS = 0.02
+
+SETTINGS = {
+    "EURUSD": {"contract_size": Decimal("100000"), "external_contract_size": Decimal("100000"),
+               "profit_currency": "USD", "external_profit_currency": "USD", "margin": Decimal("1"), "type": 1,
+               "commision_type": 0, "commision_value_type": 0, "commision": Decimal("2"),
+               "spread": Decimal("1.5"), "spread_pip": Decimal("0.0001")},
+    "EURJPY": {"contract_size": Decimal("100000"), "external_contract_size": Decimal("100000"),
+               "profit_currency": "JPY", "external_profit_currency": "JPY", "margin": Decimal("1"), "type": 1,
+               "commision_type": 0, "commision_value_type": 0, "commision": Decimal("0"),
+               "spread": Decimal("1.5"), "spread_pip": Decimal("0.01")},
+}
+PRICES = {
+    "EURUSD": {"b": Decimal("1.08520"), "o": Decimal("1.08500")},
+    "EURJPY": {"b": Decimal("162.750"), "o": Decimal("162.730")},
+    "USDJPY": {"b": Decimal("150.000"), "o": Decimal("149.980")},
+}
+ORDER = {'order_company_name': 'EURUSD', 'order_type': 'BUY', 'order_quantity': Decimal('0.1'),
+         'order_price': Decimal('1.0852'), 'status': 'ACTIVE', 'stop_loss': None, 'take_profit': None}
+
+
+class ConcurrentSessionUse(Exception):
+    pass
+
+
+class SimulatedDB:
+    def __init__(self):
+        self.pool = asyncio.Semaphore(DB_POOL_SIZE)
+        self.row_locks = {}
+        self.queries = 0
+        self.connection_seconds = 0.0
+        self.concurrent_use_errors = 0
+
+
+class SimulatedSession:
+    """
+    Holds a pooled connection from its first statement to commit/rollback. A strict
+    session raises on concurrent use, as AsyncSession does; otherwise uses are serialized.
+    """
+
+    def __init__(self, db, strict=True):
+        self.db = db
+        self.strict = strict
+        self._busy = asyncio.Lock()
+        self._checked_out_at = None
+        self._rows = []
+
+    async def execute(self, result=None, lock=None):
+        if self.strict and self._busy.locked():
+            self.db.concurrent_use_errors += 1
+            raise ConcurrentSessionUse("This session is provisioning a new connection; "
+                                       "concurrent operations are not permitted")
+        async with self._busy:
+            if self._checked_out_at is None:
+                await self.db.pool.acquire()
+                self._checked_out_at = time.perf_counter()
+            if lock is not None:
+                row = self.db.row_locks.setdefault(lock, asyncio.Lock())
+                await row.acquire()
+                self._rows.append(row)
+            self.db.queries += 1
+            await asyncio.sleep(DB_QUERY_SECONDS)
+        return result
+
+    def add(self, obj):
+        pass
+
+    async def commit(self):
+        async with self._busy:
+            if self._checked_out_at is not None:
+                await asyncio.sleep(DB_COMMIT_SECONDS)
+            self._end()
+
+    async def rollback(self):
+        async with self._busy:
+            self._end()
+
+    def _end(self):
+        for row in self._rows:
+            row.release()
+        self._rows.clear()
+        if self._checked_out_at is not None:
+            self.db.connection_seconds += time.perf_counter() - self._checked_out_at
+            self._checked_out_at = None
+            self.db.pool.release()
+
+
+class SimulatedRedis:
+    def __init__(self):
+        self.round_trips = 0
+        self.lease_calls = 0
+        self.keys = {}
+
+    async def round_trip(self, result=None):
+        self.round_trips += 1
+        await asyncio.sleep(REDIS_RTT_SECONDS)
+        return result
+
+    def _live(self, key):
+        entry = self.keys.get(key)
+        if entry is not None and entry[1] <= time.monotonic():
+            del self.keys[key]
+            entry = None
+        return entry
+
+    async def set(self, key, value, nx=False, px=None):
+        # Account leases: SET NX PX
+        self.lease_calls += 1
+        await asyncio.sleep(REDIS_RTT_SECONDS)
+        if nx and self._live(key) is not None:
+            return None
+        self.keys[key] = (value, time.monotonic() + px / 1000.0 if px else float("inf"))
+        return True
+
+    async def eval(self, script, numkeys, key, token, *args):
+        # Compare-and-pexpire / compare-and-delete scripts of account leases
+        self.lease_calls += 1
+        await asyncio.sleep(REDIS_RTT_SECONDS)
+        entry = self._live(key)
+        if entry is None or entry[0] != token:
+            return 0
+        if "pexpire" in script:
+            self.keys[key] = (token, time.monotonic() + int(args[0]) / 1000.0)
+        else:
+            del self.keys[key]
+        return 1
+
+
+def _account(n, wallet_balance="100000"):
+    return SimpleNamespace(id=n, wallet_balance=Decimal(wallet_balance), margin=Decimal("0"), leverage=Decimal("100"),
+                           group_name="standard", orders=[])
+
+
+def _user_data(account):
+    return {"id": account.id, "group_name": account.group_name, "leverage": account.leverage,
+            "wallet_balance": account.wallet_balance, "margin": account.margin}
+
+
+class SimulatedStore(OrderPlacementStore):
+    def __init__(self, redis, accounts):
+        self.redis = redis
+        self.accounts = accounts
+        self.fetches = []
+        self.cached = []
+        self.price_age = 0.1
+
+    async def fetch(self, redis_client, symbols, user_id=None, user_type='live'):
+        self.fetches.append(list(symbols))
+        account = self.accounts.get(user_id)
+        # Prices written by the WebSocket listeners a moment ago
+        cached_at = time.time() - self.price_age
+        return await self.redis.round_trip({"user_data": _user_data(account) if account else None,
+                                            "last_price": {s: {**PRICES[s], "_cached_at": cached_at}
+                                                           for s in symbols if s in PRICES}})
+
+    async def load_user_data(self, db, redis_client, user_id, user_type):
+        raise AssertionError("user data is cached")
+
+    async def market_data(self, symbol):
+        raise AssertionError("prices are cached")
+
+    async def reserve_ids(self, db, user_type, columns):
+        return await db.execute({column: str(1000000000 + i) for i, column in enumerate(columns)})
+
+    async def lock_account(self, db, user_id, user_type):
+        return await db.execute(self.accounts[user_id], lock=(user_type, user_id))
+
+    async def open_orders(self, db, user_id, symbol, user_type):
+        return await db.execute([o for o in self.accounts[user_id].orders if o['order_company_name'] == symbol])
+
+    def cache_user_data(self, redis_client, user_id, user_type, user_data):
+        self.cached.append(user_data)
+
+
+def _registry():
+    async def load(group_name):
+        return SETTINGS
+
+    return GroupSymbolRegistry(load, ttl=60)
+
+
+async def _create_order(session, account, placed):
+    """The endpoint's insert of the order, in its own transaction."""
+    await session.execute()
+    await session.commit()
+    account.orders.append({'order_company_name': placed['order_company_name'], 'order_type': placed['order_type'],
+                           'order_quantity': placed['order_quantity'], 'margin': placed['margin']})
+
+
+async def previous_placement(session, redis, account):
+    """Statements and round trips of the previous process_new_order, in order (cache hits)."""
+    await redis.round_trip()                              # get_user_data_cache
+    results = await asyncio.gather(
+        redis.round_trip(),                               # get_order_placement_data_batch_ultra
+        session.execute(SETTINGS["EURUSD"]),              # get_external_symbol_info
+        asyncio.sleep(FIREBASE_SECONDS),                  # get_latest_market_data(): every symbol (the
+                                                          # real call also blocks the event loop)
+        session.execute(list(account.orders)),            # open orders of the symbol
+        session.execute("1000000000"),                    # generate_unique_10_digit_id
+        return_exceptions=True,
+    )
+    if isinstance(results[1], Exception):
+        raise OrderProcessingError("External symbol info not found for EURUSD")
+    if isinstance(results[4], Exception):
+        raise OrderProcessingError("Failed to generate order ID")
+    open_orders = results[3] if not isinstance(results[3], Exception) else []
+    quantity = ORDER['order_quantity']
+    margin, price, contract_value, commission = single_order_margin(
+        "EURUSD", "BUY", quantity, account.leverage, SETTINGS["EURUSD"], SETTINGS["EURUSD"], PRICES)
+    extra = additional_margin(open_orders, "BUY", quantity, margin)
+    locked = await session.execute(account, lock=("live", account.id))    # get_user_by_id_with_lock
+    if locked.wallet_balance < locked.margin + extra:
+        raise InsufficientFundsError("Not enough wallet balance to cover additional margin.")
+    locked.margin += extra
+    await session.commit()
+    await session.execute()                               # db.refresh
+    return {'order_company_name': "EURUSD", 'order_type': "BUY", 'order_quantity': quantity, 'margin': margin}
+
+
+class Unserialized:
+    """No per-account turns: the phases alone, as in the previous flow (see test_account_actor.py)."""
+
+    @asynccontextmanager
+    async def hold(self, redis_client, user_type, user_id):
+        yield
+
+
+def _new_placement(redis, accounts, groups, store, actor=Unserialized()):
+    async def place(session, account):
+        return await place_new_order(session, redis, account.id, ORDER, "live", groups,
+                                     group_name=account.group_name, store=store, actor=actor)
+    return place
+
+
+async def _clients(place, strict):
+    db = SimulatedDB()
+    latencies, failures = [], []
+    accounts = place.accounts
+
+    async def client(n):
+        account = accounts[n % ACCOUNTS]
+        for _ in range(ORDERS_PER_CLIENT):
+            session = SimulatedSession(db, strict)
+            started = time.perf_counter()
+            try:
+                placed = await place(session, account)
+                await _create_order(session, account, placed)
+            except (OrderProcessingError, InsufficientFundsError) as e:
+                failures.append(e)
+                await session.rollback()
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client(n) for n in range(CLIENTS)))
+    latencies.sort()
+    orders = len(latencies)
+    return {
+        "orders": orders,
+        "failures": len(failures),
+        "p50_ms": 1000 * latencies[orders // 2] if orders else None,
+        "p99_ms": 1000 * latencies[int(orders * 0.99) - 1] if orders else None,
+        "db_ms_per_order": 1000 * db.connection_seconds / max(orders, 1),
+        "queries_per_order": db.queries / max(orders, 1),
+        "concurrent_use_errors": db.concurrent_use_errors,
+        "pool_released": db.pool._value == DB_POOL_SIZE,
+    }
+
+
+def _flows():
+    def previous():
+        redis = SimulatedRedis()
+        accounts = {n: _account(n) for n in range(ACCOUNTS)}
+
+        async def place(session, account):
+            return await previous_placement(session, redis, account)
+        place.accounts = accounts
+        place.redis = redis
+        return place
+
+    def new():
+        redis = SimulatedRedis()
+        accounts = {n: _account(n) for n in range(ACCOUNTS)}
+        place = _new_placement(redis, accounts, _registry(), SimulatedStore(redis, accounts))
+        place.accounts = accounts
+        place.redis = redis
+        return place
+
+    return previous, new
+
+
+def test_margin_math():
+    quantity, leverage = Decimal("0.1"), Decimal("100")
+    margin, price, contract_value, commission = single_order_margin(
+        "EURUSD", "BUY", quantity, leverage, SETTINGS["EURUSD"], SETTINGS["EURUSD"], PRICES)
+    # Only 'b' in the raw feed: the other side is 1 pip (0.01%) away
+    assert price == Decimal("1.08520") * Decimal("1.0001")
+    assert contract_value == Decimal("10000.00")
+    assert margin == (contract_value * price / leverage).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    assert commission == Decimal("0.20")
+    sell_price = single_order_margin("EURUSD", "SELL", quantity, leverage, SETTINGS["EURUSD"], SETTINGS["EURUSD"],
+                                     PRICES)[1]
+    assert sell_price == Decimal("1.08520")
+    assert single_order_margin("GBPUSD", "BUY", quantity, leverage, {}, {}, PRICES) == (None, None, None, None)
+
+    # Direct pair multiplies by its bid, the inverse pair divides
+    assert to_usd(Decimal("100"), "EUR", {"EURUSD": {"b": "1.1"}}) == Decimal("110.0")
+    assert to_usd(Decimal("150"), "JPY", PRICES) == Decimal("1")
+    assert to_usd(Decimal("100"), "CHF", PRICES) == Decimal("100")
+
+    # Margin is converted from ExternalSymbolInfo.profit, not from the Symbol's profit currency
+    order = {'symbol': "EURJPY", 'order_type': "BUY", 'quantity': quantity, 'order_price': None}
+    inputs = {'symbol_settings': SETTINGS["EURJPY"], 'prices': PRICES, 'user_data': {'leverage': leverage}}
+    jpy = evaluate_order(order, inputs)['margin']
+    usd = evaluate_order(order, {**inputs, 'symbol_settings': {**SETTINGS["EURJPY"],
+                                                                "external_profit_currency": "USD"}})['margin']
+    assert jpy == to_usd(usd, "JPY", PRICES) != usd
+
+    # Hedged: an opposite order within the open quantity adds nothing
+    open_orders = [{'order_type': 'BUY', 'order_quantity': Decimal('1'), 'margin': Decimal('100')}]
+    assert additional_margin(open_orders, 'SELL', Decimal('1'), Decimal('100')) == 0
+    assert additional_margin(open_orders, 'SELL', Decimal('1.5'), Decimal('150')) == Decimal('50.00')
+    # The highest margin per lot applies to the whole net quantity
+    assert additional_margin(open_orders, 'BUY', Decimal('1'), Decimal('120')) == Decimal('140.00')
+
+
+def test_prefetch_never_uses_the_session():
+    class NoSession:
+        async def execute(self, *args, **kwargs):
+            raise AssertionError("phase 1 must not use the DB session")
+
+    async def run():
+        redis = SimulatedRedis()
+        store = SimulatedStore(redis, {7: _account(7)})
+        groups = _registry()
+        # Cold registry: the conversion pairs of a JPY symbol need a second round trip
+        inputs = await prefetch_order_inputs(NoSession(), redis, 7, "live", "EURJPY", groups, "standard", store)
+        assert store.fetches == [["EURJPY"], ["JPYUSD", "USDJPY"]]
+        assert set(inputs['prices']) == {"EURJPY", "USDJPY"} and inputs['user_data']['id'] == 7
+        # Resident registry: one MGET for user data, the price and the conversion pairs
+        store.fetches.clear()
+        await prefetch_order_inputs(NoSession(), redis, 7, "live", "EURJPY", groups, "standard", store)
+        assert store.fetches == [["EURJPY", "JPYUSD", "USDJPY"]]
+        # Without the caller's group, the group comes from the cached user data
+        store.fetches.clear()
+        inputs = await prefetch_order_inputs(NoSession(), redis, 7, "live", "EURUSD", groups, None, store)
+        assert store.fetches == [["EURUSD"]] and inputs['group_name'] == "standard"
+        assert inputs['symbol_settings'] is SETTINGS["EURUSD"]
+
+        try:
+            await place_new_order(NoSession(), redis, 7, {**ORDER, 'order_company_name': 'USDJPY'}, "live",
+                                  groups, "standard", store=store)
+            raise AssertionError("unknown symbol accepted")
+        except OrderProcessingError as e:
+            assert "Group settings not found" in str(e)
+
+    asyncio.run(run())
+
+
+def test_stale_prices_are_read_from_the_feed():
+    class LiveFeedStore(SimulatedStore):
+        def __init__(self, redis, accounts):
+            super().__init__(redis, accounts)
+            self.live_reads = []
+
+        async def market_data(self, symbol):
+            self.live_reads.append(symbol)
+            return {"b": Decimal("1.09000"), "o": Decimal("1.08980")} if symbol == "EURUSD" else None
+
+    async def run():
+        redis = SimulatedRedis()
+        store = LiveFeedStore(redis, {7: _account(7)})
+        groups = _registry()
+        inputs = await prefetch_order_inputs(None, redis, 7, "live", "EURUSD", groups, "standard", store)
+        assert not store.live_reads and inputs['prices']["EURUSD"]["b"] == PRICES["EURUSD"]["b"]
+
+        # Listeners stopped persisting ticks: the cached price is too old to price an order
+        store.price_age = store.max_price_age + 1
+        inputs = await prefetch_order_inputs(None, redis, 7, "live", "EURUSD", groups, "standard", store)
+        assert store.live_reads == ["EURUSD"] and inputs['prices']["EURUSD"]["b"] == Decimal("1.09000")
+        # Without a live price either, the stale one is not used
+        store.live_reads.clear()
+        inputs = await prefetch_order_inputs(None, redis, 7, "live", "EURJPY", groups, "standard", store)
+        assert store.live_reads == ["EURJPY", "USDJPY"] and not inputs['prices']
+
+        # No ExternalSymbolInfo contract size: the group's default is not used to price the order
+        async def without_symbol_info(group_name):
+            return {"EURUSD": {**SETTINGS["EURUSD"], "external_contract_size": None}}
+
+        store.price_age = 0.1
+        try:
+            await place_new_order(None, redis, 7, ORDER, "live", GroupSymbolRegistry(without_symbol_info, ttl=60),
+                                  "standard", store=store)
+            raise AssertionError("order priced without symbol info")
+        except OrderProcessingError as e:
+            assert str(e) == "External symbol info not found for EURUSD"
+
+    asyncio.run(run())
+
+
+def test_insufficient_funds_releases_the_row_lock():
+    async def run():
+        db, redis = SimulatedDB(), SimulatedRedis()
+        account = _account(1, wallet_balance="50")
+        store = SimulatedStore(redis, {1: account})
+        session = SimulatedSession(db)
+        try:
+            await place_new_order(session, redis, 1, ORDER, "live", _registry(), "standard", store=store)
+            raise AssertionError("order accepted without margin")
+        except InsufficientFundsError:
+            pass
+        assert account.margin == 0 and not store.cached
+        assert not db.row_locks[("live", 1)].locked() and db.pool._value == DB_POOL_SIZE
+
+        account.wallet_balance = Decimal("1000")
+        placed = await place_new_order(session, redis, 1, {**ORDER, 'stop_loss': Decimal("1.07")}, "live",
+                                       _registry(), "standard", store=store)
+        assert placed['order_status'] == "OPEN" and placed['stoploss_id'] and placed['takeprofit_id'] is None
+        assert account.margin == placed['margin'] and store.cached[-1]['margin'] == placed['margin']
+        assert db.pool._value == DB_POOL_SIZE
+
+    asyncio.run(run())
+
+
+def test_concurrent_placement_benchmark():
+    previous, new = _flows()
+
+    # Sessions that reject concurrent use: the previous gather fails, the phases never overlap
+    strict_previous = asyncio.run(_clients(previous(), strict=True))
+    strict_new = asyncio.run(_clients(new(), strict=True))
+    assert strict_previous["failures"] > 0 and strict_previous["concurrent_use_errors"] > 0
+    assert strict_new["failures"] == 0 and strict_new["concurrent_use_errors"] == 0
+
+    # Latency: the previous flow with its session uses serialized
+    previous_place = previous()
+    results = {"previous (serialized session)": asyncio.run(_clients(previous_place, strict=False))}
+    place = new()
+    results["three-phase"] = asyncio.run(_clients(place, strict=True))
+    print(f"{CLIENTS} concurrent clients x {ORDERS_PER_CLIENT} orders, {ACCOUNTS} accounts, DB pool {DB_POOL_SIZE}; "
+          f"previous flow under strict sessions: {strict_previous['failures']} of "
+          f"{CLIENTS * ORDERS_PER_CLIENT} orders failed")
+    for name, r in results.items():
+        print(f"  {name:30s} p50 {r['p50_ms']:7.1f} ms  p99 {r['p99_ms']:7.1f} ms  "
+              f"DB {r['db_ms_per_order']:5.1f} ms/order  {r['queries_per_order']:.1f} statements/order")
+
+    old, new_result = results["previous (serialized session)"], results["three-phase"]
+    assert old["orders"] == new_result["orders"] == CLIENTS * ORDERS_PER_CLIENT
+    assert new_result["pool_released"] and old["pool_released"]
+    # Work per order rather than wall-clock time: fewer statements (no symbol info query, no
+    # refresh) and one Redis round trip instead of two
+    assert old["queries_per_order"] == 6 and new_result["queries_per_order"] == 4
+    assert previous_place.redis.round_trips == 2 * CLIENTS * ORDERS_PER_CLIENT
+    assert place.redis.round_trips == CLIENTS * ORDERS_PER_CLIENT
+    # The margin of every account adds up under the row lock
+    for account in place.accounts.values():
+        assert account.margin == sum(order['margin'] for order in account.orders)
+
+
+if __name__ == "__main__":
+    test_margin_math()
+    test_prefetch_never_uses_the_session()
+    test_stale_prices_are_read_from_the_feed()
+    test_insufficient_funds_releases_the_row_lock()
+    test_concurrent_placement_benchmark()
+    print("Order placement tests passed.")
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Tests for the coalesced dynamic portfolio cache writes: Redis SETs per second with
+several sockets per account on the synthetic feed, before (a SET per socket per tick)
+and after, plus the bounded staleness of what readers see.
+"""
+
+import asyncio
+import time
+from decimal import Decimal
+
+from app.services.portfolio_writer import DynamicPortfolioWriter, portfolio_fingerprint
+from app.services.synthetic_feed import SyntheticTickSource
+
+SYMBOLS = ["EURUSD", "GBPUSD", "USDJPY", "AUDUSD", "XAUUSD"]
+ACCOUNTS = 200
+SOCKETS_PER_ACCOUNT = 3
+TICK_SECONDS = 0.01
+TICKS = 100
+MIN_INTERVAL = 0.1
+
+
+class CountingStore:
+    """Stands in for Redis: counts SETs and keeps the last value per key."""
+
+    def __init__(self):
+        self.sets = 0
+        self.values = {}
+
+    async def write(self, redis_client, user_id, data):
+        self.sets += 1
+        self.values[user_id] = data
+
+
+def _portfolio(account, prices):
+    positions, pnl = [], Decimal("0")
+    for i, symbol in enumerate(SYMBOLS[:2 + account % 3]):
+        bid = Decimal(prices[symbol]["o"])
+        position_pnl = (bid - prices["open"][symbol]) * Decimal(1000) * (1 + i)
+        pnl += position_pnl
+        positions.append({"order_id": f"{account}-{i}", "order_company_name": symbol,
+                          "profit_loss": str(position_pnl), "current_price": str(bid)})
+    balance = Decimal(10000)
+    return {"balance": str(balance), "equity": str(balance + pnl), "margin": "500.0",
+            "free_margin": str(balance + pnl - 500), "profit_loss": str(pnl),
+            "margin_level": str((balance + pnl) / 500 * 100), "positions_with_pnl": positions}
+
+
+async def _run_feed(submit):
+    source = SyntheticTickSource(SYMBOLS, seed=5)
+    prices = {s: {"o": str(source.mid_prices[s]), "b": str(source.mid_prices[s])} for s in SYMBOLS}
+    prices["open"] = dict(source.mid_prices)
+    started = time.perf_counter()
+    last = {}
+    for _ in range(TICKS):
+        prices.update({k: v for k, v in source.next_tick(2).items() if k != "_timestamp"})
+        for account in range(ACCOUNTS):
+            last[account] = _portfolio(account, prices)
+            for _ in range(SOCKETS_PER_ACCOUNT):
+                await submit(account, last[account])
+        await asyncio.sleep(TICK_SECONDS)
+    return time.perf_counter() - started, last
+
+
+def test_redis_writes_per_second_on_synthetic_feed():
+    async def run():
+        before = CountingStore()
+        elapsed_before, _ = await _run_feed(lambda account, data: before.write(None, account, data))
+
+        after = CountingStore()
+        writer = DynamicPortfolioWriter(after.write, min_interval=MIN_INTERVAL, precision=2)
+        elapsed_after, last = await _run_feed(lambda account, data: writer.submit(None, "live", account, data))
+        await writer.flush()
+        return before, elapsed_before, after, elapsed_after, last
+
+    before, elapsed_before, after, elapsed_after, last = asyncio.run(run())
+    print(f"before: {before.sets / elapsed_before:9.0f} SET/s ({before.sets} SETs)")
+    print(f"after:  {after.sets / elapsed_after:9.0f} SET/s ({after.sets} SETs)")
+
+    # At most one write per account per interval (plus the final flush)
+    max_writes = ACCOUNTS * (int(elapsed_after / MIN_INTERVAL) + 2)
+    assert after.sets <= max_writes
+    assert after.sets * 10 < before.sets
+    # Nothing is lost: the stored value is the last calculation at the configured precision
+    for account, data in last.items():
+        assert portfolio_fingerprint(after.values[account]) == portfolio_fingerprint(data)
+
+
+def test_changed_value_is_written_within_the_interval():
+    async def run():
+        store = CountingStore()
+        writer = DynamicPortfolioWriter(store.write, min_interval=0.05)
+        first = {"balance": "100.00", "free_margin": "40.001"}
+        assert await writer.submit(None, "live", 1, first) is True
+        # Below the precision: not a change
+        assert await writer.submit(None, "live", 1, dict(first, free_margin="40.0012")) is False
+        assert store.sets == 1 and writer.pending("live", 1) is None
+
+        changed = dict(first, free_margin="38.50")
+        assert await writer.submit(None, "live", 1, changed) is False
+        assert writer.pending("live", 1) == changed and store.values[1] == first
+        await asyncio.sleep(0.08)
+        assert store.values[1] == changed and store.sets == 2
+
+        # A change that reverts before the flush is never written
+        assert await writer.submit(None, "live", 1, dict(changed, free_margin="37.00")) is False
+        assert await writer.submit(None, "live", 1, changed) is False
+        await asyncio.sleep(0.08)
+        assert store.sets == 2
+
+    asyncio.run(run())
+
+
+def test_unchanged_value_is_refreshed_before_expiry():
+    now = [0.0]
+
+    async def run():
+        store = CountingStore()
+        writer = DynamicPortfolioWriter(store.write, min_interval=1, refresh_after=30, clock=lambda: now[0])
+        data = {"balance": "1.00", "positions_with_pnl": [{"order_id": "1", "current_price": "1.1"}]}
+        await writer.submit(None, "live", 7, data)
+        now[0] = 29
+        # A new current_price alone does not count as a change
+        assert await writer.submit(None, "live", 7, {**data, "positions_with_pnl": [{"order_id": "1", "current_price": "1.2"}]}) is False
+        now[0] = 31
+        assert await writer.submit(None, "live", 7, data) is True
+        assert store.sets == 2
+
+    asyncio.run(run())
+
+
+def test_idle_accounts_are_pruned():
+    store = CountingStore()
+    now = [0.0]
+
+    async def run():
+        writer = DynamicPortfolioWriter(store.write, min_interval=1, refresh_after=30, clock=lambda: now[0])
+        for user_id in range(1000):
+            await writer.submit(None, "live", user_id, {"balance": "100.00", "positions_with_pnl": []})
+        await writer.submit(None, "live", 1, {"balance": "101.00", "positions_with_pnl": []})   # deferred
+        assert len(writer) == 1000
+        now[0] = 31.0
+        # Accounts still connected keep submitting; the first submit past the interval prunes the rest
+        await writer.submit(None, "live", 0, {"balance": "100.00", "positions_with_pnl": []})
+        assert len(writer) == 2 and writer.pending("live", 1) is not None
+        await writer.flush()
+        now[0] = 62.0
+        assert writer.prune() == 2 and len(writer) == 0
+        # A pruned account is written again on its next value
+        sets = store.sets
+        assert await writer.submit(None, "live", 5, {"balance": "100.00", "positions_with_pnl": []})
+        assert store.sets == sets + 1
+
+    asyncio.run(run())
+
+
+def test_live_and_demo_accounts_with_the_same_id_are_tracked_apart():
+    async def run():
+        store = CountingStore()
+        writer = DynamicPortfolioWriter(store.write, min_interval=1)
+        data = {"balance": "100.00", "positions_with_pnl": []}
+        assert await writer.submit(None, "live", 3, data) is True
+        # A demo account with the same id is not held back by the live account's write
+        assert await writer.submit(None, "demo", 3, dict(data, balance="50.00")) is True
+        assert len(writer) == 2 and store.sets == 2
+
+    asyncio.run(run())
+
+
+def test_bootstrap_write_does_not_hold_back_the_next_calculation():
+    class FakePipeline:
+        def __init__(self, store):
+            self.store = store
+            self.commands = []
+
+        def set(self, key, value, ex=None):
+            self.commands.append((key, value))
+
+        def mget(self, keys):
+            self.commands.append((None, [None] * len(keys)))
+
+        async def execute(self):
+            results = []
+            for key, value in self.commands:
+                if key is not None:
+                    self.store[key] = value
+                results.append(True if key is not None else value)
+            return results
+
+    class FakeRedis:
+        def __init__(self):
+            self.store = {}
+
+        def pipeline(self, transaction=True):
+            return FakePipeline(self.store)
+
+    async def run():
+        from app.core.cache import bootstrap_connection_cache
+        from app.services.portfolio_writer import dynamic_portfolio_writer
+
+        store = CountingStore()
+        redis_client = FakeRedis()
+        calculated = {"balance": "100.00", "equity": "112.50", "positions_with_pnl": []}
+        placeholder = {"balance": "100.00", "equity": "100.00", "positions_with_pnl": []}
+        writer = DynamicPortfolioWriter(store.write, min_interval=1)
+        original_write = dynamic_portfolio_writer._write
+        dynamic_portfolio_writer._write = store.write
+        try:
+            await dynamic_portfolio_writer.submit(redis_client, "live", 11, calculated)
+            # Reconnect: the bootstrap overwrites the key with its placeholder
+            await bootstrap_connection_cache(redis_client, user_id=11, user_type="live", user_data={}, portfolio={},
+                                             static_orders={}, dynamic_portfolio=placeholder, group_name="g",
+                                             symbols=[])
+            # The first calculation after it restores the real value at once, though unchanged
+            assert await dynamic_portfolio_writer.submit(redis_client, "live", 11, calculated) is True
+            assert store.sets == 2 and store.values[11] == calculated
+        finally:
+            dynamic_portfolio_writer._write = original_write
+            dynamic_portfolio_writer.forget("live", 11)
+
+        # forget also cancels a deferred flush of an older value
+        await writer.submit(None, "live", 1, calculated)
+        await writer.submit(None, "live", 1, placeholder)
+        assert writer.pending("live", 1) == placeholder
+        writer.forget("live", 1)
+        await writer.flush()
+        assert store.sets == 3 and len(writer) == 0
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_redis_writes_per_second_on_synthetic_feed()
+    test_changed_value_is_written_within_the_interval()
+    test_unchanged_value_is_refreshed_before_expiry()
+    test_idle_accounts_are_pruned()
+    test_live_and_demo_accounts_with_the_same_id_are_tracked_apart()
+    test_bootstrap_write_does_not_hold_back_the_next_calculation()
+    print("Dynamic portfolio writer tests passed.")
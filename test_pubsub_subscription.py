@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Tests for the push-based Redis pub/sub subscription: reconnection with backoff,
+resubscription and gap counting, clean cancellation, and idle wakeups / CPU plus the
+latency added per hop, against the get_message(timeout=1.0) + sleep(0.01) loops the
+subscribers used before. Redis is replaced by an in-process broker.
+"""
+
+import asyncio
+import random
+import statistics
+import time
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app.core.pubsub import RedisSubscription
+
+CHANNEL = "market_data_updates"
+IDLE_SUBSCRIBERS = 1000
+IDLE_SECONDS = 3.0
+LATENCY_SUBSCRIBERS = 10
+MESSAGES = 300
+
+
+class Broker:
+    """Stands in for Redis: fan-out to subscribed connections, which can be dropped."""
+
+    def __init__(self):
+        self.connections = set()
+        self.down = False
+        self.subscribe_calls = 0
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    def publish(self, channel, data):
+        for pubsub in list(self.connections):
+            if channel in pubsub.channels:
+                pubsub.queue.put_nowait({"type": "message", "pattern": None, "channel": channel, "data": data})
+
+    def drop_connections(self):
+        for pubsub in list(self.connections):
+            pubsub.queue.put_nowait(RedisConnectionError("Connection reset by peer"))
+        self.connections.clear()
+
+
+class FakePubSub:
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = set()
+        self.queue = asyncio.Queue()
+        self.closed = False
+        self.wakeups = 0
+
+    async def subscribe(self, *channels):
+        self.broker.subscribe_calls += 1
+        if self.broker.down:
+            raise RedisConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+        self.channels.update(channels)
+        self.broker.connections.add(self)
+        for channel in channels:
+            self.queue.put_nowait({"type": "subscribe", "pattern": None, "channel": channel, "data": 1})
+
+    async def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+
+    async def aclose(self):
+        self.closed = True
+        self.broker.connections.discard(self)
+
+    def _item(self, item):
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def listen(self):
+        while self.channels:
+            item = self._item(await self.queue.get())
+            self.wakeups += 1
+            yield item
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        get = asyncio.ensure_future(self.queue.get())
+        try:
+            done, _ = await asyncio.wait({get}, timeout=timeout)
+        finally:
+            get.cancel()
+        item = self._item(get.result()) if done else None
+        self.wakeups += 1
+        if item is not None and ignore_subscribe_messages and item["type"] == "subscribe":
+            return None
+        return item
+
+
+def test_reconnects_with_backoff_and_resubscribes():
+    async def run():
+        broker = Broker()
+        gaps = []
+        received = []
+        subscription = RedisSubscription(broker, [CHANNEL], "test", on_gap=lambda: gaps.append(time.monotonic()),
+                                         initial_backoff=0.01, max_backoff=0.04)
+        await subscription.connect()
+
+        async def consume():
+            async for message in subscription:
+                received.append(message["data"])
+                if message["data"] == "last":
+                    break
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        broker.publish(CHANNEL, "before")
+        await asyncio.sleep(0.01)
+        broker.down = True
+        broker.drop_connections()
+        broker.publish(CHANNEL, "lost")
+        await asyncio.sleep(0.1)
+        assert subscription.failures >= 3 and not gaps
+        broker.down = False
+        while not gaps:
+            await asyncio.sleep(0.01)
+        broker.publish(CHANNEL, "after")
+        broker.publish(CHANNEL, "last")
+        await asyncio.wait_for(task, 1)
+
+        assert received == ["before", "after", "last"]
+        assert subscription.gaps == len(gaps) == 1
+        assert subscription.reconnects == broker.subscribe_calls - 1
+        # The backoff was reset by the message received after resubscribing
+        assert subscription.failures == 0
+
+    asyncio.run(run())
+
+
+def test_backoff_is_exponential_and_capped():
+    subscription = RedisSubscription(Broker(), [CHANNEL], "test", initial_backoff=0.1, max_backoff=2.0)
+    for failures, ceiling in ((1, 0.1), (2, 0.2), (3, 0.4), (5, 1.6), (6, 2.0), (20, 2.0)):
+        subscription.failures = failures
+        for _ in range(50):
+            assert ceiling / 2 <= subscription.backoff() <= ceiling
+
+
+def test_cancellation_unsubscribes_and_closes():
+    async def run():
+        broker = Broker()
+        subscription = RedisSubscription(broker, [CHANNEL, "orders:1"], "test")
+
+        async def consume():
+            async with subscription:
+                async for _ in subscription:
+                    pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        (pubsub,) = broker.connections
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert pubsub.closed and not pubsub.channels and not broker.connections
+        assert subscription.stats()["closed"]
+        # A closed subscription does not reconnect
+        async for _ in subscription:
+            raise AssertionError("closed subscription yielded a message")
+
+    asyncio.run(run())
+
+
+async def _polling_consumer(broker, received, sleep_after_message):
+    """The loop the subscribers used before."""
+    pubsub = broker.pubsub()
+    await pubsub.subscribe(CHANNEL)
+    try:
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is None:
+                await asyncio.sleep(0.01)
+                continue
+            received.append(time.perf_counter() - message["data"])
+            if sleep_after_message:
+                await asyncio.sleep(0.01)
+    finally:
+        await pubsub.aclose()
+
+
+async def _push_consumer(broker, received):
+    async with RedisSubscription(broker, [CHANNEL], "test") as subscription:
+        async for message in subscription:
+            received.append(time.perf_counter() - message["data"])
+
+
+async def _measure(start_consumer):
+    broker = Broker()
+    latencies = []
+    tasks = [asyncio.create_task(start_consumer(broker, latencies)) for _ in range(IDLE_SUBSCRIBERS)]
+    await asyncio.sleep(0.1)
+    pubsubs = list(broker.connections)
+    wakeups_before = sum(p.wakeups for p in pubsubs)
+    cpu_before = time.process_time()
+    await asyncio.sleep(IDLE_SECONDS)
+    idle_cpu = time.process_time() - cpu_before
+    idle_wakeups = sum(p.wakeups for p in pubsubs) - wakeups_before
+    for task in tasks[LATENCY_SUBSCRIBERS:]:
+        task.cancel()
+    await asyncio.gather(*tasks[LATENCY_SUBSCRIBERS:], return_exceptions=True)
+
+    # Ticks at ~100/s with exponential gaps, as the feed publishes them
+    rng = random.Random(3)
+    for _ in range(MESSAGES):
+        broker.publish(CHANNEL, time.perf_counter())
+        await asyncio.sleep(rng.expovariate(100))
+    while len(latencies) < MESSAGES * LATENCY_SUBSCRIBERS:
+        await asyncio.sleep(0.01)
+    for task in tasks[:LATENCY_SUBSCRIBERS]:
+        task.cancel()
+    await asyncio.gather(*tasks[:LATENCY_SUBSCRIBERS], return_exceptions=True)
+    assert not broker.connections
+    latencies.sort()
+    return {
+        "idle_wakeups_per_second": idle_wakeups / IDLE_SECONDS / IDLE_SUBSCRIBERS,
+        "idle_cpu_percent": 100 * idle_cpu / IDLE_SECONDS,
+        "mean_ms": 1000 * statistics.mean(latencies),
+        "p99_ms": 1000 * latencies[int(len(latencies) * 0.99)],
+    }
+
+
+def test_idle_cpu_and_added_latency():
+    results = {
+        "get_message + sleep (websocket, sltp)": asyncio.run(_measure(
+            lambda broker, received: _polling_consumer(broker, received, sleep_after_message=False))),
+        "get_message + sleep after every message (worker)": asyncio.run(_measure(
+            lambda broker, received: _polling_consumer(broker, received, sleep_after_message=True))),
+        "RedisSubscription (listen)": asyncio.run(_measure(_push_consumer)),
+    }
+    print(f"{IDLE_SUBSCRIBERS} subscribers {IDLE_SECONDS:.0f}s idle; {LATENCY_SUBSCRIBERS} subscribers, {MESSAGES} ticks at ~100/s:")
+    for name, r in results.items():
+        print(f"  {name:50s} idle {r['idle_wakeups_per_second']:5.2f} wakeups/s/subscriber, "
+              f"{r['idle_cpu_percent']:5.1f}% CPU; delivery mean {r['mean_ms']:6.2f} ms p99 {r['p99_ms']:6.2f} ms")
+
+    push = results["RedisSubscription (listen)"]
+    worker = results["get_message + sleep after every message (worker)"]
+    polling = results["get_message + sleep (websocket, sltp)"]
+    assert push["idle_wakeups_per_second"] == 0
+    assert polling["idle_wakeups_per_second"] >= 0.5
+    assert push["idle_cpu_percent"] < polling["idle_cpu_percent"]
+    # Sleeping after every message delays the next one by up to 10ms
+    assert push["mean_ms"] < worker["mean_ms"] and push["p99_ms"] < worker["p99_ms"]
+
+
+if __name__ == "__main__":
+    test_reconnects_with_backoff_and_resubscribes()
+    test_backoff_is_exponential_and_capped()
+    test_cancellation_unsubscribes_and_closes()
+    test_idle_cpu_and_added_latency()
+    print("Pub/sub subscription tests passed.")
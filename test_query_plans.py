@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Plan regression tests for the hot queries of app/crud (crud_order, wallet,
+external_symbol_info) on SQLite. The tables are created from the models (Base.metadata)
+and seeded with a realistic mix (most orders closed). Each CRUD function is then run,
+the statements it issues are captured with the engine's before_cursor_execute event,
+and EXPLAIN QUERY PLAN of each one must not scan a table and must read history pages
+in index order. The a71c4e9d0b25 migration must create the indexes the models declare.
+"""
+
+import asyncio
+import importlib.util
+import os
+import random
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+USERS = 2000
+ORDERS = 100000
+SYMBOLS = [f"SYM{n:02d}USD" for n in range(30)]
+PENDING_STATUSES = ["BUY_LIMIT", "SELL_LIMIT", "BUY_STOP", "SELL_STOP", "PENDING"]
+MIGRATION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "alembic", "versions", "a71c4e9d0b25_add_hot_query_indexes.py")
+
+
+def _tables():
+    from app.database.models import DemoUserOrder, ExternalSymbolInfo, UserOrder, Wallet
+    return [UserOrder.__table__, DemoUserOrder.__table__, Wallet.__table__, ExternalSymbolInfo.__table__]
+
+
+async def _seed(conn):
+    from sqlalchemy import insert
+    from app.database.models import Base, DemoUserOrder, ExternalSymbolInfo, UserOrder, Wallet
+
+    await conn.run_sync(Base.metadata.create_all, tables=_tables())
+    rng = random.Random(47)
+    for model in (UserOrder, DemoUserOrder):
+        rows = []
+        for n in range(ORDERS):
+            draw = rng.random()
+            status = "CLOSED" if draw < 0.9 else "OPEN" if draw < 0.95 else rng.choice(PENDING_STATUSES)
+            rows.append({"order_id": f"{model.__tablename__[0]}{n}", "order_user_id": rng.randrange(USERS),
+                         "order_company_name": rng.choice(SYMBOLS), "order_type": rng.choice(("BUY", "SELL")),
+                         "order_status": status, "order_price": Decimal("1.1"), "order_quantity": Decimal("0.1"),
+                         "margin": Decimal("110"), "created_at": datetime(2026, 1 + n % 9, 1 + n % 28, 10)})
+        await conn.execute(insert(model), rows)
+    wallet_rows = []
+    for n in range(ORDERS):
+        demo = n % 4 == 0
+        user_id = rng.randrange(USERS)
+        wallet_rows.append({"user_id": None if demo else user_id, "demo_user_id": user_id if demo else None,
+                            "order_id": f"u{n}", "symbol": rng.choice(SYMBOLS),
+                            "transaction_type": rng.choice(("Profit/Loss", "Commission", "deposit", "withdraw")),
+                            "transaction_amount": Decimal("10"), "transaction_id": str(n),
+                            "created_at": datetime(2026, 1 + n % 9, 1 + n % 28, 10)})
+    await conn.execute(insert(Wallet), wallet_rows)
+    await conn.execute(insert(ExternalSymbolInfo), [
+        {"fix_symbol": symbol, "contract_size": Decimal("100000"), "profit": "USD"} for symbol in SYMBOLS
+    ])
+    await conn.exec_driver_sql("ANALYZE")
+
+
+def _hot_queries():
+    """(name, coroutine function of the session) per CRUD query, for live and demo orders."""
+    from app.crud import crud_order, external_symbol_info, wallet
+    from app.database.models import DemoUserOrder, UserOrder
+
+    queries = []
+    for model in (UserOrder, DemoUserOrder):
+        table = model.__tablename__
+        queries += [
+            (f"{table} get_order_by_id", lambda db, m=model: crud_order.get_order_by_id(db, "7", m)),
+            (f"{table} get_all_open_orders_by_user_id",
+             lambda db, m=model: crud_order.get_all_open_orders_by_user_id(db, 7, m)),
+            (f"{table} get_open_orders_by_user_id_and_symbol",
+             lambda db, m=model: crud_order.get_open_orders_by_user_id_and_symbol(db, 7, "SYM01USD", m)),
+            (f"{table} get_open_and_pending_orders_by_user_id_and_symbol",
+             lambda db, m=model: crud_order.get_open_and_pending_orders_by_user_id_and_symbol(db, 7, "SYM01USD", m)),
+            (f"{table} get_orders_by_user_id_and_statuses",
+             lambda db, m=model: crud_order.get_orders_by_user_id_and_statuses(db, 7, ["OPEN", "PENDING"], m)),
+            (f"{table} get_open_orders_by_user_ids_and_symbol",
+             lambda db, m=model: crud_order.get_open_orders_by_user_ids_and_symbol(db, [1, 2, 3], "SYM01USD", m)),
+            (f"{table} get_orders_by_user_id", lambda db, m=model: crud_order.get_orders_by_user_id(db, 7, m)),
+        ]
+    queries += [
+        ("get_all_open_orders", crud_order.get_all_open_orders),
+        ("get_wallet_records_by_user_id", lambda db: wallet.get_wallet_records_by_user_id(db, 7)),
+        ("get_wallet_records_by_user_id (types)",
+         lambda db: wallet.get_wallet_records_by_user_id(db, 7, transaction_types=["deposit", "withdraw"])),
+        ("get_wallet_records_by_demo_user_id", lambda db: wallet.get_wallet_records_by_demo_user_id(db, 7)),
+        ("get_wallet_records_by_order_id", lambda db: wallet.get_wallet_records_by_order_id(db, "u7", user_id=7)),
+        ("get_total_deposit_amount_for_live_user", lambda db: wallet.get_total_deposit_amount_for_live_user(db, 7)),
+        ("get_external_symbol_info_by_symbol",
+         lambda db: external_symbol_info.get_external_symbol_info_by_symbol(db, "sym01usd")),
+    ]
+    return queries
+
+
+def _plans(drop_indexes=()):
+    """{query name: [(statement, plan steps)]} of the statements each CRUD query issued."""
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import StaticPool
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with engine.begin() as conn:
+            await _seed(conn)
+            for index in drop_indexes:
+                await conn.exec_driver_sql(f"DROP INDEX {index}")
+        issued = []
+
+        def record(conn, cursor, statement, parameters, *args):
+            issued.append((statement, parameters))
+
+        statements = {}
+        event.listen(engine.sync_engine, "before_cursor_execute", record)
+        async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+            for name, query in _hot_queries():
+                issued.clear()
+                await query(db)
+                statements[name] = list(issued)
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+        plans = {}
+        async with engine.connect() as conn:
+            for name, issued_statements in statements.items():
+                plans[name] = []
+                for statement, parameters in issued_statements:
+                    rows = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                    plans[name].append((statement, [row[-1] for row in rows]))
+        await engine.dispose()
+        return plans
+
+    return asyncio.run(run())
+
+
+def _assert_indexed(name, statement, plan):
+    scans = [step for step in plan if step.startswith("SCAN") and "COVERING INDEX" not in step]
+    assert not scans, f"{name}: full scan in plan {plan}"
+    assert any(step.startswith("SEARCH") for step in plan), f"{name}: no index search in plan {plan}"
+    if "LIMIT" in statement:
+        # Pages are read in index order, not sorted after reading all of the user's rows
+        assert not any("TEMP B-TREE FOR ORDER BY" in step for step in plan), f"{name}: sorts in plan {plan}"
+
+
+def test_hot_crud_queries_use_indexes():
+    plans = _plans()
+    for name, issued in plans.items():
+        assert issued, f"{name}: issued no statement"
+        for statement, plan in issued:
+            _assert_indexed(name, statement, plan)
+            print(f"  {name:64s} {' | '.join(plan)}")
+    steps = lambda name: " ".join(step for _, plan in plans[name] for step in plan)
+    assert "ix_user_orders_user_status_symbol (order_user_id=? AND order_status=? AND order_company_name=?)" \
+        in steps("user_orders get_open_orders_by_user_id_and_symbol")
+    assert "COVERING INDEX ix_wallets_user_id_type_amount" in steps("get_total_deposit_amount_for_live_user")
+    assert "ix_external_symbol_info_fix_symbol_upper" in steps("get_external_symbol_info_by_symbol")
+
+
+def test_queries_scan_without_the_new_indexes():
+    """The same CRUD queries without the migration's indexes: scans and sorts."""
+    dropped = [f"ix_{table}_{suffix}" for table in ("user_orders", "demo_user_orders")
+               for suffix in ("user_status_symbol", "user_created_at", "status_symbol")]
+    dropped += [f"ix_wallets_{suffix}" for suffix in ("user_id_created_at", "demo_user_id_created_at",
+                                                      "user_id_type_amount")]
+    dropped.append("ix_external_symbol_info_fix_symbol_upper")
+    plans = _plans(dropped)
+    steps = lambda name: [step for _, plan in plans[name] for step in plan]
+    assert any(step.startswith("SCAN user_orders") for step in steps("get_all_open_orders"))
+    assert any("TEMP B-TREE FOR ORDER BY" in step for step in steps("user_orders get_orders_by_user_id"))
+    assert any("TEMP B-TREE FOR ORDER BY" in step for step in steps("get_wallet_records_by_user_id"))
+    assert any(step.startswith("SCAN external_symbol_info") for step in steps("get_external_symbol_info_by_symbol"))
+
+
+class _RecordingOps:
+    """Stands in for alembic's `op` while the migration's upgrade() runs: records what it creates."""
+
+    def __init__(self):
+        self.indexes = {}
+        self.columns = {}
+
+    def create_index(self, name, table, columns, unique=False):
+        self.indexes[name] = (table, tuple(columns))
+
+    def add_column(self, table, column):
+        self.columns[(table, column.name)] = column
+
+    def f(self, name):
+        return name
+
+
+def test_migration_creates_the_model_indexes():
+    pytest.importorskip("alembic.op")
+    spec = importlib.util.spec_from_file_location("hot_query_indexes_migration", MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    ops = _RecordingOps()
+    migration.op = ops
+    migration.upgrade()
+
+    declared = {index.name: (table.name, tuple(column.name for column in index.columns))
+                for table in _tables() for index in table.indexes}
+    assert ops.indexes and all(declared.get(name) == created for name, created in ops.indexes.items()), \
+        f"migration {ops.indexes} vs models {declared}"
+    column = ops.columns[("external_symbol_info", "fix_symbol_upper")]
+    assert str(column.computed.sqltext) == "upper(fix_symbol)" and column.computed.persisted
+
+
+if __name__ == "__main__":
+    test_hot_crud_queries_use_indexes()
+    test_queries_scan_without_the_new_indexes()
+    test_migration_creates_the_model_indexes()
+    print("Query plan tests passed.")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQL statement profiler (app/core/sql_profiler.py): fingerprints, redaction
+of bind parameters in the slow-query log, and attribution. Order placements run as HTTP
+requests through SqlAttributionMiddleware, on sessions whose statements fire the engine's
+cursor events, while a named background job and an unnamed task issue their own
+statements concurrently; the report must attribute each statement to its source.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.sql_profiler import (
+    SqlAttributionMiddleware,
+    fingerprint,
+    redact_parameters,
+    sql_profiler,
+    sql_source,
+)
+from app.services.order_placement import place_new_order
+from test_order_placement import (
+    ORDER,
+    SimulatedDB,
+    SimulatedRedis,
+    SimulatedSession,
+    SimulatedStore,
+    Unserialized,
+    _account,
+    _registry,
+)
+
+ROUTE = "/api/v1/orders/"
+PLACEMENTS = 20
+RESERVE_IDS = ("SELECT user_orders.order_id, user_orders.stoploss_id, user_orders.takeprofit_id FROM user_orders "
+               "WHERE user_orders.order_id IN (%s) OR user_orders.stoploss_id IN (%s) OR user_orders.takeprofit_id IN (%s)")
+LOCK_USER = "SELECT users.id, users.wallet_balance, users.margin FROM users WHERE users.id = %s FOR UPDATE"
+OPEN_ORDERS = ("SELECT user_orders.order_type, user_orders.order_quantity, user_orders.margin FROM user_orders "
+               "WHERE user_orders.order_user_id = %s AND user_orders.order_company_name = %s "
+               "AND user_orders.order_status = %s")
+INSERT_ORDER = "INSERT INTO user_orders (order_id, order_user_id, order_company_name) VALUES (%s, %s, %s)"
+PENDING_SCAN = "SELECT user_orders.id FROM user_orders WHERE user_orders.order_status IN (%s, %s, %s, %s)"
+CLEANUP = "DELETE FROM order_id_alias WHERE created_at < %s"
+
+
+class ProfiledSession(SimulatedSession):
+    """Simulated session whose statements fire the profiler's cursor events, as the engine does."""
+
+    def __init__(self, db):
+        super().__init__(db)
+        self.connection = SimpleNamespace(info={})
+
+    async def execute(self, result=None, lock=None, statement=INSERT_ORDER, parameters=()):
+        sql_profiler.before_cursor_execute(self.connection, None, statement, parameters, None, False)
+        try:
+            return await super().execute(result, lock)
+        finally:
+            sql_profiler.after_cursor_execute(self.connection, None, statement, parameters, None, False)
+
+
+class ProfiledStore(SimulatedStore):
+    """The statements the placement store issues, with their SQL text."""
+
+    async def reserve_ids(self, db, user_type, columns):
+        ids = {column: str(1000000000 + i) for i, column in enumerate(columns)}
+        return await db.execute(ids, statement=RESERVE_IDS, parameters=tuple(ids.values()))
+
+    async def lock_account(self, db, user_id, user_type):
+        return await db.execute(self.accounts[user_id], lock=(user_type, user_id), statement=LOCK_USER,
+                                parameters=(user_id,))
+
+    async def open_orders(self, db, user_id, symbol, user_type):
+        orders = [o for o in self.accounts[user_id].orders if o['order_company_name'] == symbol]
+        return await db.execute(orders, statement=OPEN_ORDERS, parameters=(user_id, symbol, "OPEN"))
+
+
+def _orders_endpoint(db, redis, accounts, store):
+    """ASGI app standing in for the router and POST /api/v1/orders/."""
+
+    async def app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path=ROUTE)    # set by routing, before the endpoint runs
+        account = accounts[int(scope["query_string"])]
+        session = ProfiledSession(db)
+        placed = await place_new_order(session, redis, account.id, ORDER, "live", _registry(),
+                                       group_name=account.group_name, store=store, actor=Unserialized())
+        await session.execute(statement=INSERT_ORDER, parameters=(placed['order_id'], account.id, "EURUSD"))
+        await session.commit()
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    return SqlAttributionMiddleware(app)
+
+
+def _by_source(report, source):
+    return {row["fingerprint"]: row for row in report["top_by_calls_per_request"] if row["source"] == source}
+
+
+def test_fingerprints_and_redaction():
+    assert fingerprint("SELECT * FROM user_orders WHERE order_id IN (%s, %s, %s) AND margin > 12.5 "
+                       "AND order_status = 'OPEN' -- sweep") == \
+        "SELECT * FROM user_orders WHERE order_id IN (...) AND margin > ? AND order_status = ?"
+    # Statements differing only in values or list lengths share a fingerprint
+    assert fingerprint("INSERT INTO wallets (a, b) VALUES (%s, %s), (%s, %s)") == \
+        fingerprint("INSERT INTO wallets (a, b) VALUES (:a_1, :b_1)") == "INSERT INTO wallets (a, b) VALUES (...)"
+    assert fingerprint("SELECT t1.id FROM t1 WHERE t1.col_2 = ?") == "SELECT t1.id FROM t1 WHERE t1.col_2 = ?"
+
+    assert redact_parameters({"email_1": "a@example.com", "id_1": 7}) == {"email_1": "str", "id_1": "int"}
+    assert redact_parameters(("a@example.com", 7)) == ["str", "int"]
+    assert redact_parameters([("a", 1), ("b", 2)]) == "2 rows of ['str', 'int']"
+
+
+def test_placement_statements_are_attributed_to_the_endpoint():
+    sql_profiler.reset()
+    slow_query_seconds, sql_profiler.slow_query_seconds = sql_profiler.slow_query_seconds, 0.02
+
+    @sql_source("task:pending_order_checker")
+    async def pending_order_checker(session):
+        for _ in range(3):
+            await session.execute(statement=PENDING_SCAN, parameters=("BUY_LIMIT", "SELL_LIMIT", "BUY_STOP", "SELL_STOP"))
+        await session.commit()
+
+    async def cleanup_orphans(session):
+        connection = session.connection
+        sql_profiler.before_cursor_execute(connection, None, CLEANUP, ("secret@example.com",), None, False)
+        await asyncio.sleep(0.03)
+        sql_profiler.after_cursor_execute(connection, None, CLEANUP, ("secret@example.com",), None, False)
+
+    async def run():
+        db, redis = SimulatedDB(), SimulatedRedis()
+        accounts = {n: _account(n) for n in range(5)}
+        endpoint = _orders_endpoint(db, redis, accounts, ProfiledStore(redis, accounts))
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def request(n):
+            scope = {"type": "http", "method": "POST", "path": ROUTE, "query_string": str(n % 5).encode()}
+            await endpoint(scope, None, send)
+
+        await asyncio.gather(
+            *(request(n) for n in range(PLACEMENTS)),
+            pending_order_checker(ProfiledSession(db)),
+            pending_order_checker(ProfiledSession(db)),
+            asyncio.create_task(cleanup_orphans(ProfiledSession(db))),
+        )
+        return sent
+
+    try:
+        sent = asyncio.run(run())
+        report = sql_profiler.snapshot(limit=50)
+    finally:
+        sql_profiler.slow_query_seconds = slow_query_seconds
+
+    assert sum(message.get("status") == 201 for message in sent) == PLACEMENTS
+    source = f"POST {ROUTE}"
+    for name, totals in report["sources"].items():
+        print(f"  {name:40s} {totals}")
+
+    # Every statement of a placement is attributed to its route, once per request
+    assert report["sources"][source]["requests"] == PLACEMENTS
+    assert report["sources"][source]["statements"] == 4 * PLACEMENTS
+    placement = _by_source(report, source)
+    for statement in (RESERVE_IDS, LOCK_USER, OPEN_ORDERS, INSERT_ORDER):
+        row = placement[fingerprint(statement)]
+        assert row["calls"] == PLACEMENTS and row["calls_per_request"] == 1.0
+    assert fingerprint(PENDING_SCAN) not in placement
+
+    # Concurrent background work keeps its own attribution
+    job = _by_source(report, "task:pending_order_checker")
+    assert report["sources"]["task:pending_order_checker"]["requests"] == 2
+    assert job[fingerprint(PENDING_SCAN)]["calls_per_request"] == 3.0
+    unnamed = "task:test_placement_statements_are_attributed_to_the_endpoint.<locals>.cleanup_orphans"
+    assert report["sources"][unnamed]["statements"] == 1
+
+    top = {row["fingerprint"]: row for row in report["top_by_total_time"]}
+    assert top[fingerprint(LOCK_USER)]["sources"] == {source: PLACEMENTS}
+    assert top[fingerprint(LOCK_USER)]["latency"]["count"] == PLACEMENTS
+
+    # Slow queries are logged without their values
+    slow = [entry for entry in report["slow_queries"] if entry["source"] == unnamed]
+    assert len(slow) == 1 and slow[0]["parameters"] == ["str"]
+    assert "secret@example.com" not in str(report)
+
+
+def test_engine_events_on_sqlite():
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from app.core.sql_profiler import SqlProfiler, sql_profile_source
+
+    profiler = SqlProfiler(slow_query_seconds=10)
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        profiler.install(engine.sync_engine)
+        async with engine.connect() as conn:
+            await conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR(255))"))
+            with sql_profile_source("task:sweep"):
+                for n in range(5):
+                    await conn.execute(text("SELECT id FROM users WHERE id = :id"), {"id": n})
+        await engine.dispose()
+
+    asyncio.run(run())
+    report = profiler.snapshot()
+    row = next(row for row in report["top_by_total_time"] if row["fingerprint"] == "SELECT id FROM users WHERE id = ?")
+    assert row["calls"] == 5 and row["sources"] == {"task:sweep": 5}
+
+
+if __name__ == "__main__":
+    test_fingerprints_and_redaction()
+    test_placement_statements_are_attributed_to_the_endpoint()
+    test_engine_events_on_sqlite()
+    print("SQL profiler tests passed.")
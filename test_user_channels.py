@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark for user-scoped order/user-data channels: 5k sockets, 200 order events/sec.
+Events are published with the real publish_order_update and received by one
+RedisSubscription per socket on the channels the per-connection listener subscribes to
+(account_update_channels); Redis is replaced by an in-process broker. Compares the old
+global channel (every socket decodes every event and filters by user_id) with
+per-account channels (each event reaches only its owner's socket).
+"""
+
+import asyncio
+import json
+import time
+from collections import defaultdict
+
+from app.core import cache
+from app.core.pubsub import RedisSubscription
+
+SOCKETS = 5000
+EVENTS_PER_SECOND = 200
+
+
+class Broker:
+    """Stands in for Redis: channel -> subscribed connections, PUBLISH returns the receivers."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    async def publish(self, channel, data):
+        receivers = self.subscribers.get(channel, ())
+        for pubsub in receivers:
+            pubsub.queue.put_nowait({"type": "message", "pattern": None, "channel": channel, "data": data})
+        return len(receivers)
+
+
+class GlobalChannelBroker(Broker):
+    """The publisher before per-account channels: every order event on the one root channel."""
+
+    async def publish(self, channel, data):
+        return await super().publish(cache.REDIS_ORDER_UPDATES_CHANNEL, data)
+
+
+class FakePubSub:
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = set()
+        self.queue = asyncio.Queue()
+
+    async def subscribe(self, *channels):
+        self.channels.update(channels)
+        for channel in channels:
+            self.broker.subscribers[channel].add(self)
+
+    async def unsubscribe(self, *channels):
+        for channel in channels:
+            self.broker.subscribers[channel].discard(self)
+        self.channels.difference_update(channels)
+
+    async def aclose(self):
+        await self.unsubscribe(*list(self.channels))
+
+    async def listen(self):
+        while self.channels:
+            yield await self.queue.get()
+
+
+def _user_type(user_id):
+    # A socket and the events addressed to it agree on the account type
+    return "live" if user_id % 3 else "demo"
+
+
+async def _socket(subscription, user_id, filter_by_user, counts):
+    async for message in subscription:
+        data = json.loads(message["data"])
+        counts["received"] += 1
+        if not filter_by_user or str(data.get("user_id")) == str(user_id):
+            counts["handled"] += 1
+
+
+async def _fan_out(scoped):
+    broker = Broker() if scoped else GlobalChannelBroker()
+    counts = {"received": 0, "handled": 0}
+    subscriptions, tasks = [], []
+    for user_id in range(1, SOCKETS + 1):
+        if scoped:
+            channels = cache.account_update_channels(_user_type(user_id), user_id)
+        else:
+            channels = (cache.REDIS_ORDER_UPDATES_CHANNEL, cache.REDIS_USER_DATA_UPDATES_CHANNEL)
+        subscription = RedisSubscription(broker, channels, "websocket")
+        await subscription.connect()
+        subscriptions.append(subscription)
+        tasks.append(asyncio.create_task(_socket(subscription, user_id, not scoped, counts)))
+    await asyncio.sleep(0)
+
+    expected = EVENTS_PER_SECOND * (1 if scoped else SOCKETS)
+    started = time.perf_counter()
+    for i in range(EVENTS_PER_SECOND):
+        user_id = i % SOCKETS + 1
+        await cache.publish_order_update(broker, user_id, _user_type(user_id))
+    while counts["received"] < expected:
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    for subscription in subscriptions:
+        await subscription.close()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return counts["received"], counts["handled"], elapsed
+
+
+def test_scoped_channels_fan_out_5k_sockets():
+    global_deliveries, global_handled, global_elapsed = asyncio.run(_fan_out(scoped=False))
+    scoped_deliveries, scoped_handled, scoped_elapsed = asyncio.run(_fan_out(scoped=True))
+    print(f"global channel: {global_deliveries} deliveries in {global_elapsed * 1000:.1f}ms; "
+          f"per-account channels: {scoped_deliveries} deliveries in {scoped_elapsed * 1000:.1f}ms")
+
+    assert global_deliveries == SOCKETS * EVENTS_PER_SECOND
+    assert scoped_deliveries == EVENTS_PER_SECOND
+    assert scoped_handled == global_handled == EVENTS_PER_SECOND
+    assert scoped_elapsed < global_elapsed / 50
+
+
+def test_event_reaches_only_its_account():
+    async def run():
+        broker = Broker()
+        received = defaultdict(list)
+
+        async def socket(account, subscription):
+            async for message in subscription:
+                received[account].append(json.loads(message["data"])["type"])
+
+        subscriptions, tasks = [], []
+        for account in (("live", 42), ("demo", 42), ("live", 7)):
+            subscription = RedisSubscription(broker, cache.account_update_channels(*account), "websocket")
+            await subscription.connect()
+            subscriptions.append(subscription)
+            tasks.append(asyncio.create_task(socket(account, subscription)))
+        await cache.publish_order_update(broker, 42, "demo")
+        await cache.publish_user_data_update(broker, 7, "live")
+        # Without the account type both accounts with the id are notified
+        await cache.publish_order_update(broker, 42)
+        await asyncio.sleep(0.05)
+        for subscription, task in zip(subscriptions, tasks):
+            await subscription.close()
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return received
+
+    received = asyncio.run(run())
+    assert received[("demo", 42)] == ["ORDER_UPDATE", "ORDER_UPDATE"]
+    assert received[("live", 42)] == ["ORDER_UPDATE"]
+    assert received[("live", 7)] == ["USER_DATA_UPDATE"]
+
+
+def test_channel_names_are_account_scoped():
+    assert cache.order_updates_channel("live", 42) == "order_updates:live:42"
+    assert cache.order_updates_channel("demo", 42) != cache.order_updates_channel("live", 42)
+    assert cache.user_data_updates_channel("demo", 7) == "user_data_updates:demo:7"
+    assert cache.account_update_channels("demo", 7) == ("order_updates:demo:7", "user_data_updates:demo:7")
+
+
+if __name__ == "__main__":
+    test_scoped_channels_fan_out_5k_sockets()
+    test_event_reaches_only_its_account()
+    test_channel_names_are_account_scoped()
+    print("User-scoped channel tests passed.")
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Tests for the batched WebSocket bootstrap: a reconnect storm of 2k sockets against a
+simulated DB (bounded pool, per-query latency) and Redis (per round trip latency),
+comparing the time to first frame of the previous serial bootstrap with the new one.
+"""
+
+import asyncio
+import datetime
+import time
+from contextlib import asynccontextmanager, nullcontext
+from decimal import Decimal
+from types import SimpleNamespace
+
+from app.services.ws_bootstrap import GroupSymbolRegistry, bootstrap_connection, initial_price
+
+SOCKETS = 2000
+GROUPS = ["standard", "vip", "pro"]
+SYMBOLS = [f"SYM{i:02d}" for i in range(12)]
+DB_POOL_SIZE = 20
+DB_QUERY_SECONDS = 0.0005
+REDIS_RTT_SECONDS = 0.0002
+
+
+class SimulatedDB:
+    """Connection pool of DB_POOL_SIZE; every query holds a connection for DB_QUERY_SECONDS."""
+
+    def __init__(self):
+        self.pool = asyncio.Semaphore(DB_POOL_SIZE)
+        self.queries = 0
+
+    async def query(self, result=None):
+        async with self.pool:
+            self.queries += 1
+            await asyncio.sleep(DB_QUERY_SECONDS)
+        return result
+
+
+class SimulatedRedis:
+    def __init__(self):
+        self.round_trips = 0
+
+    async def round_trip(self, result=None):
+        self.round_trips += 1
+        await asyncio.sleep(REDIS_RTT_SECONDS)
+        return result
+
+
+def _settings(symbol):
+    return {"spread": Decimal("1.5"), "spread_pip": Decimal("0.0001"), "show_points": 5}
+
+
+def _user(n):
+    return SimpleNamespace(id=n, email=f"u{n}@example.com", group_name=GROUPS[n % len(GROUPS)], leverage=100,
+                           wallet_balance=Decimal("1000"), margin=Decimal("0"), isActive=1, first_name=None,
+                           last_name=None, country=None, phone_number=None)
+
+
+def _orders(n):
+    return [SimpleNamespace(order_id=f"{n}-{i}", order_company_name=SYMBOLS[i], order_type="BUY",
+                            order_quantity=Decimal("0.1"), order_price=Decimal("1.1"), margin=Decimal("11"),
+                            contract_value=Decimal("11000"), stop_loss=None, take_profit=None, order_user_id=n,
+                            order_status="OPEN" if i % 2 else "BUY_LIMIT", commission=Decimal("0"),
+                            created_at=datetime.datetime(2025, 6, 1))
+            for i in range(3)]
+
+
+async def previous_bootstrap(db, redis, n):
+    """Round trips of the previous websocket_endpoint bootstrap, in order."""
+    await db.query(_user(n))                          # get_user_by_account_number
+    await redis.round_trip()                          # set_user_data_cache
+    await db.query(_orders(n))                        # get_all_open_orders_by_user_id
+    await redis.round_trip()                          # set_user_portfolio_cache
+    await db.query()                                  # update_group_symbol_settings: get_groups
+    for _ in SYMBOLS:
+        await db.query()                              # Symbol (profit_currency)
+        await db.query()                              # ExternalSymbolInfo (contract_size)
+        await redis.round_trip()                      # set_group_symbol_settings_cache
+    await db.query()                                  # update_static_orders_cache: open orders
+    await db.query()                                  # pending orders
+    await redis.round_trip()                          # set_user_static_orders_cache
+    await redis.round_trip()                          # set_user_dynamic_portfolio_cache
+    await redis.round_trip()                          # subscription: group settings
+    await db.query()                                  # favorites
+    await redis.round_trip()                          # initial frame: group settings
+    for _ in SYMBOLS:
+        await redis.round_trip()                      # adjusted price (cold cache: miss)
+        await redis.round_trip()                      # last known price
+
+
+def _new_bootstrap(db, redis, loads):
+    async def load_group(group_name):
+        loads.append(group_name)
+        await db.query()
+        for _ in SYMBOLS:
+            await db.query()
+            await db.query()
+        await redis.round_trip()
+        return {symbol: _settings(symbol) for symbol in SYMBOLS}
+
+    async def load_account(_db, account_number, user_type):
+        return await db.query((_user(int(account_number)), _orders(int(account_number)), ["SYM01"]))
+
+    async def exchange_cache(_redis, symbols, **kwargs):
+        return await redis.round_trip({"adjusted": {},
+                                       "last_price": {s: {"b": "1.10010", "o": "1.10000"} for s in symbols}})
+
+    groups = GroupSymbolRegistry(load_group, ttl=60)
+
+    async def bootstrap(n):
+        result = await bootstrap_connection(lambda: nullcontext(db), redis, str(n), "live", groups,
+                                            load_account=load_account, exchange_cache=exchange_cache)
+        assert len(result["initial_prices"]) == len(SYMBOLS)
+        assert len(result["static_orders"]["open_orders"]) == 1
+        assert len(result["static_orders"]["pending_orders"]) == 2
+        return result
+
+    return bootstrap
+
+
+async def _storm(bootstrap):
+    ttff = []
+
+    async def connect(n):
+        started = time.perf_counter()
+        await bootstrap(n)
+        ttff.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(connect(n) for n in range(SOCKETS)))
+    ttff.sort()
+    return ttff[int(len(ttff) * 0.99) - 1], ttff[len(ttff) // 2]
+
+
+def test_reconnect_storm_time_to_first_frame():
+    async def run():
+        db, redis = SimulatedDB(), SimulatedRedis()
+        previous = await _storm(lambda n: previous_bootstrap(db, redis, n))
+        previous_queries, previous_round_trips = db.queries, redis.round_trips
+
+        db, redis, loads = SimulatedDB(), SimulatedRedis(), []
+        batched = await _storm(_new_bootstrap(db, redis, loads))
+        return previous, previous_queries, previous_round_trips, batched, db.queries, redis.round_trips, loads
+
+    previous, previous_queries, previous_round_trips, batched, queries, round_trips, loads = asyncio.run(run())
+    print(f"previous: p99 {previous[0] * 1000:7.1f} ms  p50 {previous[1] * 1000:7.1f} ms  "
+          f"{previous_queries / SOCKETS:.1f} queries, {previous_round_trips / SOCKETS:.1f} Redis round trips per socket")
+    print(f"batched:  p99 {batched[0] * 1000:7.1f} ms  p50 {batched[1] * 1000:7.1f} ms  "
+          f"{queries / SOCKETS:.2f} queries, {round_trips / SOCKETS:.2f} Redis round trips per socket")
+
+    # One account query per socket, plus one settings load per group for the whole storm
+    assert sorted(loads) == sorted(GROUPS)
+    assert queries == SOCKETS + len(GROUPS) * (1 + 2 * len(SYMBOLS))
+    assert round_trips == SOCKETS + len(GROUPS)
+    assert batched[0] < previous[0] / 5
+
+
+def test_registry_ttl_and_failed_loads():
+    calls = []
+
+    async def load(group_name):
+        calls.append(group_name)
+        if len(calls) == 2:
+            raise RuntimeError("db down")
+        return {"EURUSD": {"n": len(calls)}}
+
+    async def run():
+        groups = GroupSymbolRegistry(load, ttl=60)
+        assert await groups.get("g") == {"EURUSD": {"n": 1}}
+        assert await groups.get("g") == {"EURUSD": {"n": 1}}
+        groups.invalidate("g")
+        # Failed reload keeps serving the previous settings and retries on the next call
+        assert await groups.get("g") == {"EURUSD": {"n": 1}}
+        assert await groups.get("g") == {"EURUSD": {"n": 3}}
+
+    asyncio.run(run())
+    assert calls == ["g", "g", "g"]
+
+
+def test_inactive_account_is_not_cached():
+    async def load_account(db, account_number, user_type):
+        return SimpleNamespace(id=1, group_name="g", isActive=0), [], []
+
+    async def exchange_cache(*args, **kwargs):
+        raise AssertionError("inactive accounts must not be cached")
+
+    async def load(group_name):
+        raise AssertionError("not needed")
+
+    async def run():
+        result = await bootstrap_connection(nullcontext, None, "1", "live", GroupSymbolRegistry(load),
+                                            load_account=load_account, exchange_cache=exchange_cache)
+        assert result["user"].isActive == 0 and "user_data" not in result
+
+    asyncio.run(run())
+
+
+def test_account_session_is_closed_before_the_group_load():
+    open_sessions = []
+
+    @asynccontextmanager
+    async def sessions():
+        open_sessions.append(1)
+        try:
+            yield "db"
+        finally:
+            open_sessions.pop()
+
+    async def load_account(db, account_number, user_type):
+        assert db == "db" and open_sessions
+        return SimpleNamespace(id=1, group_name="g", isActive=1, wallet_balance=0, margin=0, leverage=100), [], []
+
+    async def load(group_name):
+        # A registry load opens a session of its own; the bootstrap must not hold one meanwhile
+        assert not open_sessions
+        return {"EURUSD": {"spread": "1", "spread_pip": "0.0001"}}
+
+    async def exchange_cache(_redis, symbols, **kwargs):
+        return {"adjusted": {}, "last_price": {}}
+
+    async def run():
+        result = await bootstrap_connection(sessions, None, "1", "live", GroupSymbolRegistry(load),
+                                            load_account=load_account, exchange_cache=exchange_cache)
+        assert result["group_settings"] == {"EURUSD": {"spread": "1", "spread_pip": "0.0001"}}
+
+    asyncio.run(run())
+
+
+def test_initial_price_matches_previous_fallback():
+    settings = {"spread": "1.5", "spread_pip": "0.0001"}
+    # Last known price: half the configured spread on either side
+    price = initial_price(None, {"b": "1.10010", "o": "1.10000"}, settings)
+    assert price["buy"] == float(Decimal("1.10010") + Decimal("0.000075"))
+    assert price["sell"] == float(Decimal("1.10000") - Decimal("0.000075"))
+    assert abs(price["spread"] - 2.5) < 1e-9
+    # The adjusted cache wins; its spread is recomputed in pips
+    price = initial_price({"buy": "1.2002", "sell": "1.2000", "spread_value": "0.0002"}, {"b": "9", "o": "9"}, settings)
+    assert price == {"buy": 1.2002, "sell": 1.2, "spread": 2.0}
+    assert initial_price(None, None, settings) is None
+
+
+if __name__ == "__main__":
+    test_reconnect_storm_time_to_first_frame()
+    test_registry_ttl_and_failed_loads()
+    test_inactive_account_is_not_cached()
+    test_account_session_is_closed_before_the_group_load()
+    test_initial_price_matches_previous_fallback()
+    print("WebSocket bootstrap tests passed.")
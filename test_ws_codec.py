@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Tests for the market WebSocket frame encodings: a reference decoder for the binary
+msgpack format, format negotiation, and a benchmark of bytes per tick (raw and with
+permessage-deflate) and server encode cost against the previous JSON frames.
+"""
+
+import json
+import random
+import time
+import zlib
+from decimal import Decimal
+
+import pytest
+
+msgpack = pytest.importorskip("msgpack")
+
+from app.services.ws_codec import (
+    FORMAT_JSON, FORMAT_MSGPACK, FRAME_GENERIC, FRAME_MARKET_UPDATE, MSGPACK_SUBPROTOCOL, ORDER_FIELDS,
+    SPREAD_DECIMALS, JsonFrameCodec, MsgpackFrameCodec, negotiate_frame_format,
+    price_decimals_from_group_settings,
+)
+
+
+class ReferenceDecoder:
+    """Client-side decoder: turns binary frames back into the JSON frame shape."""
+
+    def __init__(self):
+        self.symbols = {}  # id -> (name, scale)
+        self.orders = {"open_orders": [], "pending_orders": []}
+
+    def _order(self, row):
+        order = dict(zip(ORDER_FIELDS, row))
+        if order["order_company_name"] is not None:
+            order["order_company_name"] = self.symbols[order["order_company_name"]][0]
+        if len(row) > len(ORDER_FIELDS):
+            order.update(row[-1])
+        return order
+
+    def decode(self, payload):
+        frame = msgpack.unpackb(payload, raw=False)
+        if frame[0] == FRAME_GENERIC:
+            return frame[1]
+        assert frame[0] == FRAME_MARKET_UPDATE
+        _, new_symbols, prices, account = frame
+        for symbol_id, name, decimals in new_symbols:
+            self.symbols[symbol_id] = (name, 10 ** decimals)
+        market_prices = {}
+        for i in range(0, len(prices), 4):
+            name, scale = self.symbols[prices[i]]
+            market_prices[name] = {"buy": prices[i + 1] / scale, "sell": prices[i + 2] / scale,
+                                   "spread": prices[i + 3] / 10 ** SPREAD_DECIMALS}
+        data = {"market_prices": market_prices}
+        if account is not None:
+            for key, rows in (("open_orders", account[2]), ("pending_orders", account[3])):
+                if rows is not None:
+                    self.orders[key] = [self._order(row) for row in rows]
+            data["account_summary"] = {"balance": account[0], "margin": account[1],
+                                       "open_orders": self.orders["open_orders"],
+                                       "pending_orders": self.orders["pending_orders"]}
+            if len(account) > 4:
+                data["account_summary"].update(account[4])
+        return {"type": "market_update", "data": data}
+
+
+def _order(i, symbol):
+    return {"order_id": f"5{i:08d}", "order_company_name": symbol, "order_type": "BUY",
+            "order_quantity": "0.10", "order_price": "1.08512", "margin": Decimal("21.70"),
+            "contract_value": "10851.2", "stop_loss": None, "take_profit": "1.09000",
+            "order_user_id": 42, "order_status": "OPEN", "commission": "0.0",
+            "created_at": "2025-06-01T10:15:00"}
+
+
+SYMBOLS = [f"SYM{i:03d}" for i in range(60)] + ["EURUSD", "USDJPY"]
+DECIMALS = {s: 5 for s in SYMBOLS} | {"USDJPY": 3}
+
+
+def _ticks(n=500, seed=3):
+    rng = random.Random(seed)
+    open_orders = [_order(i, rng.choice(SYMBOLS)) for i in range(15)]
+    pending_orders = [_order(100 + i, rng.choice(SYMBOLS)) | {"order_status": "PENDING"} for i in range(5)]
+    for n_tick in range(n):
+        prices = {}
+        for symbol in rng.sample(SYMBOLS, 20):
+            base = 150.0 if symbol == "USDJPY" else 1.0 + rng.random()
+            scale = 10 ** DECIMALS[symbol]
+            buy = round(base, DECIMALS[symbol])
+            prices[symbol] = {"buy": buy, "sell": round(buy - 12 / scale, DECIMALS[symbol]), "spread": 1.2}
+        if n_tick == n // 2:
+            open_orders = open_orders[1:]  # an order closes mid-stream
+        yield {"type": "market_update", "data": {"market_prices": prices, "account_summary": {
+            "balance": "10234.55", "margin": "325.50", "open_orders": open_orders, "pending_orders": pending_orders}}}
+
+
+def test_reference_decoder_round_trip():
+    codec = MsgpackFrameCodec(DECIMALS)
+    decoder = ReferenceDecoder()
+    for frame in _ticks(50):
+        decoded = decoder.decode(codec.encode(frame))
+        expected = json.loads(JsonFrameCodec().encode(frame))
+        for order in expected["data"]["account_summary"]["open_orders"] + \
+                expected["data"]["account_summary"]["pending_orders"]:
+            del order["order_user_id"]
+        assert decoded["data"]["account_summary"] == expected["data"]["account_summary"]
+        for symbol, price in expected["data"]["market_prices"].items():
+            got = decoded["data"]["market_prices"][symbol]
+            assert got["buy"] == pytest.approx(price["buy"]) and got["sell"] == pytest.approx(price["sell"])
+            assert got["spread"] == pytest.approx(price["spread"])
+
+    # Non market frames pass through as plain maps
+    assert decoder.decode(codec.encode({"type": "subscription", "data": {"symbols": ["EURUSD"]}})) == \
+        {"type": "subscription", "data": {"symbols": ["EURUSD"]}}
+
+
+def test_negotiation_and_fallback():
+    assert negotiate_frame_format(None, None) == (FORMAT_JSON, None)
+    assert negotiate_frame_format("msgpack", None) == (FORMAT_MSGPACK, None)
+    assert negotiate_frame_format(None, f"chat, {MSGPACK_SUBPROTOCOL}") == (FORMAT_MSGPACK, MSGPACK_SUBPROTOCOL)
+    assert negotiate_frame_format("protobuf", "chat") == (FORMAT_JSON, None)
+    assert price_decimals_from_group_settings({"USDJPY": {"show_points": 3}, "XAUUSD": {"show_points": None}}) == {"USDJPY": 3}
+
+
+def _deflated_sizes(payloads):
+    """permessage-deflate with context takeover, as negotiated by default."""
+    compressor = zlib.compressobj(wbits=-15)
+    return [len(compressor.compress(p if isinstance(p, bytes) else p.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+            for p in payloads]
+
+
+def test_bytes_per_tick_and_encode_cost():
+    frames = list(_ticks())
+
+    def previous_json(frame):
+        # Frames were built with json.dumps(frame, cls=DecimalEncoder)
+        return json.dumps(frame, default=str)
+
+    results = {}
+    for name, encode in (("json (previous)", previous_json),
+                         ("json (compact)", JsonFrameCodec().encode),
+                         ("msgpack", MsgpackFrameCodec(DECIMALS).encode)):
+        started = time.perf_counter()
+        payloads = [encode(frame) for frame in frames]
+        elapsed = time.perf_counter() - started
+        raw = sum(len(p) for p in payloads) / len(frames)
+        deflated = sum(_deflated_sizes(payloads)) / len(frames)
+        results[name] = (raw, deflated, elapsed / len(frames))
+        print(f"{name:16s} {raw:8.0f} B/tick  {deflated:7.0f} B/tick deflated  "
+              f"{elapsed / len(frames) * 1e6:6.1f} us/frame")
+
+    json_raw, json_deflated, _ = results["json (previous)"]
+    msgpack_raw, msgpack_deflated, _ = results["msgpack"]
+    assert msgpack_raw < json_raw * 0.25
+    assert msgpack_deflated < json_deflated
+    assert results["json (compact)"][0] < json_raw
+
+
+if __name__ == "__main__":
+    test_reference_decoder_round_trip()
+    test_negotiation_and_fallback()
+    test_bytes_per_tick_and_encode_cost()
+    print("WebSocket codec tests passed.")
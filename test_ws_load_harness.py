@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Tests for the parts of the WebSocket load harness (scripts/ws_load_test.py) that do not
+need a running app: client-side frame accounting (end-to-end latency, late frames,
+account stream sequence gaps), merging worker results, the /metrics parser and the
+pass/fail thresholds, plus the origin stamp the send queue adds to market frames.
+"""
+
+import asyncio
+import importlib.util
+import json
+import os
+import pickle
+import sys
+
+from app.core.tick_latency import HdrHistogram
+from app.services.ws_send_queue import ConnectionSendQueue
+
+_spec = importlib.util.spec_from_file_location(
+    "ws_load_test", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "ws_load_test.py")
+)
+ws_load_test = sys.modules["ws_load_test"] = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ws_load_test)
+
+
+def _market(origin):
+    return {"type": "market_update", "data": {"market_prices": {}}, "_timestamp": origin}
+
+
+def _delta(*seqs):
+    return {"type": "account_delta", "data": {"stream": "s", "deltas": [{"seq": s, "op": "account"} for s in seqs]}}
+
+
+def test_frame_accounting():
+    stats = ws_load_test.ClientStats(late_after=0.5)
+    client = ws_load_test.ClientState(connected_at=100.0)
+    stats.observe({"type": "loading"}, 10, 100.01, client)
+    stats.observe(_market(100.0), 100, 100.05, client)
+    stats.observe(_market(100.1), 100, 100.9, client)
+    stats.observe({"type": "account_snapshot", "data": {"stream": "s", "seq": 1, "account_summary": {}}}, 50, 101.0, client)
+    stats.observe(_delta(2, 3), 20, 101.1, client)
+    # 4 and 5 never arrive
+    stats.observe(_delta(6), 20, 101.2, client)
+
+    assert stats.frames == 6 and stats.market_frames == 2 and stats.bytes == 300
+    assert stats.latency.count == 2 and stats.late_frames == 1
+    assert stats.dropped_frames == 2
+    assert stats.time_to_first_frame.count == 1 and 49_000 <= stats.time_to_first_frame.max <= 51_000
+
+
+def test_worker_results_merge():
+    parts = []
+    for worker in range(3):
+        stats = ws_load_test.ClientStats(late_after=1.0)
+        client = ws_load_test.ClientState(connected_at=0.0)
+        for i in range(100):
+            stats.observe(_market(0.0), 10, (worker * 100 + i) / 1000.0, client)
+        stats.connected = 10
+        stats.disconnected("closed_1013")
+        # Results cross the process boundary pickled
+        parts.append(pickle.loads(pickle.dumps(stats)))
+
+    total = ws_load_test.ClientStats(late_after=1.0)
+    for part in parts:
+        total.merge(part)
+    single = HdrHistogram()
+    for value in range(300):
+        single.record(value * 1000)
+    assert total.latency.count == 300 and total.connected == 30
+    assert total.disconnects == {"closed_1013": 3}
+    assert total.latency.snapshot() == single.snapshot()
+
+
+def test_metrics_parsing_and_thresholds():
+    text = "\n".join([
+        "# TYPE event_loop_lag_seconds summary",
+        'event_loop_lag_seconds{quantile="0.99"} 0.012000',
+        'event_loop_lag_seconds{quantile="0.999"} 0.150000',
+        'websocket_slow_consumer_evictions_total{reason="lag_deadline"} 2',
+        'websocket_slow_consumer_evictions_total{reason="event_backlog"} 1',
+        "websocket_active_connections 42",
+    ])
+    samples = ws_load_test.parse_prometheus(text)
+    assert samples['event_loop_lag_seconds{quantile="0.99"}'] == 0.012
+    assert ws_load_test.sum_samples(samples, "websocket_slow_consumer_evictions_total") == 3
+    assert ws_load_test.sum_samples(samples, "websocket_active_connections") == 42
+
+    stats = ws_load_test.ClientStats(late_after=1.0)
+    client = ws_load_test.ClientState(connected_at=0.0)
+    for i in range(100):
+        stats.observe(_market(0.0), 10, 0.2 if i < 98 else 2.0, client)
+    stats.connected = 10
+    timeline = [{"t": 0, "rss_mb": 100.0}, {"t": 5, "rss_mb": 140.0, "loop_lag_p99_ms": 12.0, "evictions": 3}]
+    result = ws_load_test.summarize(stats, timeline, 10.0, 10, {})
+    json.dumps(result)
+    assert result["server"]["rss_mb"] == {"start": 100.0, "max": 140.0, "end": 140.0}
+    assert result["server"]["slow_consumer_evictions"] == 3
+
+    assert ws_load_test.check_thresholds(result, 5000, 0.05, 0, 0.0) == []
+    failures = ws_load_test.check_thresholds(result, 500, 0.01, 0, 0.0)
+    assert len(failures) == 2 and failures[0].startswith("p99 latency")
+
+
+def test_client_urls_ramp_and_stream_share():
+    urls = ws_load_test.client_urls(8000, [f"t{i}" for i in range(200)], 0.25, 1000.0, 10.0)
+    assert sum("stream=delta" in url for url, _ in urls) == 50
+    assert urls[0][1] == 1000.0 and urls[-1][1] < 1010.0
+    assert urls[0][0] == "ws://127.0.0.1:8000/api/v1/ws/market-data?token=t0&stream=delta"
+
+
+def test_market_frames_carry_tick_origin_when_enabled():
+    async def run(stamp_origin):
+        frames = []
+
+        async def send(text):
+            frames.append(json.loads(text))
+
+        q = ConnectionSendQueue(send, stamp_origin=stamp_origin)
+        q.note_tick_origin(1700000000.25)
+        q.note_tick_origin(1700000000.5)
+        q.put_market_update({"EURUSD": {"buy": 1.1, "sell": 1.0}})
+        q.start()
+        await asyncio.sleep(0.01)
+        # A frame with no tick behind it (e.g. a subscription snapshot) carries no stamp
+        q.put_market_update({"GBPUSD": {"buy": 1.3, "sell": 1.2}})
+        await asyncio.sleep(0.01)
+        await q.close()
+        return frames
+
+    stamped = asyncio.run(run(True))
+    assert [f.get("_timestamp") for f in stamped] == [1700000000.5, None]
+    assert all("_timestamp" not in f for f in asyncio.run(run(False)))
+
+
+if __name__ == "__main__":
+    test_frame_accounting()
+    test_worker_results_merge()
+    test_metrics_parsing_and_thresholds()
+    test_client_urls_ramp_and_stream_share()
+    test_market_frames_carry_tick_origin_when_enabled()
+    print("WebSocket load harness tests passed.")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Test for per-connection WebSocket send queues: a throttled client next to fast ones
+must get conflated market frames, every order event in order, and a stalled client
+must be evicted once its queue stays saturated past the deadline.
+"""
+
+import asyncio
+import json
+
+from app.services.ws_send_queue import ConnectionSendQueue, SlowConsumerEvicted, send_queue_stats
+
+
+class _Client:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.frames = []
+
+    async def send(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.frames.append(json.loads(text))
+
+
+async def _produce(queues, ticks=200, events_every=25):
+    for n in range(ticks):
+        prices = {"EURUSD": {"buy": 1.1 + n / 1e5, "sell": 1.1 + n / 1e5}}
+        if n % 2:
+            prices["GBPUSD"] = {"buy": 1.27 + n / 1e5, "sell": 1.27 + n / 1e5}
+        for q in queues:
+            q.put_market_update(prices, {"balance": str(n)})
+            if n % events_every == 0:
+                q.put_event({"type": "market_update", "event_no": n})
+        await asyncio.sleep(0.001)
+
+
+def _events(frames):
+    return [f["event_no"] for f in frames if "event_no" in f]
+
+
+def test_throttled_client_alongside_fast_ones():
+    async def run():
+        fast = [_Client(0) for _ in range(3)]
+        slow = _Client(0.02)
+        clients = fast + [slow]
+        queues = [ConnectionSendQueue(c.send, label=str(i), eviction_deadline=5) for i, c in enumerate(clients)]
+        for q in queues:
+            q.start()
+        await _produce(queues)
+        # Let the slow writer drain
+        for _ in range(200):
+            if all(q.depth == 0 for q in queues):
+                break
+            await asyncio.sleep(0.02)
+        stats = {s["connection"]: s for s in send_queue_stats()}
+        for q in queues:
+            await q.close()
+        return fast, slow, stats
+
+    fast, slow, stats = asyncio.run(run())
+    expected_events = list(range(0, 200, 25))
+    for client in fast + [slow]:
+        assert _events(client.frames) == expected_events
+        market = [f for f in client.frames if f["type"] == "market_update" and "event_no" not in f]
+        # Latest price and account summary always arrive
+        assert market[-1]["data"]["market_prices"]["EURUSD"]["buy"] == 1.1 + 199 / 1e5
+        assert market[-1]["data"]["account_summary"] == {"balance": "199"}
+    # The slow client got far fewer, conflated frames instead of backing up
+    assert len(slow.frames) < len(fast[0].frames) / 2
+    assert stats["3"]["frames_conflated"] > 100
+    assert stats["3"]["evicted"] is None
+
+
+def test_stalled_client_is_evicted():
+    async def run():
+        evicted = []
+        stalled = _Client(3600)
+
+        async def on_evict(reason):
+            evicted.append(reason)
+
+        queue = ConnectionSendQueue(stalled.send, label="stalled", eviction_deadline=0.1, on_evict=on_evict)
+        queue.start()
+        raised = False
+        try:
+            for n in range(50):
+                queue.put_market_update({"EURUSD": {"buy": n}})
+                await asyncio.sleep(0.01)
+        except SlowConsumerEvicted:
+            raised = True
+        await asyncio.sleep(0)
+        await queue.close()
+        return queue, evicted, raised
+
+    queue, evicted, raised = asyncio.run(run())
+    assert queue.evicted == "lag_deadline"
+    assert evicted == ["lag_deadline"]
+    assert raised
+
+
+def test_event_backlog_overflow_evicts_instead_of_dropping():
+    async def run():
+        stalled = _Client(3600)
+        queue = ConnectionSendQueue(stalled.send, label="backlog", max_events=10, eviction_deadline=60)
+        queue.start()
+        for n in range(11):
+            queue.put_event({"event_no": n})
+        evicted = queue.check()
+        await queue.close()
+        return evicted
+
+    assert asyncio.run(run()) == "event_backlog"
+
+
+if __name__ == "__main__":
+    test_throttled_client_alongside_fast_ones()
+    test_stalled_client_is_evicted()
+    test_event_backlog_overflow_evicts_instead_of_dropping()
+    print("WebSocket send queue tests passed.")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for the market WebSocket symbol-subscription protocol, plus a comparison of
+outbound bytes and CPU per connection for a watchlist vs. streaming every group symbol.
+"""
+
+import asyncio
+import json
+import random
+import time
+
+import pytest
+
+from app.services.ws_send_queue import ConnectionSendQueue
+from app.services.ws_subscriptions import SymbolSubscription, parse_control_message, position_symbols
+
+GROUP_SYMBOLS = [f"SYM{i:03d}" for i in range(200)]
+
+
+def test_default_subscription_and_control_actions():
+    static_orders = {"open_orders": [{"order_company_name": "sym007"}], "pending_orders": [{"order_company_name": "SYM150"}]}
+    subscription = SymbolSubscription("test-default", {"SYM001", "NOTINGROUP"} | position_symbols(static_orders),
+                                      allowed=GROUP_SYMBOLS)
+    assert subscription.symbols == {"SYM001", "SYM007", "SYM150"}
+    prices = {s: {"buy": 1.0} for s in GROUP_SYMBOLS}
+    assert set(subscription.filter(prices)) == {"SYM001", "SYM007", "SYM150"}
+
+    reply = subscription.apply("subscribe", ["SYM010", "XXX"])
+    assert reply["data"]["added"] == ["SYM010"] and reply["data"]["rejected"] == ["XXX"]
+    subscription.apply("unsubscribe", ["SYM001"])
+    assert set(subscription.filter(prices)) == {"SYM007", "SYM010", "SYM150"}
+
+    reply = subscription.apply("set_watchlist", ["SYM199"])
+    assert reply["data"]["symbols"] == ["SYM199"] and reply["data"]["added"] == ["SYM199"]
+    assert set(subscription.filter(prices)) == {"SYM199"}
+
+    # Emptying the watchlist streams nothing; subscribe_all restores the old behaviour
+    subscription.apply("unsubscribe", ["SYM199"])
+    assert subscription.filter(prices) == {}
+    reply = subscription.apply("subscribe_all")
+    assert reply["data"]["all"] and len(reply["data"]["added"]) == len(GROUP_SYMBOLS)
+    assert subscription.filter(prices) is prices
+
+    # A new position is followed unless everything is streamed already
+    assert subscription.follow({"SYM050"}) == set()
+    subscription.apply("set_watchlist", ["SYM001"])
+    assert subscription.follow({"SYM050"}) == {"SYM050"}
+
+
+def test_user_without_favorites_or_positions_gets_all_symbols():
+    subscription = SymbolSubscription("test-empty", [], allowed=GROUP_SYMBOLS)
+    assert subscription.subscribes_all
+    # Unsubscribing from "all" keeps the rest of the group
+    subscription.apply("unsubscribe", ["SYM000"])
+    assert not subscription.subscribes_all and len(subscription.symbols) == len(GROUP_SYMBOLS) - 1
+
+
+def test_rejected_subscribe_keeps_an_empty_watchlist_empty():
+    subscription = SymbolSubscription("test-rejected", ["SYM001"], allowed=GROUP_SYMBOLS)
+    subscription.apply("unsubscribe", ["SYM001"])
+    reply = subscription.apply("subscribe", ["NOTINGROUP"])
+    assert reply["data"]["rejected"] == ["NOTINGROUP"] and reply["data"]["added"] == []
+    assert not reply["data"]["all"] and not subscription.subscribes_all
+    assert subscription.filter({s: {"buy": 1.0} for s in GROUP_SYMBOLS}) == {}
+
+
+def test_parse_control_message():
+    assert parse_control_message("ping") is None
+    assert parse_control_message('{"type": "heartbeat"}') is None
+    assert parse_control_message('{"action": "subscribe", "symbols": "EURUSD"}') == \
+        {"action": "subscribe", "symbols": ["EURUSD"]}
+    with pytest.raises(ValueError):
+        parse_control_message('{"action": "set_watchlist", "symbols": 5}')
+
+
+def _measure(subscription, ticks):
+    """Outbound bytes and CPU seconds of one connection fed the same ticks."""
+    async def run():
+        sent = []
+
+        async def send(text):
+            sent.append(text)
+
+        queue = ConnectionSendQueue(send, label="bench", eviction_deadline=60)
+        queue.start()
+        started = time.process_time()
+        for prices in ticks:
+            queue.put_market_update(subscription.filter(prices), {"balance": "1000.0"})
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        cpu = time.process_time() - started
+        await queue.close()
+        return queue.bytes_sent, cpu
+
+    return asyncio.run(run())
+
+
+def test_watchlist_reduces_outbound_bytes_and_cpu():
+    rng = random.Random(7)
+    ticks = []
+    for _ in range(2000):
+        changed = rng.sample(GROUP_SYMBOLS, 40)
+        ticks.append({s: {"buy": rng.random(), "sell": rng.random(), "spread": 1.5} for s in changed})
+
+    everything = SymbolSubscription("test-bench", [], allowed=GROUP_SYMBOLS)
+    watchlist = SymbolSubscription("test-bench", GROUP_SYMBOLS[:12], allowed=GROUP_SYMBOLS)
+    all_bytes, all_cpu = _measure(everything, ticks)
+    watch_bytes, watch_cpu = _measure(watchlist, ticks)
+    print(f"all symbols: {all_bytes / 1024:.0f} KiB, {all_cpu * 1000:.0f}ms CPU; "
+          f"12-symbol watchlist: {watch_bytes / 1024:.0f} KiB, {watch_cpu * 1000:.0f}ms CPU")
+
+    assert watch_bytes < all_bytes * 0.2
+    assert watch_cpu < all_cpu
+
+
+if __name__ == "__main__":
+    test_default_subscription_and_control_actions()
+    test_user_without_favorites_or_positions_gets_all_symbols()
+    test_rejected_subscribe_keeps_an_empty_watchlist_empty()
+    test_parse_control_message()
+    test_watchlist_reduces_outbound_bytes_and_cpu()
+    print("WebSocket subscription tests passed.")